@@ -31,12 +31,16 @@
 
 #include "msprime.h"
 #include "likelihood.h"
+#include "stats.h"
+#include "rng.h"
+#include "msformat.h"
 
 /* We keep a reference to the gsl_error_handler so it can be restored if needed */
 static gsl_error_handler_t *old_gsl_error_handler;
 
 static PyObject *MsprimeInputError;
 static PyObject *MsprimeLibraryError;
+static PyObject *MsprimeLimitExceededError;
 
 /* A lightweight wrapper for a table collection. This serves only as a wrapper
  * around a pointer and a way move to data in-and-out of the low level structures
@@ -133,65 +137,6 @@ out:
     return ret;
 }
 
-static int
-parse_samples(PyObject *py_samples, Py_ssize_t *num_samples, sample_t **samples)
-{
-    int ret = -1;
-    long tmp_long;
-    Py_ssize_t j, n;
-    PyObject *sample, *value;
-    sample_t *ret_samples = NULL;
-
-    n = PyList_Size(py_samples);
-    ret_samples = PyMem_Malloc(n * sizeof(sample_t));
-    if (ret_samples == NULL) {
-        PyErr_NoMemory();
-        goto out;
-    }
-    for (j = 0; j < n; j++) {
-        sample = PyList_GetItem(py_samples, j);
-        if (!PyTuple_Check(sample)) {
-            PyErr_SetString(PyExc_TypeError, "not a tuple");
-            goto out;
-        }
-        if (PyTuple_Size(sample) != 2) {
-            PyErr_SetString(PyExc_ValueError,
-                    "sample must be (population,time) tuple");
-            goto out;
-        }
-        value = PyTuple_GetItem(sample, 0);
-        if (!PyNumber_Check(value)) {
-            PyErr_Format(PyExc_TypeError, "'population' is not number");
-            goto out;
-        }
-        tmp_long = PyLong_AsLong(value);
-        if (tmp_long < 0) {
-            PyErr_SetString(PyExc_ValueError, "negative population IDs not valid");
-            goto out;
-        }
-        ret_samples[j].population_id = (population_id_t) tmp_long;
-        value = PyTuple_GetItem(sample, 1);
-        if (!PyNumber_Check(value)) {
-            PyErr_Format(PyExc_TypeError, "'time' is not number");
-            goto out;
-        }
-        ret_samples[j].time = PyFloat_AsDouble(value);
-        if (ret_samples[j].time < 0) {
-            PyErr_SetString(PyExc_ValueError, "negative times not valid");
-            goto out;
-        }
-    }
-    *samples = ret_samples;
-    *num_samples = n;
-    ret = 0;
-    ret_samples = NULL;
-out:
-    if (ret_samples != NULL) {
-        PyMem_Free(ret_samples);
-    }
-    return ret;
-}
-
 static PyObject *
 convert_integer_list(size_t *list, size_t size)
 {
@@ -385,6 +330,146 @@ out:
     return ret;
 }
 
+static int
+parse_sample_list(PyObject *py_samples, Py_ssize_t *num_samples, sample_t **samples)
+{
+    int ret = -1;
+    long tmp_long;
+    Py_ssize_t j, n;
+    PyObject *sample, *value;
+    sample_t *ret_samples = NULL;
+
+    n = PyList_Size(py_samples);
+    ret_samples = PyMem_Malloc(n * sizeof(sample_t));
+    if (ret_samples == NULL) {
+        PyErr_NoMemory();
+        goto out;
+    }
+    for (j = 0; j < n; j++) {
+        sample = PyList_GetItem(py_samples, j);
+        if (!PyTuple_Check(sample)) {
+            PyErr_SetString(PyExc_TypeError, "not a tuple");
+            goto out;
+        }
+        if (PyTuple_Size(sample) != 2) {
+            PyErr_SetString(PyExc_ValueError,
+                    "sample must be (population,time) tuple");
+            goto out;
+        }
+        value = PyTuple_GetItem(sample, 0);
+        if (!PyNumber_Check(value)) {
+            PyErr_Format(PyExc_TypeError, "'population' is not number");
+            goto out;
+        }
+        tmp_long = PyLong_AsLong(value);
+        if (tmp_long < 0) {
+            PyErr_SetString(PyExc_ValueError, "negative population IDs not valid");
+            goto out;
+        }
+        ret_samples[j].population_id = (population_id_t) tmp_long;
+        value = PyTuple_GetItem(sample, 1);
+        if (!PyNumber_Check(value)) {
+            PyErr_Format(PyExc_TypeError, "'time' is not number");
+            goto out;
+        }
+        ret_samples[j].time = PyFloat_AsDouble(value);
+        if (ret_samples[j].time < 0) {
+            PyErr_SetString(PyExc_ValueError, "negative times not valid");
+            goto out;
+        }
+    }
+    *samples = ret_samples;
+    *num_samples = n;
+    ret = 0;
+    ret_samples = NULL;
+out:
+    if (ret_samples != NULL) {
+        PyMem_Free(ret_samples);
+    }
+    return ret;
+}
+
+/* Reads the samples from an object with "population" and "time" columns,
+ * such as a numpy structured array or a dictionary of arrays. The columns
+ * are read directly as buffers without creating any per-sample objects. */
+static int
+parse_sample_arrays(PyObject *py_samples, Py_ssize_t *num_samples, sample_t **samples)
+{
+    int ret = -1;
+    size_t j, n;
+    PyObject *population_input = NULL;
+    PyObject *time_input = NULL;
+    PyArrayObject *population_array = NULL;
+    PyArrayObject *time_array = NULL;
+    int32_t *population;
+    double *time;
+    sample_t *ret_samples = NULL;
+
+    population_input = PyMapping_GetItemString(py_samples, "population");
+    if (population_input != NULL) {
+        time_input = PyMapping_GetItemString(py_samples, "time");
+    }
+    if (population_input == NULL || time_input == NULL) {
+        PyErr_SetString(PyExc_TypeError,
+            "samples must be a list of (population, time) tuples or have "
+            "'population' and 'time' columns");
+        goto out;
+    }
+    population_array = table_read_column_array(population_input, NPY_INT32, &n, false);
+    if (population_array == NULL) {
+        goto out;
+    }
+    time_array = table_read_column_array(time_input, NPY_FLOAT64, &n, true);
+    if (time_array == NULL) {
+        goto out;
+    }
+    population = PyArray_DATA(population_array);
+    time = PyArray_DATA(time_array);
+    ret_samples = PyMem_Malloc(GSL_MAX(n, 1) * sizeof(sample_t));
+    if (ret_samples == NULL) {
+        PyErr_NoMemory();
+        goto out;
+    }
+    for (j = 0; j < n; j++) {
+        if (population[j] < 0) {
+            PyErr_SetString(PyExc_ValueError, "negative population IDs not valid");
+            goto out;
+        }
+        if (time[j] < 0) {
+            PyErr_SetString(PyExc_ValueError, "negative times not valid");
+            goto out;
+        }
+        ret_samples[j].population_id = (population_id_t) population[j];
+        ret_samples[j].time = time[j];
+    }
+    *samples = ret_samples;
+    *num_samples = (Py_ssize_t) n;
+    ret = 0;
+    ret_samples = NULL;
+out:
+    if (ret_samples != NULL) {
+        PyMem_Free(ret_samples);
+    }
+    Py_XDECREF(population_input);
+    Py_XDECREF(time_input);
+    Py_XDECREF(population_array);
+    Py_XDECREF(time_array);
+    return ret;
+}
+
+static int
+parse_samples(PyObject *py_samples, Py_ssize_t *num_samples, sample_t **samples)
+{
+    int ret = -1;
+
+    if (PyList_Check(py_samples)) {
+        ret = parse_sample_list(py_samples, num_samples, samples);
+    } else {
+        ret = parse_sample_arrays(py_samples, num_samples, samples);
+    }
+    return ret;
+}
+
 static int
 parse_individual_table_dict(tsk_individual_table_t *table, PyObject *dict, bool clear_table)
 {
@@ -1661,11 +1746,13 @@ static int
 RandomGenerator_init(RandomGenerator *self, PyObject *args, PyObject *kwds)
 {
     int ret = -1;
-    static char *kwlist[] = {"seed", NULL};
+    static char *kwlist[] = {"seed", "algorithm", NULL};
     unsigned long long seed = 0;
+    const char *algorithm = NULL;
+    const gsl_rng_type *rng_type = gsl_rng_default;
 
     self->rng  = NULL;
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "K", kwlist, &seed)) {
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "K|s", kwlist, &seed, &algorithm)) {
         goto out;
     }
     if (seed == 0 || seed >= (1ULL<<32)) {
@@ -1673,8 +1760,23 @@ RandomGenerator_init(RandomGenerator *self, PyObject *args, PyObject *kwds)
             "seeds must be greater than 0 and less than 2^32");
         goto out;
     }
+    if (algorithm != NULL) {
+        if (strcmp(algorithm, "mt19937") == 0) {
+            rng_type = gsl_rng_mt19937;
+        } else if (strcmp(algorithm, "xoshiro256**") == 0) {
+            rng_type = msp_gsl_rng_xoshiro256starstar;
+        } else {
+            PyErr_Format(PyExc_ValueError,
+                "Unknown random number generator '%s'", algorithm);
+            goto out;
+        }
+    }
     self->seed = seed;
-    self->rng = gsl_rng_alloc(gsl_rng_default);
+    self->rng = gsl_rng_alloc(rng_type);
+    if (self->rng == NULL) {
+        PyErr_NoMemory();
+        goto out;
+    }
     gsl_rng_set(self->rng, self->seed);
     ret = 0;
 out:
@@ -1694,6 +1796,71 @@ out:
     return ret;
 }
 
+static PyObject *
+RandomGenerator_set_seed(RandomGenerator *self, PyObject *args)
+{
+    PyObject *ret = NULL;
+    unsigned long long seed;
+
+    if (RandomGenerator_check_state(self) != 0) {
+        goto out;
+    }
+    if (!PyArg_ParseTuple(args, "K", &seed)) {
+        goto out;
+    }
+    if (seed == 0 || seed >= (1ULL<<32)) {
+        PyErr_Format(PyExc_ValueError,
+            "seeds must be greater than 0 and less than 2^32");
+        goto out;
+    }
+    self->seed = seed;
+    gsl_rng_set(self->rng, self->seed);
+    ret = Py_BuildValue("");
+out:
+    return ret;
+}
+
+static PyObject *
+RandomGenerator_get_algorithm(RandomGenerator *self)
+{
+    PyObject *ret = NULL;
+
+    if (RandomGenerator_check_state(self) != 0) {
+        goto out;
+    }
+    ret = Py_BuildValue("s", gsl_rng_name(self->rng));
+out:
+    return ret;
+}
+
+static PyObject *
+RandomGenerator_jump(RandomGenerator *self, PyObject *args, PyObject *kwds)
+{
+    PyObject *ret = NULL;
+    static char *kwlist[] = {"num_jumps", NULL};
+    Py_ssize_t num_jumps = 1;
+    int err;
+
+    if (RandomGenerator_check_state(self) != 0) {
+        goto out;
+    }
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "|n", kwlist, &num_jumps)) {
+        goto out;
+    }
+    if (num_jumps < 0) {
+        PyErr_SetString(PyExc_ValueError, "Number of jumps must be >= 0");
+        goto out;
+    }
+    err = msp_rng_jump(self->rng, (unsigned long) num_jumps);
+    if (err != 0) {
+        handle_input_error(err);
+        goto out;
+    }
+    ret = Py_BuildValue("");
+out:
+    return ret;
+}
+
 static PyMemberDef RandomGenerator_members[] = {
     {NULL}  /* Sentinel */
 };
@@ -1701,6 +1868,14 @@ static PyMemberDef RandomGenerator_members[] = {
 static PyMethodDef RandomGenerator_methods[] = {
     {"get_seed", (PyCFunction) RandomGenerator_get_seed,
         METH_NOARGS, "Returns the random seed for this generator."},
+    {"set_seed", (PyCFunction) RandomGenerator_set_seed,
+        METH_VARARGS, "Resets the state of this generator using the specified seed."},
+    {"get_algorithm", (PyCFunction) RandomGenerator_get_algorithm,
+        METH_NOARGS, "Returns the name of the random number generator algorithm."},
+    {"jump", (PyCFunction) RandomGenerator_jump,
+        METH_VARARGS|METH_KEYWORDS,
+        "Advances the generator by num_jumps * 2^128 steps, giving a stream "
+        "that does not overlap with the original."},
     {NULL}  /* Sentinel */
 };
 
@@ -1862,17 +2037,21 @@ MutationGenerator_generate(MutationGenerator *self, PyObject *args, PyObject *kw
     LightweightTableCollection *tables = NULL;
     int flags = 0;
     int keep = 0;
-    static char *kwlist[] = {"tables", "keep", NULL};
+    int reuse_exposure = 0;
+    static char *kwlist[] = {"tables", "keep", "reuse_exposure", NULL};
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O!|i", kwlist,
-            &LightweightTableCollectionType, &tables, &keep)) {
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O!|ii", kwlist,
+            &LightweightTableCollectionType, &tables, &keep, &reuse_exposure)) {
         goto out;
     }
     if (MutationGenerator_check_state(self) != 0) {
         goto out;
     }
     if (keep) {
-        flags = MSP_KEEP_SITES;
+        flags |= MSP_KEEP_SITES;
+    }
+    if (reuse_exposure) {
+        flags |= MSP_REUSE_EXPOSURE;
     }
     err = mutgen_generate(self->mutgen, tables->tables, flags);
     if (err != 0) {
@@ -2371,36 +2550,97 @@ out:
 }
 
 static int
-Simulator_parse_migration_matrix(Simulator *self, PyObject *py_migration_matrix)
+Simulator_parse_sparse_migration_matrix(Simulator *self, PyObject *py_migration_matrix)
 {
     int ret = -1;
     int err;
-    size_t num_populations, j, size;
+    size_t num_entries;
     PyObject *value;
-    double *migration_matrix = NULL;
+    PyArrayObject *source_array = NULL;
+    PyArrayObject *dest_array = NULL;
+    PyArrayObject *rate_array = NULL;
 
-    size = PyList_Size(py_migration_matrix);
-    migration_matrix = PyMem_Malloc(size * sizeof(double));
-    if (migration_matrix == NULL) {
-        PyErr_NoMemory();
+    value = get_dict_value(py_migration_matrix, "source");
+    if (value == NULL) {
         goto out;
     }
-    if (Simulator_check_sim(self) != 0) {
+    source_array = table_read_column_array(value, NPY_INT32, &num_entries, false);
+    if (source_array == NULL) {
         goto out;
     }
-    num_populations = msp_get_num_populations(self->sim);
-    if (num_populations * num_populations != size) {
-        PyErr_Format(PyExc_ValueError,
-            "Migration matrix must be a flattened "
-            "num_populations*num_populations square array");
+    value = get_dict_value(py_migration_matrix, "dest");
+    if (value == NULL) {
         goto out;
     }
-    for (j = 0; j < size; j++) {
-        value = PyList_GetItem(py_migration_matrix, j);
-        if (!PyNumber_Check(value)) {
-            PyErr_Format(PyExc_TypeError, "Migration rate not a number");
-            goto out;
-        }
+    dest_array = table_read_column_array(value, NPY_INT32, &num_entries, true);
+    if (dest_array == NULL) {
+        goto out;
+    }
+    value = get_dict_value(py_migration_matrix, "rate");
+    if (value == NULL) {
+        goto out;
+    }
+    rate_array = table_read_column_array(value, NPY_FLOAT64, &num_entries, true);
+    if (rate_array == NULL) {
+        goto out;
+    }
+    err = msp_set_sparse_migration_matrix(self->sim, num_entries,
+            PyArray_DATA(source_array), PyArray_DATA(dest_array),
+            PyArray_DATA(rate_array));
+    if (err != 0) {
+        handle_input_error(err);
+        goto out;
+    }
+    ret = 0;
+out:
+    Py_XDECREF(source_array);
+    Py_XDECREF(dest_array);
+    Py_XDECREF(rate_array);
+    return ret;
+}
+
+/* The migration matrix is either a flattened num_populations *
+ * num_populations list, or a dictionary of the source, dest and rate
+ * arrays of its nonzero entries. */
+static int
+Simulator_parse_migration_matrix(Simulator *self, PyObject *py_migration_matrix)
+{
+    int ret = -1;
+    int err;
+    size_t num_populations, j, size;
+    PyObject *value;
+    double *migration_matrix = NULL;
+
+    if (Simulator_check_sim(self) != 0) {
+        goto out;
+    }
+    if (PyDict_Check(py_migration_matrix)) {
+        ret = Simulator_parse_sparse_migration_matrix(self, py_migration_matrix);
+        goto out;
+    }
+    if (!PyList_Check(py_migration_matrix)) {
+        PyErr_SetString(PyExc_TypeError, "Migration matrix must be a list or dict");
+        goto out;
+    }
+    size = PyList_Size(py_migration_matrix);
+    migration_matrix = PyMem_Malloc(size * sizeof(double));
+    if (migration_matrix == NULL) {
+        PyErr_NoMemory();
+        goto out;
+    }
+    num_populations = msp_get_num_populations(self->sim);
+    if (num_populations * num_populations != size) {
+        PyErr_Format(PyExc_ValueError,
+            "Migration matrix must be a flattened "
+            "num_populations*num_populations square array");
+        goto out;
+    }
+    for (j = 0; j < size; j++) {
+        value = PyList_GetItem(py_migration_matrix, j);
+        if (!PyNumber_Check(value)) {
+            PyErr_Format(PyExc_TypeError, "Migration rate not a number");
+            goto out;
+        }
         migration_matrix[j] = PyFloat_AsDouble(value);
         if (migration_matrix[j] < 0.0) {
             PyErr_Format(PyExc_ValueError, "Negative values not permitted");
@@ -2655,10 +2895,23 @@ Simulator_parse_demographic_events(Simulator *self, PyObject *py_events)
            strength;
     int err, population_id, matrix_index, source, destination;
     int is_population_parameter_change, is_migration_rate_change, is_mass_migration,
-        is_simple_bottleneck, is_instantaneous_bottleneck, is_census_event;
+        is_simple_bottleneck, is_instantaneous_bottleneck, is_census_event,
+        is_population_size_history, is_migration_matrix_change, size_function,
+        per_lineage;
+    size_t num_breakpoints, num_entries;
+    double *carrying_capacity;
     PyObject *item, *value, *type;
+    PyArrayObject *times_array = NULL;
+    PyArrayObject *initial_sizes_array = NULL;
+    PyArrayObject *growth_rates_array = NULL;
+    PyArrayObject *carrying_capacities_array = NULL;
+    PyArrayObject *source_array = NULL;
+    PyArrayObject *dest_array = NULL;
+    PyArrayObject *rate_array = NULL;
     PyObject *population_parameter_change_s = NULL;
+    PyObject *population_size_history_s = NULL;
     PyObject *migration_rate_change_s = NULL;
+    PyObject *migration_matrix_change_s = NULL;
     PyObject *mass_migration_s = NULL;
     PyObject *simple_bottleneck_s = NULL;
     PyObject *instantaneous_bottleneck_s = NULL;
@@ -2676,10 +2929,18 @@ Simulator_parse_demographic_events(Simulator *self, PyObject *py_events)
     if (population_parameter_change_s == NULL) {
         goto out;
     }
+    population_size_history_s = Py_BuildValue("s", "population_size_history");
+    if (population_size_history_s == NULL) {
+        goto out;
+    }
     migration_rate_change_s = Py_BuildValue("s", "migration_rate_change");
     if (migration_rate_change_s == NULL) {
         goto out;
     }
+    migration_matrix_change_s = Py_BuildValue("s", "migration_matrix_change");
+    if (migration_matrix_change_s == NULL) {
+        goto out;
+    }
     mass_migration_s = Py_BuildValue("s", "mass_migration");
     if (mass_migration_s == NULL) {
         goto out;
@@ -2733,11 +2994,21 @@ Simulator_parse_demographic_events(Simulator *self, PyObject *py_events)
         if (is_population_parameter_change == -1) {
             goto out;
         }
+        is_population_size_history = PyObject_RichCompareBool(type,
+                population_size_history_s, Py_EQ);
+        if (is_population_size_history == -1) {
+            goto out;
+        }
         is_migration_rate_change = PyObject_RichCompareBool(type,
                 migration_rate_change_s, Py_EQ);
         if (is_migration_rate_change == -1) {
             goto out;
         }
+        is_migration_matrix_change = PyObject_RichCompareBool(type,
+                migration_matrix_change_s, Py_EQ);
+        if (is_migration_matrix_change == -1) {
+            goto out;
+        }
         is_mass_migration = PyObject_RichCompareBool(type, mass_migration_s,
                 Py_EQ);
         if (is_mass_migration == -1) {
@@ -2782,6 +3053,69 @@ Simulator_parse_demographic_events(Simulator *self, PyObject *py_events)
             population_id = (int) PyLong_AsLong(value);
             err = msp_add_population_parameters_change(self->sim, time,
                     population_id, initial_size, growth_rate);
+        } else if (is_population_size_history) {
+            value = get_dict_number(item, "population");
+            if (value == NULL) {
+                goto out;
+            }
+            population_id = (int) PyLong_AsLong(value);
+            value = get_dict_value(item, "times");
+            if (value == NULL) {
+                goto out;
+            }
+            times_array = table_read_column_array(value, NPY_FLOAT64,
+                    &num_breakpoints, false);
+            if (times_array == NULL) {
+                goto out;
+            }
+            value = get_dict_value(item, "initial_sizes");
+            if (value == NULL) {
+                goto out;
+            }
+            initial_sizes_array = table_read_column_array(value, NPY_FLOAT64,
+                    &num_breakpoints, true);
+            if (initial_sizes_array == NULL) {
+                goto out;
+            }
+            value = get_dict_value(item, "growth_rates");
+            if (value == NULL) {
+                goto out;
+            }
+            growth_rates_array = table_read_column_array(value, NPY_FLOAT64,
+                    &num_breakpoints, true);
+            if (growth_rates_array == NULL) {
+                goto out;
+            }
+            size_function = MSP_SIZE_FUNCTION_EXPONENTIAL;
+            if (PyDict_GetItemString(item, "size_function") != NULL) {
+                value = get_dict_number(item, "size_function");
+                if (value == NULL) {
+                    goto out;
+                }
+                size_function = (int) PyLong_AsLong(value);
+                if (PyErr_Occurred()) {
+                    goto out;
+                }
+            }
+            carrying_capacity = NULL;
+            value = PyDict_GetItemString(item, "carrying_capacities");
+            if (value != NULL && value != Py_None) {
+                carrying_capacities_array = table_read_column_array(value,
+                        NPY_FLOAT64, &num_breakpoints, true);
+                if (carrying_capacities_array == NULL) {
+                    goto out;
+                }
+                carrying_capacity = PyArray_DATA(carrying_capacities_array);
+            }
+            /* The arrays are copied, so we can release them straight away */
+            err = msp_add_population_size_history(self->sim, population_id,
+                    size_function, num_breakpoints, PyArray_DATA(times_array),
+                    PyArray_DATA(initial_sizes_array),
+                    PyArray_DATA(growth_rates_array), carrying_capacity);
+            Py_CLEAR(times_array);
+            Py_CLEAR(initial_sizes_array);
+            Py_CLEAR(growth_rates_array);
+            Py_CLEAR(carrying_capacities_array);
         } else if (is_migration_rate_change) {
             value = get_dict_number(item, "migration_rate");
             if (value == NULL) {
@@ -2795,6 +3129,41 @@ Simulator_parse_demographic_events(Simulator *self, PyObject *py_events)
             matrix_index = (int) PyLong_AsLong(value);
             err = msp_add_migration_rate_change(self->sim, time, matrix_index,
                     migration_rate);
+        } else if (is_migration_matrix_change) {
+            value = get_dict_value(item, "source");
+            if (value == NULL) {
+                goto out;
+            }
+            source_array = table_read_column_array(value, NPY_INT32,
+                    &num_entries, false);
+            if (source_array == NULL) {
+                goto out;
+            }
+            value = get_dict_value(item, "dest");
+            if (value == NULL) {
+                goto out;
+            }
+            dest_array = table_read_column_array(value, NPY_INT32,
+                    &num_entries, true);
+            if (dest_array == NULL) {
+                goto out;
+            }
+            value = get_dict_value(item, "rate");
+            if (value == NULL) {
+                goto out;
+            }
+            rate_array = table_read_column_array(value, NPY_FLOAT64,
+                    &num_entries, true);
+            if (rate_array == NULL) {
+                goto out;
+            }
+            /* The entries are copied, so we can release them straight away */
+            err = msp_add_migration_matrix_change(self->sim, time, num_entries,
+                    PyArray_DATA(source_array), PyArray_DATA(dest_array),
+                    PyArray_DATA(rate_array));
+            Py_CLEAR(source_array);
+            Py_CLEAR(dest_array);
+            Py_CLEAR(rate_array);
         } else if (is_mass_migration) {
             value = get_dict_number(item, "proportion");
             if (value == NULL) {
@@ -2840,7 +3209,15 @@ Simulator_parse_demographic_events(Simulator *self, PyObject *py_events)
             err = msp_add_instantaneous_bottleneck(self->sim, time, population_id,
                     strength);
         } else if (is_census_event) {
-            err = msp_add_census_event(self->sim, time);
+            per_lineage = false;
+            value = PyDict_GetItemString(item, "per_lineage");
+            if (value != NULL) {
+                per_lineage = PyObject_IsTrue(value);
+                if (per_lineage == -1) {
+                    goto out;
+                }
+            }
+            err = msp_add_census_event(self->sim, time, (bool) per_lineage);
         } else {
             PyErr_Format(PyExc_ValueError, "Unknown demographic event type");
             goto out;
@@ -2852,8 +3229,17 @@ Simulator_parse_demographic_events(Simulator *self, PyObject *py_events)
     }
     ret = 0;
 out:
+    Py_XDECREF(times_array);
+    Py_XDECREF(initial_sizes_array);
+    Py_XDECREF(growth_rates_array);
+    Py_XDECREF(carrying_capacities_array);
+    Py_XDECREF(source_array);
+    Py_XDECREF(dest_array);
+    Py_XDECREF(rate_array);
     Py_XDECREF(population_parameter_change_s);
+    Py_XDECREF(population_size_history_s);
     Py_XDECREF(migration_rate_change_s);
+    Py_XDECREF(migration_matrix_change_s);
     Py_XDECREF(mass_migration_s);
     Py_XDECREF(simple_bottleneck_s);
     Py_XDECREF(instantaneous_bottleneck_s);
@@ -2909,13 +3295,13 @@ Simulator_init(Simulator *self, PyObject *args, PyObject *kwds)
     self->sim = NULL;
     self->random_generator = NULL;
     self->recombination_map = NULL;
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O!O!O!O!|O!O!O!O!nnnidin", kwlist,
-            &PyList_Type, &py_samples,
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO!O!O!|O!OO!O!nnnidin", kwlist,
+            &py_samples,
             &RecombinationMapType, &recombination_map,
             &RandomGeneratorType, &random_generator,
             &LightweightTableCollectionType, &tables,
             &PyList_Type, &population_configuration,
-            &PyList_Type, &migration_matrix,
+            &migration_matrix,
             &PyList_Type, &demographic_events,
             &PyDict_Type, &py_model,
             &avl_node_block_size, &segment_block_size,
@@ -3140,6 +3526,132 @@ out:
     return ret;
 }
 
+static PyObject *
+Simulator_set_reference_size(Simulator *self, PyObject *args)
+{
+    PyObject *ret = NULL;
+    double reference_size;
+    int err;
+
+    if (Simulator_check_sim(self) != 0) {
+        goto out;
+    }
+    if (!PyArg_ParseTuple(args, "d", &reference_size)) {
+        goto out;
+    }
+    err = msp_set_reference_size(self->sim, reference_size);
+    if (err != 0) {
+        handle_input_error(err);
+        goto out;
+    }
+    ret = Py_BuildValue("");
+out:
+    return ret;
+}
+
+static PyObject *
+Simulator_set_recombination_map(Simulator *self, PyObject *args)
+{
+    PyObject *ret = NULL;
+    RecombinationMap *recombination_map = NULL;
+    int err;
+
+    if (Simulator_check_sim(self) != 0) {
+        goto out;
+    }
+    if (!PyArg_ParseTuple(args, "O!", &RecombinationMapType, &recombination_map)) {
+        goto out;
+    }
+    if (RecombinationMap_check_recomb_map(recombination_map) != 0) {
+        goto out;
+    }
+    err = msp_set_recombination_map(self->sim, recombination_map->recomb_map);
+    if (err != 0) {
+        handle_input_error(err);
+        goto out;
+    }
+    /* The simulator now refers to the new map's memory, so we must keep a
+     * reference to it and release the old one. */
+    Py_INCREF(recombination_map);
+    Py_XDECREF(self->recombination_map);
+    self->recombination_map = recombination_map;
+    ret = Py_BuildValue("");
+out:
+    return ret;
+}
+
+static PyObject *
+Simulator_set_population_configuration(Simulator *self, PyObject *args)
+{
+    PyObject *ret = NULL;
+    PyObject *population_configuration = NULL;
+
+    if (Simulator_check_sim(self) != 0) {
+        goto out;
+    }
+    if (!PyArg_ParseTuple(args, "O!", &PyList_Type, &population_configuration)) {
+        goto out;
+    }
+    if (PyList_Size(population_configuration)
+            != (Py_ssize_t) msp_get_num_populations(self->sim)) {
+        PyErr_SetString(PyExc_ValueError,
+            "The number of populations cannot be changed");
+        goto out;
+    }
+    if (Simulator_parse_population_configuration(self, population_configuration) != 0) {
+        goto out;
+    }
+    ret = Py_BuildValue("");
+out:
+    return ret;
+}
+
+static PyObject *
+Simulator_set_migration_matrix(Simulator *self, PyObject *args)
+{
+    PyObject *ret = NULL;
+    PyObject *migration_matrix = NULL;
+
+    if (Simulator_check_sim(self) != 0) {
+        goto out;
+    }
+    if (!PyArg_ParseTuple(args, "O", &migration_matrix)) {
+        goto out;
+    }
+    if (Simulator_parse_migration_matrix(self, migration_matrix) != 0) {
+        goto out;
+    }
+    ret = Py_BuildValue("");
+out:
+    return ret;
+}
+
+static PyObject *
+Simulator_set_demographic_events(Simulator *self, PyObject *args)
+{
+    PyObject *ret = NULL;
+    PyObject *demographic_events = NULL;
+    int err;
+
+    if (Simulator_check_sim(self) != 0) {
+        goto out;
+    }
+    if (!PyArg_ParseTuple(args, "O!", &PyList_Type, &demographic_events)) {
+        goto out;
+    }
+    err = msp_clear_demographic_events(self->sim);
+    if (err != 0) {
+        handle_input_error(err);
+        goto out;
+    }
+    if (Simulator_parse_demographic_events(self, demographic_events) != 0) {
+        goto out;
+    }
+    ret = Py_BuildValue("");
+out:
+    return ret;
+}
+
 static PyObject *
 Simulator_get_num_loci(Simulator *self)
 {
@@ -3272,6 +3784,30 @@ out:
     return ret;
 }
 
+static PyObject *
+Simulator_get_num_events(Simulator  *self)
+{
+    PyObject *ret = NULL;
+    if (Simulator_check_sim(self) != 0) {
+        goto out;
+    }
+    ret = Py_BuildValue("n", (Py_ssize_t) msp_get_num_events(self->sim));
+out:
+    return ret;
+}
+
+static PyObject *
+Simulator_get_used_memory(Simulator  *self)
+{
+    PyObject *ret = NULL;
+    if (Simulator_check_sim(self) != 0) {
+        goto out;
+    }
+    ret = Py_BuildValue("n", (Py_ssize_t) msp_get_used_memory(self->sim));
+out:
+    return ret;
+}
+
 static PyObject *
 Simulator_get_num_common_ancestor_events(Simulator  *self)
 {
@@ -3581,6 +4117,47 @@ out:
     return ret;
 }
 
+static PyObject *
+Simulator_get_sparse_migration_matrix(Simulator *self)
+{
+    PyObject *ret = NULL;
+    PyArrayObject *source_array = NULL;
+    PyArrayObject *dest_array = NULL;
+    PyArrayObject *rate_array = NULL;
+    PyArrayObject *num_events_array = NULL;
+    npy_intp num_entries;
+    int err;
+
+    if (Simulator_check_sim(self) != 0) {
+        goto out;
+    }
+    num_entries = (npy_intp) msp_get_num_migration_matrix_entries(self->sim);
+    source_array = (PyArrayObject *) PyArray_SimpleNew(1, &num_entries, NPY_INT32);
+    dest_array = (PyArrayObject *) PyArray_SimpleNew(1, &num_entries, NPY_INT32);
+    rate_array = (PyArrayObject *) PyArray_SimpleNew(1, &num_entries, NPY_FLOAT64);
+    num_events_array = (PyArrayObject *) PyArray_SimpleNew(1, &num_entries,
+            NPY_UINTP);
+    if (source_array == NULL || dest_array == NULL || rate_array == NULL
+            || num_events_array == NULL) {
+        goto out;
+    }
+    err = msp_get_sparse_migration_matrix(self->sim, PyArray_DATA(source_array),
+            PyArray_DATA(dest_array), PyArray_DATA(rate_array),
+            PyArray_DATA(num_events_array));
+    if (err != 0) {
+        handle_library_error(err);
+        goto out;
+    }
+    ret = Py_BuildValue("{s:O,s:O,s:O,s:O}", "source", source_array,
+            "dest", dest_array, "rate", rate_array, "num_events", num_events_array);
+out:
+    Py_XDECREF(source_array);
+    Py_XDECREF(dest_array);
+    Py_XDECREF(rate_array);
+    Py_XDECREF(num_events_array);
+    return ret;
+}
+
 /* TODO these get_edge/nodes/migration methods are no longer necessary
  * once we have an direct reference to the underlying tables. They're
  * only used for testing, so remove and update the tests to work from the
@@ -3780,27 +4357,93 @@ out:
 }
 
 
+/* Returns the value of the time.perf_counter function, or -1 if an error
+ * occurs. */
+static double
+get_perf_counter(PyObject *perf_counter)
+{
+    double ret = -1;
+    PyObject *value = PyObject_CallObject(perf_counter, NULL);
+
+    if (value != NULL) {
+        ret = PyFloat_AsDouble(value);
+        Py_DECREF(value);
+    }
+    return ret;
+}
+
 static PyObject *
-Simulator_run(Simulator *self, PyObject *args)
+Simulator_run(Simulator *self, PyObject *args, PyObject *kwds)
 {
     PyObject *ret = NULL;
+    PyObject *time_module = NULL;
+    PyObject *perf_counter = NULL;
+    static char *kwlist[] = {"end_time", "max_wall_time", "max_events",
+        "max_memory", NULL};
     int status, not_done, coalesced;
-    uint64_t chunk = 1024;
+    size_t num_events;
+    uint64_t chunk;
     double end_time = DBL_MAX;
+    double max_wall_time = 0;
+    double start_time = 0;
+    double now;
+    Py_ssize_t max_events = 0;
+    Py_ssize_t max_memory = 0;
+    const char *limit = NULL;
 
     if (Simulator_check_sim(self) != 0) {
         goto out;
     }
-    if (!PyArg_ParseTuple(args, "|d", &end_time)) {
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "|ddnn", kwlist,
+                &end_time, &max_wall_time, &max_events, &max_memory)) {
         goto out;
     }
     if (end_time < 0) {
         PyErr_SetString(PyExc_ValueError, "end_time must be > 0");
         goto out;
     }
+    if (max_wall_time < 0) {
+        PyErr_SetString(PyExc_ValueError, "max_wall_time must be >= 0");
+        goto out;
+    }
+    if (max_events < 0) {
+        PyErr_SetString(PyExc_ValueError, "max_events must be >= 0");
+        goto out;
+    }
+    if (max_memory < 0) {
+        PyErr_SetString(PyExc_ValueError, "max_memory must be >= 0");
+        goto out;
+    }
+    if (max_wall_time > 0) {
+        time_module = PyImport_ImportModule("time");
+        if (time_module == NULL) {
+            goto out;
+        }
+        perf_counter = PyObject_GetAttrString(time_module, "perf_counter");
+        if (perf_counter == NULL) {
+            goto out;
+        }
+        start_time = get_perf_counter(perf_counter);
+        if (start_time == -1 && PyErr_Occurred()) {
+            goto out;
+        }
+    }
 
+    /* Limits are checked between chunks of events, so that we never stop
+     * in the middle of an event and the state of the simulation is still
+     * valid. The max_events limit applies to the total number of events
+     * since the simulation was reset, and so we choose the size of the
+     * last chunk so that the limit is hit exactly. */
     not_done = 1;
     while (not_done) {
+        chunk = 1024;
+        if (max_events > 0) {
+            num_events = msp_get_num_events(self->sim);
+            chunk = 0;
+            if (num_events < (size_t) max_events) {
+                chunk = GSL_MIN((size_t) max_events - num_events, 1024);
+            }
+        }
         Py_BEGIN_ALLOW_THREADS
         status = msp_run(self->sim, end_time, chunk);
         Py_END_ALLOW_THREADS
@@ -3812,12 +4455,69 @@ Simulator_run(Simulator *self, PyObject *args)
         if (PyErr_CheckSignals() < 0) {
             goto out;
         }
+        if (not_done) {
+            if (max_events > 0
+                    && msp_get_num_events(self->sim) >= (size_t) max_events) {
+                limit = "max_events";
+            } else if (max_memory > 0
+                    && msp_get_used_memory(self->sim) > (size_t) max_memory) {
+                limit = "max_memory";
+            } else if (max_wall_time > 0) {
+                now = get_perf_counter(perf_counter);
+                if (now == -1 && PyErr_Occurred()) {
+                    goto out;
+                }
+                if (now - start_time > max_wall_time) {
+                    limit = "max_wall_time";
+                }
+            }
+            if (limit != NULL) {
+                PyErr_SetString(MsprimeLimitExceededError, limit);
+                goto out;
+            }
+        }
     }
     coalesced = status == 0;
     /* return True if complete coalescence has occured */
     ret = coalesced ? Py_True : Py_False;
 
     Py_INCREF(ret);
+out:
+    Py_XDECREF(time_module);
+    Py_XDECREF(perf_counter);
+    return ret;
+}
+
+static PyObject *
+Simulator_run_chunk(Simulator *self, PyObject *args)
+{
+    PyObject *ret = NULL;
+    int status;
+    double end_time;
+    Py_ssize_t max_events;
+
+    if (Simulator_check_sim(self) != 0) {
+        goto out;
+    }
+    if (!PyArg_ParseTuple(args, "dn", &end_time, &max_events)) {
+        goto out;
+    }
+    if (end_time < 0) {
+        PyErr_SetString(PyExc_ValueError, "end_time must be > 0");
+        goto out;
+    }
+    if (max_events <= 0) {
+        PyErr_SetString(PyExc_ValueError, "max_events must be > 0");
+        goto out;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    status = msp_run(self->sim, end_time, (unsigned long) max_events);
+    Py_END_ALLOW_THREADS
+    if (status < 0) {
+        handle_library_error(status);
+        goto out;
+    }
+    ret = Py_BuildValue("i", status);
 out:
     return ret;
 }
@@ -3930,6 +4630,21 @@ static PyMethodDef Simulator_methods[] = {
             "Sets the simulation model." },
     {"get_model", (PyCFunction) Simulator_get_model, METH_NOARGS,
             "Returns the simulation model" },
+    {"set_reference_size", (PyCFunction) Simulator_set_reference_size,
+            METH_VARARGS,
+            "Sets the reference population size, taking effect on the next reset." },
+    {"set_recombination_map", (PyCFunction) Simulator_set_recombination_map,
+            METH_VARARGS,
+            "Replaces the recombination map, taking effect on the next reset." },
+    {"set_population_configuration",
+            (PyCFunction) Simulator_set_population_configuration, METH_VARARGS,
+            "Sets the population configuration, taking effect on the next reset." },
+    {"set_migration_matrix", (PyCFunction) Simulator_set_migration_matrix,
+            METH_VARARGS,
+            "Sets the migration matrix, taking effect on the next reset." },
+    {"set_demographic_events", (PyCFunction) Simulator_set_demographic_events,
+            METH_VARARGS,
+            "Replaces the demographic events, taking effect on the next reset." },
     {"get_num_loci", (PyCFunction) Simulator_get_num_loci, METH_NOARGS,
             "Returns the number of loci" },
     {"get_store_migrations",
@@ -3957,6 +4672,12 @@ static PyMethodDef Simulator_methods[] = {
             "Returns the current simulation time" },
     {"get_num_ancestors", (PyCFunction) Simulator_get_num_ancestors, METH_NOARGS,
             "Returns the number of ancestors" },
+    {"get_num_events",
+            (PyCFunction) Simulator_get_num_events, METH_NOARGS,
+            "Returns the total number of events simulated since the last reset" },
+    {"get_used_memory",
+            (PyCFunction) Simulator_get_used_memory, METH_NOARGS,
+            "Returns an estimate of the memory used by the simulation in bytes" },
     {"get_num_common_ancestor_events",
             (PyCFunction) Simulator_get_num_common_ancestor_events, METH_NOARGS,
             "Returns the number of common_ancestor_events" },
@@ -3998,6 +4719,10 @@ static PyMethodDef Simulator_methods[] = {
             "Returns the ancestors" },
     {"get_breakpoints", (PyCFunction) Simulator_get_breakpoints,
             METH_NOARGS, "Returns the list of breakpoints." },
+    {"get_sparse_migration_matrix",
+            (PyCFunction) Simulator_get_sparse_migration_matrix, METH_NOARGS,
+            "Returns the source, dest, rate and num_events arrays of the "
+            "entries of the migration matrix." },
     {"get_migration_matrix", (PyCFunction) Simulator_get_migration_matrix,
             METH_NOARGS, "Returns the migration matrix." },
     {"get_nodes", (PyCFunction) Simulator_get_nodes,
@@ -4012,13 +4737,17 @@ static PyMethodDef Simulator_methods[] = {
     {"get_samples",
             (PyCFunction) Simulator_get_samples, METH_NOARGS,
             "Returns the samples"},
-    {"run", (PyCFunction) Simulator_run, METH_VARARGS,
+    {"run", (PyCFunction) Simulator_run, METH_VARARGS|METH_KEYWORDS,
             "Simulates until at most the specified time. Returns True\
-            if sample has coalesced and False otherwise." },
+            if sample has coalesced and False otherwise. Raises a\
+            LimitExceededError if one of the specified limits is reached." },
     {"reset", (PyCFunction) Simulator_reset, METH_NOARGS,
             "Resets the simulation so it's ready for another replicate."},
     {"finalise_tables", (PyCFunction) Simulator_finalise_tables, METH_NOARGS,
             "Finalises the tables so they ready for export."},
+    {"run_chunk", (PyCFunction) Simulator_run_chunk, METH_VARARGS,
+            "Runs the simulation for at most the specified number of events, "
+            "returning the exit status." },
     {"run_event", (PyCFunction) Simulator_run_event, METH_NOARGS,
             "Simulates exactly one event. Returns True "
             "if sample has coalesced and False otherwise." },
@@ -4119,6 +4848,111 @@ out:
     return ret;
 }
 
+static PyObject *
+msprime_summary_stats(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    PyObject *ret = NULL;
+    int err;
+    LightweightTableCollection *tables = NULL;
+    PyObject *stats = NULL;
+    PyArrayObject *stats_array = NULL;
+    PyArrayObject *output = NULL;
+    static char *kwlist[] = {"tables", "statistics", "output", NULL};
+    size_t num_stats, size;
+    tsk_treeseq_t ts;
+
+    memset(&ts, 0, sizeof(ts));
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O!OO!", kwlist,
+            &LightweightTableCollectionType, &tables, &stats,
+            &PyArray_Type, &output)) {
+        goto out;
+    }
+    stats_array = (PyArrayObject *) PyArray_FROMANY(stats, NPY_INT32, 1, 1,
+            NPY_ARRAY_IN_ARRAY);
+    if (stats_array == NULL) {
+        goto out;
+    }
+    num_stats = (size_t) PyArray_DIMS(stats_array)[0];
+    if (PyArray_NDIM(output) != 1 || PyArray_TYPE(output) != NPY_FLOAT64
+            || !PyArray_ISCARRAY(output)) {
+        PyErr_SetString(PyExc_TypeError,
+                "output must be a writable contiguous 1D float64 array");
+        goto out;
+    }
+    err = tsk_treeseq_init(&ts, tables->tables, TSK_BUILD_INDEXES);
+    if (err != 0) {
+        handle_tskit_library_error(err);
+        goto out;
+    }
+    err = msp_get_summary_stats_size(&ts, num_stats, PyArray_DATA(stats_array),
+            &size);
+    if (err != 0) {
+        handle_library_error(err);
+        goto out;
+    }
+    if ((size_t) PyArray_DIMS(output)[0] != size) {
+        PyErr_Format(PyExc_ValueError, "output must have length %d",
+                (int) size);
+        goto out;
+    }
+    err = msp_summary_stats(&ts, num_stats, PyArray_DATA(stats_array),
+            size, PyArray_DATA(output));
+    if (err != 0) {
+        handle_library_error(err);
+        goto out;
+    }
+    ret = Py_BuildValue("");
+out:
+    tsk_treeseq_free(&ts);
+    Py_XDECREF(stats_array);
+    return ret;
+}
+
+static PyObject *
+msprime_format_ms_sites(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    PyObject *ret = NULL;
+    int err;
+    LightweightTableCollection *tables = NULL;
+    static char *kwlist[] = {"tables", "precision", NULL};
+    int precision;
+    char *buffer = NULL;
+    size_t length;
+    tsk_treeseq_t ts;
+
+    memset(&ts, 0, sizeof(ts));
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O!i", kwlist,
+            &LightweightTableCollectionType, &tables, &precision)) {
+        goto out;
+    }
+    if (LightweightTableCollection_check_state(tables) != 0) {
+        goto out;
+    }
+    if (precision < 0) {
+        PyErr_SetString(PyExc_ValueError, "precision must be >= 0");
+        goto out;
+    }
+    err = tsk_treeseq_init(&ts, tables->tables, TSK_BUILD_INDEXES);
+    if (err != 0) {
+        handle_tskit_library_error(err);
+        goto out;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    err = msp_format_ms_sites(&ts, (unsigned int) precision, &buffer, &length);
+    Py_END_ALLOW_THREADS
+    if (err != 0) {
+        handle_library_error(err);
+        goto out;
+    }
+    ret = PyUnicode_FromStringAndSize(buffer, (Py_ssize_t) length);
+out:
+    tsk_treeseq_free(&ts);
+    if (buffer != NULL) {
+        free(buffer);
+    }
+    return ret;
+}
+
 static PyObject *
 msprime_get_gsl_version(PyObject *self)
 {
@@ -4145,6 +4979,12 @@ static PyMethodDef msprime_methods[] = {
     {"log_likelihood_arg", (PyCFunction) msprime_log_likelihood_arg,
             METH_VARARGS|METH_KEYWORDS,
             "Computes the log-likelihood of an ARG." },
+    {"summary_stats", (PyCFunction) msprime_summary_stats,
+            METH_VARARGS|METH_KEYWORDS,
+            "Computes summary statistics of the specified tables into an array." },
+    {"format_ms_sites", (PyCFunction) msprime_format_ms_sites,
+            METH_VARARGS|METH_KEYWORDS,
+            "Returns the segregating sites of the specified tables in ms format." },
     {"get_gsl_version", (PyCFunction) msprime_get_gsl_version, METH_NOARGS,
             "Returns the version of GSL we are linking against." },
     {"restore_gsl_error_handler", (PyCFunction) msprime_restore_gsl_error_handler,
@@ -4220,11 +5060,28 @@ PyInit__msprime(void)
     MsprimeLibraryError = PyErr_NewException("_msprime.LibraryError", NULL, NULL);
     Py_INCREF(MsprimeLibraryError);
     PyModule_AddObject(module, "LibraryError", MsprimeLibraryError);
-
+    MsprimeLimitExceededError = PyErr_NewException(
+        "_msprime.LimitExceededError", NULL, NULL);
+    Py_INCREF(MsprimeLimitExceededError);
+    PyModule_AddObject(module, "LimitExceededError", MsprimeLimitExceededError);
+
+    PyModule_AddIntConstant(module, "EXIT_COALESCENCE", 0);
+    PyModule_AddIntConstant(module, "EXIT_MAX_EVENTS", MSP_EXIT_MAX_EVENTS);
+    PyModule_AddIntConstant(module, "EXIT_MAX_TIME", MSP_EXIT_MAX_TIME);
+    PyModule_AddIntConstant(module, "NODE_IS_SAMPLE", TSK_NODE_IS_SAMPLE);
     PyModule_AddIntConstant(module, "NODE_IS_CA_EVENT", MSP_NODE_IS_CA_EVENT);
     PyModule_AddIntConstant(module, "NODE_IS_RE_EVENT", MSP_NODE_IS_RE_EVENT);
     PyModule_AddIntConstant(module, "NODE_IS_MIG_EVENT", MSP_NODE_IS_MIG_EVENT);
     PyModule_AddIntConstant(module, "NODE_IS_CEN_EVENT", MSP_NODE_IS_CEN_EVENT);
+    PyModule_AddIntConstant(module, "SIZE_FUNCTION_EXPONENTIAL",
+            MSP_SIZE_FUNCTION_EXPONENTIAL);
+    PyModule_AddIntConstant(module, "SIZE_FUNCTION_LINEAR", MSP_SIZE_FUNCTION_LINEAR);
+    PyModule_AddIntConstant(module, "SIZE_FUNCTION_LOGISTIC",
+            MSP_SIZE_FUNCTION_LOGISTIC);
+    PyModule_AddIntConstant(module, "STAT_NUM_TREES", MSP_STAT_NUM_TREES);
+    PyModule_AddIntConstant(module, "STAT_SEGREGATING_SITES", MSP_STAT_SEGREGATING_SITES);
+    PyModule_AddIntConstant(module, "STAT_PI", MSP_STAT_PI);
+    PyModule_AddIntConstant(module, "STAT_SFS", MSP_STAT_SFS);
 
     /* The function unset_gsl_error_handler should be called at import time,
      * ensuring we capture the value of the handler. However, just in case
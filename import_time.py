@@ -0,0 +1,83 @@
+"""
+Measures the time taken to import msprime in a fresh interpreter, so that
+we can keep track of the startup cost paid by every invocation of the
+command line programs.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+
+def time_command(args):
+    before = time.perf_counter()
+    subprocess.check_call(args)
+    return time.perf_counter() - before
+
+
+def import_breakdown(module):
+    """
+    Returns a list of (cumulative_time, name) tuples for the modules directly
+    imported while importing the specified module, as reported by the
+    interpreter's -X importtime option.
+    """
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    result = []
+    children = []
+    for line in output.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        # Nested imports are indented by two spaces per level, and are
+        # reported before the module that imports them.
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((int(cumulative) / 1e6, name.strip()))
+        elif depth == 0:
+            if name.strip() == module:
+                result = children
+            children = []
+    return sorted(result, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the time taken to import msprime.")
+    parser.add_argument(
+        "-m", "--module", default="msprime", help="The module to import")
+    parser.add_argument(
+        "-n", "--num-runs", type=int, default=20,
+        help="The number of times to start the interpreter")
+    parser.add_argument(
+        "-b", "--budget", type=float, default=None,
+        help="Exit with an error if the median import time exceeds this many "
+        "seconds")
+    args = parser.parse_args()
+
+    # Subtract the time taken to start an interpreter that does nothing.
+    baseline = [
+        time_command([sys.executable, "-c", "pass"]) for _ in range(args.num_runs)]
+    times = [
+        time_command([sys.executable, "-c", "import " + args.module])
+        for _ in range(args.num_runs)]
+    offset = statistics.median(baseline)
+    median = statistics.median(times) - offset
+    print("import {}: median = {:.3f}s min = {:.3f}s (startup = {:.3f}s)".format(
+        args.module, median, min(times) - offset, offset))
+
+    for cumulative, name in import_breakdown(args.module):
+        print("\t{:.3f}s\t{}".format(cumulative, name))
+    # tskit should only be imported when it is first used.
+    output = subprocess.check_output([
+        sys.executable, "-c",
+        "import sys, {}; print('tskit' in sys.modules)".format(args.module)])
+    if output.strip() == b"True":
+        print("WARNING: tskit was imported")
+    if args.budget is not None and median > args.budget:
+        sys.exit("Import time {:.3f}s exceeds the budget of {:.3f}s".format(
+            median, args.budget))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+/*
+** Copyright (C) 2019 University of Oxford
+**
+** This file is part of msprime.
+**
+** msprime is free software: you can redistribute it and/or modify
+** it under the terms of the GNU General Public License as published by
+** the Free Software Foundation, either version 3 of the License, or
+** (at your option) any later version.
+**
+** msprime is distributed in the hope that it will be useful,
+** but WITHOUT ANY WARRANTY; without even the implied warranty of
+** MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+** GNU General Public License for more details.
+**
+** You should have received a copy of the GNU General Public License
+** along with msprime.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+/*
+ * Output of the segregating sites in a tree sequence in the text format
+ * used by ms, so that ms-compatible programs do not need to format
+ * large numbers of sites and haplotypes in Python.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+
+#include <gsl/gsl_math.h>
+
+#include "msformat.h"
+#include "msprime.h"
+
+typedef struct {
+    char *data;
+    size_t length;
+    size_t max_length;
+} text_buffer_t;
+
+/* Ensures that there is space for at least the specified number of
+ * characters after the current end of the buffer. */
+static int MSP_WARN_UNUSED
+text_buffer_reserve(text_buffer_t *self, size_t num_chars)
+{
+    int ret = 0;
+    size_t max_length;
+    char *p;
+
+    if (self->length + num_chars > self->max_length) {
+        max_length = GSL_MAX(2 * self->max_length, self->length + num_chars);
+        p = realloc(self->data, max_length);
+        if (p == NULL) {
+            ret = MSP_ERR_NO_MEMORY;
+            goto out;
+        }
+        self->data = p;
+        self->max_length = max_length;
+    }
+out:
+    return ret;
+}
+
+static int MSP_WARN_UNUSED
+text_buffer_append(text_buffer_t *self, const char *str, size_t length)
+{
+    int ret = text_buffer_reserve(self, length);
+
+    if (ret == 0) {
+        memcpy(self->data + self->length, str, length);
+        self->length += length;
+    }
+    return ret;
+}
+
+/* Appends the specified value to the buffer in "%.*f " format. */
+static int MSP_WARN_UNUSED
+text_buffer_append_position(text_buffer_t *self, unsigned int precision, double x)
+{
+    int ret = 0;
+    int written;
+    size_t available = self->max_length - self->length;
+
+    written = snprintf(self->data + self->length, available, "%.*f ",
+            (int) precision, x);
+    if (written < 0) {
+        ret = MSP_ERR_GENERIC;
+        goto out;
+    }
+    if ((size_t) written >= available) {
+        /* snprintf needs space for the trailing NULL */
+        ret = text_buffer_reserve(self, (size_t) written + 1);
+        if (ret != 0) {
+            goto out;
+        }
+        available = self->max_length - self->length;
+        snprintf(self->data + self->length, available, "%.*f ", (int) precision, x);
+    }
+    self->length += (size_t) written;
+out:
+    return ret;
+}
+
+/* Writes the haplotypes for the specified tree sequence into the specified
+ * matrix with one row of length num_sites + 1 for each sample, where the
+ * last character of each row is a newline. */
+static int MSP_WARN_UNUSED
+msp_get_haplotypes(tsk_treeseq_t *ts, char *haplotypes)
+{
+    int ret = 0;
+    int it;
+    tsk_id_t u, index;
+    tsk_size_t l;
+    tsk_site_t *site;
+    tsk_mutation_t *mutation;
+    size_t j, k;
+    const size_t num_sites = tsk_treeseq_get_num_sites(ts);
+    const size_t num_samples = tsk_treeseq_get_num_samples(ts);
+    const size_t row_length = num_sites + 1;
+    tsk_tree_t tree;
+
+    memset(&tree, 0, sizeof(tree));
+    ret = tsk_tree_init(&tree, ts, TSK_SAMPLE_LISTS);
+    if (ret != 0) {
+        ret = msp_set_tsk_error(ret);
+        goto out;
+    }
+    for (it = tsk_tree_first(&tree); it == 1; it = tsk_tree_next(&tree)) {
+        for (l = 0; l < tree.sites_length; l++) {
+            site = &tree.sites[l];
+            mutation = &site->mutations[0];
+            if (site->mutations_length != 1 || site->ancestral_state_length != 1
+                    || mutation->derived_state_length != 1) {
+                ret = MSP_ERR_BAD_PARAM_VALUE;
+                goto out;
+            }
+            k = (size_t) site->id;
+            for (j = 0; j < num_samples; j++) {
+                haplotypes[j * row_length + k] = site->ancestral_state[0];
+            }
+            u = mutation->node;
+            index = tree.left_sample[u];
+            while (index != TSK_NULL) {
+                haplotypes[((size_t) index) * row_length + k] =
+                    mutation->derived_state[0];
+                if (index == tree.right_sample[u]) {
+                    break;
+                }
+                index = tree.next_sample[index];
+            }
+        }
+    }
+    if (it < 0) {
+        ret = msp_set_tsk_error(it);
+        goto out;
+    }
+    for (j = 0; j < num_samples; j++) {
+        haplotypes[j * row_length + num_sites] = '\n';
+    }
+out:
+    tsk_tree_free(&tree);
+    return ret;
+}
+
+/* Formats the segregating sites of the specified tree sequence as they
+ * appear in a replicate in ms's output: the "segsites" line, followed by
+ * the "positions" line and one line per sample giving its haplotype if
+ * there are any sites. Positions are given as a fraction of the sequence
+ * length with the specified number of decimal places. All sites must have
+ * exactly one mutation (i.e., infinite sites), and alleles must be single
+ * characters.
+ *
+ * On success, buffer points to a newly allocated string of the specified
+ * length (which is not NULL terminated) that must be freed by the caller.
+ */
+int
+msp_format_ms_sites(tsk_treeseq_t *ts, unsigned int precision,
+        char **buffer, size_t *length)
+{
+    int ret = 0;
+    size_t j;
+    const size_t num_sites = tsk_treeseq_get_num_sites(ts);
+    const size_t num_samples = tsk_treeseq_get_num_samples(ts);
+    const size_t haplotypes_length = num_samples * (num_sites + 1);
+    const double L = tsk_treeseq_get_sequence_length(ts);
+    const double *position = ts->tables->sites.position;
+    char line[64];
+    text_buffer_t text;
+
+    memset(&text, 0, sizeof(text));
+    if (tsk_treeseq_get_num_mutations(ts) != num_sites) {
+        ret = MSP_ERR_BAD_PARAM_VALUE;
+        goto out;
+    }
+    /* Each position takes at least precision + 3 characters */
+    ret = text_buffer_reserve(&text, 64 + num_sites * ((size_t) precision + 4)
+            + haplotypes_length);
+    if (ret != 0) {
+        goto out;
+    }
+    snprintf(line, sizeof(line), "segsites: %d\n", (int) num_sites);
+    ret = text_buffer_append(&text, line, strlen(line));
+    if (ret != 0) {
+        goto out;
+    }
+    if (num_sites == 0) {
+        ret = text_buffer_append(&text, "\n", 1);
+        if (ret != 0) {
+            goto out;
+        }
+    } else {
+        ret = text_buffer_append(&text, "positions: ", strlen("positions: "));
+        if (ret != 0) {
+            goto out;
+        }
+        /* Sites are sorted by position */
+        for (j = 0; j < num_sites; j++) {
+            ret = text_buffer_append_position(&text, precision, position[j] / L);
+            if (ret != 0) {
+                goto out;
+            }
+        }
+        ret = text_buffer_append(&text, "\n", 1);
+        if (ret != 0) {
+            goto out;
+        }
+        ret = text_buffer_reserve(&text, haplotypes_length);
+        if (ret != 0) {
+            goto out;
+        }
+        ret = msp_get_haplotypes(ts, text.data + text.length);
+        if (ret != 0) {
+            goto out;
+        }
+        text.length += haplotypes_length;
+    }
+    *buffer = text.data;
+    *length = text.length;
+    text.data = NULL;
+out:
+    msp_safe_free(text.data);
+    return ret;
+}
@@ -0,0 +1,29 @@
+/*
+** Copyright (C) 2019 University of Oxford
+**
+** This file is part of msprime.
+**
+** msprime is free software: you can redistribute it and/or modify
+** it under the terms of the GNU General Public License as published by
+** the Free Software Foundation, either version 3 of the License, or
+** (at your option) any later version.
+**
+** msprime is distributed in the hope that it will be useful,
+** but WITHOUT ANY WARRANTY; without even the implied warranty of
+** MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+** GNU General Public License for more details.
+**
+** You should have received a copy of the GNU General Public License
+** along with msprime.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+#ifndef __MSFORMAT_H__
+#define __MSFORMAT_H__
+
+#include <stdio.h>
+#include <tskit.h>
+
+int msp_format_ms_sites(tsk_treeseq_t *ts, unsigned int precision,
+        char **buffer, size_t *length);
+
+#endif /*__MSFORMAT_H__*/
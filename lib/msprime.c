@@ -75,6 +75,236 @@ cmp_sampling_event(const void *a, const void *b) {
     return (ia->time > ib->time) - (ia->time < ib->time);
 }
 
+static int
+cmp_migration_entry(const void *a, const void *b) {
+    const migration_entry_t *ia = (const migration_entry_t *) a;
+    const migration_entry_t *ib = (const migration_entry_t *) b;
+    return (ia->dest > ib->dest) - (ia->dest < ib->dest);
+}
+
+/* Migration matrix rows */
+
+static void
+migration_row_update_total_rate(migration_row_t *self)
+{
+    size_t j;
+
+    self->total_rate = 0;
+    for (j = 0; j < self->num_entries; j++) {
+        self->total_rate += self->entries[j].rate;
+    }
+}
+
+static int MSP_WARN_UNUSED
+migration_row_reserve(migration_row_t *self, size_t max_entries)
+{
+    int ret = 0;
+    migration_entry_t *p;
+
+    if (max_entries > self->max_entries) {
+        p = realloc(self->entries, max_entries * sizeof(migration_entry_t));
+        if (p == NULL) {
+            ret = MSP_ERR_NO_MEMORY;
+            goto out;
+        }
+        self->entries = p;
+        self->max_entries = max_entries;
+    }
+out:
+    return ret;
+}
+
+/* Returns the index of the first entry with destination >= dest. */
+static size_t
+migration_row_search(migration_row_t *self, population_id_t dest)
+{
+    size_t lo = 0;
+    size_t hi = self->num_entries;
+    size_t mid;
+
+    while (lo < hi) {
+        mid = (lo + hi) / 2;
+        if (self->entries[mid].dest < dest) {
+            lo = mid + 1;
+        } else {
+            hi = mid;
+        }
+    }
+    return lo;
+}
+
+static migration_entry_t *
+migration_row_get_entry(migration_row_t *self, population_id_t dest)
+{
+    size_t k = migration_row_search(self, dest);
+    migration_entry_t *entry = NULL;
+
+    if (k < self->num_entries && self->entries[k].dest == dest) {
+        entry = &self->entries[k];
+    }
+    return entry;
+}
+
+/* Sets the rate of migration to the specified destination, inserting a
+ * new entry if there is none and the rate is nonzero. */
+static int MSP_WARN_UNUSED
+migration_row_set_rate(migration_row_t *self, population_id_t dest, double rate)
+{
+    int ret = 0;
+    size_t k = migration_row_search(self, dest);
+
+    if (k < self->num_entries && self->entries[k].dest == dest) {
+        self->entries[k].rate = rate;
+    } else if (rate != 0.0) {
+        if (self->num_entries == self->max_entries) {
+            ret = migration_row_reserve(self, GSL_MAX(2 * self->max_entries, 8));
+            if (ret != 0) {
+                goto out;
+            }
+        }
+        memmove(self->entries + k + 1, self->entries + k,
+                (self->num_entries - k) * sizeof(migration_entry_t));
+        self->entries[k].dest = dest;
+        self->entries[k].rate = rate;
+        self->entries[k].num_events = 0;
+        self->num_entries++;
+    }
+    migration_row_update_total_rate(self);
+out:
+    return ret;
+}
+
+/* Sets the rate of migration to all of the num_populations populations
+ * other than the source population to the specified rate, keeping the
+ * event counts of the existing entries. */
+static int MSP_WARN_UNUSED
+migration_row_set_all_rates(migration_row_t *self, population_id_t source,
+        size_t num_populations, double rate)
+{
+    int ret = 0;
+    population_id_t dest;
+    size_t k, num_events;
+    size_t j = self->num_entries;
+
+    if (rate == 0.0) {
+        for (k = 0; k < self->num_entries; k++) {
+            self->entries[k].rate = 0.0;
+        }
+    } else {
+        ret = migration_row_reserve(self, num_populations - 1);
+        if (ret != 0) {
+            goto out;
+        }
+        /* Fill the row in place from the end, so that the existing entries
+         * are read before they are overwritten. */
+        for (dest = (population_id_t) num_populations - 1; dest >= 0; dest--) {
+            if (dest == source) {
+                continue;
+            }
+            k = (size_t) dest - (dest > source);
+            num_events = 0;
+            if (j > 0 && self->entries[j - 1].dest == dest) {
+                num_events = self->entries[j - 1].num_events;
+                j--;
+            }
+            self->entries[k].dest = dest;
+            self->entries[k].rate = rate;
+            self->entries[k].num_events = num_events;
+        }
+        self->num_entries = num_populations - 1;
+    }
+    migration_row_update_total_rate(self);
+out:
+    return ret;
+}
+
+/* Sets the rates of migration to the destinations of the specified
+ * entries, which must be sorted by destination, converting them with the
+ * specified function. The rates of all other entries are set to zero,
+ * and the event counts of the existing entries are kept. */
+static int MSP_WARN_UNUSED
+migration_row_set_rates(migration_row_t *self, size_t num_rates,
+        migration_entry_t *rates, simulation_model_t *model,
+        double (*convert)(simulation_model_t *, double))
+{
+    int ret = 0;
+    size_t j = 0;
+    size_t k = 0;
+    size_t n = 0;
+    migration_entry_t entry;
+
+    /* Count the entries in the union of the two rows */
+    while (j < self->num_entries || k < num_rates) {
+        if (k == num_rates
+                || (j < self->num_entries && self->entries[j].dest < rates[k].dest)) {
+            j++;
+        } else if (j == self->num_entries || rates[k].dest < self->entries[j].dest) {
+            k++;
+        } else {
+            j++;
+            k++;
+        }
+        n++;
+    }
+    ret = migration_row_reserve(self, n);
+    if (ret != 0) {
+        goto out;
+    }
+    /* Merge the rows in place from the end, so that the existing entries
+     * are read before they are overwritten. */
+    self->num_entries = n;
+    while (n > 0) {
+        n--;
+        if (k == 0 || (j > 0 && self->entries[j - 1].dest > rates[k - 1].dest)) {
+            entry = self->entries[j - 1];
+            entry.rate = 0.0;
+            j--;
+        } else if (j == 0 || rates[k - 1].dest > self->entries[j - 1].dest) {
+            entry.dest = rates[k - 1].dest;
+            entry.rate = convert(model, rates[k - 1].rate);
+            entry.num_events = 0;
+            k--;
+        } else {
+            entry = self->entries[j - 1];
+            entry.rate = convert(model, rates[k - 1].rate);
+            j--;
+            k--;
+        }
+        self->entries[n] = entry;
+    }
+    migration_row_update_total_rate(self);
+out:
+    return ret;
+}
+
+static int MSP_WARN_UNUSED
+migration_row_copy(migration_row_t *self, migration_row_t *source)
+{
+    int ret = migration_row_reserve(self, source->num_entries);
+
+    if (ret != 0) {
+        goto out;
+    }
+    memcpy(self->entries, source->entries,
+            source->num_entries * sizeof(migration_entry_t));
+    self->num_entries = source->num_entries;
+    self->total_rate = source->total_rate;
+out:
+    return ret;
+}
+
+static void
+migration_row_convert_rates(migration_row_t *self, simulation_model_t *model,
+        double (*convert)(simulation_model_t *, double))
+{
+    size_t k;
+
+    for (k = 0; k < self->num_entries; k++) {
+        self->entries[k].rate = convert(model, self->entries[k].rate);
+    }
+    migration_row_update_total_rate(self);
+}
+
 static void
 segment_init(void **obj, size_t id)
 {
@@ -105,6 +335,48 @@ msp_get_num_segment_blocks(msp_t *self)
     return total;
 }
 
+static size_t
+msp_get_object_heap_memory(object_heap_t *heap)
+{
+    return heap->num_blocks * heap->block_size * heap->object_size
+        + heap->size * sizeof(void *);
+}
+
+/* Returns an estimate of the number of bytes of memory used to store the
+ * state of the simulation, including the output tables. */
+size_t
+msp_get_used_memory(msp_t *self)
+{
+    uint32_t j;
+    size_t total = 0;
+    tsk_node_table_t *nodes = &self->tables->nodes;
+    tsk_edge_table_t *edges = &self->tables->edges;
+    tsk_migration_table_t *migrations = &self->tables->migrations;
+
+    total += msp_get_object_heap_memory(&self->avl_node_heap);
+    total += msp_get_object_heap_memory(&self->node_mapping_heap);
+    for (j = 0; j < self->num_labels; j++) {
+        total += msp_get_object_heap_memory(&self->segment_heap[j]);
+    }
+    for (j = 0; j < self->num_populations; j++) {
+        total += (self->initial_migration_matrix[j].max_entries
+                + self->migration_matrix[j].max_entries) * sizeof(migration_entry_t);
+    }
+    total += self->max_buffered_edges * sizeof(tsk_edge_t);
+    total += nodes->max_rows * (sizeof(tsk_flags_t) + sizeof(double)
+            + 2 * sizeof(tsk_id_t) + sizeof(tsk_size_t))
+        + nodes->max_metadata_length;
+    total += edges->max_rows * (2 * sizeof(double) + 2 * sizeof(tsk_id_t));
+    total += migrations->max_rows * (3 * sizeof(double) + 3 * sizeof(tsk_id_t));
+    return total;
+}
+
+size_t
+msp_get_num_events(msp_t *self)
+{
+    return self->num_events;
+}
+
 size_t
 msp_get_num_common_ancestor_events(msp_t *self)
 {
@@ -123,6 +395,14 @@ msp_get_num_recombination_events(msp_t *self)
     return self->num_re_events;
 }
 
+/* Returns true if the simulation has been started (or is being debugged)
+ * and not yet reset, so that parameters cannot be changed. */
+static bool
+msp_is_running(msp_t *self)
+{
+    return self->state == MSP_STATE_SIMULATING || self->state == MSP_STATE_DEBUGGING;
+}
+
 int
 msp_set_start_time(msp_t *self, double start_time)
 {
@@ -151,6 +431,23 @@ msp_set_store_full_arg(msp_t *self, bool store_full_arg)
     return 0;
 }
 
+static void
+msp_free_migration_matrices(msp_t *self)
+{
+    size_t j;
+
+    for (j = 0; j < self->num_populations; j++) {
+        if (self->initial_migration_matrix != NULL) {
+            msp_safe_free(self->initial_migration_matrix[j].entries);
+        }
+        if (self->migration_matrix != NULL) {
+            msp_safe_free(self->migration_matrix[j].entries);
+        }
+    }
+    msp_safe_free(self->initial_migration_matrix);
+    msp_safe_free(self->migration_matrix);
+}
+
 int
 msp_set_dimensions(msp_t *self, size_t num_populations, size_t num_labels)
 {
@@ -170,29 +467,22 @@ msp_set_dimensions(msp_t *self, size_t num_populations, size_t num_labels)
     for (j = 0; j < self->num_populations; j++) {
         msp_safe_free(self->populations[j].ancestors);
     }
+    msp_free_migration_matrices(self);
     msp_safe_free(self->populations);
     msp_safe_free(self->initial_populations);
-    msp_safe_free(self->initial_migration_matrix);
-    msp_safe_free(self->migration_matrix);
-    msp_safe_free(self->num_migration_events);
     msp_safe_free(self->links);
     msp_safe_free(self->segment_heap);
 
     self->num_populations = (uint32_t) num_populations;
     self->num_labels = (uint32_t) num_labels;
-    self->initial_migration_matrix = calloc(num_populations * num_populations,
-            sizeof(double));
-    self->migration_matrix = calloc(num_populations * num_populations,
-            sizeof(double));
-    self->num_migration_events = calloc(num_populations * num_populations,
-            sizeof(size_t));
+    self->initial_migration_matrix = calloc(num_populations, sizeof(migration_row_t));
+    self->migration_matrix = calloc(num_populations, sizeof(migration_row_t));
     self->initial_populations = calloc(num_populations, sizeof(population_t));
     self->populations = calloc(num_populations, sizeof(population_t));
     self->links = calloc(self->num_labels, sizeof(fenwick_t));
     self->segment_heap = calloc(self->num_labels, sizeof(object_heap_t));
     if (self->migration_matrix == NULL
             || self->initial_migration_matrix == NULL
-            || self->num_migration_events == NULL
             || self->initial_populations == NULL
             || self->populations == NULL
             || self->links == NULL
@@ -231,6 +521,10 @@ msp_set_population_configuration(msp_t *self, int population_id, double initial_
     int ret = MSP_ERR_BAD_POPULATION_CONFIGURATION;
     simulation_model_t *model = &self->model;
 
+    if (msp_is_running(self)) {
+        ret = MSP_ERR_BAD_STATE;
+        goto out;
+    }
     if (population_id < 0 || population_id > (int) self->num_populations) {
         ret = MSP_ERR_POPULATION_OUT_OF_BOUNDS;
         goto out;
@@ -255,7 +549,12 @@ msp_set_migration_matrix(msp_t *self, size_t size, double *migration_matrix)
     size_t j, k;
     size_t N = self->num_populations;
     simulation_model_t *model = &self->model;
+    migration_row_t *row;
 
+    if (msp_is_running(self)) {
+        ret = MSP_ERR_BAD_STATE;
+        goto out;
+    }
     if (N * N != size) {
         goto out;
     }
@@ -273,15 +572,165 @@ msp_set_migration_matrix(msp_t *self, size_t size, double *migration_matrix)
             }
         }
     }
-    for (j = 0; j < N * N; j++) {
-        self->initial_migration_matrix[j] = model->generation_rate_to_model_rate(
-                model, migration_matrix[j]);
+    for (j = 0; j < N; j++) {
+        row = &self->initial_migration_matrix[j];
+        row->num_entries = 0;
+        row->total_rate = 0;
+        for (k = 0; k < N; k++) {
+            if (migration_matrix[j * N + k] != 0.0) {
+                ret = migration_row_set_rate(row, (population_id_t) k,
+                        model->generation_rate_to_model_rate(
+                            model, migration_matrix[j * N + k]));
+                if (ret != 0) {
+                    goto out;
+                }
+            }
+        }
     }
     ret = 0;
 out:
     return ret;
 }
 
+/* Sets the initial migration matrix from the specified entries, in any
+ * order. Entries with zero rates are ignored. */
+int
+msp_set_sparse_migration_matrix(msp_t *self, size_t num_entries,
+        population_id_t *source, population_id_t *dest, double *rate)
+{
+    int ret = MSP_ERR_BAD_MIGRATION_MATRIX;
+    size_t j, k;
+    population_id_t N = (population_id_t) self->num_populations;
+    simulation_model_t *model = &self->model;
+    migration_row_t *row;
+    migration_entry_t *entry;
+
+    if (msp_is_running(self)) {
+        ret = MSP_ERR_BAD_STATE;
+        goto out;
+    }
+    for (j = 0; j < num_entries; j++) {
+        if (source[j] < 0 || source[j] >= N || dest[j] < 0 || dest[j] >= N
+                || rate[j] < 0.0 || (source[j] == dest[j] && rate[j] != 0.0)) {
+            goto out;
+        }
+    }
+    /* Count the entries in each row, so that each is allocated once */
+    for (k = 0; k < self->num_populations; k++) {
+        self->initial_migration_matrix[k].num_entries = 0;
+        self->initial_migration_matrix[k].total_rate = 0;
+    }
+    for (j = 0; j < num_entries; j++) {
+        if (rate[j] != 0.0) {
+            self->initial_migration_matrix[source[j]].num_entries++;
+        }
+    }
+    for (k = 0; k < self->num_populations; k++) {
+        row = &self->initial_migration_matrix[k];
+        ret = migration_row_reserve(row, row->num_entries);
+        if (ret != 0) {
+            goto out;
+        }
+        row->num_entries = 0;
+    }
+    for (j = 0; j < num_entries; j++) {
+        if (rate[j] != 0.0) {
+            row = &self->initial_migration_matrix[source[j]];
+            entry = &row->entries[row->num_entries];
+            entry->dest = dest[j];
+            entry->rate = model->generation_rate_to_model_rate(model, rate[j]);
+            entry->num_events = 0;
+            row->num_entries++;
+        }
+    }
+    for (k = 0; k < self->num_populations; k++) {
+        row = &self->initial_migration_matrix[k];
+        qsort(row->entries, row->num_entries, sizeof(migration_entry_t),
+                cmp_migration_entry);
+        for (j = 1; j < row->num_entries; j++) {
+            if (row->entries[j].dest == row->entries[j - 1].dest) {
+                row->num_entries = 0;
+                row->total_rate = 0;
+                ret = MSP_ERR_BAD_MIGRATION_MATRIX;
+                goto out;
+            }
+        }
+        migration_row_update_total_rate(row);
+    }
+    ret = 0;
+out:
+    return ret;
+}
+
+/* Replaces the recombination map used by an initialised simulation. The
+ * new map must have the same number of loci and sequence length, so that
+ * none of the simulation's memory needs to be reallocated. */
+int
+msp_set_recombination_map(msp_t *self, recomb_map_t *recomb_map)
+{
+    int ret = 0;
+    simulation_model_t *model = &self->model;
+
+    if (self->state != MSP_STATE_INITIALISED) {
+        ret = MSP_ERR_BAD_STATE;
+        goto out;
+    }
+    if (recomb_map_get_num_loci(recomb_map) != self->num_loci
+            || recomb_map_get_sequence_length(recomb_map)
+                != recomb_map_get_sequence_length(self->recomb_map)) {
+        ret = MSP_ERR_BAD_RECOMBINATION_MAP;
+        goto out;
+    }
+    self->recomb_map = recomb_map;
+    self->recombination_rate = model->generation_rate_to_model_rate(model,
+            recomb_map_get_per_locus_recombination_rate(recomb_map));
+out:
+    return ret;
+}
+
+static int msp_change_population_size_history(msp_t *self,
+        demographic_event_t *event);
+
+static int msp_change_migration_matrix(msp_t *self, demographic_event_t *event);
+
+static void
+msp_free_demographic_event(demographic_event_t *de)
+{
+    if (de->change_state == msp_change_population_size_history) {
+        /* All of the history arrays are held in a single block */
+        free(de->params.population_size_history.time);
+    } else if (de->change_state == msp_change_migration_matrix) {
+        free(de->params.migration_matrix_change.entries);
+        free(de->params.migration_matrix_change.row_start);
+    }
+    free(de);
+}
+
+/* Removes all demographic events, so that a new set can be added before
+ * the simulation is next reset. */
+int
+msp_clear_demographic_events(msp_t *self)
+{
+    int ret = 0;
+    demographic_event_t *de = self->demographic_events_head;
+    demographic_event_t *tmp;
+
+    if (msp_is_running(self)) {
+        ret = MSP_ERR_BAD_STATE;
+        goto out;
+    }
+    while (de != NULL) {
+        tmp = de->next;
+        msp_free_demographic_event(de);
+        de = tmp;
+    }
+    self->demographic_events_head = NULL;
+    self->demographic_events_tail = NULL;
+    self->next_demographic_event = NULL;
+out:
+    return ret;
+}
+
 int
 msp_set_node_mapping_block_size(msp_t *self, size_t block_size)
 {
@@ -441,8 +890,6 @@ msp_alloc(msp_t *self,
     if (ret != 0) {
         goto out;
     }
-    /* Set sensible defaults for the sample_config and migration matrix */
-    self->initial_migration_matrix[0] = 0.0;
     /* Set the memory defaults */
     self->store_migrations = false;
     self->store_full_arg = false;
@@ -525,7 +972,7 @@ msp_free(msp_t *self)
 
     while (de != NULL) {
         tmp = de->next;
-        free(de);
+        msp_free_demographic_event(de);
         de = tmp;
     }
     for (j = 0; j < self->num_labels; j++) {
@@ -541,9 +988,7 @@ msp_free(msp_t *self)
     }
     msp_safe_free(self->links);
     msp_safe_free(self->segment_heap);
-    msp_safe_free(self->initial_migration_matrix);
-    msp_safe_free(self->migration_matrix);
-    msp_safe_free(self->num_migration_events);
+    msp_free_migration_matrices(self);
     msp_safe_free(self->initial_populations);
     msp_safe_free(self->populations);
     msp_safe_free(self->samples);
@@ -839,10 +1284,13 @@ msp_print_state(msp_t *self, FILE *out)
     }
     fprintf(out, "Migration matrix\n");
     for (j = 0; j < self->num_populations; j++) {
-        fprintf(out, "\t");
-        for (k = 0; k < self->num_populations; k++) {
-            fprintf(out, "%0.3f ",
-                self->migration_matrix[j * self->num_populations + k]);
+        fprintf(out, "\t%d: total_rate = %0.3f:", j,
+                self->migration_matrix[j].total_rate);
+        for (k = 0; k < self->migration_matrix[j].num_entries; k++) {
+            fprintf(out, " %d -> %0.3f (%d)",
+                (int) self->migration_matrix[j].entries[k].dest,
+                self->migration_matrix[j].entries[k].rate,
+                (int) self->migration_matrix[j].entries[k].num_events);
         }
         fprintf(out, "\n");
     }
@@ -1869,6 +2317,62 @@ out:
     return ret;
 }
 
+/* Returns the total rate of migration of the lineages with the specified
+ * label. */
+static double
+msp_get_total_migration_rate(msp_t *self, label_id_t label)
+{
+    uint32_t j;
+    double rate = 0;
+
+    for (j = 0; j < self->num_populations; j++) {
+        rate += avl_count(&self->populations[j].ancestors[label])
+            * self->migration_matrix[j].total_rate;
+    }
+    return rate;
+}
+
+/* Chooses the source and destination populations of a migration event
+ * in proportion to their rates, given the total rate of migration. */
+static void
+msp_choose_migration(msp_t *self, label_id_t label, double total_rate,
+        population_id_t *source_pop, population_id_t *dest_pop)
+{
+    uint32_t j;
+    size_t k;
+    double x;
+    double u = gsl_rng_uniform(self->rng) * total_rate;
+    migration_row_t *row = NULL;
+
+    /* If rounding takes u past the end, we keep the last possible choice */
+    for (j = 0; j < self->num_populations; j++) {
+        x = avl_count(&self->populations[j].ancestors[label])
+            * self->migration_matrix[j].total_rate;
+        if (x > 0) {
+            row = &self->migration_matrix[j];
+            *source_pop = (population_id_t) j;
+            if (u < x) {
+                u /= avl_count(&self->populations[j].ancestors[label]);
+                break;
+            }
+            u -= x;
+        }
+    }
+    assert(row != NULL);
+    for (k = 0; k < row->num_entries; k++) {
+        if (row->entries[k].rate > 0) {
+            /* m[j, k] is the rate at which migrants move from population k
+             * to j forwards in time. Backwards in time, we move the
+             * individual from population j into population k. */
+            *dest_pop = row->entries[k].dest;
+            if (u < row->entries[k].rate) {
+                break;
+            }
+            u -= row->entries[k].rate;
+        }
+    }
+}
+
 static int MSP_WARN_UNUSED
 msp_migration_event(msp_t *self, population_id_t source_pop, population_id_t dest_pop)
 {
@@ -1877,9 +2381,11 @@ msp_migration_event(msp_t *self, population_id_t source_pop, population_id_t des
     avl_node_t *node;
     label_id_t label = 0; /* For now only support label 0 */
     avl_tree_t *source = &self->populations[source_pop].ancestors[label];
-    size_t index = ((size_t) source_pop) * self->num_populations + (size_t) dest_pop;
+    migration_entry_t *entry = migration_row_get_entry(
+            &self->migration_matrix[source_pop], dest_pop);
 
-    self->num_migration_events[index]++;
+    assert(entry != NULL);
+    entry->num_events++;
     j = (uint32_t) gsl_rng_uniform_int(self->rng, avl_count(source));
     node = avl_at(source, j);
     assert(node != NULL);
@@ -1925,6 +2431,14 @@ msp_reset_memory_state(msp_t *self)
         msp_free_avl_node(self, node);
         msp_free_node_mapping(self, nm);
     }
+    /* Edges are left in the buffer if the previous simulation was stopped
+     * or debugged through events that merge lineages. */
+    self->num_buffered_edges = 0;
+    /* Segments are ordered by their IDs, so we must reset the segment heaps
+     * to ensure that a reset simulation is identical to a new one. */
+    for (label = 0; label < (label_id_t) self->num_labels; label++) {
+        object_heap_reset(&self->segment_heap[label]);
+    }
     return ret;
 }
 
@@ -2178,6 +2692,14 @@ msp_reset(msp_t *self)
     population_t *pop, *initial_pop;
 
     memcpy(&self->model, &self->initial_model, sizeof(self->model));
+    /* If any demographic events have time < than the start_time then
+     * raise an error */
+    if (self->demographic_events_head != NULL) {
+        if (self->demographic_events_head->time < self->start_time) {
+            ret = MSP_ERR_BAD_DEMOGRAPHIC_EVENT_TIME;
+            goto out;
+        }
+    }
     ret = msp_reset_memory_state(self);
     if (ret != 0) {
         goto out;
@@ -2192,6 +2714,8 @@ msp_reset(msp_t *self)
         pop->growth_rate = initial_pop->growth_rate;
         pop->initial_size = initial_pop->initial_size;
         pop->start_time = self->time;
+        pop->size_history = NULL;
+        pop->size_history_index = 0;
     }
     if (self->from_ts == NULL) {
         ret = msp_reset_from_samples(self);
@@ -2202,15 +2726,20 @@ msp_reset(msp_t *self)
         goto out;
     }
     self->next_demographic_event = self->demographic_events_head;
-    memcpy(self->migration_matrix, self->initial_migration_matrix,
-            N * N * sizeof(double));
+    for (population_id = 0; population_id < (population_id_t) N; population_id++) {
+        ret = migration_row_copy(&self->migration_matrix[population_id],
+                &self->initial_migration_matrix[population_id]);
+        if (ret != 0) {
+            goto out;
+        }
+    }
     self->next_sampling_event = 0;
+    self->num_events = 0;
     self->num_re_events = 0;
     self->num_ca_events = 0;
     self->num_rejected_ca_events = 0;
     self->num_trapped_re_events = 0;
     self->num_multiple_re_events = 0;
-    memset(self->num_migration_events, 0, N * N * sizeof(size_t));
     self->state = MSP_STATE_INITIALISED;
 out:
     return ret;
@@ -2342,20 +2871,232 @@ msp_initialise(msp_t *self)
 
     /* Copy the state of the simulation model into the initial model */
     memcpy(&self->initial_model, &self->model, sizeof(self->model));
-    /* If any demographic events have time < than the start_time then
-     * raise an error */
-    if (self->demographic_events_head != NULL) {
-        if (self->demographic_events_head->time < self->start_time) {
-            ret = MSP_ERR_BAD_DEMOGRAPHIC_EVENT_TIME;
-            goto out;
+    ret = msp_reset(self);
+    if (ret != 0) {
+        goto out;
+    }
+out:
+    return ret;
+}
+
+/* Returns the index of the breakpoint of the specified size history that is
+ * in effect at time t. The search starts from the specified index, so that
+ * moving forward through the history usually takes constant time. */
+static size_t
+population_size_history_get_index(population_size_history_t *history,
+        size_t index, double t)
+{
+    size_t lo, hi, mid;
+    double *time = history->model_time;
+    size_t n = history->num_breakpoints;
+
+    if (time[index] <= t && (index + 1 == n || t < time[index + 1])) {
+        return index;
+    }
+    if (index + 2 < n && time[index + 1] <= t && t < time[index + 2]) {
+        return index + 1;
+    }
+    /* Binary search for the last breakpoint with time <= t */
+    lo = 0;
+    hi = n;
+    while (hi - lo > 1) {
+        mid = lo + (hi - lo) / 2;
+        if (time[mid] <= t) {
+            lo = mid;
+        } else {
+            hi = mid;
         }
     }
-    ret = msp_reset(self);
-    if (ret != 0) {
-        goto out;
+    return lo;
+}
+
+/* Returns the size of the population in interval k of the specified size
+ * history at time t. */
+static double
+population_size_history_get_size(population_size_history_t *history, size_t k,
+        double t)
+{
+    double size = history->model_initial_size[k];
+    double rate = history->model_growth_rate[k];
+    double dt = t - history->model_time[k];
+    double K;
+    double ret = size;
+
+    if (history->size_function == MSP_SIZE_FUNCTION_LINEAR) {
+        ret = size + rate * dt;
+    } else if (history->size_function == MSP_SIZE_FUNCTION_LOGISTIC) {
+        if (rate != 0.0) {
+            K = history->model_carrying_capacity[k];
+            ret = K / (1 + (K / size - 1) * exp(rate * dt));
+        }
+    } else if (rate != 0.0) {
+        ret = size * exp(-rate * dt);
+    }
+    return ret;
+}
+
+/* Returns the integral of the inverse population size over [x, x + w] in
+ * interval k of the specified size history. */
+static double
+population_size_history_get_hazard(population_size_history_t *history, size_t k,
+        double x, double w)
+{
+    double size = history->model_initial_size[k];
+    double rate = history->model_growth_rate[k];
+    double dt = x - history->model_time[k];
+    double K;
+    double ret = w / size;
+
+    if (rate != 0.0) {
+        if (history->size_function == MSP_SIZE_FUNCTION_LINEAR) {
+            ret = log1p(rate * w / (size + rate * dt)) / rate;
+        } else if (history->size_function == MSP_SIZE_FUNCTION_LOGISTIC) {
+            K = history->model_carrying_capacity[k];
+            ret = (w + (K / size - 1) * exp(rate * dt) * expm1(rate * w) / rate) / K;
+        } else {
+            ret = exp(rate * dt) * expm1(rate * w) / (rate * size);
+        }
+    }
+    return ret;
+}
+
+/* Returns the w >= 0 such that w + a * (exp(r * w) - 1) = b, which is the
+ * scaled integral of the inverse size of a logistically growing population,
+ * or DBL_MAX if there is no such w. The function is increasing while the
+ * population size is positive, and so we use Newton's method safeguarded by
+ * bisection. max_w is an upper bound on the solution, or infinite. */
+static double
+logistic_solve_hazard(double a, double r, double b, double max_w)
+{
+    double lo = 0;
+    double hi = max_w;
+    double w, w_next, f, df, w_max;
+    int j;
+
+    if (a * r < 0 && r > 0) {
+        /* The population size goes to infinity at w_max, where the integral
+         * of the inverse size is finite. */
+        w_max = -log(-a * r) / r;
+        if (b >= w_max - 1 / r - a) {
+            return DBL_MAX;
+        }
+        hi = GSL_MIN(hi, w_max);
+    } else if (!gsl_finite(hi)) {
+        hi = b;
+        while (hi + a * expm1(r * hi) < b) {
+            hi *= 2;
+            if (!gsl_finite(hi)) {
+                return DBL_MAX;
+            }
+        }
+    }
+    w = GSL_MIN(b, hi / 2);
+    for (j = 0; j < 100; j++) {
+        f = w + a * expm1(r * w) - b;
+        if (f == 0) {
+            break;
+        }
+        if (f < 0) {
+            lo = w;
+        } else {
+            hi = w;
+        }
+        df = 1 + a * r * exp(r * w);
+        w_next = w - f / df;
+        if (!(w_next > lo && w_next < hi)) {
+            w_next = lo + (hi - lo) / 2;
+        }
+        if (fabs(w_next - w) <= 4 * DBL_EPSILON * w) {
+            w = w_next;
+            break;
+        }
+        w = w_next;
+    }
+    return w;
+}
+
+/* Returns the w >= 0 such that the integral of the inverse population size
+ * over [x, x + w] in interval k of the specified size history is u, or
+ * DBL_MAX if there is no such w. max_w is the length of the remainder of the
+ * interval, or infinite for the last interval. */
+static double
+population_size_history_solve_hazard(population_size_history_t *history, size_t k,
+        double x, double u, double max_w)
+{
+    double size = history->model_initial_size[k];
+    double rate = history->model_growth_rate[k];
+    double dt = x - history->model_time[k];
+    double K, z;
+    double ret = DBL_MAX;
+
+    if (rate == 0.0) {
+        ret = size * u;
+    } else if (history->size_function == MSP_SIZE_FUNCTION_LINEAR) {
+        ret = (size + rate * dt) * expm1(rate * u) / rate;
+    } else if (history->size_function == MSP_SIZE_FUNCTION_LOGISTIC) {
+        K = history->model_carrying_capacity[k];
+        ret = logistic_solve_hazard((K / size - 1) * exp(rate * dt) / rate, rate,
+                K * u, max_w);
+    } else {
+        z = 1 + rate * size * exp(-rate * dt) * u;
+        /* if z is <= 0 no coancestry can occur */
+        if (z > 0) {
+            ret = log(z) / rate;
+        }
+    }
+    return ret;
+}
+
+/* Updates the parameters of the specified population to those of the
+ * breakpoint of its size history that is in effect at time t. For size
+ * functions other than exponential, the population is given the size at
+ * the breakpoint and a growth rate of zero. */
+static void
+population_sync_size_history(population_t *pop, double t)
+{
+    population_size_history_t *history = pop->size_history;
+    size_t k = population_size_history_get_index(history, pop->size_history_index, t);
+
+    pop->size_history_index = k;
+    pop->initial_size = history->model_initial_size[k];
+    pop->growth_rate = 0;
+    if (history->size_function == MSP_SIZE_FUNCTION_EXPONENTIAL) {
+        pop->growth_rate = history->model_growth_rate[k];
+    }
+    pop->start_time = history->model_time[k];
+}
+
+/* Removes the size history of the specified population at time t, leaving
+ * the population with its size at that time. Exponential growth continues
+ * at the rate in effect at time t; otherwise the growth rate is zero. */
+static void
+population_detach_size_history(population_t *pop, double t)
+{
+    population_size_history_t *history = pop->size_history;
+
+    population_sync_size_history(pop, t);
+    if (history->size_function != MSP_SIZE_FUNCTION_EXPONENTIAL) {
+        pop->initial_size = population_size_history_get_size(history,
+                pop->size_history_index, t);
+        pop->start_time = t;
     }
-out:
-    return ret;
+    pop->size_history = NULL;
+}
+
+/* Sets the slope of the population size in each interval of a linear size
+ * history from the model times and sizes. */
+static void
+population_size_history_set_slopes(population_size_history_t *history)
+{
+    size_t k;
+    size_t n = history->num_breakpoints;
+
+    for (k = 0; k + 1 < n; k++) {
+        history->model_growth_rate[k] =
+            (history->model_initial_size[k + 1] - history->model_initial_size[k])
+            / (history->model_time[k + 1] - history->model_time[k]);
+    }
+    history->model_growth_rate[n - 1] = 0;
 }
 
 /* Returns the size of the specified population at the specified time */
@@ -2365,8 +3106,13 @@ get_population_size(population_t *pop, double t)
     double ret = 0;
     double alpha = pop->growth_rate;
     double dt;
+    size_t k;
 
-    if (alpha == 0.0) {
+    if (pop->size_history != NULL) {
+        k = population_size_history_get_index(pop->size_history,
+                pop->size_history_index, t);
+        ret = population_size_history_get_size(pop->size_history, k, t);
+    } else if (alpha == 0.0) {
         ret = pop->initial_size;
     } else {
         dt = t - pop->start_time;
@@ -2375,19 +3121,65 @@ get_population_size(population_t *pop, double t)
     return ret;
 }
 
+/* Returns the waiting time from time t until the integral of the inverse
+ * size of the specified population reaches u, walking forward through the
+ * breakpoints of its size history from the current one. Returns DBL_MAX if
+ * the integral never reaches u. */
+static double
+msp_get_size_history_waiting_time(population_t *pop, double t, double u)
+{
+    population_size_history_t *history = pop->size_history;
+    size_t k = pop->size_history_index;
+    double ret = 0;
+    double x = t;
+    double w, hazard;
+    double max_w = GSL_POSINF;
+
+    while (k + 1 < history->num_breakpoints) {
+        max_w = history->model_time[k + 1] - x;
+        hazard = population_size_history_get_hazard(history, k, x, max_w);
+        if (hazard >= u) {
+            break;
+        }
+        u -= hazard;
+        ret += max_w;
+        x = history->model_time[k + 1];
+        max_w = GSL_POSINF;
+        k++;
+    }
+    /* The waiting time ends within this interval */
+    w = population_size_history_solve_hazard(history, k, x, u, max_w);
+    if (w == DBL_MAX) {
+        ret = DBL_MAX;
+    } else {
+        ret += w;
+    }
+    return ret;
+}
+
 /* Given the specified rate, return the waiting time until the next common ancestor
  * event for the specified population */
 static double
 msp_get_common_ancestor_waiting_time_from_rate(msp_t *self, population_t *pop, double lambda)
 {
     double ret = DBL_MAX;
-    double alpha = pop->growth_rate;
     double t = self->time;
-    double u, dt, z;
+    double alpha, u, dt, z;
 
+    if (pop->size_history != NULL) {
+        population_sync_size_history(pop, t);
+    }
+    alpha = pop->growth_rate;
     if (lambda > 0.0) {
         u = gsl_ran_exponential(self->rng, 1.0 / lambda);
-        if (alpha == 0.0) {
+        if (pop->size_history != NULL
+                && (pop->size_history_index + 1 < pop->size_history->num_breakpoints
+                    || pop->size_history->size_function
+                        != MSP_SIZE_FUNCTION_EXPONENTIAL)) {
+            /* Integrate over the remaining breakpoints of the history
+             * directly, rather than restarting at each of them. */
+            ret = msp_get_size_history_waiting_time(pop, t, u);
+        } else if (alpha == 0.0) {
             ret = pop->initial_size * u;
         } else {
             dt = t - pop->start_time;
@@ -2456,11 +3248,13 @@ static int MSP_WARN_UNUSED
 msp_run_coalescent(msp_t *self, double max_time, unsigned long max_events)
 {
     int ret = 0;
-    double lambda, t_temp, t_wait, ca_t_wait, re_t_wait, mig_t_wait,
+    double lambda, t_temp, t_wait, ca_t_wait, re_t_wait, mig_t_wait, mig_rate,
            sampling_event_time, demographic_event_time;
     int64_t num_links;
-    uint32_t j, k, n;
-    population_id_t ca_pop_id, mig_source_pop, mig_dest_pop;
+    uint32_t j;
+    population_id_t ca_pop_id;
+    population_id_t mig_source_pop = 0;
+    population_id_t mig_dest_pop = 0;
     unsigned long events = 0;
     sampling_event_t *se;
     /* Only support a single label for now. */
@@ -2493,28 +3287,12 @@ msp_run_coalescent(msp_t *self, double max_time, unsigned long max_events)
                 ca_pop_id = (population_id_t) j;
             }
         }
-        /* Migration */
+        /* Migration. The source and destination populations are only
+         * chosen if a migration event happens. */
         mig_t_wait = DBL_MAX;
-        mig_source_pop = 0;
-        mig_dest_pop = 0;
-        for (j = 0; j < self->num_populations; j++) {
-            n = avl_count(&self->populations[j].ancestors[label]);
-            for (k = 0; k < self->num_populations; k++) {
-                lambda = n * self->migration_matrix[j * self->num_populations + k];
-                if (lambda != 0.0) {
-                    t_temp = gsl_ran_exponential(self->rng, 1.0 / lambda);
-                    if (t_temp < mig_t_wait) {
-                        mig_t_wait = t_temp;
-                        /* m[j, k] is the rate at which migrants move from
-                         * population k to j forwards in time. Backwards
-                         * in time, we move the individual from from
-                         * population j into population k.
-                         */
-                        mig_source_pop = (population_id_t) j;
-                        mig_dest_pop = (population_id_t) k;
-                    }
-                }
-            }
+        mig_rate = msp_get_total_migration_rate(self, label);
+        if (mig_rate != 0.0) {
+            mig_t_wait = gsl_ran_exponential(self->rng, 1.0 / mig_rate);
         }
         t_wait = GSL_MIN(GSL_MIN(re_t_wait, ca_t_wait), mig_t_wait);
         if (self->next_demographic_event == NULL
@@ -2584,6 +3362,8 @@ msp_run_coalescent(msp_t *self, double max_time, unsigned long max_events)
                     ret = 0;
                 }
             } else {
+                msp_choose_migration(self, label, mig_rate, &mig_source_pop,
+                        &mig_dest_pop);
                 ret = msp_migration_event(self, mig_source_pop, mig_dest_pop);
             }
             if (ret != 0) {
@@ -2592,6 +3372,7 @@ msp_run_coalescent(msp_t *self, double max_time, unsigned long max_events)
         }
     }
 out:
+    self->num_events += events;
     return ret;
 }
 
@@ -2746,11 +3527,14 @@ msp_simultaneous_migration_event(msp_t *self, avl_tree_t *nodes,
         population_id_t source_pop, population_id_t dest_pop) {
     int ret = 0;
     avl_node_t *node;
-    size_t index;
     label_id_t label = 0; /* For now only support label 0 */
+    migration_entry_t *entry = migration_row_get_entry(
+            &self->migration_matrix[source_pop], dest_pop);
 
-    index = ((size_t) source_pop) * self->num_populations + (size_t) dest_pop;
-    self->num_migration_events[index]++;
+    assert(entry != NULL);
+    if (avl_count(nodes) > 0) {
+        entry->num_events++;
+    }
 
     // Iterate through nodes in tree and move to new pop
     // -- removed from "nodes" in msp_move_individual()
@@ -2783,14 +3567,18 @@ msp_run_dtwf(msp_t *self, double max_time, unsigned long max_events)
     int mig_source_pop, mig_dest_pop;
     sampling_event_t *se;
     uint32_t j, k, i, N;
+    size_t num_entries, offset;
     unsigned int *n = NULL;
     double *mig_tmp = NULL;
     double sum, cur_time;
     avl_tree_t *node_trees = NULL;
     avl_tree_t *nodes;
+    migration_row_t *row;
     /* Only support a single structured coalescent label at the moment */
     label_id_t label = 0;
 
+    /* A row has at most num_populations - 1 entries, plus the
+     * non-migrants */
     n = malloc(self->num_populations * sizeof(int));
     mig_tmp = malloc(self->num_populations * sizeof(double));
     if (n == NULL || mig_tmp == NULL) {
@@ -2811,37 +3599,33 @@ msp_run_dtwf(msp_t *self, double max_time, unsigned long max_events)
         self->time++;
 
         /* Following SLiM, we perform migrations prior to selecting
-         * parents for the current generation */
-        node_trees = malloc(self->num_populations * self->num_populations
-                * sizeof(avl_tree_t));
+         * parents for the current generation. We keep a tree of migrants
+         * for each entry of the migration matrix. */
+        num_entries = msp_get_num_migration_matrix_entries(self);
+        node_trees = malloc(GSL_MAX(num_entries, 1) * sizeof(avl_tree_t));
         if (node_trees == NULL){
             ret = MSP_ERR_NO_MEMORY;
             goto out;
         }
 
-        mig_source_pop = 0;
-        mig_dest_pop = 0;
+        offset = 0;
         for (j = 0; j < self->num_populations; j++) {
+            row = &self->migration_matrix[j];
             // For proper sampling, we need to calculate the proportion
             // of non-migrants as well
             sum = 0;
-            for (k = 0; k < self->num_populations; k++) {
-                mig_tmp[k] = self->migration_matrix[j * self->num_populations + k];
+            for (k = 0; k < row->num_entries; k++) {
+                mig_tmp[k] = row->entries[k].rate;
                 sum += mig_tmp[k];
             }
-            assert(mig_tmp[j] == 0);
-
-            mig_tmp[j] = 1 - sum;
+            mig_tmp[row->num_entries] = 1 - sum;
             N = avl_count(&self->populations[j].ancestors[label]);
             gsl_ran_multinomial(
-                    self->rng, self->num_populations, N, mig_tmp, n);
+                    self->rng, row->num_entries + 1, N, mig_tmp, n);
 
-            for (k = 0; k < self->num_populations; k++) {
-                if (k == j) {
-                    continue;
-                }
+            for (k = 0; k < row->num_entries; k++) {
                 // Initialize an avl tree for this pair of populations
-                nodes = &node_trees[j * self->num_populations + k];
+                nodes = &node_trees[offset + k];
                 avl_init_tree(nodes, cmp_individual, NULL);
 
                 /* m[j, k] is the rate at which migrants move from
@@ -2850,8 +3634,6 @@ msp_run_dtwf(msp_t *self, double max_time, unsigned long max_events)
                  * population j into population k.
                  */
                 mig_source_pop = (population_id_t) j;
-                mig_dest_pop = (population_id_t) k;
-
                 for (i = 0; i < n[k]; i++) {
                     ret = msp_store_simultaneous_migration_events(
                             self, nodes, mig_source_pop, label);
@@ -2860,21 +3642,22 @@ msp_run_dtwf(msp_t *self, double max_time, unsigned long max_events)
                     }
                 }
             }
+            offset += row->num_entries;
         }
+        offset = 0;
         for (j = 0; j < self->num_populations; j++) {
-            for (k = 0; k < self->num_populations; k++) {
-                if (k == j) {
-                    continue;
-                }
-                nodes = &node_trees[j * self->num_populations + k];
+            row = &self->migration_matrix[j];
+            for (k = 0; k < row->num_entries; k++) {
+                nodes = &node_trees[offset + k];
                 mig_source_pop = (population_id_t) j;
-                mig_dest_pop = (population_id_t) k;
+                mig_dest_pop = row->entries[k].dest;
                 ret = msp_simultaneous_migration_event(
                         self, nodes, mig_source_pop, mig_dest_pop);
                 if (ret != 0) {
                     goto out;
                 }
             }
+            offset += row->num_entries;
         }
         free(node_trees);
         node_trees = NULL;
@@ -2914,6 +3697,7 @@ msp_run_dtwf(msp_t *self, double max_time, unsigned long max_events)
         }
     }
 out:
+    self->num_events += events;
     msp_safe_free(node_trees);
     msp_safe_free(n);
     msp_safe_free(mig_tmp);
@@ -3397,7 +4181,10 @@ msp_compute_population_size(msp_t *self, size_t population_id, double time,
         goto out;
     }
     pop = &self->populations[population_id];
-    if (pop->growth_rate == 0.0) {
+    if (pop->size_history != NULL) {
+        *pop_size = model->reference_size * get_population_size(pop,
+                model->generations_to_model_time(model, time));
+    } else if (pop->growth_rate == 0.0) {
         *pop_size = model->reference_size * pop->initial_size;
     } else {
         dt = model->generations_to_model_time(model, time) - pop->start_time;
@@ -3563,12 +4350,57 @@ int MSP_WARN_UNUSED
 msp_get_migration_matrix(msp_t *self, double *migration_matrix)
 {
     size_t N = self->num_populations;
+    size_t j, k;
+    simulation_model_t *model = &self->model;
+    migration_row_t *row;
+
+    memset(migration_matrix, 0, N * N * sizeof(double));
+    for (j = 0; j < N; j++) {
+        row = &self->migration_matrix[j];
+        for (k = 0; k < row->num_entries; k++) {
+            migration_matrix[j * N + (size_t) row->entries[k].dest] =
+                model->model_rate_to_generation_rate(model, row->entries[k].rate);
+        }
+    }
+    return 0;
+}
+
+/* Returns the number of entries in the sparse migration matrix, which
+ * may include entries whose rate has been changed to zero. */
+size_t
+msp_get_num_migration_matrix_entries(msp_t *self)
+{
     size_t j;
+    size_t num_entries = 0;
+
+    for (j = 0; j < self->num_populations; j++) {
+        num_entries += self->migration_matrix[j].num_entries;
+    }
+    return num_entries;
+}
+
+/* Writes the entries of the sparse migration matrix and the number of
+ * migration events for each in row major order to the specified arrays,
+ * which must be of the size returned by
+ * msp_get_num_migration_matrix_entries. */
+int MSP_WARN_UNUSED
+msp_get_sparse_migration_matrix(msp_t *self, population_id_t *source,
+        population_id_t *dest, double *rate, size_t *num_events)
+{
+    size_t j, k;
+    size_t l = 0;
     simulation_model_t *model = &self->model;
+    migration_row_t *row;
 
-    for (j = 0; j < N * N; j++) {
-        migration_matrix[j] = model->model_rate_to_generation_rate(
-                model, self->migration_matrix[j]);
+    for (j = 0; j < self->num_populations; j++) {
+        row = &self->migration_matrix[j];
+        for (k = 0; k < row->num_entries; k++) {
+            source[l] = (population_id_t) j;
+            dest[l] = row->entries[k].dest;
+            rate[l] = model->model_rate_to_generation_rate(model, row->entries[k].rate);
+            num_events[l] = row->entries[k].num_events;
+            l++;
+        }
     }
     return 0;
 }
@@ -3577,8 +4409,17 @@ int MSP_WARN_UNUSED
 msp_get_num_migration_events(msp_t *self, size_t *num_migration_events)
 {
     size_t N = self->num_populations;
+    size_t j, k;
+    migration_row_t *row;
 
-    memcpy(num_migration_events, self->num_migration_events, N * N * sizeof(size_t));
+    memset(num_migration_events, 0, N * N * sizeof(size_t));
+    for (j = 0; j < N; j++) {
+        row = &self->migration_matrix[j];
+        for (k = 0; k < row->num_entries; k++) {
+            num_migration_events[j * N + (size_t) row->entries[k].dest] =
+                row->entries[k].num_events;
+        }
+    }
     return 0;
 }
 
@@ -3679,6 +4520,10 @@ msp_change_single_population_parameters(msp_t *self, size_t population_id,
         goto out;
     }
     pop = &self->populations[population_id];
+    if (pop->size_history != NULL) {
+        /* This change replaces the size history from here on. */
+        population_detach_size_history(pop, time);
+    }
     /* If initial_size is not specified, calculate the initial_size of the
      * population over the coming time period based on the growth rate over
      * the preceding period.
@@ -3778,6 +4623,180 @@ out:
     return ret;
 }
 
+/* Population size history */
+
+static int
+msp_change_population_size_history(msp_t *self, demographic_event_t *event)
+{
+    int ret = 0;
+    population_size_history_t *history = &event->params.population_size_history;
+    simulation_model_t *model = &self->model;
+    population_t *pop;
+    size_t j;
+
+    if (history->population_id >= (population_id_t) self->num_populations) {
+        ret = MSP_ERR_POPULATION_OUT_OF_BOUNDS;
+        goto out;
+    }
+    for (j = 0; j < history->num_breakpoints; j++) {
+        history->model_time[j] = model->generations_to_model_time(model,
+                history->time[j]);
+        history->model_initial_size[j] = history->initial_size[j]
+            / model->reference_size;
+        history->model_growth_rate[j] = model->generation_rate_to_model_rate(model,
+                history->growth_rate[j]);
+        history->model_carrying_capacity[j] = history->carrying_capacity[j]
+            / model->reference_size;
+    }
+    /* Make sure the first breakpoint is exactly the time of the event */
+    history->model_time[0] = event->time;
+    if (history->size_function == MSP_SIZE_FUNCTION_LINEAR) {
+        population_size_history_set_slopes(history);
+    }
+    pop = &self->populations[history->population_id];
+    pop->size_history = history;
+    pop->size_history_index = 0;
+    population_sync_size_history(pop, event->time);
+out:
+    return ret;
+}
+
+static void
+msp_print_population_size_history(msp_t * MSP_UNUSED(self),
+        demographic_event_t *event, FILE *out)
+{
+    population_size_history_t *history = &event->params.population_size_history;
+    size_t j;
+
+    fprintf(out, "%f\tpopulation_size_history: %d -> size_function=%d, "
+            "num_breakpoints=%d\n",
+            event->time, (int) history->population_id, history->size_function,
+            (int) history->num_breakpoints);
+    for (j = 0; j < history->num_breakpoints; j++) {
+        fprintf(out, "\t\t%f\tinitial_size=%f, growth_rate=%f, "
+                "carrying_capacity=%f\n",
+                history->time[j], history->initial_size[j],
+                history->growth_rate[j], history->carrying_capacity[j]);
+    }
+}
+
+/* Adds a population size history, which sets the size of the specified
+ * population at each of the specified times, and applies as a single event.
+ * Between the times the population size follows the specified size function:
+ *
+ * MSP_SIZE_FUNCTION_EXPONENTIAL: exponential growth at the specified rates,
+ *      in the same way as a series of population parameter changes.
+ * MSP_SIZE_FUNCTION_LINEAR: the size is interpolated linearly between the
+ *      times, and is constant after the last of them. The growth rates are
+ *      not used, and may be NULL.
+ * MSP_SIZE_FUNCTION_LOGISTIC: logistic growth at the specified rates towards
+ *      the specified carrying capacities, forwards in time.
+ *
+ * The carrying capacities are only used for logistic growth, and may
+ * otherwise be NULL. The times and growth rates are measured in units of
+ * generations, and the sizes and carrying capacities are absolute values. */
+int
+msp_add_population_size_history(msp_t *self, int population_id,
+        int size_function, size_t num_breakpoints, double *time,
+        double *initial_size, double *growth_rate, double *carrying_capacity)
+{
+    int ret = -1;
+    demographic_event_t *de;
+    population_size_history_t *history;
+    double *buffer = NULL;
+    size_t j;
+    double c;
+    int N = (int) self->num_populations;
+
+    if (population_id < 0 || population_id >= N) {
+        ret = MSP_ERR_POPULATION_OUT_OF_BOUNDS;
+        goto out;
+    }
+    if (num_breakpoints == 0) {
+        ret = MSP_ERR_BAD_PARAM_VALUE;
+        goto out;
+    }
+    if (size_function != MSP_SIZE_FUNCTION_EXPONENTIAL
+            && size_function != MSP_SIZE_FUNCTION_LINEAR
+            && size_function != MSP_SIZE_FUNCTION_LOGISTIC) {
+        ret = MSP_ERR_BAD_PARAM_VALUE;
+        goto out;
+    }
+    if ((growth_rate == NULL && size_function != MSP_SIZE_FUNCTION_LINEAR)
+            || (carrying_capacity == NULL
+                && size_function == MSP_SIZE_FUNCTION_LOGISTIC)) {
+        ret = MSP_ERR_BAD_PARAM_VALUE;
+        goto out;
+    }
+    for (j = 0; j < num_breakpoints; j++) {
+        if (!(initial_size[j] > 0)
+                || (growth_rate != NULL && !gsl_finite(growth_rate[j]))) {
+            ret = MSP_ERR_BAD_PARAM_VALUE;
+            goto out;
+        }
+        if (j > 0 && !(time[j] > time[j - 1])) {
+            ret = MSP_ERR_UNSORTED_POPULATION_SIZE_HISTORY;
+            goto out;
+        }
+        if (size_function == MSP_SIZE_FUNCTION_LOGISTIC) {
+            if (!(carrying_capacity[j] > 0) || !gsl_finite(carrying_capacity[j])) {
+                ret = MSP_ERR_BAD_PARAM_VALUE;
+                goto out;
+            }
+            /* Going back in time, a population above its carrying capacity
+             * reaches an infinite size in finite time if its growth rate is
+             * positive. This must not happen before the next breakpoint,
+             * and so cannot happen in the last segment. */
+            c = carrying_capacity[j] / initial_size[j] - 1;
+            if (c < 0 && growth_rate[j] > 0) {
+                if (j + 1 == num_breakpoints
+                        || growth_rate[j] * (time[j + 1] - time[j]) >= -log(-c)) {
+                    ret = MSP_ERR_BAD_PARAM_VALUE;
+                    goto out;
+                }
+            }
+        }
+    }
+    buffer = calloc(8 * num_breakpoints, sizeof(double));
+    if (buffer == NULL) {
+        ret = MSP_ERR_NO_MEMORY;
+        goto out;
+    }
+    ret = msp_add_demographic_event(self, time[0], &de);
+    if (ret != 0) {
+        goto out;
+    }
+    history = &de->params.population_size_history;
+    history->population_id = population_id;
+    history->size_function = size_function;
+    history->num_breakpoints = num_breakpoints;
+    history->time = buffer;
+    history->initial_size = buffer + num_breakpoints;
+    history->growth_rate = buffer + 2 * num_breakpoints;
+    history->carrying_capacity = buffer + 3 * num_breakpoints;
+    history->model_time = buffer + 4 * num_breakpoints;
+    history->model_initial_size = buffer + 5 * num_breakpoints;
+    history->model_growth_rate = buffer + 6 * num_breakpoints;
+    history->model_carrying_capacity = buffer + 7 * num_breakpoints;
+    buffer = NULL;
+    memcpy(history->time, time, num_breakpoints * sizeof(double));
+    memcpy(history->initial_size, initial_size, num_breakpoints * sizeof(double));
+    /* Unused growth rates and carrying capacities are left as zero */
+    if (size_function != MSP_SIZE_FUNCTION_LINEAR) {
+        memcpy(history->growth_rate, growth_rate, num_breakpoints * sizeof(double));
+    }
+    if (size_function == MSP_SIZE_FUNCTION_LOGISTIC) {
+        memcpy(history->carrying_capacity, carrying_capacity,
+                num_breakpoints * sizeof(double));
+    }
+    de->change_state = msp_change_population_size_history;
+    de->print_state = msp_print_population_size_history;
+    ret = 0;
+out:
+    msp_safe_free(buffer);
+    return ret;
+}
+
 /* Migration rate change */
 
 static int MSP_WARN_UNUSED
@@ -3794,7 +4813,8 @@ msp_change_migration_matrix_entry(msp_t *self, size_t index, double rate)
         ret = MSP_ERR_DIAGONAL_MIGRATION_MATRIX_INDEX;
         goto out;
     }
-    self->migration_matrix[index] = rate;
+    ret = migration_row_set_rate(&self->migration_matrix[index / N],
+            (population_id_t) (index % N), rate);
 out:
     return ret;
 }
@@ -3803,6 +4823,7 @@ static int
 msp_change_migration_rate(msp_t *self, demographic_event_t *event)
 {
     int ret = 0;
+    int j;
     int index = event->params.migration_rate_change.matrix_index;
     int N = (int) self->num_populations;
     simulation_model_t *model = &self->model;
@@ -3810,13 +4831,11 @@ msp_change_migration_rate(msp_t *self, demographic_event_t *event)
         event->params.migration_rate_change.migration_rate);
 
     if (index == -1) {
-        for (index = 0; index < N * N; index++) {
-            if (index % (N + 1) != 0) {
-                ret = msp_change_migration_matrix_entry(self, (size_t) index,
-                        rate);
-                if (ret != 0) {
-                    goto out;
-                }
+        for (j = 0; j < N; j++) {
+            ret = migration_row_set_all_rates(&self->migration_matrix[j],
+                    (population_id_t) j, (size_t) N, rate);
+            if (ret != 0) {
+                goto out;
             }
         }
     } else {
@@ -3875,6 +4894,126 @@ out:
     return ret;
 }
 
+/* Migration matrix change */
+
+static int
+msp_change_migration_matrix(msp_t *self, demographic_event_t *event)
+{
+    int ret = 0;
+    size_t j;
+    migration_matrix_change_t *change = &event->params.migration_matrix_change;
+    simulation_model_t *model = &self->model;
+
+    /* Each row's total rate is updated once, after all of its entries */
+    for (j = 0; j < self->num_populations; j++) {
+        ret = migration_row_set_rates(&self->migration_matrix[j],
+                change->row_start[j + 1] - change->row_start[j],
+                change->entries + change->row_start[j], model,
+                model->generation_rate_to_model_rate);
+        if (ret != 0) {
+            goto out;
+        }
+    }
+out:
+    return ret;
+}
+
+static void
+msp_print_migration_matrix_change(msp_t *self,
+        demographic_event_t *event, FILE *out)
+{
+    migration_matrix_change_t *change = &event->params.migration_matrix_change;
+    size_t j, k;
+
+    fprintf(out, "%f\tmigration_matrix_change: %d entries\n",
+            event->time, (int) change->num_entries);
+    for (j = 0; j < self->num_populations; j++) {
+        for (k = change->row_start[j]; k < change->row_start[j + 1]; k++) {
+            fprintf(out, "\t%d -> %d: %f\n", (int) j,
+                    (int) change->entries[k].dest, change->entries[k].rate);
+        }
+    }
+}
+
+/* Add an event that replaces the migration matrix with the matrix with the
+ * specified entries, in any order. Entries with zero rates are ignored, and
+ * all other rates are set to zero. Time and migration rates are measured
+ * in units of generations. */
+int MSP_WARN_UNUSED
+msp_add_migration_matrix_change(msp_t *self, double time, size_t num_entries,
+        population_id_t *source, population_id_t *dest, double *rate)
+{
+    int ret = MSP_ERR_BAD_MIGRATION_MATRIX;
+    demographic_event_t *de;
+    migration_entry_t *entries = NULL;
+    size_t *row_start = NULL;
+    size_t *next = NULL;
+    size_t j, k;
+    size_t N = self->num_populations;
+
+    for (j = 0; j < num_entries; j++) {
+        if (source[j] < 0 || source[j] >= (population_id_t) N
+                || dest[j] < 0 || dest[j] >= (population_id_t) N
+                || !(rate[j] >= 0.0) || (source[j] == dest[j] && rate[j] != 0.0)) {
+            goto out;
+        }
+    }
+    entries = malloc(GSL_MAX(num_entries, 1) * sizeof(*entries));
+    row_start = calloc(N + 1, sizeof(*row_start));
+    next = malloc(N * sizeof(*next));
+    if (entries == NULL || row_start == NULL || next == NULL) {
+        ret = MSP_ERR_NO_MEMORY;
+        goto out;
+    }
+    /* Group the nonzero entries into rows by counting sort, and then sort
+     * each row by destination. */
+    for (j = 0; j < num_entries; j++) {
+        if (rate[j] != 0.0) {
+            row_start[source[j] + 1]++;
+        }
+    }
+    for (k = 0; k < N; k++) {
+        row_start[k + 1] += row_start[k];
+        next[k] = row_start[k];
+    }
+    for (j = 0; j < num_entries; j++) {
+        if (rate[j] != 0.0) {
+            k = next[source[j]]++;
+            entries[k].dest = dest[j];
+            entries[k].rate = rate[j];
+            entries[k].num_events = 0;
+        }
+    }
+    for (k = 0; k < N; k++) {
+        qsort(entries + row_start[k], row_start[k + 1] - row_start[k],
+                sizeof(migration_entry_t), cmp_migration_entry);
+        for (j = row_start[k] + 1; j < row_start[k + 1]; j++) {
+            if (entries[j].dest == entries[j - 1].dest) {
+                ret = MSP_ERR_BAD_MIGRATION_MATRIX;
+                goto out;
+            }
+        }
+    }
+    ret = msp_add_demographic_event(self, time, &de);
+    if (ret != 0) {
+        goto out;
+    }
+    de->params.migration_matrix_change.num_entries = row_start[N];
+    de->params.migration_matrix_change.entries = entries;
+    de->params.migration_matrix_change.row_start = row_start;
+    entries = NULL;
+    row_start = NULL;
+    /* Wait until the event happens to rescale the rates */
+    de->change_state = msp_change_migration_matrix;
+    de->print_state = msp_print_migration_matrix_change;
+    ret = 0;
+out:
+    msp_safe_free(entries);
+    msp_safe_free(row_start);
+    msp_safe_free(next);
+    return ret;
+}
+
 /* Mass migration */
 
 static int
@@ -4229,17 +5368,20 @@ out:
     return ret;
 }
 
-/* Add a census event at a specified time (given in generations). */
+/* Add a census node to each branch of every tree, either with a node for
+ * each segment of each ancestor, or with a single node for each ancestor
+ * that is the parent of all of its segments. */
 static int
 msp_census_event(msp_t *self, demographic_event_t *event)
 {
     int ret = 0;
     double time = self->model.model_time_to_generations(&self->model, event->time);
+    bool per_lineage = event->params.census_event.per_lineage;
     avl_tree_t *ancestors;
     avl_node_t *node;
     segment_t *seg;
     int i, j;
-    node_id_t u;
+    node_id_t u = TSK_NULL;
 
     for (i = 0; i < (int) self->num_populations; i++) {
         for (j = 0; j < (int) self->num_labels; j++) {
@@ -4252,18 +5394,20 @@ msp_census_event(msp_t *self, demographic_event_t *event)
                 seg = (segment_t *) node->item;
 
                 while (seg != NULL) {
-                    // Add an edge to the edge table.
-                    ret = msp_flush_edges(self);
-                    if (ret != 0) {
-                        goto out;
-                    }
-                    ret = tsk_node_table_add_row(&self->tables->nodes,
-                            MSP_NODE_IS_CEN_EVENT, time, (population_id_t) i, TSK_NULL,
-                            NULL, 0);
-                    if (ret < 0) {
-                        goto out;
+                    if (!per_lineage || u == TSK_NULL) {
+                        // Flush the edges of the previous census node.
+                        ret = msp_flush_edges(self);
+                        if (ret != 0) {
+                            goto out;
+                        }
+                        ret = tsk_node_table_add_row(&self->tables->nodes,
+                                MSP_NODE_IS_CEN_EVENT, time, (population_id_t) i,
+                                TSK_NULL, NULL, 0);
+                        if (ret < 0) {
+                            goto out;
+                        }
+                        u = (tsk_id_t) ret;
                     }
-                    u = (tsk_id_t) ret;
                     // Add an edge joining the segment to the new node.
                     ret = msp_store_edge(self, seg->left, seg->right, u, seg->value);
                     if (ret != 0) {
@@ -4273,11 +5417,13 @@ msp_census_event(msp_t *self, demographic_event_t *event)
                     seg->value = u;
                     seg = seg->next;
                 }
+                // The next lineage needs a new node.
+                u = TSK_NULL;
                 node = node->next;
             }
         }
     }
-    ret = 0;
+    ret = msp_flush_edges(self);
 out:
     return ret;
 }
@@ -4285,12 +5431,15 @@ out:
 static void
 msp_print_census_event(msp_t * MSP_UNUSED(self), demographic_event_t *event, FILE *out)
 {
-    fprintf(out, "%f\tcensus_event:\n",
-            event->time);
+    fprintf(out, "%f\tcensus_event: per_lineage=%d\n",
+            event->time, event->params.census_event.per_lineage);
 }
 
+/* Add a census event at a specified time (given in generations). If
+ * per_lineage is true, a single census node is added for each lineage;
+ * otherwise, a census node is added for each segment of each lineage. */
 int MSP_WARN_UNUSED
-msp_add_census_event(msp_t *self, double time)
+msp_add_census_event(msp_t *self, double time, bool per_lineage)
 {
     int ret = 0;
     demographic_event_t *de;
@@ -4300,6 +5449,7 @@ msp_add_census_event(msp_t *self, double time)
         goto out;
     }
 
+    de->params.census_event.per_lineage = per_lineage;
     de->change_state = msp_census_event;
     de->print_state = msp_print_census_event;
     ret = 0;
@@ -4970,8 +6120,10 @@ static int
 msp_unscale_model_times(msp_t *self)
 {
     uint32_t j;
+    size_t k;
     simulation_model_t *model = &self->model;
     demographic_event_t *de;
+    population_size_history_t *history;
 
     self->start_time = self->model.model_time_to_generations(model, self->start_time);
     self->time = self->model.model_time_to_generations(model, self->time);
@@ -4993,11 +6145,20 @@ msp_unscale_model_times(msp_t *self)
                 model, self->populations[j].growth_rate);
         self->populations[j].start_time = model->model_time_to_generations(
                 model, self->populations[j].start_time);
+        history = self->populations[j].size_history;
+        if (history != NULL) {
+            for (k = 0; k < history->num_breakpoints; k++) {
+                history->model_time[k] = model->model_time_to_generations(
+                        model, history->model_time[k]);
+                history->model_growth_rate[k] = model->model_rate_to_generation_rate(
+                        model, history->model_growth_rate[k]);
+            }
+        }
     }
     /* Migration rates */
-    for (j = 0; j < gsl_pow_2(self->num_populations); j++) {
-        self->migration_matrix[j] = model->model_rate_to_generation_rate(
-                model, self->migration_matrix[j]);
+    for (j = 0; j < self->num_populations; j++) {
+        migration_row_convert_rates(&self->migration_matrix[j], model,
+                model->model_rate_to_generation_rate);
     }
     /* Demographic events */
     for (de = self->demographic_events_head; de != NULL; de = de->next) {
@@ -5011,8 +6172,10 @@ static int
 msp_rescale_model_times(msp_t *self)
 {
     uint32_t j;
+    size_t k;
     simulation_model_t *model = &self->model;
     demographic_event_t *de;
+    population_size_history_t *history;
 
     self->time = model->generations_to_model_time(model, self->time);
     self->start_time = model->generations_to_model_time(model, self->start_time);
@@ -5034,11 +6197,24 @@ msp_rescale_model_times(msp_t *self)
                 model, self->populations[j].growth_rate);
         self->populations[j].start_time = model->generations_to_model_time(
                 model, self->populations[j].start_time);
+        history = self->populations[j].size_history;
+        if (history != NULL) {
+            for (k = 0; k < history->num_breakpoints; k++) {
+                history->model_time[k] = model->generations_to_model_time(
+                        model, history->model_time[k]);
+                history->model_growth_rate[k] = model->generation_rate_to_model_rate(
+                        model, history->model_growth_rate[k]);
+            }
+            if (history->size_function == MSP_SIZE_FUNCTION_LINEAR) {
+                /* The slopes are not rates, and must be recomputed */
+                population_size_history_set_slopes(history);
+            }
+        }
     }
     /* Migration rates */
-    for (j = 0; j < gsl_pow_2(self->num_populations); j++) {
-        self->migration_matrix[j] = model->generation_rate_to_model_rate(
-                model, self->migration_matrix[j]);
+    for (j = 0; j < self->num_populations; j++) {
+        migration_row_convert_rates(&self->migration_matrix[j], model,
+                model->generation_rate_to_model_rate);
     }
     /* Demographic events */
     for (de = self->demographic_events_head; de != NULL; de = de->next) {
@@ -5047,6 +6223,67 @@ msp_rescale_model_times(msp_t *self)
     return 0;
 }
 
+/* Changes the reference size of the simulation model of an initialised
+ * simulation. All times and rates are rescaled from generations, so that
+ * the absolute population sizes, migration rates and event times are
+ * unchanged. */
+int
+msp_set_reference_size(msp_t *self, double reference_size)
+{
+    int ret = 0;
+    size_t j;
+    size_t N = self->num_populations;
+    simulation_model_t *model = &self->model;
+
+    if (self->state != MSP_STATE_INITIALISED) {
+        ret = MSP_ERR_BAD_STATE;
+        goto out;
+    }
+    if (reference_size <= 0) {
+        ret = MSP_ERR_BAD_POPULATION_SIZE;
+        goto out;
+    }
+    if (model->type == MSP_MODEL_SWEEP) {
+        /* The trajectory parameters are stored in model time */
+        ret = MSP_ERR_UNSUPPORTED_OPERATION;
+        goto out;
+    }
+    ret = msp_unscale_model_times(self);
+    if (ret != 0) {
+        goto out;
+    }
+    for (j = 0; j < N; j++) {
+        self->initial_populations[j].growth_rate = model->model_rate_to_generation_rate(
+                model, self->initial_populations[j].growth_rate);
+        self->initial_populations[j].initial_size *= model->reference_size;
+        self->populations[j].initial_size *= model->reference_size;
+    }
+    for (j = 0; j < N; j++) {
+        migration_row_convert_rates(&self->initial_migration_matrix[j], model,
+                model->model_rate_to_generation_rate);
+    }
+
+    model->reference_size = reference_size;
+    self->initial_model.reference_size = reference_size;
+
+    ret = msp_rescale_model_times(self);
+    if (ret != 0) {
+        goto out;
+    }
+    for (j = 0; j < N; j++) {
+        self->initial_populations[j].growth_rate = model->generation_rate_to_model_rate(
+                model, self->initial_populations[j].growth_rate);
+        self->initial_populations[j].initial_size /= reference_size;
+        self->populations[j].initial_size /= reference_size;
+    }
+    for (j = 0; j < N; j++) {
+        migration_row_convert_rates(&self->initial_migration_matrix[j], model,
+                model->generation_rate_to_model_rate);
+    }
+out:
+    return ret;
+}
+
 static int
 msp_set_simulation_model(msp_t *self, int model, double reference_size)
 {
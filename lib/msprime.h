@@ -51,12 +51,18 @@
 #define MSP_NODE_IS_MIG_EVENT   (1u << 19)
 #define MSP_NODE_IS_CEN_EVENT   (1u << 20)
 
+/* Population size functions between the breakpoints of a size history */
+#define MSP_SIZE_FUNCTION_EXPONENTIAL   0
+#define MSP_SIZE_FUNCTION_LINEAR        1
+#define MSP_SIZE_FUNCTION_LOGISTIC      2
+
 /* Alphabets for mutation generator */
 #define MSP_ALPHABET_BINARY     0
 #define MSP_ALPHABET_NUCLEOTIDE 1
 
 /* Flags for mutgen */
 #define MSP_KEEP_SITES  1
+#define MSP_REUSE_EXPOSURE 2
 
 /* FIXME: Using these typedefs to keep the diff size small on the initial
  * tskit transition. Can remove later. */
@@ -97,11 +103,17 @@ typedef struct {
     double time;
 } sample_t;
 
+struct population_size_history_t_t;
+
 typedef struct {
     double initial_size;
     double growth_rate;
     double start_time;
     avl_tree_t *ancestors;
+    /* The size history currently in effect, if any, and the index of its
+     * breakpoint that was last synced into the fields above. */
+    struct population_size_history_t_t *size_history;
+    size_t size_history_index;
 } population_t;
 
 typedef struct {
@@ -110,6 +122,24 @@ typedef struct {
     population_id_t population_id;
 } sampling_event_t;
 
+/* The migration matrix is stored sparsely, as a row for each population
+ * holding the entries for the populations that its lineages can migrate
+ * to, sorted by destination. Entries are only created for nonzero rates,
+ * but are kept if their rate is later set to zero. */
+typedef struct {
+    population_id_t dest;
+    double rate;
+    size_t num_events;
+} migration_entry_t;
+
+typedef struct {
+    size_t num_entries;
+    size_t max_entries;
+    /* The sum of the rates of the entries */
+    double total_rate;
+    migration_entry_t *entries;
+} migration_row_t;
+
 /* Simulation models */
 
 typedef struct {
@@ -196,17 +226,17 @@ typedef struct _msp_t {
     double start_time;
     tsk_treeseq_t *from_ts;
     simulation_model_t initial_model;
-    double *initial_migration_matrix;
+    migration_row_t *initial_migration_matrix;
     population_t *initial_populations;
     /* allocation block sizes */
     size_t avl_node_block_size;
     size_t node_mapping_block_size;
     size_t segment_block_size;
     /* Counters for statistics */
+    size_t num_events;
     size_t num_re_events;
     size_t num_ca_events;
     size_t num_rejected_ca_events;
-    size_t *num_migration_events;
     size_t num_trapped_re_events;
     size_t num_multiple_re_events;
     /* sampling events */
@@ -220,7 +250,7 @@ typedef struct _msp_t {
     /* algorithm state */
     int state;
     double time;
-    double *migration_matrix;
+    migration_row_t *migration_matrix;
     population_t *populations;
     avl_tree_t breakpoints;
     avl_tree_t overlap_counts;
@@ -258,6 +288,35 @@ typedef struct {
     double migration_rate;
 } migration_rate_change_t;
 
+typedef struct {
+    size_t num_entries;
+    /* The nonzero entries of the new migration matrix, sorted by source and
+     * then destination. The rates are in units of generations, and the
+     * entries of the row for source population j are entries[row_start[j]]
+     * to entries[row_start[j + 1] - 1]. */
+    migration_entry_t *entries;
+    size_t *row_start;
+} migration_matrix_change_t;
+
+typedef struct population_size_history_t_t {
+    population_id_t population_id;
+    int size_function;
+    size_t num_breakpoints;
+    /* Breakpoint times and growth rates in generations, and absolute sizes
+     * and carrying capacities */
+    double *time;
+    double *initial_size;
+    double *growth_rate;
+    double *carrying_capacity;
+    /* The same values in model units, computed when the event is applied.
+     * For linear size functions, model_growth_rate holds the slope of the
+     * population size in each interval. */
+    double *model_time;
+    double *model_initial_size;
+    double *model_growth_rate;
+    double *model_carrying_capacity;
+} population_size_history_t;
+
 typedef struct {
     population_id_t source;
     population_id_t destination;
@@ -274,6 +333,12 @@ typedef struct {
     double strength;
 } instantaneous_bottleneck_t;
 
+typedef struct {
+    /* If true, one node is added for each lineage, rather than for each
+     * segment of each lineage */
+    bool per_lineage;
+} census_event_t;
+
 typedef struct demographic_event_t_t {
     double time;
     int (*change_state)(msp_t *, struct demographic_event_t_t *);
@@ -281,9 +346,12 @@ typedef struct demographic_event_t_t {
     union {
         simple_bottleneck_t simple_bottleneck;
         instantaneous_bottleneck_t instantaneous_bottleneck;
+        census_event_t census_event;
         mass_migration_t mass_migration;
         migration_rate_change_t migration_rate_change;
+        migration_matrix_change_t migration_matrix_change;
         population_parameters_change_t population_parameters_change;
+        population_size_history_t population_size_history;
     } params;
     struct demographic_event_t_t *next;
 } demographic_event_t;
@@ -303,6 +371,10 @@ typedef struct {
     double mutation_rate;
     avl_tree_t sites;
     tsk_blkalloc_t allocator;
+    /* Per-edge branch length x span, cached between calls to generate */
+    double *exposure;
+    size_t num_exposure_edges;
+    size_t max_exposure_edges;
 } mutgen_t;
 
 int msp_alloc(msp_t *self,
@@ -330,20 +402,30 @@ int msp_set_segment_block_size(msp_t *self, size_t block_size);
 int msp_set_avl_node_block_size(msp_t *self, size_t block_size);
 int msp_set_migration_matrix(msp_t *self, size_t size,
         double *migration_matrix);
+int msp_set_sparse_migration_matrix(msp_t *self, size_t num_entries,
+        population_id_t *source, population_id_t *dest, double *rate);
 int msp_set_population_configuration(msp_t *self, int population_id,
         double initial_size, double growth_rate);
+int msp_set_reference_size(msp_t *self, double reference_size);
+int msp_set_recombination_map(msp_t *self, recomb_map_t *recomb_map);
+int msp_clear_demographic_events(msp_t *self);
 
 int msp_add_population_parameters_change(msp_t *self, double time,
         int population_id, double size, double growth_rate);
+int msp_add_population_size_history(msp_t *self, int population_id,
+        int size_function, size_t num_breakpoints, double *time,
+        double *initial_size, double *growth_rate, double *carrying_capacity);
 int msp_add_migration_rate_change(msp_t *self, double time, int matrix_index,
         double migration_rate);
+int msp_add_migration_matrix_change(msp_t *self, double time, size_t num_entries,
+        population_id_t *source, population_id_t *dest, double *rate);
 int msp_add_mass_migration(msp_t *self, double time, int source, int dest,
         double proportion);
 int msp_add_simple_bottleneck(msp_t *self, double time, int population_id,
         double intensity);
 int msp_add_instantaneous_bottleneck(msp_t *self, double time, int population_id,
         double strength);
-int msp_add_census_event(msp_t *self, double time);
+int msp_add_census_event(msp_t *self, double time, bool per_lineage);
 
 int msp_initialise(msp_t *self);
 int msp_run(msp_t *self, double max_time, unsigned long max_events);
@@ -357,6 +439,9 @@ void msp_verify(msp_t *self);
 int msp_get_ancestors(msp_t *self, segment_t **ancestors);
 int msp_get_breakpoints(msp_t *self, size_t *breakpoints);
 int msp_get_migration_matrix(msp_t *self, double *migration_matrix);
+size_t msp_get_num_migration_matrix_entries(msp_t *self);
+int msp_get_sparse_migration_matrix(msp_t *self, population_id_t *source,
+        population_id_t *dest, double *rate, size_t *num_events);
 int msp_get_num_migration_events(msp_t *self, size_t *num_migration_events);
 int msp_get_samples(msp_t *self, sample_t **samples);
 int msp_get_population_configuration(msp_t *self, size_t population_id,
@@ -382,6 +467,8 @@ size_t msp_get_num_migrations(msp_t *self);
 size_t msp_get_num_avl_node_blocks(msp_t *self);
 size_t msp_get_num_node_mapping_blocks(msp_t *self);
 size_t msp_get_num_segment_blocks(msp_t *self);
+size_t msp_get_used_memory(msp_t *self);
+size_t msp_get_num_events(msp_t *self);
 size_t msp_get_num_common_ancestor_events(msp_t *self);
 size_t msp_get_num_rejected_common_ancestor_events(msp_t *self);
 size_t msp_get_num_recombination_events(msp_t *self);
@@ -17,6 +17,7 @@
 ** along with msprime.  If not, see <http://www.gnu.org/licenses/>.
 */
 #include <stdio.h>
+#include <stdlib.h>
 #include <string.h>
 #include <assert.h>
 #include <float.h>
@@ -121,6 +122,7 @@ int
 mutgen_free(mutgen_t *self)
 {
     tsk_blkalloc_free(&self->allocator);
+    msp_safe_free(self->exposure);
     return 0;
 }
 
@@ -135,6 +137,10 @@ mutgen_set_time_interval(mutgen_t *self, double start_time, double end_time)
     }
     self->start_time = start_time;
     self->end_time = end_time;
+    /* Any cached exposures were computed for the old interval */
+    msp_safe_free(self->exposure);
+    self->num_exposure_edges = 0;
+    self->max_exposure_edges = 0;
 out:
     return ret;
 }
@@ -171,196 +177,316 @@ out:
     return ret;
 }
 
+/* The sites and mutations present in the tables before generating new
+ * mutations when MSP_KEEP_SITES is specified. The original columns are
+ * moved out of the tables and merged with the new mutations in a single
+ * pass, so that we never copy individual sites into the AVL tree. */
+typedef struct {
+    double position;
+    site_id_t id;
+} existing_site_t;
+
+typedef struct {
+    tsk_site_table_t sites;
+    tsk_mutation_table_t mutations;
+    /* The existing sites sorted by position */
+    existing_site_t *index;
+    /* The ID of the first mutation for each site */
+    tsk_size_t *mutation_start;
+} existing_sites_t;
+
+static int
+cmp_existing_site(const void *a, const void *b) {
+    const existing_site_t *ia = (const existing_site_t *) a;
+    const existing_site_t *ib = (const existing_site_t *) b;
+    return (ia->position > ib->position) - (ia->position < ib->position);
+}
+
+static void
+existing_sites_free(existing_sites_t *self)
+{
+    tsk_site_table_free(&self->sites);
+    tsk_mutation_table_free(&self->mutations);
+    msp_safe_free(self->index);
+    msp_safe_free(self->mutation_start);
+}
+
+/* Takes ownership of the site and mutation columns in the specified tables,
+ * leaving them empty. */
 static int MSP_WARN_UNUSED
-mutget_initialise_sites(mutgen_t *self, tsk_table_collection_t *tables)
+existing_sites_init(existing_sites_t *self, tsk_table_collection_t *tables)
 {
     int ret = 0;
-    tsk_site_table_t *sites = &tables->sites;
-    tsk_mutation_table_t *mutations = &tables->mutations;
-    mutation_id_t mutation_id;
-    site_id_t site_id;
-    tsk_site_t *site;
-    avl_node_t *avl_node;
-    tsk_mutation_t *site_mutations;
-    tsk_size_t j, num_mutations, length;
-    char *buff;
-
-    mutation_id = 0;
-    for (site_id = 0; site_id < (site_id_t) sites->num_rows; site_id++) {
-        j = (tsk_size_t) mutation_id;
-        while (j < mutations->num_rows && mutations->site[j] == site_id) {
-            j++;
-        }
-        num_mutations = j - (tsk_size_t) mutation_id;
+    tsk_size_t j, num_sites, num_mutations;
+    site_id_t site;
+    bool sorted = true;
+
+    memset(self, 0, sizeof(*self));
+    /* Move the columns rather than copying them */
+    memcpy(&self->sites, &tables->sites, sizeof(self->sites));
+    memcpy(&self->mutations, &tables->mutations, sizeof(self->mutations));
+    ret = tsk_site_table_init(&tables->sites, 0);
+    if (ret != 0) {
+        ret = msp_set_tsk_error(ret);
+        goto out;
+    }
+    ret = tsk_mutation_table_init(&tables->mutations, 0);
+    if (ret != 0) {
+        ret = msp_set_tsk_error(ret);
+        goto out;
+    }
+    num_sites = self->sites.num_rows;
+    num_mutations = self->mutations.num_rows;
 
-        site = tsk_blkalloc_get(&self->allocator, sizeof(*site));
-        avl_node = tsk_blkalloc_get(&self->allocator, sizeof(*avl_node));
-        site_mutations = tsk_blkalloc_get(&self->allocator,
-                num_mutations * sizeof(*mutations));
-        if (site == NULL || avl_node == NULL || site_mutations == NULL) {
-            ret = MSP_ERR_NO_MEMORY;
-            goto out;
+    self->index = malloc((num_sites + 1) * sizeof(*self->index));
+    self->mutation_start = malloc((num_sites + 1) * sizeof(*self->mutation_start));
+    if (self->index == NULL || self->mutation_start == NULL) {
+        ret = MSP_ERR_NO_MEMORY;
+        goto out;
+    }
+    for (j = 0; j < num_sites; j++) {
+        self->index[j].position = self->sites.position[j];
+        self->index[j].id = (site_id_t) j;
+        if (j > 0 && self->index[j].position <= self->index[j - 1].position) {
+            sorted = false;
         }
-        site->position = sites->position[site_id];
-        site->mutations = site_mutations;
-        site->mutations_length = num_mutations;
-        /* ancestral state */
-        length = sites->ancestral_state_offset[site_id + 1]
-            - sites->ancestral_state_offset[site_id];
-        buff = tsk_blkalloc_get(&self->allocator, length);
-        if (buff == NULL) {
-            ret = MSP_ERR_NO_MEMORY;
+    }
+    /* Site tables from a tree sequence are always sorted, so we only need to
+     * sort when we're given arbitrary tables */
+    if (!sorted) {
+        qsort(self->index, num_sites, sizeof(*self->index), cmp_existing_site);
+    }
+    for (j = 1; j < num_sites; j++) {
+        if (self->index[j].position == self->index[j - 1].position) {
+            ret = MSP_ERR_DUPLICATE_SITE_POSITION;
             goto out;
         }
-        memcpy(buff, sites->ancestral_state +
-            sites->ancestral_state_offset[site_id], length);
-        site->ancestral_state = buff;
-        site->ancestral_state_length = length;
-
-        /* metadata */
-        length = sites->metadata_offset[site_id + 1]
-            - sites->metadata_offset[site_id];
-        buff = tsk_blkalloc_get(&self->allocator, length);
-        if (buff == NULL) {
-            ret = MSP_ERR_NO_MEMORY;
+    }
+
+    /* Mutations must be grouped by site in increasing order of site ID */
+    site = 0;
+    self->mutation_start[0] = 0;
+    for (j = 0; j < num_mutations; j++) {
+        if (self->mutations.site[j] < site
+                || self->mutations.site[j] >= (site_id_t) num_sites) {
+            ret = MSP_ERR_UNSORTED_MUTATIONS;
             goto out;
         }
-        memcpy(buff, sites->metadata +
-            sites->metadata_offset[site_id], length);
-        site->metadata = buff;
-        site->metadata_length = length;
-
-        for (j = 0; j < num_mutations; j++) {
-            /* We don't use the mutation ID directly here, so we can use it as a
-             * flag to indicate when a mutation was imported from outside or not.
-             * This is used when computing updated mutation parents when we
-             * re-export to the tables.. */
-            site_mutations[j].id = 1;
-            site_mutations[j].node = mutations->node[mutation_id];
-            site_mutations[j].parent = mutations->parent[mutation_id];
-
-            /* ancestral state */
-            length = mutations->derived_state_offset[mutation_id + 1]
-                - mutations->derived_state_offset[mutation_id];
-            buff = tsk_blkalloc_get(&self->allocator, length);
-            if (buff == NULL) {
-                ret = MSP_ERR_NO_MEMORY;
-                goto out;
-            }
-            memcpy(buff, mutations->derived_state +
-                mutations->derived_state_offset[mutation_id], length);
-            site_mutations[j].derived_state = buff;
-            site_mutations[j].derived_state_length = length;
-
-            /* metadata */
-            length = mutations->metadata_offset[mutation_id + 1]
-                - mutations->metadata_offset[mutation_id];
-            buff = tsk_blkalloc_get(&self->allocator, length);
-            if (buff == NULL) {
-                ret = MSP_ERR_NO_MEMORY;
-                goto out;
-            }
-            memcpy(buff, mutations->metadata +
-                mutations->metadata_offset[mutation_id], length);
-            site_mutations[j].metadata = buff;
-            site_mutations[j].metadata_length = length;
+        while (site < self->mutations.site[j]) {
+            site++;
+            self->mutation_start[site] = j;
+        }
+    }
+    while (site < (site_id_t) num_sites) {
+        site++;
+        self->mutation_start[site] = num_mutations;
+    }
+out:
+    return ret;
+}
+
+/* Returns true if there is an existing site at the specified position. */
+static bool
+existing_sites_contains(existing_sites_t *self, double position)
+{
+    existing_site_t search;
 
-            mutation_id++;
+    if (self->index == NULL || self->sites.num_rows == 0) {
+        return false;
+    }
+    search.position = position;
+    return bsearch(&search, self->index, self->sites.num_rows,
+            sizeof(*self->index), cmp_existing_site) != NULL;
+}
+
+/* Writes the existing site at the specified position in the sorted order,
+ * along with its mutations, to the tables. */
+static int MSP_WARN_UNUSED
+existing_sites_write_site(existing_sites_t *self, tsk_size_t k,
+        tsk_site_table_t *sites, tsk_mutation_table_t *mutations)
+{
+    int ret = 0;
+    site_id_t old_id = self->index[k].id;
+    site_id_t new_id;
+    mutation_id_t parent, new_start;
+    tsk_size_t j, start, end;
+    tsk_site_table_t *s = &self->sites;
+    tsk_mutation_table_t *m = &self->mutations;
+
+    new_id = tsk_site_table_add_row(sites, s->position[old_id],
+            s->ancestral_state + s->ancestral_state_offset[old_id],
+            s->ancestral_state_offset[old_id + 1] - s->ancestral_state_offset[old_id],
+            s->metadata + s->metadata_offset[old_id],
+            s->metadata_offset[old_id + 1] - s->metadata_offset[old_id]);
+    if (new_id < 0) {
+        ret = msp_set_tsk_error(new_id);
+        goto out;
+    }
+    start = self->mutation_start[old_id];
+    end = self->mutation_start[old_id + 1];
+    new_start = (mutation_id_t) mutations->num_rows;
+    for (j = start; j < end; j++) {
+        /* Mutation parents are within the same site, so we shift them by the
+         * same amount as the site's mutations */
+        parent = m->parent[j];
+        if (parent != TSK_NULL) {
+            parent = parent - (mutation_id_t) start + new_start;
         }
-        avl_init_node(avl_node, site);
-        avl_node = avl_insert_node(&self->sites, avl_node);
-        if (avl_node == NULL) {
-            ret = MSP_ERR_DUPLICATE_SITE_POSITION;
+        ret = tsk_mutation_table_add_row(mutations, new_id, m->node[j], parent,
+                m->derived_state + m->derived_state_offset[j],
+                m->derived_state_offset[j + 1] - m->derived_state_offset[j],
+                m->metadata + m->metadata_offset[j],
+                m->metadata_offset[j + 1] - m->metadata_offset[j]);
+        if (ret < 0) {
+            ret = msp_set_tsk_error(ret);
             goto out;
         }
     }
+    ret = 0;
 out:
     return ret;
 }
 
-static int
-mutgen_populate_tables(mutgen_t *self, tsk_site_table_t *sites, tsk_mutation_table_t *mutations)
+static int MSP_WARN_UNUSED
+mutgen_write_site(tsk_site_t *site, tsk_site_table_t *sites,
+        tsk_mutation_table_t *mutations)
 {
     int ret = 0;
-    size_t j;
     site_id_t site_id;
-    avl_node_t *a;
-    tsk_site_t *site;
+    size_t j;
     tsk_mutation_t *mutation;
-    mutation_id_t new_mutations = 0;
-    mutation_id_t parent;
 
-    for (a = self->sites.head; a != NULL; a = a->next) {
-        site = (tsk_site_t *) a->item;
-        site_id = tsk_site_table_add_row(sites, site->position, site->ancestral_state,
-                site->ancestral_state_length, site->metadata, site->metadata_length);
-        if (site_id < 0) {
-            ret = msp_set_tsk_error(site_id);
+    site_id = tsk_site_table_add_row(sites, site->position, site->ancestral_state,
+            site->ancestral_state_length, site->metadata, site->metadata_length);
+    if (site_id < 0) {
+        ret = msp_set_tsk_error(site_id);
+        goto out;
+    }
+    for (j = 0; j < site->mutations_length; j++) {
+        mutation = site->mutations + j;
+        ret = tsk_mutation_table_add_row(mutations, site_id,
+                mutation->node, mutation->parent,
+                mutation->derived_state, mutation->derived_state_length,
+                mutation->metadata, mutation->metadata_length);
+        if (ret < 0) {
+            ret = msp_set_tsk_error(ret);
             goto out;
         }
-        for (j = 0; j < site->mutations_length; j++) {
-            mutation = site->mutations + j;
-            parent = mutation->parent;
-            if (parent != TSK_NULL) {
-                parent += new_mutations;
-            }
-            ret = tsk_mutation_table_add_row(mutations, site_id,
-                    mutation->node, parent,
-                    mutation->derived_state, mutation->derived_state_length,
-                    mutation->metadata, mutation->metadata_length);
-            if (ret < 0) {
-                ret = msp_set_tsk_error(ret);
-                goto out;
-            }
-            if (mutation->id == 0) {
-                /* We use this flag to track the number of extra mutations we have
-                 * generated, which enables us to compute the new mutation parent
-                 * ID efficiently. See above for more notes on this */
-                new_mutations++;
-            }
-        }
     }
     ret = 0;
 out:
     return ret;
 }
 
+/* Merges the new sites with any existing sites in order of position. */
+static int MSP_WARN_UNUSED
+mutgen_populate_tables(mutgen_t *self, existing_sites_t *existing,
+        tsk_site_table_t *sites, tsk_mutation_table_t *mutations)
+{
+    int ret = 0;
+    avl_node_t *a = self->sites.head;
+    tsk_site_t *site;
+    tsk_size_t k = 0;
+    tsk_size_t num_existing = existing == NULL? 0: existing->sites.num_rows;
+
+    while (a != NULL || k < num_existing) {
+        site = a == NULL? NULL: (tsk_site_t *) a->item;
+        if (site == NULL || (k < num_existing
+                    && existing->index[k].position < site->position)) {
+            ret = existing_sites_write_site(existing, k, sites, mutations);
+            k++;
+        } else {
+            ret = mutgen_write_site(site, sites, mutations);
+            a = a->next;
+        }
+        if (ret != 0) {
+            goto out;
+        }
+    }
+out:
+    return ret;
+}
+
+/* Computes the exposure (branch length within the mutation time interval
+ * times the span) of every edge, so that replicate calls to generate over
+ * the same edges do not need to recompute it. */
+static int MSP_WARN_UNUSED
+mutgen_compute_exposure(mutgen_t *self, tsk_table_collection_t *tables)
+{
+    int ret = 0;
+    const double *node_time = tables->nodes.time;
+    tsk_edge_table_t *edges = &tables->edges;
+    size_t j;
+    double branch_start, branch_end;
+    double *tmp;
+
+    if (edges->num_rows > self->max_exposure_edges || self->exposure == NULL) {
+        self->max_exposure_edges = GSL_MAX(edges->num_rows, 1);
+        tmp = realloc(self->exposure, self->max_exposure_edges * sizeof(*tmp));
+        if (tmp == NULL) {
+            ret = MSP_ERR_NO_MEMORY;
+            goto out;
+        }
+        self->exposure = tmp;
+    }
+    for (j = 0; j < edges->num_rows; j++) {
+        assert(edges->child[j] >= 0
+                && edges->child[j] < (node_id_t) tables->nodes.num_rows);
+        branch_start = GSL_MAX(self->start_time, node_time[edges->child[j]]);
+        branch_end = GSL_MIN(self->end_time, node_time[edges->parent[j]]);
+        self->exposure[j] = (branch_end - branch_start)
+            * (edges->right[j] - edges->left[j]);
+    }
+    self->num_exposure_edges = edges->num_rows;
+out:
+    return ret;
+}
+
 int MSP_WARN_UNUSED
 mutgen_generate(mutgen_t *self, tsk_table_collection_t *tables, int flags)
 {
     int ret = 0;
-    tsk_node_table_t *nodes = &tables->nodes;
     tsk_edge_table_t *edges = &tables->edges;
     size_t j, l, branch_mutations;
-    double left, right, branch_length, distance, mu, position;
-    node_id_t parent, child;
+    double left, right, mu, position;
+    node_id_t child;
     const mutation_type_t *mutation_types;
     unsigned long num_mutation_types;
     unsigned long type;
-    double start_time = self->start_time;
-    double end_time = self->end_time;
-    double branch_start, branch_end;
     avl_node_t *avl_node;
     tsk_site_t search;
+    existing_sites_t existing;
+    existing_sites_t *keep = NULL;
 
     avl_clear_tree(&self->sites);
     tsk_blkalloc_reset(&self->allocator);
 
     if (flags & MSP_KEEP_SITES) {
-        ret = mutget_initialise_sites(self, tables);
+        keep = &existing;
+        ret = existing_sites_init(keep, tables);
         if (ret != 0) {
             goto out;
         }
+    } else {
+        ret = tsk_site_table_clear(&tables->sites);
+        if (ret != 0) {
+            ret = msp_set_tsk_error(ret);
+            goto out;
+        }
+        ret = tsk_mutation_table_clear(&tables->mutations);
+        if (ret != 0) {
+            ret = msp_set_tsk_error(ret);
+            goto out;
+        }
     }
-    ret = tsk_site_table_clear(&tables->sites);
-    if (ret != 0) {
-        ret = msp_set_tsk_error(ret);
-        goto out;
-    }
-    ret = tsk_mutation_table_clear(&tables->mutations);
-    if (ret != 0) {
-        ret = msp_set_tsk_error(ret);
-        goto out;
+
+    /* Exposures can only be reused if they were computed for these edges */
+    if (!(flags & MSP_REUSE_EXPOSURE) || self->exposure == NULL
+            || self->num_exposure_edges != edges->num_rows) {
+        ret = mutgen_compute_exposure(self, tables);
+        if (ret != 0) {
+            goto out;
+        }
     }
 
     if (self->alphabet == 0) {
@@ -374,14 +500,8 @@ mutgen_generate(mutgen_t *self, tsk_table_collection_t *tables, int flags)
     for (j = 0; j < edges->num_rows; j++) {
         left = edges->left[j];
         right = edges->right[j];
-        distance = right - left;
-        parent = edges->parent[j];
         child = edges->child[j];
-        assert(child >= 0 && child < (node_id_t) nodes->num_rows);
-        branch_start = GSL_MAX(start_time, nodes->time[child]);
-        branch_end = GSL_MIN(end_time, nodes->time[parent]);
-        branch_length = branch_end - branch_start;
-        mu = branch_length * distance * self->mutation_rate;
+        mu = self->exposure[j] * self->mutation_rate;
         branch_mutations = gsl_ran_poisson(self->rng, mu);
         for (l = 0; l < branch_mutations; l++) {
             /* Rejection sample positions until we get one we haven't seen before. */
@@ -390,7 +510,8 @@ mutgen_generate(mutgen_t *self, tsk_table_collection_t *tables, int flags)
                 position = gsl_ran_flat(self->rng, left, right);
                 search.position = position;
                 avl_node = avl_search(&self->sites, &search);
-            } while (avl_node != NULL);
+            } while (avl_node != NULL
+                    || (keep != NULL && existing_sites_contains(keep, position)));
             assert(left <= position && position < right);
             type = gsl_rng_uniform_int(self->rng, num_mutation_types);
             ret = mutgen_add_mutation(self, child, position,
@@ -401,10 +522,22 @@ mutgen_generate(mutgen_t *self, tsk_table_collection_t *tables, int flags)
             }
         }
     }
-    ret = mutgen_populate_tables(self, &tables->sites, &tables->mutations);
+    ret = mutgen_populate_tables(self, keep, &tables->sites, &tables->mutations);
     if (ret != 0) {
         goto out;
     }
 out:
+    if (keep != NULL) {
+        if (ret != 0) {
+            /* Put the original columns back so the tables are unchanged */
+            tsk_site_table_free(&tables->sites);
+            tsk_mutation_table_free(&tables->mutations);
+            memcpy(&tables->sites, &keep->sites, sizeof(keep->sites));
+            memcpy(&tables->mutations, &keep->mutations, sizeof(keep->mutations));
+            memset(&keep->sites, 0, sizeof(keep->sites));
+            memset(&keep->mutations, 0, sizeof(keep->mutations));
+        }
+        existing_sites_free(keep);
+    }
     return ret;
 }
@@ -139,6 +139,24 @@ object_heap_free_object(object_heap_t *self, void *obj)
     self->top++;
 }
 
+/* Restores the order in which objects are allocated to that of a new heap,
+ * so that the same sequence of allocations returns the same objects. All
+ * objects must have been freed. */
+void
+object_heap_reset(object_heap_t *self)
+{
+    size_t j, block, obj;
+
+    assert(self->top == self->size);
+    for (j = 0; j < self->size; j++) {
+        /* Objects are allocated from the top of the heap, and so we put
+         * the first block at the top. */
+        block = self->num_blocks - 1 - j / self->block_size;
+        obj = j % self->block_size;
+        self->heap[j] = self->mem_blocks[block] + obj * self->object_size;
+    }
+}
+
 int MSP_WARN_UNUSED
 object_heap_init(object_heap_t *self, size_t object_size, size_t block_size,
         void (*init_object)(void **, size_t))
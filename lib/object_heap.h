@@ -42,6 +42,7 @@ extern void object_heap_print_state(object_heap_t *self, FILE *out);
 extern int object_heap_expand(object_heap_t *self);
 extern void * object_heap_get_object(object_heap_t *self, size_t index);
 extern int object_heap_empty(object_heap_t *self);
+extern void object_heap_reset(object_heap_t *self);
 extern void * object_heap_alloc_object(object_heap_t *self);
 extern void object_heap_free_object(object_heap_t *self, void *obj);
 extern int object_heap_init(object_heap_t *self, size_t object_size, size_t block_size,
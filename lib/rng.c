@@ -0,0 +1,150 @@
+/*
+** Copyright (C) 2019 University of Oxford
+**
+** This file is part of msprime.
+**
+** msprime is free software: you can redistribute it and/or modify
+** it under the terms of the GNU General Public License as published by
+** the Free Software Foundation, either version 3 of the License, or
+** (at your option) any later version.
+**
+** msprime is distributed in the hope that it will be useful,
+** but WITHOUT ANY WARRANTY; without even the implied warranty of
+** MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+** GNU General Public License for more details.
+**
+** You should have received a copy of the GNU General Public License
+** along with msprime.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+/*
+ * Random number generators that are not provided by GSL, implemented as
+ * GSL generator types so that the simulation code can use them through
+ * the usual gsl_rng_uniform and gsl_ran_* functions.
+ *
+ * xoshiro256** is described in Blackman and Vigna, "Scrambled linear
+ * pseudorandom number generators" (2018). It has a period of 2^256 - 1,
+ * and its jump function advances the state by 2^128 steps, so that
+ * successive jumps give non-overlapping streams for parallel computations.
+ */
+
+#include <stdint.h>
+#include "rng.h"
+#include "util.h"
+
+typedef struct {
+    uint64_t s[4];
+} xoshiro256_state_t;
+
+static inline uint64_t
+rotl(const uint64_t x, int k)
+{
+    return (x << k) | (x >> (64 - k));
+}
+
+static inline uint64_t
+xoshiro256_next(xoshiro256_state_t *state)
+{
+    uint64_t *s = state->s;
+    const uint64_t result = rotl(s[1] * 5, 7) * 9;
+    const uint64_t t = s[1] << 17;
+
+    s[2] ^= s[0];
+    s[3] ^= s[1];
+    s[1] ^= s[2];
+    s[0] ^= s[3];
+    s[2] ^= t;
+    s[3] = rotl(s[3], 45);
+    return result;
+}
+
+static void
+xoshiro256_set(void *vstate, unsigned long int seed)
+{
+    xoshiro256_state_t *state = (xoshiro256_state_t *) vstate;
+    uint64_t x = (uint64_t) seed;
+    uint64_t z;
+    int j;
+
+    /* The state is filled using the output of the splitmix64 generator,
+     * as recommended by the authors. This cannot give an all-zero state. */
+    for (j = 0; j < 4; j++) {
+        x += 0x9e3779b97f4a7c15ULL;
+        z = x;
+        z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+        z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+        state->s[j] = z ^ (z >> 31);
+    }
+}
+
+/* GSL generators return unsigned longs, which are 32 bit on some platforms,
+ * so we return the upper 32 bits of the output (which are the best quality). */
+static unsigned long int
+xoshiro256_get(void *vstate)
+{
+    return (unsigned long int) (xoshiro256_next((xoshiro256_state_t *) vstate) >> 32);
+}
+
+/* Returns a double in [0, 1) using the upper 53 bits of the output. */
+static double
+xoshiro256_get_double(void *vstate)
+{
+    uint64_t x = xoshiro256_next((xoshiro256_state_t *) vstate);
+    return (double) (x >> 11) * 0x1.0p-53;
+}
+
+static const gsl_rng_type xoshiro256starstar_type = {
+    "xoshiro256**",
+    0xffffffffUL,
+    0,
+    sizeof(xoshiro256_state_t),
+    &xoshiro256_set,
+    &xoshiro256_get,
+    &xoshiro256_get_double
+};
+
+const gsl_rng_type *msp_gsl_rng_xoshiro256starstar = &xoshiro256starstar_type;
+
+/* Advances the state of the specified generator by num_jumps * 2^128
+ * steps. Only supported for the xoshiro256** generator. */
+int
+msp_rng_jump(gsl_rng *rng, unsigned long num_jumps)
+{
+    static const uint64_t jump[] = {
+        0x180ec6d33cfd0abaULL, 0xd5a61266f0c9392cULL,
+        0xa9582618e03fc9aaULL, 0x39abdc4529b1661cULL};
+    int ret = 0;
+    xoshiro256_state_t *state;
+    uint64_t s[4];
+    unsigned long k;
+    int j, b;
+
+    if (rng->type != msp_gsl_rng_xoshiro256starstar) {
+        ret = MSP_ERR_UNSUPPORTED_OPERATION;
+        goto out;
+    }
+    state = (xoshiro256_state_t *) rng->state;
+    for (k = 0; k < num_jumps; k++) {
+        s[0] = 0;
+        s[1] = 0;
+        s[2] = 0;
+        s[3] = 0;
+        for (j = 0; j < 4; j++) {
+            for (b = 0; b < 64; b++) {
+                if (jump[j] & (UINT64_C(1) << b)) {
+                    s[0] ^= state->s[0];
+                    s[1] ^= state->s[1];
+                    s[2] ^= state->s[2];
+                    s[3] ^= state->s[3];
+                }
+                xoshiro256_next(state);
+            }
+        }
+        state->s[0] = s[0];
+        state->s[1] = s[1];
+        state->s[2] = s[2];
+        state->s[3] = s[3];
+    }
+out:
+    return ret;
+}
@@ -0,0 +1,31 @@
+/*
+** Copyright (C) 2019 University of Oxford
+**
+** This file is part of msprime.
+**
+** msprime is free software: you can redistribute it and/or modify
+** it under the terms of the GNU General Public License as published by
+** the Free Software Foundation, either version 3 of the License, or
+** (at your option) any later version.
+**
+** msprime is distributed in the hope that it will be useful,
+** but WITHOUT ANY WARRANTY; without even the implied warranty of
+** MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+** GNU General Public License for more details.
+**
+** You should have received a copy of the GNU General Public License
+** along with msprime.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+#ifndef __RNG_H__
+#define __RNG_H__
+
+#include <gsl/gsl_rng.h>
+
+/* The xoshiro256** generator of Blackman and Vigna, defined as a GSL
+ * generator type so that it can be used wherever a gsl_rng is expected. */
+extern const gsl_rng_type *msp_gsl_rng_xoshiro256starstar;
+
+int msp_rng_jump(gsl_rng *rng, unsigned long num_jumps);
+
+#endif /*__RNG_H__*/
@@ -0,0 +1,160 @@
+/*
+** Copyright (C) 2019 University of Oxford
+**
+** This file is part of msprime.
+**
+** msprime is free software: you can redistribute it and/or modify
+** it under the terms of the GNU General Public License as published by
+** the Free Software Foundation, either version 3 of the License, or
+** (at your option) any later version.
+**
+** msprime is distributed in the hope that it will be useful,
+** but WITHOUT ANY WARRANTY; without even the implied warranty of
+** MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+** GNU General Public License for more details.
+**
+** You should have received a copy of the GNU General Public License
+** along with msprime.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+/*
+ * Summary statistics computed directly from a tree sequence, so that
+ * large numbers of replicates can be reduced without going through Python.
+ * All site statistics assume infinite sites, so that each site has exactly
+ * one mutation.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+#include "stats.h"
+#include "msprime.h"
+
+/* Returns the number of values the specified statistic occupies in the
+ * output for a tree sequence with n samples, or -1 if it is not valid. */
+static long
+get_stat_size(int stat, size_t n)
+{
+    long ret = -1;
+
+    switch (stat) {
+        case MSP_STAT_NUM_TREES:
+        case MSP_STAT_SEGREGATING_SITES:
+        case MSP_STAT_PI:
+            ret = 1;
+            break;
+        case MSP_STAT_SFS:
+            /* Derived allele counts 1 to n - 1 */
+            ret = n > 0 ? (long) n - 1 : 0;
+            break;
+    }
+    return ret;
+}
+
+int
+msp_get_summary_stats_size(tsk_treeseq_t *ts, size_t num_stats, const int *stats,
+        size_t *size)
+{
+    int ret = 0;
+    size_t j;
+    size_t total = 0;
+    size_t n = tsk_treeseq_get_num_samples(ts);
+    long stat_size;
+
+    for (j = 0; j < num_stats; j++) {
+        stat_size = get_stat_size(stats[j], n);
+        if (stat_size < 0) {
+            ret = MSP_ERR_BAD_PARAM_VALUE;
+            goto out;
+        }
+        total += (size_t) stat_size;
+    }
+    *size = total;
+out:
+    return ret;
+}
+
+int
+msp_summary_stats(tsk_treeseq_t *ts, size_t num_stats, const int *stats,
+        size_t size, double *result)
+{
+    int ret = 0;
+    int it;
+    size_t j, k, offset, required_size;
+    tsk_size_t l;
+    tsk_site_t *site;
+    const size_t n = tsk_treeseq_get_num_samples(ts);
+    double num_trees = 0;
+    double segregating_sites = 0;
+    double pi = 0;
+    double *sfs = NULL;
+    tsk_tree_t tree;
+
+    memset(&tree, 0, sizeof(tree));
+    ret = msp_get_summary_stats_size(ts, num_stats, stats, &required_size);
+    if (ret != 0) {
+        goto out;
+    }
+    if (size != required_size) {
+        ret = MSP_ERR_BAD_PARAM_VALUE;
+        goto out;
+    }
+    sfs = calloc(n + 1, sizeof(*sfs));
+    if (sfs == NULL) {
+        ret = MSP_ERR_NO_MEMORY;
+        goto out;
+    }
+    ret = tsk_tree_init(&tree, ts, TSK_SAMPLE_COUNTS);
+    if (ret != 0) {
+        ret = msp_set_tsk_error(ret);
+        goto out;
+    }
+    for (it = tsk_tree_first(&tree); it == 1; it = tsk_tree_next(&tree)) {
+        num_trees++;
+        for (l = 0; l < tree.sites_length; l++) {
+            site = &tree.sites[l];
+            if (site->mutations_length != 1) {
+                ret = MSP_ERR_BAD_PARAM_VALUE;
+                goto out;
+            }
+            k = (size_t) tree.num_samples[site->mutations[0].node];
+            sfs[k]++;
+            if (k > 0 && k < n) {
+                segregating_sites++;
+                pi += 2.0 * (double) k * (double) (n - k)
+                    / ((double) n * (double) (n - 1));
+            }
+        }
+    }
+    if (it < 0) {
+        ret = msp_set_tsk_error(it);
+        goto out;
+    }
+
+    offset = 0;
+    for (j = 0; j < num_stats; j++) {
+        switch (stats[j]) {
+            case MSP_STAT_NUM_TREES:
+                result[offset] = num_trees;
+                offset++;
+                break;
+            case MSP_STAT_SEGREGATING_SITES:
+                result[offset] = segregating_sites;
+                offset++;
+                break;
+            case MSP_STAT_PI:
+                result[offset] = pi;
+                offset++;
+                break;
+            case MSP_STAT_SFS:
+                for (k = 1; k < n; k++) {
+                    result[offset] = sfs[k];
+                    offset++;
+                }
+                break;
+        }
+    }
+out:
+    msp_safe_free(sfs);
+    tsk_tree_free(&tree);
+    return ret;
+}
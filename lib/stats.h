@@ -0,0 +1,36 @@
+/*
+** Copyright (C) 2019 University of Oxford
+**
+** This file is part of msprime.
+**
+** msprime is free software: you can redistribute it and/or modify
+** it under the terms of the GNU General Public License as published by
+** the Free Software Foundation, either version 3 of the License, or
+** (at your option) any later version.
+**
+** msprime is distributed in the hope that it will be useful,
+** but WITHOUT ANY WARRANTY; without even the implied warranty of
+** MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+** GNU General Public License for more details.
+**
+** You should have received a copy of the GNU General Public License
+** along with msprime.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+#ifndef __STATS_H__
+#define __STATS_H__
+
+#include <stdio.h>
+#include <tskit.h>
+
+#define MSP_STAT_NUM_TREES              0
+#define MSP_STAT_SEGREGATING_SITES      1
+#define MSP_STAT_PI                     2
+#define MSP_STAT_SFS                    3
+
+int msp_get_summary_stats_size(tsk_treeseq_t *ts, size_t num_stats,
+        const int *stats, size_t *size);
+int msp_summary_stats(tsk_treeseq_t *ts, size_t num_stats, const int *stats,
+        size_t size, double *result);
+
+#endif /*__STATS_H__*/
@@ -23,6 +23,9 @@
 
 #include "msprime.h"
 #include "likelihood.h"
+#include "stats.h"
+#include "rng.h"
+#include "msformat.h"
 
 #include <float.h>
 #include <limits.h>
@@ -745,6 +748,342 @@ test_simulator_getters_setters(void)
     tsk_table_collection_free(&tables);
 }
 
+static void
+test_sparse_migration_matrix(void)
+{
+    int ret;
+    uint32_t j, model;
+    uint32_t n = 10;
+    size_t N = 50;
+    size_t num_entries = 2 * N;
+    size_t k, l;
+    sample_t *samples = malloc(n * sizeof(sample_t));
+    gsl_rng *rng = gsl_rng_alloc(gsl_rng_default);
+    population_id_t *source = malloc((num_entries + 1) * sizeof(population_id_t));
+    population_id_t *dest = malloc((num_entries + 1) * sizeof(population_id_t));
+    double *rate = malloc((num_entries + 1) * sizeof(double));
+    population_id_t *out_source = malloc(N * N * sizeof(population_id_t));
+    population_id_t *out_dest = malloc(N * N * sizeof(population_id_t));
+    double *out_rate = malloc(N * N * sizeof(double));
+    double *matrix = malloc(N * N * sizeof(double));
+    size_t *migration_events = malloc(N * N * sizeof(size_t));
+    recomb_map_t recomb_map;
+    tsk_table_collection_t tables;
+    msp_t msp;
+
+    CU_ASSERT_FATAL(samples != NULL && rng != NULL && source != NULL
+            && dest != NULL && rate != NULL && out_source != NULL
+            && out_dest != NULL && out_rate != NULL && matrix != NULL
+            && migration_events != NULL);
+    ret = recomb_map_alloc_uniform(&recomb_map, 10, 1.0, 10);
+    CU_ASSERT_EQUAL(ret, 0);
+    ret = tsk_table_collection_init(&tables, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    for (j = 0; j < n; j++) {
+        samples[j].time = 0;
+        samples[j].population_id = 0;
+    }
+    /* A ring of populations, with the entries in reverse order */
+    for (k = 0; k < N; k++) {
+        source[2 * k] = (population_id_t) (N - k - 1);
+        dest[2 * k] = (population_id_t) ((2 * N - k - 2) % N);
+        rate[2 * k] = 0.5;
+        source[2 * k + 1] = (population_id_t) (N - k - 1);
+        dest[2 * k + 1] = (population_id_t) ((N - k) % N);
+        rate[2 * k + 1] = 0.25;
+    }
+    /* Explicit zeros, including on the diagonal, are ignored */
+    source[num_entries] = 3;
+    dest[num_entries] = 3;
+    rate[num_entries] = 0;
+
+    for (model = 0; model < 2; model++) {
+        ret = msp_alloc(&msp, n, samples, &recomb_map, &tables, rng);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        if (model == 0) {
+            ret = msp_set_simulation_model_hudson(&msp, 1);
+        } else {
+            ret = msp_set_simulation_model_dtwf(&msp, 10);
+        }
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        ret = msp_set_num_populations(&msp, N);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+
+        source[0] = -1;
+        CU_ASSERT_EQUAL(msp_set_sparse_migration_matrix(&msp, num_entries, source,
+                    dest, rate), MSP_ERR_BAD_MIGRATION_MATRIX);
+        source[0] = (population_id_t) N;
+        CU_ASSERT_EQUAL(msp_set_sparse_migration_matrix(&msp, num_entries, source,
+                    dest, rate), MSP_ERR_BAD_MIGRATION_MATRIX);
+        source[0] = (population_id_t) N - 1;
+        dest[0] = (population_id_t) N;
+        CU_ASSERT_EQUAL(msp_set_sparse_migration_matrix(&msp, num_entries, source,
+                    dest, rate), MSP_ERR_BAD_MIGRATION_MATRIX);
+        dest[0] = (population_id_t) N - 1;
+        CU_ASSERT_EQUAL(msp_set_sparse_migration_matrix(&msp, num_entries, source,
+                    dest, rate), MSP_ERR_BAD_MIGRATION_MATRIX);
+        dest[0] = (population_id_t) N - 2;
+        rate[0] = -1;
+        CU_ASSERT_EQUAL(msp_set_sparse_migration_matrix(&msp, num_entries, source,
+                    dest, rate), MSP_ERR_BAD_MIGRATION_MATRIX);
+        rate[0] = 0.5;
+        dest[1] = dest[0];
+        CU_ASSERT_EQUAL(msp_set_sparse_migration_matrix(&msp, num_entries, source,
+                    dest, rate), MSP_ERR_BAD_MIGRATION_MATRIX);
+        dest[1] = 0;
+
+        ret = msp_set_sparse_migration_matrix(&msp, num_entries + 1, source, dest,
+                rate);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        /* Lineages can first migrate to the other side of the ring at 1 */
+        ret = msp_add_migration_rate_change(&msp, 1.0, (int) (N / 2), 0.125);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        ret = msp_add_migration_rate_change(&msp, 2.0, (int) (N + 2), 0);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        ret = msp_add_migration_rate_change(&msp, 20.0, -1, 0.01);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        ret = msp_initialise(&msp);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+
+        CU_ASSERT_EQUAL(msp_get_num_migration_matrix_entries(&msp), num_entries);
+        ret = msp_get_sparse_migration_matrix(&msp, out_source, out_dest, out_rate,
+                migration_events);
+        CU_ASSERT_EQUAL(ret, 0);
+        ret = msp_get_migration_matrix(&msp, matrix);
+        CU_ASSERT_EQUAL(ret, 0);
+        for (l = 0; l < num_entries; l++) {
+            /* Entries are in row major order */
+            CU_ASSERT_EQUAL(out_source[l], (population_id_t) (l / 2));
+            if (l > 0 && out_source[l] == out_source[l - 1]) {
+                CU_ASSERT(out_dest[l] > out_dest[l - 1]);
+            }
+            CU_ASSERT_EQUAL(
+                matrix[(size_t) out_source[l] * N + (size_t) out_dest[l]],
+                out_rate[l]);
+        }
+        CU_ASSERT_EQUAL(matrix[1], 0.25);
+        CU_ASSERT_EQUAL(matrix[N - 1], 0.5);
+        CU_ASSERT_EQUAL(matrix[2], 0);
+        CU_ASSERT_EQUAL(matrix[N + 2], 0.25);
+
+        ret = msp_run(&msp, 10, ULONG_MAX);
+        CU_ASSERT_EQUAL_FATAL(ret, MSP_EXIT_MAX_TIME);
+        msp_verify(&msp);
+        /* The entry added by the change is kept with a zero rate */
+        CU_ASSERT_EQUAL(msp_get_num_migration_matrix_entries(&msp), num_entries + 1);
+        ret = msp_get_migration_matrix(&msp, matrix);
+        CU_ASSERT_EQUAL(ret, 0);
+        CU_ASSERT_EQUAL(matrix[N / 2], 0.125);
+        CU_ASSERT_EQUAL(matrix[N + 2], 0);
+        ret = msp_get_num_migration_events(&msp, migration_events);
+        CU_ASSERT_EQUAL(ret, 0);
+        for (k = 0; k < N * N; k++) {
+            if (k != N / 2 && k % N != (k / N + 1) % N
+                    && k % N != (k / N + N - 1) % N) {
+                CU_ASSERT_EQUAL(migration_events[k], 0);
+            }
+        }
+        CU_ASSERT(migration_events[1] > 0);
+
+        ret = msp_run(&msp, DBL_MAX, ULONG_MAX);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        msp_verify(&msp);
+        CU_ASSERT_EQUAL(msp_get_num_migration_matrix_entries(&msp), N * (N - 1));
+        ret = msp_get_migration_matrix(&msp, matrix);
+        CU_ASSERT_EQUAL(ret, 0);
+        for (k = 0; k < N * N; k++) {
+            CU_ASSERT_EQUAL(matrix[k], k % (N + 1) == 0? 0: 0.01);
+        }
+
+        /* Resetting restores the initial matrix and clears the counts */
+        ret = msp_reset(&msp);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        CU_ASSERT_EQUAL(msp_get_num_migration_matrix_entries(&msp), num_entries);
+        ret = msp_get_num_migration_events(&msp, migration_events);
+        CU_ASSERT_EQUAL(ret, 0);
+        for (k = 0; k < N * N; k++) {
+            CU_ASSERT_EQUAL(migration_events[k], 0);
+        }
+        ret = msp_run(&msp, DBL_MAX, ULONG_MAX);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        msp_verify(&msp);
+
+        ret = msp_free(&msp);
+        CU_ASSERT_EQUAL(ret, 0);
+        ret = tsk_table_collection_clear(&tables);
+        CU_ASSERT_EQUAL(ret, 0);
+    }
+
+    free(samples);
+    free(source);
+    free(dest);
+    free(rate);
+    free(out_source);
+    free(out_dest);
+    free(out_rate);
+    free(matrix);
+    free(migration_events);
+    gsl_rng_free(rng);
+    recomb_map_free(&recomb_map);
+    tsk_table_collection_free(&tables);
+}
+
+static void
+test_migration_matrix_change(void)
+{
+    int ret;
+    uint32_t j, model;
+    uint32_t n = 10;
+    size_t N = 4;
+    size_t k;
+    sample_t *samples = malloc(n * sizeof(sample_t));
+    gsl_rng *rng = gsl_rng_alloc(gsl_rng_default);
+    double migration_matrix[] = {
+        0, 1, 0, 0,
+        0, 0, 1, 0,
+        0, 0, 0, 1,
+        1, 0, 0, 0};
+    /* The new entries in arbitrary order, with an explicit zero */
+    population_id_t source[] = {2, 0, 0, 1, 3, 0};
+    population_id_t dest[] = {0, 3, 1, 0, 2, 2};
+    double rate[] = {0.5, 2.0, 0, 1.0, 1.0, 0.25};
+    size_t num_entries = 6;
+    double expected[] = {
+        0, 0, 0.25, 2.0,
+        1.0, 0, 0, 0,
+        0.5, 0, 0, 0,
+        0, 0, 1.0, 0};
+    population_id_t all_source[12], all_dest[12];
+    double all_rate[12];
+    double matrix[16];
+    size_t migration_events[16], previous_events[16];
+    recomb_map_t recomb_map;
+    tsk_table_collection_t tables;
+    msp_t msp;
+
+    CU_ASSERT_FATAL(samples != NULL && rng != NULL);
+    ret = recomb_map_alloc_uniform(&recomb_map, 10, 1.0, 10);
+    CU_ASSERT_EQUAL(ret, 0);
+    ret = tsk_table_collection_init(&tables, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    for (j = 0; j < n; j++) {
+        samples[j].time = 0;
+        samples[j].population_id = 0;
+    }
+    /* An island model with all of the entries */
+    k = 0;
+    for (j = 0; j < N * N; j++) {
+        if (j % (N + 1) != 0) {
+            all_source[k] = (population_id_t) (j / N);
+            all_dest[k] = (population_id_t) (j % N);
+            all_rate[k] = 0.01;
+            k++;
+        }
+    }
+
+    for (model = 0; model < 2; model++) {
+        ret = msp_alloc(&msp, n, samples, &recomb_map, &tables, rng);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        if (model == 0) {
+            ret = msp_set_simulation_model_hudson(&msp, 100);
+        } else {
+            ret = msp_set_simulation_model_dtwf(&msp, 100);
+        }
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        ret = msp_set_num_populations(&msp, N);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        ret = msp_set_migration_matrix(&msp, N * N, migration_matrix);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+
+        source[0] = -1;
+        CU_ASSERT_EQUAL(msp_add_migration_matrix_change(&msp, 1.0, num_entries,
+                    source, dest, rate), MSP_ERR_BAD_MIGRATION_MATRIX);
+        source[0] = (population_id_t) N;
+        CU_ASSERT_EQUAL(msp_add_migration_matrix_change(&msp, 1.0, num_entries,
+                    source, dest, rate), MSP_ERR_BAD_MIGRATION_MATRIX);
+        source[0] = 2;
+        dest[0] = (population_id_t) N;
+        CU_ASSERT_EQUAL(msp_add_migration_matrix_change(&msp, 1.0, num_entries,
+                    source, dest, rate), MSP_ERR_BAD_MIGRATION_MATRIX);
+        dest[0] = 2;
+        CU_ASSERT_EQUAL(msp_add_migration_matrix_change(&msp, 1.0, num_entries,
+                    source, dest, rate), MSP_ERR_BAD_MIGRATION_MATRIX);
+        dest[0] = 0;
+        rate[0] = -1;
+        CU_ASSERT_EQUAL(msp_add_migration_matrix_change(&msp, 1.0, num_entries,
+                    source, dest, rate), MSP_ERR_BAD_MIGRATION_MATRIX);
+        rate[0] = GSL_NAN;
+        CU_ASSERT_EQUAL(msp_add_migration_matrix_change(&msp, 1.0, num_entries,
+                    source, dest, rate), MSP_ERR_BAD_MIGRATION_MATRIX);
+        rate[0] = 0.5;
+        dest[1] = 2;
+        CU_ASSERT_EQUAL(msp_add_migration_matrix_change(&msp, 1.0, num_entries,
+                    source, dest, rate), MSP_ERR_BAD_MIGRATION_MATRIX);
+        dest[1] = 3;
+
+        ret = msp_add_migration_matrix_change(&msp, 1.0, num_entries, source,
+                dest, rate);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        ret = msp_add_migration_matrix_change(&msp, 20.0, N * (N - 1), all_source,
+                all_dest, all_rate);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        ret = msp_initialise(&msp);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        msp_print_state(&msp, _devnull);
+
+        ret = msp_run(&msp, 0.5, ULONG_MAX);
+        CU_ASSERT_EQUAL_FATAL(ret, MSP_EXIT_MAX_TIME);
+        ret = msp_get_num_migration_events(&msp, previous_events);
+        CU_ASSERT_EQUAL(ret, 0);
+        ret = msp_run(&msp, 10, ULONG_MAX);
+        CU_ASSERT_EQUAL_FATAL(ret, MSP_EXIT_MAX_TIME);
+        msp_verify(&msp);
+        ret = msp_get_migration_matrix(&msp, matrix);
+        CU_ASSERT_EQUAL(ret, 0);
+        for (k = 0; k < N * N; k++) {
+            CU_ASSERT_EQUAL(matrix[k], expected[k]);
+        }
+        /* Entries with zero rates are kept, along with their counts */
+        CU_ASSERT_EQUAL(msp_get_num_migration_matrix_entries(&msp), 9);
+        ret = msp_get_num_migration_events(&msp, migration_events);
+        CU_ASSERT_EQUAL(ret, 0);
+        for (k = 0; k < N * N; k++) {
+            CU_ASSERT(migration_events[k] >= previous_events[k]);
+        }
+
+        ret = msp_run(&msp, DBL_MAX, ULONG_MAX);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        msp_verify(&msp);
+        ret = msp_get_migration_matrix(&msp, matrix);
+        CU_ASSERT_EQUAL(ret, 0);
+        for (k = 0; k < N * N; k++) {
+            CU_ASSERT_EQUAL(matrix[k], k % (N + 1) == 0? 0: 0.01);
+        }
+
+        /* Resetting restores the initial matrix */
+        ret = msp_reset(&msp);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        ret = msp_get_migration_matrix(&msp, matrix);
+        CU_ASSERT_EQUAL(ret, 0);
+        for (k = 0; k < N * N; k++) {
+            CU_ASSERT_EQUAL(matrix[k], migration_matrix[k]);
+        }
+        ret = msp_run(&msp, DBL_MAX, ULONG_MAX);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        msp_verify(&msp);
+
+        ret = msp_free(&msp);
+        CU_ASSERT_EQUAL(ret, 0);
+        ret = tsk_table_collection_clear(&tables);
+        CU_ASSERT_EQUAL(ret, 0);
+    }
+
+    free(samples);
+    gsl_rng_free(rng);
+    recomb_map_free(&recomb_map);
+    tsk_table_collection_free(&tables);
+}
+
 static void
 test_demographic_events(void)
 {
@@ -855,10 +1194,10 @@ test_demographic_events(void)
             MSP_ERR_POPULATION_OUT_OF_BOUNDS);
 
         CU_ASSERT_EQUAL(
-        	msp_add_census_event(&msp, -0.5),
+        	msp_add_census_event(&msp, -0.5, false),
         	MSP_ERR_BAD_PARAM_VALUE);
 
-        ret = msp_add_census_event(&msp, 0.05);
+        ret = msp_add_census_event(&msp, 0.05, false);
         CU_ASSERT_EQUAL(ret, 0);
         ret = msp_add_mass_migration(&msp, 0.1, 0, 1, 0.5);
         CU_ASSERT_EQUAL(ret, 0);
@@ -973,45 +1312,325 @@ test_census_event(void)
     gsl_rng *rng = gsl_rng_alloc(gsl_rng_default);
     recomb_map_t recomb_map;
     tsk_table_collection_t tables;
-    int num_census_nodes = 0;
-    int i;
+    tsk_treeseq_t ts;
+    size_t num_census_nodes[2], num_census_edges[2];
+    double census_span[2];
+    size_t i, per_lineage;
 
     CU_ASSERT_FATAL(msp != NULL);
     CU_ASSERT_FATAL(samples != NULL);
     CU_ASSERT_FATAL(rng != NULL);
-    ret = recomb_map_alloc_uniform(&recomb_map, 1, 1.0, 1);
+    ret = recomb_map_alloc_uniform(&recomb_map, 100, 100.0, 1.0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    memset(samples, 0, n * sizeof(sample_t));
+
+    for (per_lineage = 0; per_lineage < 2; per_lineage++) {
+        ret = tsk_table_collection_init(&tables, 0);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        gsl_rng_set(rng, 5);
+        ret = msp_alloc(msp, n, samples, &recomb_map, &tables, rng);
+        CU_ASSERT_EQUAL(ret, 0);
+
+        /* Add a census event in at 0.5 generations. */
+        ret = msp_add_census_event(msp, 0.5, (bool) per_lineage);
+        CU_ASSERT_EQUAL(ret, 0);
+        ret = msp_initialise(msp);
+        CU_ASSERT_EQUAL(ret, 0);
+
+        ret = msp_run(msp, DBL_MAX, UINT32_MAX);
+        CU_ASSERT_EQUAL(ret, 0);
+        msp_verify(msp);
+        msp_print_state(msp, _devnull);
+        ret = msp_finalise_tables(msp);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        ret = tsk_table_collection_sort(&tables, 0, 0);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        ret = tsk_treeseq_init(&ts, &tables, TSK_BUILD_INDEXES);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+
+        /* Check there is more than 1 node at the census time. */
+        num_census_nodes[per_lineage] = 0;
+        for (i = 0; i < tables.nodes.num_rows; i++) {
+            if (tables.nodes.time[i] == 0.5) {
+                CU_ASSERT_EQUAL(tables.nodes.flags[i], MSP_NODE_IS_CEN_EVENT);
+                num_census_nodes[per_lineage]++;
+            }
+        }
+        CU_ASSERT_TRUE(num_census_nodes[per_lineage] > 1);
+        num_census_edges[per_lineage] = 0;
+        census_span[per_lineage] = 0;
+        for (i = 0; i < tables.edges.num_rows; i++) {
+            if (tables.nodes.time[tables.edges.parent[i]] == 0.5) {
+                num_census_edges[per_lineage]++;
+                census_span[per_lineage] += tables.edges.right[i] - tables.edges.left[i];
+            }
+        }
+        if (!per_lineage) {
+            CU_ASSERT_EQUAL(num_census_nodes[0], num_census_edges[0]);
+        }
+
+        tsk_treeseq_free(&ts);
+        ret = msp_free(msp);
+        CU_ASSERT_EQUAL(ret, 0);
+        tsk_table_collection_free(&tables);
+    }
+    /* The same segments are recorded with fewer nodes */
+    CU_ASSERT_TRUE(num_census_nodes[1] < num_census_nodes[0]);
+    CU_ASSERT_TRUE(num_census_edges[1] <= num_census_edges[0]);
+    CU_ASSERT_DOUBLE_EQUAL(census_span[1], census_span[0], 1e-9);
+
+    /* Free things. */
+    gsl_rng_free(rng);
+    free(msp);
+    free(samples);
+    recomb_map_free(&recomb_map);
+}
+
+static void
+test_population_size_history(void)
+{
+    int ret;
+    uint32_t n = 10;
+    sample_t *samples = malloc(n * sizeof(sample_t));
+    msp_t msp;
+    gsl_rng *rng = gsl_rng_alloc(gsl_rng_default);
+    recomb_map_t recomb_map;
+    tsk_table_collection_t tables;
+    double time[] = {1, 2, 3, 4};
+    double initial_size[] = {10, 0.5, 2, 4};
+    double growth_rate[] = {0, 0.5, 0, -0.25};
+    double bad_time[] = {1, 2, 2, 4};
+    double bad_size[] = {10, 0.5, 0, 4};
+    double end_time, size;
+    size_t j;
+
+    CU_ASSERT_FATAL(samples != NULL);
+    CU_ASSERT_FATAL(rng != NULL);
+    memset(samples, 0, n * sizeof(sample_t));
+    ret = recomb_map_alloc_uniform(&recomb_map, 10, 1.0, 10);
     CU_ASSERT_EQUAL_FATAL(ret, 0);
     ret = tsk_table_collection_init(&tables, 0);
     CU_ASSERT_EQUAL_FATAL(ret, 0);
 
-    memset(samples, 0, n * sizeof(sample_t));
-    ret = msp_alloc(msp, n, samples, &recomb_map, &tables, rng);
-    CU_ASSERT_EQUAL(ret, 0);
+    ret = msp_alloc(&msp, n, samples, &recomb_map, &tables, rng);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_set_num_populations(&msp, 2);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
 
-    /* Add a census event in at 0.5 generations. */
-    ret = msp_add_census_event(msp, 0.5);
-    CU_ASSERT_EQUAL(ret, 0);
-    ret = msp_initialise(msp);
-    CU_ASSERT_EQUAL(ret, 0);
+    CU_ASSERT_EQUAL(msp_add_population_size_history(&msp, -1,
+                MSP_SIZE_FUNCTION_EXPONENTIAL, 4, time, initial_size, growth_rate,
+                NULL), MSP_ERR_POPULATION_OUT_OF_BOUNDS);
+    CU_ASSERT_EQUAL(msp_add_population_size_history(&msp, 2,
+                MSP_SIZE_FUNCTION_EXPONENTIAL, 4, time, initial_size, growth_rate,
+                NULL), MSP_ERR_POPULATION_OUT_OF_BOUNDS);
+    CU_ASSERT_EQUAL(msp_add_population_size_history(&msp, 0,
+                MSP_SIZE_FUNCTION_EXPONENTIAL, 0, time, initial_size, growth_rate,
+                NULL), MSP_ERR_BAD_PARAM_VALUE);
+    CU_ASSERT_EQUAL(msp_add_population_size_history(&msp, 0,
+                MSP_SIZE_FUNCTION_EXPONENTIAL, 4, bad_time, initial_size, growth_rate,
+                NULL), MSP_ERR_UNSORTED_POPULATION_SIZE_HISTORY);
+    CU_ASSERT_EQUAL(msp_add_population_size_history(&msp, 0,
+                MSP_SIZE_FUNCTION_EXPONENTIAL, 4, time, bad_size, growth_rate,
+                NULL), MSP_ERR_BAD_PARAM_VALUE);
+    CU_ASSERT_EQUAL(msp_add_population_size_history(&msp, 0, 3, 4, time,
+                initial_size, growth_rate, NULL), MSP_ERR_BAD_PARAM_VALUE);
+
+    ret = msp_add_population_size_history(&msp, 0, MSP_SIZE_FUNCTION_EXPONENTIAL,
+            4, time, initial_size, growth_rate, NULL);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_add_population_size_history(&msp, 1, MSP_SIZE_FUNCTION_EXPONENTIAL,
+            2, time, initial_size, growth_rate, NULL);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    /* A later change to the population replaces the rest of the history */
+    ret = msp_add_population_parameters_change(&msp, 3.5, 0, GSL_NAN, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_initialise(&msp);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    msp_print_state(&msp, _devnull);
 
-    ret = msp_run(msp, DBL_MAX, UINT32_MAX);
+    /* Step through the events, checking the sizes within each breakpoint */
+    ret = msp_debug_demography(&msp, &end_time);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_EQUAL(end_time, 1);
+    ret = msp_debug_demography(&msp, &end_time);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_EQUAL(end_time, 3.5);
+    for (j = 0; j < 3; j++) {
+        ret = msp_compute_population_size(&msp, 0, time[j] + 0.25, &size);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        CU_ASSERT_DOUBLE_EQUAL(size,
+                initial_size[j] * exp(-growth_rate[j] * 0.25), 1e-9);
+    }
+    ret = msp_compute_population_size(&msp, 1, 10, &size);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_DOUBLE_EQUAL(size, 0.5 * exp(-0.5 * 8), 1e-9);
+    ret = msp_debug_demography(&msp, &end_time);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_TRUE(gsl_isinf(end_time));
+    ret = msp_compute_population_size(&msp, 0, 10, &size);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_DOUBLE_EQUAL(size, 2, 1e-9);
+    CU_ASSERT_EQUAL(msp.populations[0].size_history, NULL);
+    CU_ASSERT_NOT_EQUAL(msp.populations[1].size_history, NULL);
+
+    /* Simulate through the history, including after a reset */
+    for (j = 0; j < 2; j++) {
+        ret = msp_reset(&msp);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        ret = msp_run(&msp, DBL_MAX, UINT32_MAX);
+        CU_ASSERT_EQUAL(ret, 0);
+        msp_verify(&msp);
+        msp_print_state(&msp, _devnull);
+        ret = msp_finalise_tables(&msp);
+        CU_ASSERT_EQUAL(ret, 0);
+        ret = tsk_table_collection_clear(&tables);
+        CU_ASSERT_EQUAL(ret, 0);
+    }
+
+    ret = msp_free(&msp);
     CU_ASSERT_EQUAL(ret, 0);
-    msp_verify(msp);
-    msp_print_state(msp, _devnull);
+    gsl_rng_free(rng);
+    free(samples);
+    recomb_map_free(&recomb_map);
+    tsk_table_collection_free(&tables);
+}
 
-    /* Check there is more than 1 node at the census time. */
-    for (i = 0; i < tables.nodes.num_rows; i++) {
-        if (tables.nodes.time[i] == 0.5) {
-            num_census_nodes++;
-        }
+static void
+test_population_size_functions(void)
+{
+    int ret;
+    uint32_t n = 10;
+    sample_t *samples = malloc(n * sizeof(sample_t));
+    msp_t msp;
+    gsl_rng *rng = gsl_rng_alloc(gsl_rng_default);
+    recomb_map_t recomb_map;
+    tsk_table_collection_t tables;
+    double linear_time[] = {0, 1, 3};
+    double linear_size[] = {1, 3, 0.5};
+    double logistic_time[] = {0, 2, 4};
+    double logistic_size[] = {1, 1.5, 0.5};
+    double logistic_rate[] = {1, 0.5, -1};
+    double logistic_capacity[] = {4, 1, 2};
+    double bad_capacity[] = {4, 1, 0};
+    double end_time, size;
+    int j;
+
+    CU_ASSERT_FATAL(samples != NULL);
+    CU_ASSERT_FATAL(rng != NULL);
+    for (j = 0; j < (int) n; j++) {
+        samples[j].time = 0;
+        samples[j].population_id = j % 2;
     }
-    CU_ASSERT_TRUE(num_census_nodes > 1);
+    ret = recomb_map_alloc_uniform(&recomb_map, 10, 1.0, 10);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = tsk_table_collection_init(&tables, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
 
-    /* Free things. */
-    ret = msp_free(msp);
+    ret = msp_alloc(&msp, n, samples, &recomb_map, &tables, rng);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_set_num_populations(&msp, 2);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_add_migration_rate_change(&msp, 0, -1, 1.0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+
+    CU_ASSERT_EQUAL(msp_add_population_size_history(&msp, 1,
+                MSP_SIZE_FUNCTION_LOGISTIC, 3, logistic_time, logistic_size,
+                logistic_rate, NULL), MSP_ERR_BAD_PARAM_VALUE);
+    CU_ASSERT_EQUAL(msp_add_population_size_history(&msp, 1,
+                MSP_SIZE_FUNCTION_LOGISTIC, 3, logistic_time, logistic_size,
+                NULL, logistic_capacity), MSP_ERR_BAD_PARAM_VALUE);
+    CU_ASSERT_EQUAL(msp_add_population_size_history(&msp, 1,
+                MSP_SIZE_FUNCTION_LOGISTIC, 3, logistic_time, logistic_size,
+                logistic_rate, bad_capacity), MSP_ERR_BAD_PARAM_VALUE);
+    /* The size would go to infinity before the next breakpoint */
+    logistic_rate[1] = 2;
+    CU_ASSERT_EQUAL(msp_add_population_size_history(&msp, 1,
+                MSP_SIZE_FUNCTION_LOGISTIC, 3, logistic_time, logistic_size,
+                logistic_rate, logistic_capacity), MSP_ERR_BAD_PARAM_VALUE);
+    logistic_rate[1] = 0.5;
+    /* ... or at any time in the last segment */
+    logistic_rate[2] = 1;
+    logistic_capacity[2] = 0.25;
+    CU_ASSERT_EQUAL(msp_add_population_size_history(&msp, 1,
+                MSP_SIZE_FUNCTION_LOGISTIC, 3, logistic_time, logistic_size,
+                logistic_rate, logistic_capacity), MSP_ERR_BAD_PARAM_VALUE);
+    logistic_rate[2] = -1;
+    logistic_capacity[2] = 2;
+
+    ret = msp_add_population_size_history(&msp, 0, MSP_SIZE_FUNCTION_LINEAR,
+            3, linear_time, linear_size, NULL, NULL);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_add_population_size_history(&msp, 1, MSP_SIZE_FUNCTION_LOGISTIC,
+            3, logistic_time, logistic_size, logistic_rate, logistic_capacity);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_initialise(&msp);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    msp_print_state(&msp, _devnull);
+
+    ret = msp_debug_demography(&msp, &end_time);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_debug_demography(&msp, &end_time);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_TRUE(gsl_isinf(end_time));
+    ret = msp_compute_population_size(&msp, 0, 0.5, &size);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_DOUBLE_EQUAL(size, 2, 1e-9);
+    ret = msp_compute_population_size(&msp, 0, 2, &size);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_DOUBLE_EQUAL(size, 1.75, 1e-9);
+    ret = msp_compute_population_size(&msp, 0, 10, &size);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_DOUBLE_EQUAL(size, 0.5, 1e-9);
+    ret = msp_compute_population_size(&msp, 1, 1, &size);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_DOUBLE_EQUAL(size, 4 / (1 + 3 * exp(1)), 1e-9);
+    ret = msp_compute_population_size(&msp, 1, 3, &size);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_DOUBLE_EQUAL(size, 1 / (1 - exp(0.5) / 3), 1e-9);
+    ret = msp_compute_population_size(&msp, 1, 100, &size);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_DOUBLE_EQUAL(size, 2, 1e-9);
+
+    for (j = 0; j < 2; j++) {
+        ret = msp_reset(&msp);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        ret = msp_run(&msp, DBL_MAX, UINT32_MAX);
+        CU_ASSERT_EQUAL(ret, 0);
+        msp_verify(&msp);
+        msp_print_state(&msp, _devnull);
+        ret = msp_finalise_tables(&msp);
+        CU_ASSERT_EQUAL(ret, 0);
+        ret = tsk_table_collection_clear(&tables);
+        CU_ASSERT_EQUAL(ret, 0);
+    }
+    ret = msp_free(&msp);
+    CU_ASSERT_EQUAL(ret, 0);
+
+    /* A later change keeps the size of the population at that time */
+    ret = msp_alloc(&msp, n, samples, &recomb_map, &tables, rng);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_set_num_populations(&msp, 2);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_add_population_size_history(&msp, 0, MSP_SIZE_FUNCTION_LINEAR,
+            3, linear_time, linear_size, NULL, NULL);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_add_population_parameters_change(&msp, 2, 0, GSL_NAN, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_initialise(&msp);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    for (j = 0; j < 3; j++) {
+        ret = msp_debug_demography(&msp, &end_time);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+    }
+    CU_ASSERT_TRUE(gsl_isinf(end_time));
+    CU_ASSERT_EQUAL(msp.populations[0].size_history, NULL);
+    ret = msp_compute_population_size(&msp, 0, 10, &size);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_DOUBLE_EQUAL(size, 1.75, 1e-9);
+    ret = msp_free(&msp);
     CU_ASSERT_EQUAL(ret, 0);
+
     gsl_rng_free(rng);
-    free(msp);
     free(samples);
     recomb_map_free(&recomb_map);
     tsk_table_collection_free(&tables);
@@ -1561,10 +2180,12 @@ test_single_locus_simulation(void)
     for (j = 0; j < n - 2; j++) {
         ret = msp_run(msp, DBL_MAX, 1);
         CU_ASSERT_EQUAL(ret, MSP_EXIT_MAX_EVENTS);
+        CU_ASSERT_EQUAL(msp_get_num_events(msp), j + 1);
         msp_verify(msp);
     }
     ret = msp_run(msp, DBL_MAX, 1);
     CU_ASSERT_EQUAL(ret, 0);
+    CU_ASSERT_EQUAL(msp_get_num_events(msp), n - 1);
     msp_verify(msp);
 
     model = msp_get_model(msp)->type;
@@ -1814,6 +2435,298 @@ test_likelihood_three_leaves(void)
     tsk_table_collection_free(&tables);
 }
 
+static void
+test_rng_xoshiro256starstar(void)
+{
+    int ret;
+    int j;
+    double x;
+    uint64_t *state;
+    unsigned long expected[] = {0xb3f2af6d, 0x853b5596, 0x92f89756};
+    unsigned long expected_jump[] = {0xc00b7581, 0x3108407c, 0xd4282228};
+    uint64_t expected_raw[] = {11520, 0, 1509978240};
+    gsl_rng *rng = gsl_rng_alloc(msp_gsl_rng_xoshiro256starstar);
+    gsl_rng *other = gsl_rng_alloc(msp_gsl_rng_xoshiro256starstar);
+    gsl_rng *mt = gsl_rng_alloc(gsl_rng_mt19937);
+
+    CU_ASSERT_FATAL(rng != NULL);
+    CU_ASSERT_FATAL(other != NULL);
+    CU_ASSERT_FATAL(mt != NULL);
+    CU_ASSERT_STRING_EQUAL(gsl_rng_name(rng), "xoshiro256**");
+    CU_ASSERT_EQUAL(gsl_rng_max(rng), 0xffffffffUL);
+    CU_ASSERT_EQUAL(gsl_rng_min(rng), 0);
+
+    /* Reference output of xoshiro256** for the state {1, 2, 3, 4}. The
+     * generator returns the upper 32 bits of each 64 bit output. */
+    state = (uint64_t *) rng->state;
+    for (j = 0; j < 4; j++) {
+        state[j] = (uint64_t) j + 1;
+    }
+    for (j = 0; j < 3; j++) {
+        CU_ASSERT_EQUAL(gsl_rng_get(rng), (unsigned long) (expected_raw[j] >> 32));
+    }
+
+    /* Seeding with splitmix64 */
+    gsl_rng_set(rng, 1);
+    for (j = 0; j < 3; j++) {
+        CU_ASSERT_EQUAL(gsl_rng_get(rng), expected[j]);
+    }
+    gsl_rng_set(rng, 1);
+    ret = msp_rng_jump(rng, 2);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    for (j = 0; j < 3; j++) {
+        CU_ASSERT_EQUAL(gsl_rng_get(rng), expected_jump[j]);
+    }
+    /* Jumping twice is the same as a double jump */
+    gsl_rng_set(rng, 1);
+    gsl_rng_set(other, 1);
+    ret = msp_rng_jump(rng, 1);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_rng_jump(rng, 1);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_rng_jump(other, 2);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_rng_jump(other, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    for (j = 0; j < 100; j++) {
+        CU_ASSERT_EQUAL(gsl_rng_get(rng), gsl_rng_get(other));
+    }
+
+    gsl_rng_set(rng, 1);
+    CU_ASSERT_DOUBLE_EQUAL(gsl_rng_uniform(rng), 0.7029218331588505, 1e-15);
+    for (j = 0; j < 1000; j++) {
+        x = gsl_rng_uniform(rng);
+        CU_ASSERT(x >= 0 && x < 1);
+        x = gsl_rng_uniform_pos(rng);
+        CU_ASSERT(x > 0 && x < 1);
+        CU_ASSERT(gsl_rng_uniform_int(rng, 10) < 10);
+    }
+
+    ret = msp_rng_jump(mt, 1);
+    CU_ASSERT_EQUAL(ret, MSP_ERR_UNSUPPORTED_OPERATION);
+
+    gsl_rng_free(rng);
+    gsl_rng_free(other);
+    gsl_rng_free(mt);
+}
+
+static void
+test_simulation_xoshiro256starstar(void)
+{
+    int ret;
+    uint32_t n = 10;
+    sample_t *samples = malloc(n * sizeof(sample_t));
+    gsl_rng *rng = gsl_rng_alloc(msp_gsl_rng_xoshiro256starstar);
+    msp_t msp;
+    tsk_table_collection_t tables;
+    recomb_map_t recomb_map;
+
+    CU_ASSERT_FATAL(samples != NULL);
+    CU_ASSERT_FATAL(rng != NULL);
+    memset(samples, 0, n * sizeof(sample_t));
+    gsl_rng_set(rng, 5);
+    ret = recomb_map_alloc_uniform(&recomb_map, 100, 1.0, 1.0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = tsk_table_collection_init(&tables, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_alloc(&msp, n, samples, &recomb_map, &tables, rng);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_initialise(&msp);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_run(&msp, DBL_MAX, SIZE_MAX);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    msp_verify(&msp);
+    CU_ASSERT_TRUE(msp_get_num_recombination_events(&msp) > 0);
+    ret = msp_finalise_tables(&msp);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+
+    msp_free(&msp);
+    gsl_rng_free(rng);
+    free(samples);
+    tsk_table_collection_free(&tables);
+    recomb_map_free(&recomb_map);
+}
+
+/* Initialises the specified tables with a tree sequence of four samples
+ * with two trees and four infinite sites mutations. */
+static void
+init_example_sites_tables(tsk_table_collection_t *tables)
+{
+    int ret;
+
+    ret = tsk_table_collection_init(tables, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    tables->sequence_length = 1;
+    /* Samples 0-3; ((0, 1), (2, 3)) on [0, 0.5) and (((0, 1), 2), 3) on [0.5, 1) */
+    ret = tsk_node_table_add_row(&tables->nodes, TSK_NODE_IS_SAMPLE, 0.0, 0, TSK_NULL, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_node_table_add_row(&tables->nodes, TSK_NODE_IS_SAMPLE, 0.0, 0, TSK_NULL, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_node_table_add_row(&tables->nodes, TSK_NODE_IS_SAMPLE, 0.0, 0, TSK_NULL, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_node_table_add_row(&tables->nodes, TSK_NODE_IS_SAMPLE, 0.0, 0, TSK_NULL, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_node_table_add_row(&tables->nodes, 0, 1.0, 0, TSK_NULL, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_node_table_add_row(&tables->nodes, 0, 2.0, 0, TSK_NULL, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_node_table_add_row(&tables->nodes, 0, 3.0, 0, TSK_NULL, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_node_table_add_row(&tables->nodes, 0, 2.5, 0, TSK_NULL, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_node_table_add_row(&tables->nodes, 0, 4.0, 0, TSK_NULL, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+
+    ret = tsk_edge_table_add_row(&tables->edges, 0, 1, 4, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_edge_table_add_row(&tables->edges, 0, 1, 4, 1);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_edge_table_add_row(&tables->edges, 0, 0.5, 5, 2);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_edge_table_add_row(&tables->edges, 0, 0.5, 5, 3);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_edge_table_add_row(&tables->edges, 0.5, 1, 7, 2);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_edge_table_add_row(&tables->edges, 0.5, 1, 7, 4);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_edge_table_add_row(&tables->edges, 0, 0.5, 6, 4);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_edge_table_add_row(&tables->edges, 0, 0.5, 6, 5);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_edge_table_add_row(&tables->edges, 0.5, 1, 8, 3);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_edge_table_add_row(&tables->edges, 0.5, 1, 8, 7);
+    CU_ASSERT_FATAL(ret >= 0);
+
+    ret = tsk_site_table_add_row(&tables->sites, 0.1, "0", 1, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_site_table_add_row(&tables->sites, 0.2, "0", 1, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_site_table_add_row(&tables->sites, 0.6, "0", 1, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_site_table_add_row(&tables->sites, 0.7, "0", 1, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_mutation_table_add_row(&tables->mutations, 0, 4, -1, "1", 1, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_mutation_table_add_row(&tables->mutations, 1, 0, -1, "1", 1, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_mutation_table_add_row(&tables->mutations, 2, 7, -1, "1", 1, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_mutation_table_add_row(&tables->mutations, 3, 3, -1, "1", 1, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_population_table_add_row(&tables->populations, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+}
+
+static void
+test_summary_stats(void)
+{
+    int ret;
+    size_t size;
+    int stats[] = {MSP_STAT_SFS, MSP_STAT_NUM_TREES, MSP_STAT_PI,
+        MSP_STAT_SEGREGATING_SITES};
+    int bad_stats[] = {-1, 4};
+    double result[6];
+    tsk_table_collection_t tables;
+    tsk_treeseq_t ts;
+
+    init_example_sites_tables(&tables);
+    ret = tsk_treeseq_init(&ts, &tables, TSK_BUILD_INDEXES);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+
+    ret = msp_get_summary_stats_size(&ts, 4, stats, &size);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_EQUAL_FATAL(size, 6);
+    ret = msp_summary_stats(&ts, 4, stats, 6, result);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    /* Derived allele counts are 2, 1, 3 and 1 */
+    CU_ASSERT_EQUAL(result[0], 2);
+    CU_ASSERT_EQUAL(result[1], 1);
+    CU_ASSERT_EQUAL(result[2], 1);
+    CU_ASSERT_EQUAL(result[3], 2);
+    CU_ASSERT_DOUBLE_EQUAL(result[4], 13.0 / 6.0, 1e-12);
+    CU_ASSERT_EQUAL(result[5], 4);
+
+    ret = msp_summary_stats(&ts, 0, stats, 0, result);
+    CU_ASSERT_EQUAL(ret, 0);
+    ret = msp_summary_stats(&ts, 4, stats, 5, result);
+    CU_ASSERT_EQUAL(ret, MSP_ERR_BAD_PARAM_VALUE);
+    ret = msp_get_summary_stats_size(&ts, 1, bad_stats, &size);
+    CU_ASSERT_EQUAL(ret, MSP_ERR_BAD_PARAM_VALUE);
+    ret = msp_get_summary_stats_size(&ts, 1, bad_stats + 1, &size);
+    CU_ASSERT_EQUAL(ret, MSP_ERR_BAD_PARAM_VALUE);
+    ret = msp_summary_stats(&ts, 2, bad_stats, 2, result);
+    CU_ASSERT_EQUAL(ret, MSP_ERR_BAD_PARAM_VALUE);
+    tsk_treeseq_free(&ts);
+
+    /* Multiple mutations at a site are not supported */
+    ret = tsk_mutation_table_add_row(&tables.mutations, 3, 2, -1, "1", 1, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_treeseq_init(&ts, &tables, TSK_BUILD_INDEXES);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_summary_stats(&ts, 4, stats, 6, result);
+    CU_ASSERT_EQUAL(ret, MSP_ERR_BAD_PARAM_VALUE);
+
+    tsk_treeseq_free(&ts);
+    tsk_table_collection_free(&tables);
+}
+
+static void
+test_format_ms_sites(void)
+{
+    int ret;
+    char *buffer = NULL;
+    size_t length;
+    const char *expected =
+        "segsites: 4\n"
+        "positions: 0.100 0.200 0.600 0.700 \n"
+        "1110\n1010\n0010\n0001\n";
+    tsk_table_collection_t tables;
+    tsk_treeseq_t ts;
+
+    init_example_sites_tables(&tables);
+    ret = tsk_treeseq_init(&ts, &tables, TSK_BUILD_INDEXES);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_format_ms_sites(&ts, 3, &buffer, &length);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_EQUAL_FATAL(length, strlen(expected));
+    CU_ASSERT_TRUE(strncmp(buffer, expected, length) == 0);
+    free(buffer);
+    ret = msp_format_ms_sites(&ts, 0, &buffer, &length);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_TRUE(strncmp(buffer, "segsites: 4\npositions: 0 0 1 1 \n1110\n",
+                strlen("segsites: 4\npositions: 0 0 1 1 \n1110\n")) == 0);
+    free(buffer);
+    /* Large precision values need more than the initial buffer */
+    ret = msp_format_ms_sites(&ts, 100, &buffer, &length);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_EQUAL(length, strlen(expected) + 4 * 97);
+    free(buffer);
+    tsk_treeseq_free(&ts);
+
+    /* Multiple mutations at a site are not supported */
+    ret = tsk_mutation_table_add_row(&tables.mutations, 3, 2, -1, "1", 1, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_treeseq_init(&ts, &tables, TSK_BUILD_INDEXES);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_format_ms_sites(&ts, 3, &buffer, &length);
+    CU_ASSERT_EQUAL(ret, MSP_ERR_BAD_PARAM_VALUE);
+    tsk_treeseq_free(&ts);
+
+    /* With no sites we output an empty line */
+    tsk_site_table_clear(&tables.sites);
+    tsk_mutation_table_clear(&tables.mutations);
+    ret = tsk_treeseq_init(&ts, &tables, TSK_BUILD_INDEXES);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_format_ms_sites(&ts, 3, &buffer, &length);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_EQUAL_FATAL(length, strlen("segsites: 0\n\n"));
+    CU_ASSERT_TRUE(strncmp(buffer, "segsites: 0\n\n", length) == 0);
+    free(buffer);
+    tsk_treeseq_free(&ts);
+    tsk_table_collection_free(&tables);
+}
+
 static void
 test_likelihood_two_mrcas(void)
 {
@@ -2451,6 +3364,287 @@ test_simulation_replicates(void)
     recomb_map_free(&recomb_map);
 }
 
+static void
+test_simulation_reset_reproducible(void)
+{
+    int ret;
+    uint32_t n = 50;
+    uint32_t m = 100;
+    unsigned long seed = 5;
+    double migration_matrix[] = {0, 1, 1, 0};
+    size_t j;
+    sample_t *samples = malloc(n * sizeof(sample_t));
+    gsl_rng *rng[2];
+    msp_t msp[2];
+    tsk_table_collection_t tables[2];
+    recomb_map_t recomb_map;
+
+    CU_ASSERT_FATAL(samples != NULL);
+    ret = recomb_map_alloc_uniform(&recomb_map, m, 1.0, 1.0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    memset(samples, 0, n * sizeof(sample_t));
+
+    for (j = 0; j < 2; j++) {
+        rng[j] = gsl_rng_alloc(gsl_rng_default);
+        CU_ASSERT_FATAL(rng[j] != NULL);
+        gsl_rng_set(rng[j], seed);
+        ret = tsk_table_collection_init(&tables[j], 0);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        ret = msp_alloc(&msp[j], n, samples, &recomb_map, &tables[j], rng[j]);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        ret = msp_set_num_populations(&msp[j], 2);
+        CU_ASSERT_EQUAL(ret, 0);
+        ret = msp_set_migration_matrix(&msp[j], 4, migration_matrix);
+        CU_ASSERT_EQUAL(ret, 0);
+        /* Use small blocks to make sure that the heaps are expanded */
+        ret = msp_set_segment_block_size(&msp[j], 3);
+        CU_ASSERT_EQUAL(ret, 0);
+        ret = msp_initialise(&msp[j]);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+    }
+    /* Run a replicate on the first simulator and then reset it. */
+    ret = msp_run(&msp[0], DBL_MAX, SIZE_MAX);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_TRUE(msp_get_num_segment_blocks(&msp[0]) > 1);
+    ret = msp_reset(&msp[0]);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    gsl_rng_set(rng[0], seed);
+
+    /* With the same random state, a reset simulation must give exactly the
+     * same result as a new one. */
+    for (j = 0; j < 2; j++) {
+        ret = msp_run(&msp[j], DBL_MAX, SIZE_MAX);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        msp_verify(&msp[j]);
+        ret = msp_finalise_tables(&msp[j]);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+    }
+    CU_ASSERT_TRUE(tsk_table_collection_equals(&tables[0], &tables[1]));
+    CU_ASSERT_EQUAL(msp_get_num_events(&msp[0]), msp_get_num_events(&msp[1]));
+
+    for (j = 0; j < 2; j++) {
+        ret = msp_free(&msp[j]);
+        CU_ASSERT_EQUAL(ret, 0);
+        gsl_rng_free(rng[j]);
+        tsk_table_collection_free(&tables[j]);
+    }
+    free(samples);
+    recomb_map_free(&recomb_map);
+}
+
+static void
+verify_simulation_parameters(msp_t *msp, double *initial_size, double *growth_rate,
+        double *migration_matrix, double recombination_rate)
+{
+    int ret;
+    size_t j;
+    size_t N = msp_get_num_populations(msp);
+    double size, rate;
+    double *M = malloc(N * N * sizeof(double));
+
+    CU_ASSERT_FATAL(M != NULL);
+    for (j = 0; j < N; j++) {
+        ret = msp_get_population_configuration(msp, j, &size, &rate);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+        CU_ASSERT_DOUBLE_EQUAL(size, initial_size[j], 1e-12);
+        CU_ASSERT_DOUBLE_EQUAL(rate, growth_rate[j], 1e-12);
+    }
+    ret = msp_get_migration_matrix(msp, M);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    for (j = 0; j < N * N; j++) {
+        CU_ASSERT_DOUBLE_EQUAL(M[j], migration_matrix[j], 1e-12);
+    }
+    CU_ASSERT_DOUBLE_EQUAL(msp_get_recombination_rate(msp), recombination_rate, 1e-12);
+    free(M);
+}
+
+static void
+test_simulation_update_parameters(void)
+{
+    int ret;
+    uint32_t j;
+    uint32_t n = 10;
+    uint32_t m = 100;
+    double initial_size[] = {1.0, 0.25};
+    double growth_rate[] = {0.5, 0};
+    double new_initial_size[] = {2.0, 0.5};
+    double new_growth_rate[] = {0, 0.25};
+    double migration_matrix[] = {0, 1, 1, 0};
+    double new_migration_matrix[] = {0, 2, 0.5, 0};
+    double bad_migration_matrix[] = {0, 2, 0.5};
+    sample_t *samples = malloc(n * sizeof(sample_t));
+    gsl_rng *rng = gsl_rng_alloc(gsl_rng_default);
+    msp_t msp;
+    tsk_table_collection_t tables;
+    recomb_map_t recomb_map, new_recomb_map, bad_recomb_map;
+
+    CU_ASSERT_FATAL(samples != NULL);
+    CU_ASSERT_FATAL(rng != NULL);
+    memset(samples, 0, n * sizeof(sample_t));
+    samples[1].population_id = 1;
+    samples[2].time = 0.5;
+    ret = recomb_map_alloc_uniform(&recomb_map, m, 1.0, 1.0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = recomb_map_alloc_uniform(&new_recomb_map, m, 1.0, 2.0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = recomb_map_alloc_uniform(&bad_recomb_map, m + 1, 1.0, 2.0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = tsk_table_collection_init(&tables, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+
+    ret = msp_alloc(&msp, n, samples, &recomb_map, &tables, rng);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_set_simulation_model_hudson(&msp, 0.25);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_set_num_populations(&msp, 2);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    for (j = 0; j < 2; j++) {
+        ret = msp_set_population_configuration(&msp, (int) j, initial_size[j],
+                growth_rate[j]);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+    }
+    ret = msp_set_migration_matrix(&msp, 4, migration_matrix);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_add_population_parameters_change(&msp, 0.25, -1, 0.5, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    /* These can only be set after initialisation */
+    CU_ASSERT_EQUAL(msp_set_reference_size(&msp, 1.0), MSP_ERR_BAD_STATE);
+    CU_ASSERT_EQUAL(msp_set_recombination_map(&msp, &new_recomb_map),
+            MSP_ERR_BAD_STATE);
+    ret = msp_initialise(&msp);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    verify_simulation_parameters(&msp, initial_size, growth_rate, migration_matrix,
+            1.0 / (m - 1));
+    ret = msp_run(&msp, DBL_MAX, 10);
+    CU_ASSERT_EQUAL_FATAL(ret, MSP_EXIT_MAX_EVENTS);
+    /* Parameters cannot be changed during a simulation */
+    CU_ASSERT_EQUAL(msp_set_reference_size(&msp, 1.0), MSP_ERR_BAD_STATE);
+    CU_ASSERT_EQUAL(msp_set_recombination_map(&msp, &new_recomb_map),
+            MSP_ERR_BAD_STATE);
+    CU_ASSERT_EQUAL(msp_set_migration_matrix(&msp, 4, new_migration_matrix),
+            MSP_ERR_BAD_STATE);
+    CU_ASSERT_EQUAL(msp_set_population_configuration(&msp, 0, 1, 0),
+            MSP_ERR_BAD_STATE);
+    CU_ASSERT_EQUAL(msp_clear_demographic_events(&msp), MSP_ERR_BAD_STATE);
+    ret = msp_run(&msp, DBL_MAX, SIZE_MAX);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_reset(&msp);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+
+    /* Changing the reference size keeps parameters in generations fixed */
+    CU_ASSERT_EQUAL(msp_set_reference_size(&msp, 0), MSP_ERR_BAD_POPULATION_SIZE);
+    ret = msp_set_reference_size(&msp, 1.0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_reset(&msp);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    verify_simulation_parameters(&msp, initial_size, growth_rate, migration_matrix,
+            1.0 / (m - 1));
+
+    /* Update the remaining parameters in place */
+    CU_ASSERT_EQUAL(msp_set_recombination_map(&msp, &bad_recomb_map),
+            MSP_ERR_BAD_RECOMBINATION_MAP);
+    CU_ASSERT_EQUAL(msp_set_migration_matrix(&msp, 3, bad_migration_matrix),
+            MSP_ERR_BAD_MIGRATION_MATRIX);
+    ret = msp_set_recombination_map(&msp, &new_recomb_map);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    for (j = 0; j < 2; j++) {
+        ret = msp_set_population_configuration(&msp, (int) j, new_initial_size[j],
+                new_growth_rate[j]);
+        CU_ASSERT_EQUAL_FATAL(ret, 0);
+    }
+    ret = msp_set_migration_matrix(&msp, 4, new_migration_matrix);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_clear_demographic_events(&msp);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_add_population_parameters_change(&msp, 4.0, -1, 0.25, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_add_mass_migration(&msp, 8.0, 0, 1, 1.0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_reset(&msp);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    verify_simulation_parameters(&msp, new_initial_size, new_growth_rate,
+            new_migration_matrix, 2.0 / (m - 1));
+    msp_print_state(&msp, _devnull);
+    ret = msp_run(&msp, DBL_MAX, SIZE_MAX);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    msp_verify(&msp);
+    ret = msp_finalise_tables(&msp);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_EQUAL(tables.nodes.time[2], 0.5);
+
+    /* Demographic events before the start time are caught on reset */
+    ret = msp_reset(&msp);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_clear_demographic_events(&msp);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_set_start_time(&msp, 1.0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = msp_add_census_event(&msp, 0.5, false);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_EQUAL(msp_reset(&msp), MSP_ERR_BAD_DEMOGRAPHIC_EVENT_TIME);
+
+    msp_free(&msp);
+    gsl_rng_free(rng);
+    free(samples);
+    tsk_table_collection_free(&tables);
+    recomb_map_free(&recomb_map);
+    recomb_map_free(&new_recomb_map);
+    recomb_map_free(&bad_recomb_map);
+}
+
+static void
+test_simulation_used_memory(void)
+{
+    int ret;
+    size_t memory, last_memory;
+    uint32_t n = 100;
+    sample_t *samples = malloc(n * sizeof(sample_t));
+    msp_t *msp = malloc(sizeof(msp_t));
+    gsl_rng *rng = gsl_rng_alloc(gsl_rng_default);
+    recomb_map_t recomb_map;
+    tsk_table_collection_t tables;
+
+    CU_ASSERT_FATAL(msp != NULL);
+    CU_ASSERT_FATAL(samples != NULL);
+    CU_ASSERT_FATAL(rng != NULL);
+    ret = recomb_map_alloc_uniform(&recomb_map, 1000, 1.0, 10.0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = tsk_table_collection_init(&tables, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+
+    memset(samples, 0, n * sizeof(sample_t));
+    ret = msp_alloc(msp, n, samples, &recomb_map, &tables, rng);
+    CU_ASSERT_EQUAL(ret, 0);
+    ret = msp_set_segment_block_size(msp, 8);
+    CU_ASSERT_EQUAL(ret, 0);
+    ret = msp_set_avl_node_block_size(msp, 8);
+    CU_ASSERT_EQUAL(ret, 0);
+    ret = msp_initialise(msp);
+    CU_ASSERT_EQUAL(ret, 0);
+
+    last_memory = msp_get_used_memory(msp);
+    CU_ASSERT_TRUE(last_memory > 0);
+    /* Memory is never returned to the system during a simulation */
+    do {
+        ret = msp_run(msp, DBL_MAX, 100);
+        CU_ASSERT_FATAL(ret >= 0);
+        memory = msp_get_used_memory(msp);
+        CU_ASSERT_TRUE(memory >= last_memory);
+        last_memory = memory;
+    } while (ret == MSP_EXIT_MAX_EVENTS);
+    CU_ASSERT_EQUAL(ret, 0);
+    CU_ASSERT_TRUE(msp_get_num_segment_blocks(msp) > 1);
+    CU_ASSERT_TRUE(last_memory >= msp_get_num_segment_blocks(msp) * 8 * sizeof(segment_t));
+
+    ret = msp_free(msp);
+    CU_ASSERT_EQUAL(ret, 0);
+    gsl_rng_free(rng);
+    free(msp);
+    free(samples);
+    recomb_map_free(&recomb_map);
+    tsk_table_collection_free(&tables);
+}
+
 static void
 test_bottleneck_simulation(void)
 {
@@ -3572,6 +4766,84 @@ test_single_tree_mutgen_keep_sites(void)
     gsl_rng_free(rng);
 }
 
+static void
+test_single_tree_mutgen_keep_sites_merge(void)
+{
+    int ret = 0;
+    gsl_rng *rng = gsl_rng_alloc(gsl_rng_default);
+    tsk_table_collection_t tables;
+    tsk_table_collection_t copy;
+    mutgen_t mutgen;
+    tsk_size_t j, found;
+    tsk_id_t site, parent;
+
+    ret = tsk_table_collection_init(&tables, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    insert_single_tree(&tables);
+    /* Add a site with a mutation and a child mutation */
+    ret = tsk_site_table_add_row(&tables.sites, 0.5, "A", 1, "meta", 4);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_mutation_table_add_row(&tables.mutations, 1, 5, -1, "T", 1, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_mutation_table_add_row(&tables.mutations, 1, 2, 1, "GG", 2, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    ret = tsk_table_collection_copy(&tables, &copy, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+
+    gsl_rng_set(rng, 5);
+    ret = mutgen_alloc(&mutgen, 20.0, rng, 0, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = mutgen_generate(&mutgen, &tables, MSP_KEEP_SITES);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_TRUE(tables.sites.num_rows > copy.sites.num_rows);
+    CU_ASSERT_EQUAL(tables.sites.num_rows - copy.sites.num_rows,
+            tables.mutations.num_rows - copy.mutations.num_rows);
+    for (j = 1; j < tables.sites.num_rows; j++) {
+        CU_ASSERT_TRUE(tables.sites.position[j - 1] < tables.sites.position[j]);
+    }
+    found = 0;
+    for (j = 0; j < tables.mutations.num_rows; j++) {
+        site = tables.mutations.site[j];
+        parent = tables.mutations.parent[j];
+        if (tables.sites.position[site] == 0.5) {
+            CU_ASSERT_EQUAL(tables.sites.metadata_offset[site + 1]
+                    - tables.sites.metadata_offset[site], 4);
+            if (found == 0) {
+                CU_ASSERT_EQUAL(parent, TSK_NULL);
+                CU_ASSERT_EQUAL(tables.mutations.node[j], 5);
+            } else {
+                CU_ASSERT_EQUAL(parent, (tsk_id_t) j - 1);
+                CU_ASSERT_EQUAL(tables.mutations.node[j], 2);
+                CU_ASSERT_EQUAL(tables.mutations.derived_state_offset[j + 1]
+                        - tables.mutations.derived_state_offset[j], 2);
+            }
+            found++;
+        } else {
+            CU_ASSERT_EQUAL(parent, TSK_NULL);
+        }
+    }
+    CU_ASSERT_EQUAL(found, 2);
+
+    /* Mutations that are not grouped by site are an error, and the tables
+     * are left unchanged. */
+    tsk_table_collection_free(&tables);
+    ret = tsk_table_collection_copy(&copy, &tables, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = tsk_mutation_table_add_row(&tables.mutations, 0, 1, -1, "C", 1, NULL, 0);
+    CU_ASSERT_FATAL(ret >= 0);
+    tsk_table_collection_free(&copy);
+    ret = tsk_table_collection_copy(&tables, &copy, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = mutgen_generate(&mutgen, &tables, MSP_KEEP_SITES);
+    CU_ASSERT_EQUAL_FATAL(ret, MSP_ERR_UNSORTED_MUTATIONS);
+    CU_ASSERT_TRUE(tsk_table_collection_equals(&tables, &copy));
+
+    mutgen_free(&mutgen);
+    tsk_table_collection_free(&tables);
+    tsk_table_collection_free(&copy);
+    gsl_rng_free(rng);
+}
+
 static void
 test_single_tree_mutgen_interval(void)
 {
@@ -3634,6 +4906,60 @@ test_single_tree_mutgen_interval(void)
     gsl_rng_free(rng);
 }
 
+static void
+test_single_tree_mutgen_reuse_exposure(void)
+{
+    int ret = 0;
+    mutgen_t mutgen;
+    gsl_rng *rng = gsl_rng_alloc(gsl_rng_default);
+    tsk_table_collection_t tables1, tables2;
+
+    CU_ASSERT_FATAL(rng != NULL);
+    ret = tsk_table_collection_init(&tables1, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = tsk_table_collection_init(&tables2, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    insert_single_tree(&tables1);
+    insert_single_tree(&tables2);
+
+    /* Reusing the cached exposures must give identical results to
+     * recomputing them on every call. */
+    gsl_rng_set(rng, 3);
+    ret = mutgen_alloc(&mutgen, 10.0, rng, 0, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = mutgen_generate(&mutgen, &tables1, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    ret = mutgen_generate(&mutgen, &tables1, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_TRUE(tables1.mutations.num_rows > 0);
+    mutgen_free(&mutgen);
+
+    gsl_rng_set(rng, 3);
+    ret = mutgen_alloc(&mutgen, 10.0, rng, 0, 0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    /* The first call must compute the exposures even if we ask to reuse */
+    ret = mutgen_generate(&mutgen, &tables2, MSP_REUSE_EXPOSURE);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_EQUAL(mutgen.num_exposure_edges, tables2.edges.num_rows);
+    ret = mutgen_generate(&mutgen, &tables2, MSP_REUSE_EXPOSURE);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_TRUE(tsk_table_collection_equals(&tables1, &tables2));
+
+    /* Changing the time interval invalidates the cache */
+    ret = mutgen_set_time_interval(&mutgen, 0.0, 0.0);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_EQUAL(mutgen.num_exposure_edges, 0);
+    ret = mutgen_generate(&mutgen, &tables2, MSP_REUSE_EXPOSURE);
+    CU_ASSERT_EQUAL_FATAL(ret, 0);
+    CU_ASSERT_EQUAL(tables2.sites.num_rows, 0);
+    CU_ASSERT_EQUAL(tables2.mutations.num_rows, 0);
+    mutgen_free(&mutgen);
+
+    tsk_table_collection_free(&tables1);
+    tsk_table_collection_free(&tables2);
+    gsl_rng_free(rng);
+}
+
 static void
 verify_simple_genic_selection_trajectory(
        double start_frequency, double end_frequency, double alpha,
@@ -3991,9 +5317,13 @@ main(int argc, char **argv)
         {"test_single_locus_historical_sample_end_time",
             test_single_locus_historical_sample_end_time},
         {"test_simulator_getters_setters", test_simulator_getters_setters},
+        {"test_sparse_migration_matrix", test_sparse_migration_matrix},
+        {"test_migration_matrix_change", test_migration_matrix_change},
         {"test_demographic_events", test_demographic_events},
         {"test_demographic_events_start_time", test_demographic_events_start_time},
         {"test_census_event", test_census_event},
+        {"test_population_size_history", test_population_size_history},
+        {"test_population_size_functions", test_population_size_functions},
         {"test_dtwf_unsupported_bottleneck", test_dtwf_unsupported_bottleneck},
         {"test_time_travel_error", test_time_travel_error},
         {"test_single_locus_simulation", test_single_locus_simulation},
@@ -4004,6 +5334,10 @@ main(int argc, char **argv)
         {"test_dtwf_events_between_generations", test_dtwf_events_between_generations},
         {"test_dtwf_single_locus_simulation", test_dtwf_single_locus_simulation},
         {"test_likelihood_three_leaves", test_likelihood_three_leaves},
+        {"test_summary_stats", test_summary_stats},
+        {"test_format_ms_sites", test_format_ms_sites},
+        {"test_rng_xoshiro256starstar", test_rng_xoshiro256starstar},
+        {"test_simulation_xoshiro256starstar", test_simulation_xoshiro256starstar},
         {"test_likelihood_two_mrcas", test_likelihood_two_mrcas},
         {"test_likelihood_material_overhang", test_likelihood_material_overhang},
         {"test_likelihood_material_gap", test_likelihood_material_gap},
@@ -4012,6 +5346,9 @@ main(int argc, char **argv)
         {"test_multi_locus_simulation", test_multi_locus_simulation},
         {"test_dtwf_multi_locus_simulation", test_dtwf_multi_locus_simulation},
         {"test_simulation_replicates", test_simulation_replicates},
+        {"test_simulation_reset_reproducible", test_simulation_reset_reproducible},
+        {"test_simulation_update_parameters", test_simulation_update_parameters},
+        {"test_simulation_used_memory", test_simulation_used_memory},
         {"test_bottleneck_simulation", test_bottleneck_simulation},
         {"test_compute_falling_factorial", test_compute_falling_factorial},
         {"test_compute_dirac_coalescence_rate", test_compute_dirac_coalescence_rate},
@@ -4039,7 +5376,11 @@ main(int argc, char **argv)
 
         {"test_single_tree_mutgen", test_single_tree_mutgen},
         {"test_single_tree_mutgen_keep_sites", test_single_tree_mutgen_keep_sites},
+        {"test_single_tree_mutgen_keep_sites_merge",
+            test_single_tree_mutgen_keep_sites_merge},
         {"test_single_tree_mutgen_interval", test_single_tree_mutgen_interval},
+        {"test_single_tree_mutgen_reuse_exposure",
+            test_single_tree_mutgen_reuse_exposure},
 
         {"test_genic_selection_trajectory", test_genic_selection_trajectory},
         {"test_sweep_genic_selection_bad_parameters",
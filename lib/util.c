@@ -156,6 +156,15 @@ msp_strerror_internal(int err)
             ret = "Bottleneck events are not supported in DTWF. They can "
                 "be implemented as population size changes.";
             break;
+        case MSP_ERR_DUPLICATE_SITE_POSITION:
+            ret = "Duplicate site positions.";
+            break;
+        case MSP_ERR_UNSORTED_MUTATIONS:
+            ret = "Mutations must be sorted by site and refer to valid sites.";
+            break;
+        case MSP_ERR_UNSORTED_POPULATION_SIZE_HISTORY:
+            ret = "Population size history times must be strictly increasing.";
+            break;
 
         default:
             ret = "Error occurred generating error string. Please file a bug "
@@ -21,33 +21,89 @@ Msprime is a reimplementation of Hudson's classical ms simulator for
 modern datasets.
 """
 # flake8: NOQA
-import tskit
-
-# Compatibility layer for old code using the tskit API exported by msprime.
-NULL_NODE = tskit.NULL
-NULL_POPULATION = tskit.NULL
-NULL_INDIVIDUAL = tskit.NULL
-NULL_MUTATION = tskit.NULL
-
-from tskit import (
-    Individual, Node, Edge, Site, Mutation, Migration, Population,
-    Variant, Edgeset, Provenance)
-from tskit import Tree as SparseTree  # Rename SparseTree to Tree in tskit
-from tskit import TreeSequence
-from tskit import (
-    IndividualTable, NodeTable, EdgeTable, SiteTable, MutationTable,
-    MigrationTable, PopulationTable, ProvenanceTable, TableCollection)
-from tskit import LdCalculator
-from tskit import load, load_text
-from tskit import (
-    parse_nodes, parse_edges, parse_individuals, parse_sites, parse_mutations)
-from tskit import pack_strings, pack_bytes, unpack_bytes, unpack_strings
-from tskit import validate_provenance
-
-from tskit import NODE_IS_SAMPLE, FORWARD, REVERSE
+import sys
+
+# Names re-exported from tskit, mapped to their names in tskit. Importing
+# tskit is by far the most expensive part of importing msprime, and many
+# uses (such as running a quick mspms simulation) never need it, so these
+# are resolved on first access where the module __getattr__ hook of
+# PEP 562 is available.
+_tskit_names = {
+    "NULL_NODE": "NULL",
+    "NULL_POPULATION": "NULL",
+    "NULL_INDIVIDUAL": "NULL",
+    "NULL_MUTATION": "NULL",
+    "Individual": "Individual",
+    "Node": "Node",
+    "Edge": "Edge",
+    "Site": "Site",
+    "Mutation": "Mutation",
+    "Migration": "Migration",
+    "Population": "Population",
+    "Variant": "Variant",
+    "Edgeset": "Edgeset",
+    "Provenance": "Provenance",
+    # Rename SparseTree to Tree in tskit
+    "SparseTree": "Tree",
+    "TreeSequence": "TreeSequence",
+    "IndividualTable": "IndividualTable",
+    "NodeTable": "NodeTable",
+    "EdgeTable": "EdgeTable",
+    "SiteTable": "SiteTable",
+    "MutationTable": "MutationTable",
+    "MigrationTable": "MigrationTable",
+    "PopulationTable": "PopulationTable",
+    "ProvenanceTable": "ProvenanceTable",
+    "TableCollection": "TableCollection",
+    "LdCalculator": "LdCalculator",
+    "load": "load",
+    "load_text": "load_text",
+    "parse_nodes": "parse_nodes",
+    "parse_edges": "parse_edges",
+    "parse_individuals": "parse_individuals",
+    "parse_sites": "parse_sites",
+    "parse_mutations": "parse_mutations",
+    "pack_strings": "pack_strings",
+    "pack_bytes": "pack_bytes",
+    "unpack_bytes": "unpack_bytes",
+    "unpack_strings": "unpack_strings",
+    "validate_provenance": "validate_provenance",
+    "NODE_IS_SAMPLE": "NODE_IS_SAMPLE",
+    "FORWARD": "FORWARD",
+    "REVERSE": "REVERSE",
+}
+
+
+def _import_tskit_names():
+    import tskit
+    for name, tskit_name in _tskit_names.items():
+        globals()[name] = getattr(tskit, tskit_name)
+
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name in _tskit_names:
+            _import_tskit_names()
+            return globals()[name]
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    def __dir__():
+        return sorted(set(globals()) | set(_tskit_names))
+else:
+    _import_tskit_names()
 
 from msprime.provenance import __version__
 from msprime.simulations import *
 from msprime.exceptions import *
 from msprime.mutations import *
 from msprime.likelihood import *
+from msprime.archive import *
+from msprime.batch import *
+from msprime.structure import *
+if sys.version_info >= (3, 5):
+    from msprime.asynchronous import *
+
+# The tskit names are listed so that "from msprime import *" exports them
+# through __getattr__, in the same way as on versions without it.
+__all__ = sorted(
+    set(name for name in globals() if not name.startswith("_")) | set(_tskit_names))
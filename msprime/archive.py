@@ -0,0 +1,392 @@
+#
+# Copyright (C) 2019 University of Oxford
+#
+# This file is part of msprime.
+#
+# msprime is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# msprime is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with msprime.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Module responsible for reading and writing replicate archives, which
+store the results of many simulation replicates in a single binary file.
+
+An archive consists of a fixed size header, followed by a record for
+each replicate, followed by a JSON index. The header holds the kind of the
+archive and the offset and size of the index, and the index records the
+offset, dtype and shape of each array in each replicate. Each record holds
+the arrays of a replicate followed by its entry in the index, and starts
+with the size of the record and of the entry, so that the replicates in an
+archive that was not closed can be recovered by scanning the records.
+Records and arrays are aligned to 8 bytes, so that the arrays can be read
+directly from a memory map of the file.
+"""
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from msprime import simulations
+
+_MAGIC = b"\x89MSPARC\n"
+_HEADER = struct.Struct("<8sQQB7x")
+_RECORD_HEADER = struct.Struct("<QQ")
+_FORMAT_VERSION = 1
+_ALIGNMENT = 8
+_KINDS = ["haplotypes", "tables"]
+
+
+def _decode_index(data):
+    index = json.loads(data.decode())
+    if index["format_version"] != _FORMAT_VERSION:
+        raise ValueError("Unsupported replicate archive version {}".format(
+            index["format_version"]))
+    return index
+
+
+def _scan_records(f):
+    """
+    Returns the entries of the complete records in the specified archive
+    file, starting after the header, and the offset of the end of the last
+    complete record.
+    """
+    replicates = []
+    end = _HEADER.size
+    while True:
+        offset = end + (-end % _ALIGNMENT)
+        f.seek(offset)
+        data = f.read(_RECORD_HEADER.size)
+        if len(data) < _RECORD_HEADER.size:
+            break
+        record_size, entry_size = _RECORD_HEADER.unpack(data)
+        if record_size == 0:
+            break
+        f.seek(offset + record_size - entry_size)
+        data = f.read(entry_size)
+        if len(data) < entry_size:
+            break
+        replicates.append(json.loads(data.decode()))
+        end = offset + record_size
+    return replicates, end
+
+
+def _read_index(f):
+    """
+    Reads the archive in the specified binary file and returns its kind, the
+    list of its replicates and the offset of the end of the last replicate.
+    If the archive was not closed, the replicates are recovered from the
+    records.
+    """
+    f.seek(0)
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise ValueError("File is not a replicate archive")
+    magic, index_offset, index_size, kind = _HEADER.unpack(header)
+    if magic != _MAGIC or kind >= len(_KINDS):
+        raise ValueError("File is not a replicate archive")
+    if index_offset == 0:
+        replicates, end = _scan_records(f)
+        return _KINDS[kind], replicates, end
+    f.seek(index_offset)
+    data = f.read(index_size)
+    if len(data) < index_size:
+        raise ValueError("Replicate archive is truncated")
+    index = _decode_index(data)
+    return index["kind"], index["replicates"], index_offset
+
+
+class ReplicateArchiveWriter(object):
+    """
+    Writes simulation replicates to a replicate archive, which can be read
+    using :class:`.ReplicateArchive`. Replicates are written with
+    :meth:`.add` in the order they are added, and the writer can be used as
+    a context manager, which closes the writer on exit. Closing the writer
+    writes an index that makes the archive faster to open, but the
+    replicates that have been added can still be read and appended to if
+    the writer is not closed, for example because the process was killed.
+
+    An archive of kind ``"haplotypes"`` stores the site positions and the
+    haplotypes of the samples packed into bits, and requires that all
+    sites are biallelic. An archive of kind ``"tables"`` stores the table
+    columns of each tree sequence, from which the tree sequence can be
+    rebuilt.
+
+    If ``append`` is True and the file exists, the replicates are added to
+    the end of the existing archive, which must be of the same kind. This
+    allows a series of simulations that was interrupted to be resumed.
+
+    :param str path: The path of the file to write.
+    :param str kind: The kind of archive to write; either ``"haplotypes"``
+        (the default) or ``"tables"``.
+    :param bool append: If True, append to the archive in the specified
+        file if it exists.
+    """
+    def __init__(self, path, kind="haplotypes", append=False):
+        if kind not in _KINDS:
+            raise ValueError("kind must be one of {}".format(_KINDS))
+        self.kind = kind
+        self._replicates = []
+        self._offset = _HEADER.size
+        self._file = None
+        if append and os.path.exists(path):
+            f = open(path, "r+b")
+            try:
+                archive_kind, replicates, end = _read_index(f)
+                if archive_kind != kind:
+                    raise ValueError(
+                        "Cannot append to an archive of kind '{}'".format(
+                            archive_kind))
+                # The index and any incomplete record are overwritten by the
+                # new replicates.
+                f.truncate(end)
+            except Exception:
+                f.close()
+                raise
+            self._file = f
+            self._replicates = replicates
+            self._offset = end
+        else:
+            self._file = open(path, "wb")
+        # The header is rewritten with the location of the index on close.
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(_MAGIC, 0, 0, _KINDS.index(kind)))
+        self._file.seek(self._offset)
+        self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def num_replicates(self):
+        """
+        The number of replicates written to the archive so far.
+        """
+        return len(self._replicates)
+
+    def _align(self):
+        padding = -self._offset % _ALIGNMENT
+        self._file.write(bytes(padding))
+        self._offset += padding
+
+    def _write_array(self, array):
+        array = np.ascontiguousarray(array)
+        self._align()
+        entry = [self._offset, array.dtype.str, list(array.shape)]
+        self._file.write(array.tobytes())
+        self._offset += array.nbytes
+        return entry
+
+    def add(self, tree_sequence):
+        """
+        Writes the specified replicate to the archive.
+
+        :param tree_sequence: The replicate to write.
+        :type tree_sequence: :class:`tskit.TreeSequence` or
+            :class:`.SimulationResult`
+        """
+        if self._file is None:
+            raise ValueError("Cannot add replicates to a closed archive")
+        if isinstance(tree_sequence, simulations.SimulationResult):
+            tree_sequence = tree_sequence.tree_sequence
+        # Each access to the tables of a tree sequence makes a copy.
+        tables = tree_sequence.tables
+        if self.kind == "haplotypes":
+            genotypes = tree_sequence.genotype_matrix()
+            if np.any(genotypes > 1):
+                raise ValueError(
+                    "Only biallelic sites can be written to a haplotypes archive")
+            arrays = {
+                "position": tables.sites.position,
+                # Pack the sites of each sample into bits, with sample j
+                # in row j.
+                "haplotypes": np.packbits(genotypes.T, axis=1),
+            }
+        else:
+            arrays = {}
+            for name, value in tables.asdict().items():
+                if isinstance(value, dict):
+                    for column, array in value.items():
+                        arrays[name + "/" + column] = array
+        self._align()
+        start = self._offset
+        self._file.write(bytes(_RECORD_HEADER.size))
+        self._offset += _RECORD_HEADER.size
+        replicate = {
+            "sequence_length": tree_sequence.sequence_length,
+            "num_samples": tree_sequence.num_samples,
+            "arrays": {
+                name: self._write_array(array) for name, array in arrays.items()},
+        }
+        entry = json.dumps(replicate).encode()
+        self._file.write(entry)
+        self._offset += len(entry)
+        # The record header is written last, so that a record which is only
+        # partly written when the process is killed is ignored.
+        self._file.seek(start)
+        self._file.write(_RECORD_HEADER.pack(self._offset - start, len(entry)))
+        self._file.seek(self._offset)
+        self._file.flush()
+        self._replicates.append(replicate)
+
+    def close(self):
+        """
+        Writes the index and closes the archive. Calling this method more
+        than once has no effect.
+        """
+        if self._file is None:
+            return
+        index = json.dumps({
+            "format_version": _FORMAT_VERSION,
+            "kind": self.kind,
+            "replicates": self._replicates,
+        }).encode()
+        self._file.write(index)
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(
+            _MAGIC, self._offset, len(index), _KINDS.index(self.kind)))
+        self._file.close()
+        self._file = None
+
+
+class ReplicateArchive(object):
+    """
+    A replicate archive written by :class:`.ReplicateArchiveWriter`,
+    :program:`mspms --archive` or :program:`msp simulate --archive`. The
+    file is memory mapped, and the arrays returned by the methods of this
+    class are read-only views of the file, so that only the parts of the
+    archive that are used are read from disk. Any replicate can be
+    accessed directly by its index, without reading the replicates before
+    it. The archive can be used as a context manager, which closes it on
+    exit. The replicates in an archive whose writer was not closed are
+    recovered from the file, and can be read in the same way.
+
+    :param str path: The path of the archive file.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.kind, self._replicates, _ = _read_index(f)
+            # The map remains valid after the file is closed.
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._replicates)
+
+    @property
+    def num_replicates(self):
+        """
+        The number of replicates in the archive.
+        """
+        return len(self._replicates)
+
+    def close(self):
+        """
+        Closes the archive. The memory map is released when all of the arrays
+        read from the archive have been deleted.
+        """
+        self._mmap = None
+
+    def _replicate(self, index):
+        if self._mmap is None:
+            raise ValueError("Cannot read from a closed archive")
+        if index < -len(self._replicates) or index >= len(self._replicates):
+            raise IndexError("Replicate index out of range")
+        return self._replicates[index]
+
+    def _array(self, replicate, name):
+        offset, dtype, shape = replicate["arrays"][name]
+        array = np.frombuffer(
+            self._mmap, dtype=dtype, count=int(np.prod(shape)), offset=offset)
+        return array.reshape(shape)
+
+    def _check_kind(self, kind):
+        if self.kind != kind:
+            raise ValueError("Operation requires an archive of kind '{}'".format(kind))
+
+    def sequence_length(self, index):
+        """
+        Returns the sequence length of the specified replicate.
+        """
+        return self._replicate(index)["sequence_length"]
+
+    def num_samples(self, index):
+        """
+        Returns the number of samples in the specified replicate.
+        """
+        return self._replicate(index)["num_samples"]
+
+    def positions(self, index):
+        """
+        Returns a numpy array of the positions of the sites in the
+        specified replicate.
+        """
+        replicate = self._replicate(index)
+        if self.kind == "haplotypes":
+            return self._array(replicate, "position")
+        return self._array(replicate, "sites/position")
+
+    def packed_haplotypes(self, index):
+        """
+        Returns the haplotypes of the specified replicate as stored in the
+        archive, as a numpy array of unsigned bytes with one row per sample,
+        in which the sites of each sample are packed into bits as by
+        :func:`numpy.packbits`. Only supported for archives of kind
+        ``"haplotypes"``.
+        """
+        self._check_kind("haplotypes")
+        return self._array(self._replicate(index), "haplotypes")
+
+    def haplotypes(self, index):
+        """
+        Returns the haplotypes of the specified replicate as a numpy array
+        of unsigned bytes with one row per sample and one column per site,
+        in which the ancestral and derived states are 0 and 1. Only
+        supported for archives of kind ``"haplotypes"``.
+        """
+        num_sites = len(self.positions(index))
+        packed = self.packed_haplotypes(index)
+        return np.unpackbits(packed, axis=1)[:, :num_sites]
+
+    def tables_dict(self, index):
+        """
+        Returns the tables of the specified replicate as a dictionary of
+        numpy arrays, which can be passed to
+        :meth:`tskit.TableCollection.fromdict`. Only supported for archives
+        of kind ``"tables"``.
+        """
+        self._check_kind("tables")
+        replicate = self._replicate(index)
+        tables_dict = {"sequence_length": replicate["sequence_length"]}
+        for name in replicate["arrays"]:
+            table, column = name.split("/")
+            tables_dict.setdefault(table, {})[column] = self._array(
+                replicate, name)
+        return tables_dict
+
+    def tree_sequence(self, index):
+        """
+        Returns the specified replicate as a :class:`tskit.TreeSequence`.
+        Only supported for archives of kind ``"tables"``.
+        """
+        import tskit
+        tables = tskit.TableCollection.fromdict(self.tables_dict(index))
+        return tables.tree_sequence()
@@ -0,0 +1,161 @@
+#
+# Copyright (C) 2019 University of Oxford
+#
+# This file is part of msprime.
+#
+# msprime is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# msprime is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with msprime.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Module providing coroutine versions of the simulation functions for use
+with asyncio. This module requires Python 3.5 or later.
+"""
+import json
+
+from msprime import simulations
+
+
+async def _run_replicate(sim, mutation_generator, provenance_record, options):
+    """
+    Runs the simulation to completion in chunks on the executor, and returns
+    the result. If the calling task is cancelled, we stop at the end of the
+    chunk that is currently running.
+    """
+    # Importing asyncio is relatively expensive, so we only do it when needed.
+    import asyncio
+    loop = asyncio.get_event_loop()
+    executor = options["executor"]
+    chunks = sim.run_chunks(options["end_time"], options["chunk_size"])
+    while await loop.run_in_executor(executor, _advance, chunks):
+        pass
+    if options["lazy"]:
+        get_result = sim.get_result
+    else:
+        get_result = sim.get_tree_sequence
+    return await loop.run_in_executor(
+        executor, get_result, mutation_generator, provenance_record)
+
+
+def _advance(iterator):
+    """
+    Advances the specified iterator, returning False if it is exhausted.
+    """
+    for _ in iterator:
+        return True
+    return False
+
+
+def _get_options(end_time, lazy, executor, chunk_size):
+    chunk_size = int(chunk_size)
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be >= 1")
+    return {
+        "end_time": end_time,
+        "lazy": bool(lazy),
+        "executor": executor,
+        "chunk_size": chunk_size,
+    }
+
+
+async def simulate_async(
+        sample_size=None, end_time=None, lazy=False, executor=None,
+        chunk_size=10**4, **kwargs):
+    """
+    Coroutine version of :func:`.simulate`, which does not block the event
+    loop while the simulation is running. The simulation is run in chunks of
+    at most ``chunk_size`` events, each of which is run on the specified
+    :class:`concurrent.futures.Executor` (or the event loop's default
+    executor if None). Because the low-level simulation code does not hold
+    the global interpreter lock, many simulations can run concurrently on a
+    thread pool executor. If the task awaiting this coroutine is cancelled,
+    the simulation stops at the end of the current chunk.
+
+    All other arguments are interpreted as in :func:`.simulate`, except that
+    ``num_replicates`` is not supported; see
+    :func:`.simulate_replicates_async` for this.
+
+    :param concurrent.futures.Executor executor: The executor on which to
+        run the simulation.
+    :param int chunk_size: The maximum number of events to simulate in each
+        chunk.
+    :return: The :class:`tskit.TreeSequence` object representing the results
+        of the simulation, or a :class:`.SimulationResult` if ``lazy`` is True.
+    """
+    options = _get_options(end_time, lazy, executor, chunk_size)
+    sim, mutation_generator, provenance_dict = simulations._simulation_setup(
+        sample_size=sample_size, **kwargs)
+    return await _run_replicate(
+        sim, mutation_generator, json.dumps(provenance_dict), options)
+
+
+class SimulationReplicates(object):
+    """
+    An asynchronous iterator over independent simulation replicates, as
+    returned by :func:`.simulate_replicates_async`.
+    """
+    def __init__(self, num_replicates, sim, mutation_generator, provenance_dict,
+                 options):
+        self.num_replicates = num_replicates
+        self.index = 0
+        self._sim = sim
+        self._mutation_generator = mutation_generator
+        self._provenance_record = json.dumps(provenance_dict)
+        self._options = options
+        self._running = False
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._running:
+            raise RuntimeError("A replicate is already being simulated")
+        if self._closed or self.index == self.num_replicates:
+            raise StopAsyncIteration
+        self._running = True
+        try:
+            if self.index > 0:
+                self._sim.reset()
+            result = await _run_replicate(
+                self._sim, self._mutation_generator, self._provenance_record,
+                self._options)
+        except BaseException:
+            # If we're cancelled, a chunk of the simulation may still be running
+            # on the executor, so we cannot safely use the simulator again.
+            self._closed = True
+            raise
+        finally:
+            self._running = False
+        self.index += 1
+        return result
+
+
+def simulate_replicates_async(
+        num_replicates, sample_size=None, end_time=None, lazy=False, executor=None,
+        chunk_size=10**4, **kwargs):
+    """
+    Returns an asynchronous iterator over ``num_replicates`` independent
+    replicates of the specified simulation, for use in an ``async for``
+    loop. Each replicate is simulated as described in
+    :func:`.simulate_async` when the iterator is advanced, and all other
+    arguments are interpreted as in :func:`.simulate`.
+
+    :param int num_replicates: The number of replicates to simulate.
+    :return: An asynchronous iterator over the simulated replicates.
+    :rtype: :class:`.SimulationReplicates`
+    """
+    options = _get_options(end_time, lazy, executor, chunk_size)
+    sim, mutation_generator, provenance_dict = simulations._simulation_setup(
+        sample_size=sample_size, **kwargs)
+    return SimulationReplicates(
+        num_replicates, sim, mutation_generator, provenance_dict, options)
@@ -0,0 +1,223 @@
+#
+# Copyright (C) 2019 University of Oxford
+#
+# This file is part of msprime.
+#
+# msprime is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# msprime is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with msprime.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Module responsible for running batches of simulations with different
+parameters.
+"""
+import csv
+import json
+import os
+
+from msprime import archive
+from msprime import simulations
+
+# The parameters that can be changed without creating a new simulator.
+_UPDATABLE_PARAMETERS = ["Ne", "recombination_rate"]
+
+
+def _parse_csv_value(value):
+    for parse in [int, float]:
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+    if value.lower() in ["true", "false"]:
+        return value.lower() == "true"
+    return value
+
+
+def read_batch_jobs(path):
+    """
+    Reads the parameters for a batch of simulations from the specified file,
+    and returns them as a list of dictionaries suitable for
+    :func:`.simulate_batch`. If the file name ends with ``.csv`` the file is
+    read as a CSV file, in which the first row gives the names of the
+    parameters and each subsequent row gives the parameters for a job; empty
+    values are omitted, and other values are converted to numbers or
+    booleans where possible (except for the ``id`` column). Otherwise, the
+    file is read as JSON lines, where each non-empty line is a JSON object
+    giving the parameters of a job.
+
+    :param str path: The path of the file to read.
+    :return: The list of job parameters.
+    :rtype: list
+    """
+    with open(path) as f:
+        if path.endswith(".csv"):
+            return [
+                {
+                    key: value if key == "id" else _parse_csv_value(value)
+                    for key, value in row.items() if value != ""}
+                for row in csv.DictReader(f)]
+        return [json.loads(line) for line in f if len(line.strip()) > 0]
+
+
+class _BatchWorker(object):
+    """
+    Runs the jobs in a batch, reusing the simulator from the previous job
+    if the parameters differ only in their updatable parameters, random
+    seed, mutation rate and end time.
+    """
+    def __init__(self):
+        self._simulator = None
+        self._key = None
+
+    def run(self, parameters):
+        parameters = dict(parameters)
+        parameters.pop("id", None)
+        random_seed = parameters.pop("random_seed", None)
+        if random_seed is None:
+            random_seed = simulations._get_random_seed()
+        random_seed = int(random_seed)
+        end_time = parameters.pop("end_time", None)
+        mutation_rate = parameters.pop("mutation_rate", None)
+        try:
+            key = json.dumps({
+                name: value for name, value in parameters.items()
+                if name not in _UPDATABLE_PARAMETERS}, sort_keys=True)
+        except TypeError:
+            # Jobs with objects such as population configurations or numpy
+            # arrays among their parameters always get a new simulator.
+            key = None
+        if key is not None and key == self._key:
+            self._simulator.update(
+                Ne=parameters.get("Ne", 1),
+                recombination_rate=parameters.get("recombination_rate", 0))
+            self._simulator.random_generator.set_seed(random_seed)
+        else:
+            self._simulator = None
+            self._key = None
+            self._simulator, _, _ = simulations._simulation_setup(
+                random_seed=random_seed, **parameters)
+            self._key = key
+        mutation_generator = None
+        if mutation_rate is not None:
+            mutation_generator = simulations.MutationGenerator(
+                self._simulator.random_generator, mutation_rate)
+        self._simulator.run(end_time)
+        provenance_record = json.dumps(
+            simulations._get_simulate_provenance_dict(random_seed))
+        return self._simulator.get_tree_sequence(
+            mutation_generator, provenance_record)
+
+
+def _run_jobs(jobs, indexes, write, num_threads):
+    """
+    Runs the jobs with the specified indexes, and calls write with the index
+    and resulting tree sequence of each job in order.
+    """
+    if num_threads is None:
+        worker = _BatchWorker()
+        for j in indexes:
+            write(j, worker.run(jobs[j]))
+        return
+    # These modules are only needed here, so avoid importing them on
+    # startup.
+    import collections
+    import concurrent.futures
+    import threading
+
+    local = threading.local()
+
+    def run(j):
+        if not hasattr(local, "worker"):
+            local.worker = _BatchWorker()
+        return local.worker.run(jobs[j])
+
+    # Limit the number of results held in memory at once, while keeping
+    # all of the threads busy.
+    max_pending = 2 * num_threads
+    with concurrent.futures.ThreadPoolExecutor(num_threads) as executor:
+        pending = collections.deque()
+        for j in indexes:
+            pending.append((j, executor.submit(run, j)))
+            if len(pending) == max_pending:
+                j, future = pending.popleft()
+                write(j, future.result())
+        while len(pending) > 0:
+            j, future = pending.popleft()
+            write(j, future.result())
+
+
+def simulate_batch(
+        jobs, output_dir=None, archive_path=None, archive_kind="tables",
+        num_threads=None):
+    """
+    Runs a batch of simulations, each of which is specified by a dictionary
+    of keyword arguments to :func:`.simulate` (see :func:`.read_batch_jobs`
+    for reading these from a file). Only a single replicate is simulated for
+    each job, and so ``num_replicates`` cannot be specified. Each worker
+    reuses its simulator for the next job if only the ``Ne``,
+    ``recombination_rate``, ``mutation_rate``, ``random_seed`` and
+    ``end_time`` parameters differ from the previous job, which avoids the
+    cost of allocating a new simulator for each job when running many small
+    simulations. Jobs without a ``random_seed`` are given a random seed.
+
+    The results are written either to the tree sequence file
+    ``<id>.trees`` in ``output_dir`` for each job, where ``<id>`` is the
+    value of the job's ``id`` parameter (or the index of the job if not
+    specified), or to a :class:`.ReplicateArchive` of the specified kind at
+    ``archive_path``, in which the results are stored in the order of the
+    jobs. If a batch is interrupted it can be resumed by calling this
+    function again with the same arguments: jobs for which a tree sequence
+    file exists, or which are already stored in the archive, are skipped.
+
+    :param list jobs: The list of dictionaries of parameters.
+    :param str output_dir: The directory in which to write the tree
+        sequence file for each job.
+    :param str archive_path: The path of the archive to write the results
+        to.
+    :param str archive_kind: The kind of archive to write; see
+        :class:`.ReplicateArchiveWriter`.
+    :param int num_threads: The number of threads on which to run the jobs
+        concurrently. If None (the default), the jobs are run in the calling
+        thread.
+    :return: The number of jobs that were run.
+    :rtype: int
+    """
+    if (output_dir is None) == (archive_path is None):
+        raise ValueError("Exactly one of output_dir and archive_path must be specified")
+    if num_threads is not None and num_threads < 1:
+        raise ValueError("num_threads must be >= 1")
+    jobs = list(jobs)
+    for job in jobs:
+        if "num_replicates" in job:
+            raise ValueError("num_replicates cannot be specified for a batch job")
+    if output_dir is not None:
+        ids = [str(job.get("id", j)) for j, job in enumerate(jobs)]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Job ids must be unique")
+        os.makedirs(output_dir, exist_ok=True)
+        paths = [os.path.join(output_dir, job_id + ".trees") for job_id in ids]
+        indexes = [j for j, path in enumerate(paths) if not os.path.exists(path)]
+
+        def write(j, tree_sequence):
+            # Write to a temporary file first, so that an interrupted batch
+            # does not leave an incomplete file that would be skipped.
+            temp_path = paths[j] + ".tmp"
+            tree_sequence.dump(temp_path)
+            os.replace(temp_path, paths[j])
+
+        _run_jobs(jobs, indexes, write, num_threads)
+    else:
+        with archive.ReplicateArchiveWriter(
+                archive_path, archive_kind, append=True) as writer:
+            indexes = list(range(writer.num_replicates, len(jobs)))
+            _run_jobs(jobs, indexes, lambda j, ts: writer.add(ts), num_threads)
+    return len(indexes)
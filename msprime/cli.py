@@ -21,6 +21,7 @@ Command line interfaces to the msprime library.
 """
 import argparse
 import hashlib
+import io
 import json
 import os
 import random
@@ -28,7 +29,6 @@ import signal
 import sys
 
 import msprime
-import tskit
 
 
 def set_sigpipe_handler():
@@ -109,6 +109,20 @@ def get_single_seed(seeds):
     return int(m.hexdigest(), 16) % (2**32)
 
 
+def get_replicate_seed(seeds, replicate):
+    """
+    Returns the seed for the specified replicate when each replicate is
+    simulated with its own random generator, derived from the command line
+    seeds and the index of the replicate.
+    """
+    assert len(seeds) == 3
+    m = hashlib.md5()
+    for s in list(seeds) + [replicate]:
+        m.update("{}:".format(s).encode())
+    # Seeds must be between 1 and 2^32 - 1.
+    return int(m.hexdigest(), 16) % (2**32 - 1) + 1
+
+
 class SimulationRunner(object):
     """
     Class to run msprime simulation and output the results.
@@ -118,7 +132,8 @@ class SimulationRunner(object):
             num_replicates=1, migration_matrix=None,
             population_configurations=None, demographic_events=None,
             scaled_mutation_rate=0, print_trees=False,
-            precision=3, random_seeds=None):
+            precision=3, random_seeds=None, num_threads=None, archive=None,
+            archive_kind="haplotypes"):
         self._sample_size = sample_size
         self._num_loci = num_loci
         self._num_replicates = num_replicates
@@ -135,13 +150,18 @@ class SimulationRunner(object):
         # msprime measure's time in units of generations, given a specific
         # Ne value whereas ms uses coalescent time. To be compatible with ms,
         # we therefore need to use an Ne value of 1/4.
-        self._simulator = msprime.simulator_factory(
-            Ne=0.25,
-            sample_size=sample_size,
-            recombination_map=recomb_map,
-            population_configurations=population_configurations,
-            migration_matrix=migration_matrix,
-            demographic_events=demographic_events)
+        self._simulator_args = {
+            "Ne": 0.25,
+            "sample_size": sample_size,
+            "recombination_map": recomb_map,
+            "population_configurations": population_configurations,
+            "migration_matrix": migration_matrix,
+            "demographic_events": demographic_events,
+        }
+        self._simulator = msprime.simulator_factory(**self._simulator_args)
+        self._num_threads = num_threads
+        self._archive = archive
+        self._archive_kind = archive_kind
         self._precision = precision
         self._print_trees = print_trees
         # sort out the random seeds
@@ -161,6 +181,23 @@ class SimulationRunner(object):
         """
         return self._num_replicates
 
+    def get_num_threads(self):
+        """
+        Returns the number of threads used to run replicates, or None if
+        replicates are run serially in the calling thread.
+        """
+        return self._num_threads
+
+    def get_archive(self):
+        """
+        Returns the tuple (filename, kind) describing the replicate archive
+        that replicates are written to, or None if the ms format output is
+        to be written.
+        """
+        if self._archive is None:
+            return None
+        return self._archive, self._archive_kind
+
     def get_simulator(self):
         """
         Returns the simulator instance for this simulation runner.
@@ -174,14 +211,16 @@ class SimulationRunner(object):
         """
         return self._mutation_rate
 
-    def print_trees(self, tree_sequence, output):
+    def print_trees(self, tree_sequence, output, simulator=None):
         """
         Print out the trees in ms-format from the specified tree sequence.
         When 'invisible' recombinations occur ms prints out copies of the
         same tree. Therefore, we must keep track of all breakpoints from the
         simulation and write out a tree for each one.
         """
-        breakpoints = self._simulator.breakpoints + [self._num_loci]
+        if simulator is None:
+            simulator = self._simulator
+        breakpoints = simulator.breakpoints + [self._num_loci]
         if self._num_loci == 1:
             tree = next(tree_sequence.trees())
             newick = tree.newick(precision=self._precision)
@@ -193,46 +232,115 @@ class SimulationRunner(object):
                 left, right = tree.interval
                 while j < len(breakpoints) and breakpoints[j] <= right:
                     length = breakpoints[j] - left
+                    # Invisible recombinations split the tree into segments.
+                    left = breakpoints[j]
                     j += 1
                     # Print these seperately to avoid the cost of creating
                     # another string.
                     print("[{}]".format(int(length)), end="", file=output)
                     print(newick, file=output)
 
+    def run_replicate(self, simulator, mutation_generator, output):
+        """
+        Runs a single replicate using the specified simulator and writes
+        the output to the specified file handle.
+        """
+        simulator.run()
+        mutation_generator.generate(simulator.ll_tables)
+        print(file=output)
+        print("//", file=output)
+        if self._print_trees:
+            self.print_trees(simulator.get_tree_sequence(), output, simulator)
+        if self._mutation_rate > 0:
+            output.write(simulator.format_ms_sites(self._precision))
+
+    def simulate_replicate(self, simulator, mutation_generator):
+        """
+        Runs a single replicate using the specified simulator and returns
+        the resulting tree sequence.
+        """
+        simulator.run()
+        return simulator.get_tree_sequence(mutation_generator)
+
     def run(self, output):
         """
         Runs the simulations and writes the output to the specified
-        file handle.
+        file handle, or to the archive file if one was specified.
         """
+        if self._archive is not None:
+            with msprime.ReplicateArchiveWriter(
+                    self._archive, self._archive_kind) as writer:
+                self.run_archive(writer)
+            return
         # The first line of ms's output is the command line.
         print(" ".join(sys.argv), file=output)
         print(" ".join(str(s) for s in self._ms_random_seeds), file=output)
-        for j in range(self._num_replicates):
-            self._simulator.run()
-            tree_sequence = self._simulator.get_tree_sequence(self._mutation_generator)
-            print(file=output)
-            print("//", file=output)
-            if self._print_trees:
-                self.print_trees(tree_sequence, output)
-            if self._mutation_rate > 0:
-                s = tree_sequence.get_num_mutations()
-                print("segsites:", s, file=output)
-                if s != 0:
-                    print("positions: ", end="", file=output)
-                    positions = [
-                        mutation.position / self._num_loci for mutation in
-                        tree_sequence.mutations()]
-                    positions.sort()
-                    for position in positions:
-                        print(
-                            "{0:.{1}f}".format(position, self._precision),
-                            end=" ", file=output)
-                    print(file=output)
-                    for h in tree_sequence.haplotypes():
-                        print(h, file=output)
-                else:
-                    print(file=output)
-            self._simulator.reset()
+
+        def format_replicate(simulator, mutation_generator):
+            buff = io.StringIO()
+            self.run_replicate(simulator, mutation_generator, buff)
+            return buff.getvalue()
+
+        self._run_independent_replicates(format_replicate, output.write)
+
+    def run_archive(self, writer):
+        """
+        Runs the simulations and adds the resulting tree sequences to the
+        specified :class:`.ReplicateArchiveWriter`.
+        """
+        self._run_independent_replicates(self.simulate_replicate, writer.add)
+
+    def _run_independent_replicates(self, run_replicate, write):
+        """
+        Runs the replicates, where each replicate is simulated using a random
+        generator seeded from the command line seeds and the replicate index.
+        The result of calling run_replicate with the simulator and mutation
+        generator for each replicate is passed to the write function in
+        replicate order, and is therefore the same for any number of threads.
+        Without threads, the replicates are run in this thread using the
+        runner's simulator.
+        """
+        # These modules are only needed here, so avoid importing them on
+        # startup.
+        import collections
+        import concurrent.futures
+        import threading
+
+        local = threading.local()
+
+        if self._num_threads is None:
+            local.random_generator = self._random_generator
+            local.simulator = self._simulator
+            local.mutation_generator = self._mutation_generator
+
+        def run(j):
+            if not hasattr(local, "simulator"):
+                local.random_generator = msprime.RandomGenerator(1)
+                local.simulator = msprime.simulator_factory(**self._simulator_args)
+                local.simulator.random_generator = local.random_generator
+                local.mutation_generator = msprime.MutationGenerator(
+                    local.random_generator, self._mutation_rate)
+            else:
+                local.simulator.reset()
+            local.random_generator.set_seed(
+                get_replicate_seed(self._ms_random_seeds, j))
+            return run_replicate(local.simulator, local.mutation_generator)
+
+        if self._num_threads is None or self._num_threads == 1:
+            for j in range(self._num_replicates):
+                write(run(j))
+            return
+        # Limit the number of replicates held in memory at once, while
+        # keeping all of the threads busy.
+        max_pending = 2 * self._num_threads
+        with concurrent.futures.ThreadPoolExecutor(self._num_threads) as executor:
+            pending = collections.deque()
+            for j in range(self._num_replicates):
+                pending.append(executor.submit(run, j))
+                if len(pending) == max_pending:
+                    write(pending.popleft().result())
+            while len(pending) > 0:
+                write(pending.popleft().result())
 
 
 def convert_int(value, parser):
@@ -539,7 +647,10 @@ def create_simulation_runner(parser, arg_list):
         scaled_mutation_rate=mu,
         precision=args.precision,
         print_trees=args.trees,
-        random_seeds=args.random_seeds)
+        random_seeds=args.random_seeds,
+        num_threads=args.threads,
+        archive=args.archive,
+        archive_kind=args.archive_kind)
     return runner
 
 
@@ -717,6 +828,24 @@ def get_mspms_parser(error_handler=None):
     group.add_argument(
         "--precision", "-p", type=positive_int, default=3,
         help="Number of values after decimal place to print")
+    group.add_argument(
+        "--threads", type=positive_int, default=None,
+        help=(
+            "Simulate replicates concurrently using this many threads. Each "
+            "replicate is simulated using a random seed derived from the "
+            "random seeds and the replicate index, so that the output is the "
+            "same for any number of threads, and the same as without this "
+            "option"))
+    group.add_argument(
+        "--archive", default=None, metavar="FILENAME",
+        help=(
+            "Write the replicates to a binary replicate archive in this file "
+            "instead of writing ms format output"))
+    group.add_argument(
+        "--archive-kind", choices=["haplotypes", "tables"], default="haplotypes",
+        help=(
+            "Store the positions and bit-packed haplotypes (the default) or "
+            "the tree sequence tables of each replicate in the archive"))
 
     # now for the parser that gets called first
     init_parser = argparse.ArgumentParser(
@@ -765,7 +894,15 @@ def exit(message):
     sys.exit(message)
 
 
+def load_tree_sequence(filename):
+    # tskit is only imported when needed, since it is expensive to import
+    # and is not needed to run simulations.
+    import tskit
+    return tskit.load(filename)
+
+
 def run_upgrade(args):
+    import tskit
     try:
         tree_sequence = tskit.load_legacy(args.source, args.remove_duplicate_positions)
     except tskit.DuplicatePositionsError:
@@ -778,47 +915,47 @@ def run_upgrade(args):
 
 
 def run_dump_newick(args):
-    tree_sequence = tskit.load(args.tree_sequence)
+    tree_sequence = load_tree_sequence(args.tree_sequence)
     for tree in tree_sequence.trees():
         newick = tree.newick(precision=args.precision)
         print(newick)
 
 
 def run_dump_haplotypes(args):
-    tree_sequence = tskit.load(args.tree_sequence)
+    tree_sequence = load_tree_sequence(args.tree_sequence)
     for h in tree_sequence.haplotypes():
         print(h)
 
 
 def run_dump_variants(args):
-    tree_sequence = tskit.load(args.tree_sequence)
+    tree_sequence = load_tree_sequence(args.tree_sequence)
     for variant in tree_sequence.variants(as_bytes=True):
         print(variant.position, end="\t")
         print("{}".format(variant.genotypes.decode()))
 
 
 def run_dump_nodes(args):
-    tree_sequence = tskit.load(args.tree_sequence)
+    tree_sequence = load_tree_sequence(args.tree_sequence)
     tree_sequence.dump_text(nodes=sys.stdout, precision=args.precision)
 
 
 def run_dump_edges(args):
-    tree_sequence = tskit.load(args.tree_sequence)
+    tree_sequence = load_tree_sequence(args.tree_sequence)
     tree_sequence.dump_text(edges=sys.stdout, precision=args.precision)
 
 
 def run_dump_sites(args):
-    tree_sequence = tskit.load(args.tree_sequence)
+    tree_sequence = load_tree_sequence(args.tree_sequence)
     tree_sequence.dump_text(sites=sys.stdout, precision=args.precision)
 
 
 def run_dump_mutations(args):
-    tree_sequence = tskit.load(args.tree_sequence)
+    tree_sequence = load_tree_sequence(args.tree_sequence)
     tree_sequence.dump_text(mutations=sys.stdout, precision=args.precision)
 
 
 def run_dump_provenances(args):
-    tree_sequence = tskit.load(args.tree_sequence)
+    tree_sequence = load_tree_sequence(args.tree_sequence)
     if args.human:
         for provenance in tree_sequence.provenances():
             d = json.loads(provenance.record)
@@ -828,16 +965,188 @@ def run_dump_provenances(args):
         tree_sequence.dump_text(provenances=sys.stdout)
 
 
+# The BGZF end-of-file marker block, as defined in the SAM specification.
+_BGZF_EOF = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000")
+# The maximum amount of input data in a BGZF block, as used by bgzip.
+_BGZF_BLOCK_SIZE = 0xff00
+# The approximate number of bytes of VCF text generated in each region.
+_VCF_REGION_SIZE = 2**25
+
+
+def bgzf_compress(data):
+    """
+    Returns the specified bytes compressed as a sequence of BGZF blocks,
+    without the end-of-file marker. The concatenation of the outputs for
+    consecutive chunks of a file followed by the end-of-file marker is
+    therefore a valid BGZF file.
+    """
+    import struct
+    import zlib
+    blocks = []
+    for j in range(0, len(data), _BGZF_BLOCK_SIZE):
+        chunk = data[j: j + _BGZF_BLOCK_SIZE]
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        deflated = compressor.compress(chunk) + compressor.flush()
+        # The gzip header with the BC extra subfield holding the total
+        # block size minus 1.
+        blocks.append(struct.pack(
+            "<BBBBIBBHBBHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+            len(deflated) + 25))
+        blocks.append(deflated)
+        blocks.append(struct.pack("<II", zlib.crc32(chunk) & 0xffffffff, len(chunk)))
+    return b"".join(blocks)
+
+
+def _compress(text, compression):
+    if compression is None:
+        return text
+    data = text.encode()
+    if compression == "bgzf":
+        return bgzf_compress(data)
+    import gzip
+    return gzip.compress(data)
+
+
+def format_vcf_region(
+        contig_id, positions, alleles, genotypes, separators, compression=None):
+    """
+    Returns the VCF lines for the sites with the specified positions and
+    alleles, as written by write_vcf. The genotypes are a matrix with a row
+    for each site, and the separators hold the character that follows the
+    genotype of each sample. If compression is "gzip" or "bgzf", the output
+    is compressed into a gzip member or BGZF blocks.
+    """
+    import numpy as np
+    rows = np.empty((len(positions), 2 * len(separators)), dtype=np.int8)
+    rows[:, ::2] = genotypes
+    rows[:, ::2] += ord("0")
+    rows[:, 1::2] = separators
+    lines = []
+    for position, site_alleles, row in zip(positions, alleles, rows):
+        lines.append("{}\t{}\t.\t{}\t{}\t.\tPASS\t.\tGT\t".format(
+            contig_id, position, site_alleles[0], ",".join(site_alleles[1:])))
+        lines.append(row.tobytes().decode())
+    return _compress("".join(lines), compression)
+
+
+def _vcf_regions(tree_sequence, samples, positions, sites_per_region):
+    """
+    Returns an iterator over the positions, alleles and genotypes of the
+    sites in each region of the specified number of sites, decoding the
+    variants of the tree sequence in a single pass.
+    """
+    import numpy as np
+    num_samples = tree_sequence.num_samples
+    if samples is not None:
+        num_samples = len(samples)
+    genotypes = np.empty((sites_per_region, num_samples), dtype=np.int8)
+    alleles = []
+    start = 0
+    for variant in tree_sequence.variants(samples=samples):
+        if variant.num_alleles > 9:
+            raise ValueError("More than 9 alleles not supported in VCF output")
+        if variant.has_missing_data:
+            raise ValueError("Missing data not supported in VCF output")
+        genotypes[len(alleles)] = variant.genotypes
+        alleles.append(variant.alleles)
+        if len(alleles) == sites_per_region:
+            yield positions[start: start + len(alleles)], alleles, genotypes.copy()
+            start += len(alleles)
+            alleles = []
+    if len(alleles) > 0:
+        yield positions[start:], alleles, genotypes[:len(alleles)].copy()
+
+
+def write_vcf(
+        filename, output, ploidy=1, num_processes=None, compression=None,
+        sites_per_region=None):
+    """
+    Writes the tree sequence in the specified file to the specified output
+    in VCF format. The output is identical to the output of the tree
+    sequence's write_vcf method. The variants are decoded in a single pass
+    and formatted in regions of the specified number of sites (by default,
+    chosen so that each region is roughly _VCF_REGION_SIZE bytes), which are
+    formatted concurrently by the specified number of worker processes (or
+    in this process if None). If compression is "gzip" or "bgzf", the
+    output must be a binary file, and the header and each region are
+    compressed separately.
+    """
+    import collections
+    import concurrent.futures
+    import numpy as np
+    tree_sequence = load_tree_sequence(filename)
+    tables = tree_sequence.dump_tables()
+    # Sites are written at their positions rounded to the nearest integer.
+    vcf_positions = np.round(tables.sites.position).astype(int)
+    # The header does not depend on the sites, so we take it from the VCF
+    # output of the tree sequence without them. This also checks the ploidy.
+    tables.mutations.clear()
+    tables.sites.clear()
+    contig_id = "1"
+    header = io.StringIO()
+    tables.tree_sequence().write_vcf(header, ploidy, contig_id=contig_id)
+    output.write(_compress(header.getvalue(), compression))
+    # Each VCF individual corresponds to a tskit individual if there are
+    # any, and to ploidy consecutive samples otherwise.
+    if tree_sequence.num_individuals > 0:
+        samples = []
+        individual_ploidies = []
+        for individual in tree_sequence.individuals():
+            samples.extend(individual.nodes)
+            individual_ploidies.append(len(individual.nodes))
+    else:
+        samples = None
+        individual_ploidies = [ploidy] * (tree_sequence.num_samples // ploidy)
+    # Each genotype is followed by "|" within an individual, a tab between
+    # individuals and a newline at the end of the line.
+    separators = []
+    for individual_ploidy in individual_ploidies:
+        separators.extend("|" * (individual_ploidy - 1) + "\t")
+    separators[-1] = "\n"
+    separators = np.array([ord(c) for c in separators], dtype=np.int8)
+    if sites_per_region is None:
+        # Each site gives a genotype and a separator for each sample.
+        sites_per_region = max(1, _VCF_REGION_SIZE // (2 * len(separators)))
+    regions = _vcf_regions(tree_sequence, samples, vcf_positions, sites_per_region)
+    if num_processes is None:
+        for positions, alleles, genotypes in regions:
+            output.write(format_vcf_region(
+                contig_id, positions, alleles, genotypes, separators, compression))
+    else:
+        max_pending = 2 * num_processes
+        with concurrent.futures.ProcessPoolExecutor(num_processes) as executor:
+            pending = collections.deque()
+            for positions, alleles, genotypes in regions:
+                pending.append(executor.submit(
+                    format_vcf_region, contig_id, positions, alleles, genotypes,
+                    separators, compression))
+                if len(pending) == max_pending:
+                    output.write(pending.popleft().result())
+            while len(pending) > 0:
+                output.write(pending.popleft().result())
+    if compression == "bgzf":
+        output.write(_BGZF_EOF)
+
+
 def run_dump_vcf(args):
-    tree_sequence = tskit.load(args.tree_sequence)
-    tree_sequence.write_vcf(sys.stdout, args.ploidy)
+    if args.processes is None and args.compression is None:
+        tree_sequence = load_tree_sequence(args.tree_sequence)
+        tree_sequence.write_vcf(sys.stdout, args.ploidy)
+    else:
+        output = sys.stdout
+        if args.compression is not None:
+            output = sys.stdout.buffer
+        write_vcf(
+            args.tree_sequence, output, args.ploidy, args.processes,
+            args.compression)
 
 
 def run_dump_macs(args):
     """
     Write a macs formatted file so we can import into pbwt.
     """
-    tree_sequence = tskit.load(args.tree_sequence)
+    tree_sequence = load_tree_sequence(args.tree_sequence)
     n = tree_sequence.get_sample_size()
     m = tree_sequence.get_sequence_length()
     print("COMMAND:\tnot_macs {} {}".format(n, m))
@@ -849,14 +1158,33 @@ def run_dump_macs(args):
 
 
 def run_simulate(args):
-    tree_sequence = msprime.simulate(
-        sample_size=int(args.sample_size),
-        Ne=args.effective_population_size,
-        length=args.length,
-        recombination_rate=args.recombination_rate,
-        mutation_rate=args.mutation_rate,
-        random_seed=args.random_seed)
-    tree_sequence.dump(args.tree_sequence, zlib_compression=args.compress)
+    if args.archive is None and args.num_replicates != 1:
+        exit("Error: --num-replicates requires --archive")
+    simulate_args = {
+        "sample_size": int(args.sample_size),
+        "Ne": args.effective_population_size,
+        "length": args.length,
+        "recombination_rate": args.recombination_rate,
+        "mutation_rate": args.mutation_rate,
+        "random_seed": args.random_seed,
+    }
+    if args.archive is None:
+        tree_sequence = msprime.simulate(**simulate_args)
+        tree_sequence.dump(args.tree_sequence, zlib_compression=args.compress)
+    else:
+        replicates = msprime.simulate(
+            num_replicates=args.num_replicates, **simulate_args)
+        with msprime.ReplicateArchiveWriter(
+                args.tree_sequence, args.archive) as writer:
+            for tree_sequence in replicates:
+                writer.add(tree_sequence)
+
+
+def run_batch(args):
+    jobs = msprime.read_batch_jobs(args.jobs)
+    msprime.simulate_batch(
+        jobs, output_dir=args.output_dir, archive_path=args.archive,
+        archive_kind=args.archive_kind, num_threads=args.threads)
 
 
 def get_msp_parser():
@@ -892,8 +1220,40 @@ def get_msp_parser():
     parser.add_argument(
         "--compress", "-z", action="store_true",
         help="Enable zlib compression")
+    parser.add_argument(
+        "--num-replicates", type=positive_int, default=1,
+        help="The number of replicates to simulate. Requires --archive.")
+    parser.add_argument(
+        "--archive", choices=["haplotypes", "tables"], default=None,
+        help=(
+            "Write the replicates to the output file as a replicate archive "
+            "of this kind, storing either the positions and bit-packed "
+            "haplotypes or the tree sequence tables of each replicate"))
     parser.set_defaults(runner=run_simulate)
 
+    parser = subparsers.add_parser(
+        "batch",
+        help="Run a batch of simulations with different parameters")
+    parser.add_argument(
+        "jobs",
+        help=(
+            "The file listing the parameters of each simulation, in CSV format "
+            "if the file name ends with .csv and JSON lines otherwise"))
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument(
+        "--output-dir", "-o", default=None,
+        help="Write the tree sequence for each job to a file in this directory")
+    group.add_argument(
+        "--archive", default=None, metavar="FILENAME",
+        help="Write the results of all jobs to a replicate archive in this file")
+    parser.add_argument(
+        "--archive-kind", choices=["haplotypes", "tables"], default="tables",
+        help="The kind of replicate archive to write")
+    parser.add_argument(
+        "--threads", type=positive_int, default=None,
+        help="Run jobs concurrently using this many threads")
+    parser.set_defaults(runner=run_batch)
+
     parser = subparsers.add_parser(
         "vcf",
         help="Write the tree sequence out in VCF format.")
@@ -901,6 +1261,17 @@ def get_msp_parser():
     parser.add_argument(
         "--ploidy", "-P", type=int, default=1,
         help="The ploidy level of samples")
+    parser.add_argument(
+        "--processes", "-j", type=positive_int, default=None,
+        help=(
+            "Split the genome into regions and format them concurrently "
+            "using this many worker processes. The output is the same as "
+            "when writing serially."))
+    parser.add_argument(
+        "--compression", choices=["gzip", "bgzf"], default=None,
+        help=(
+            "Compress the output, compressing each region separately. BGZF "
+            "output can be indexed using tabix."))
     parser.set_defaults(runner=run_dump_vcf)
 
     parser = subparsers.add_parser(
@@ -55,3 +55,25 @@ class ProvenanceValidationError(MsprimeException):
     """
     A JSON document did non validate against the provenance schema.
     """
+
+
+class SimulationLimitExceeded(MsprimeException):
+    """
+    A simulation was stopped because it reached one of the limits on
+    wall clock time, number of events or memory usage. The ``limit``
+    attribute is the name of the limit that was reached (``"max_wall_time"``,
+    ``"max_events"`` or ``"max_memory"``), and the ``statistics`` attribute
+    is a dictionary describing the state of the simulation when it was
+    stopped.
+    """
+    def __init__(self, limit, statistics):
+        super().__init__(limit, statistics)
+        self.limit = limit
+        self.statistics = statistics
+
+    def __str__(self):
+        return (
+            "Simulation stopped by the {} limit at time {} after {} events "
+            "with {} ancestral lineages remaining".format(
+                self.limit, self.statistics["time"],
+                self.statistics["num_events"], self.statistics["num_ancestors"]))
@@ -21,7 +21,6 @@ Module responsible for generating mutations on a given tree sequence.
 """
 import json
 import sys
-import tskit
 
 import _msprime
 import msprime.simulations as simulations
@@ -113,6 +112,30 @@ def mutate(
         tables = tree_sequence.tables
     except AttributeError:
         raise ValueError("First argument must be a TreeSequence instance.")
+    keep = bool(keep)
+    parameters = {"command": "mutate", "keep": keep}
+    mutation_generator = _mutation_generator_factory(
+        parameters, rate, random_seed, model, start_time, end_time)
+    # TODO Add a JSON representation of the model to the provenance.
+    provenance_dict = provenance.get_provenance_dict(parameters)
+
+    lwt = _msprime.LightweightTableCollection()
+    lwt.fromdict(tables.asdict())
+    mutation_generator.generate(lwt, keep=keep)
+
+    import tskit
+    tables = tskit.TableCollection.fromdict(lwt.asdict())
+    tables.provenances.add_row(json.dumps(provenance_dict))
+    return tables.tree_sequence()
+
+
+def _mutation_generator_factory(
+        parameters, rate, random_seed, model, start_time, end_time):
+    """
+    Checks the common parameters of the mutate functions and returns the
+    corresponding low-level MutationGenerator. The values used are recorded
+    in the specified parameters dictionary for the provenance.
+    """
     if random_seed is None:
         random_seed = simulations._get_random_seed()
     random_seed = int(random_seed)
@@ -127,10 +150,8 @@ def mutate(
     if rate is None:
         rate = 0
     rate = float(rate)
-    keep = bool(keep)
-
-    parameters = {
-        "command": "mutate", "rate": rate, "random_seed": random_seed, "keep": keep}
+    parameters["rate"] = rate
+    parameters["random_seed"] = random_seed
 
     if start_time is None:
         start_time = -sys.float_info.max
@@ -143,18 +164,91 @@ def mutate(
     else:
         end_time = float(end_time)
         parameters["end_time"] = end_time
-    # TODO Add a JSON representation of the model to the provenance.
-    provenance_dict = provenance.get_provenance_dict(parameters)
 
     if start_time > end_time:
         raise ValueError("start_time must be <= end_time")
 
-    mutation_generator = _msprime.MutationGenerator(
+    return _msprime.MutationGenerator(
         rng, rate, alphabet=alphabet, start_time=start_time, end_time=end_time)
+
+
+def mutate_replicates(
+        tree_sequence, rate=None, num_replicates=1, random_seed=None, model=None,
+        start_time=None, end_time=None, as_arrays=False):
+    """
+    Returns an iterator over ``num_replicates`` independent sets of mutations
+    simulated on the specified ancestry. This is equivalent to calling
+    :func:`.mutate` repeatedly on the same tree sequence, but is much more
+    efficient: the input tables are copied only once, and the exposure of
+    each edge to mutation (its branch length within the ``start_time`` and
+    ``end_time`` interval multiplied by its span) is computed once and reused
+    for all replicates. Existing sites and mutations in the input tree
+    sequence are discarded. All other parameters are interpreted as in
+    :func:`.mutate`.
+
+    Replicates are generated lazily as the iterator is consumed. By default
+    each replicate is a :class:`tskit.TreeSequence`. If ``as_arrays`` is
+    True, each replicate is instead a ``(sites, mutations)`` tuple of
+    dictionaries mapping column names to numpy arrays, which can be passed
+    to :meth:`tskit.SiteTable.set_columns` and
+    :meth:`tskit.MutationTable.set_columns`. This avoids the cost of building
+    a full tree sequence for each replicate when only the mutations are
+    needed.
+
+    :param tskit.TreeSequence tree_sequence: The tree sequence onto which we
+        wish to throw mutations.
+    :param float rate: The rate of mutation per generation. (Default: 0).
+    :param int num_replicates: The number of replicates to generate.
+    :param int random_seed: The random seed. If this is `None`, a
+        random seed will be automatically generated. Valid random
+        seeds must be between 1 and :math:`2^{32} - 1`.
+    :param MutationModel model: The mutation model to use when generating
+        mutations. If not specified or None, the :class:`.InfiniteSites`
+        mutation model is used.
+    :param float start_time: The minimum time at which a mutation can
+        occur. (Default: no restriction.)
+    :param float end_time: The maximum time at which a mutation can occur
+        (Default: no restriction).
+    :param bool as_arrays: If True, return the site and mutation columns for
+        each replicate rather than a tree sequence (default: False).
+    :return: An iterator over the mutated replicates.
+    :rtype: iter
+    """
+    try:
+        tables = tree_sequence.tables
+    except AttributeError:
+        raise ValueError("First argument must be a TreeSequence instance.")
+    num_replicates = int(num_replicates)
+    if num_replicates < 0:
+        raise ValueError("num_replicates must be >= 0")
+    parameters = {"command": "mutate_replicates", "num_replicates": num_replicates}
+    mutation_generator = _mutation_generator_factory(
+        parameters, rate, random_seed, model, start_time, end_time)
+    provenance_dict = provenance.get_provenance_dict(parameters)
+
     lwt = _msprime.LightweightTableCollection()
     lwt.fromdict(tables.asdict())
-    mutation_generator.generate(lwt, keep=keep)
+    return _mutation_replicate_generator(
+        lwt, mutation_generator, num_replicates, provenance_dict, bool(as_arrays))
 
-    tables = tskit.TableCollection.fromdict(lwt.asdict())
-    tables.provenances.add_row(json.dumps(provenance_dict))
-    return tables.tree_sequence()
+
+def _mutation_replicate_generator(
+        lwt, mutation_generator, num_replicates, provenance_dict, as_arrays):
+    """
+    Generator function for mutate_replicates.
+    """
+    provenance_record = json.dumps(provenance_dict)
+    for j in range(num_replicates):
+        mutation_generator.generate(lwt, reuse_exposure=j > 0)
+        tables_dict = lwt.asdict()
+        if as_arrays:
+            # The arrays in the dictionary refer to the memory in the low-level
+            # tables, which is overwritten by the next replicate.
+            yield tuple(
+                {name: column.copy() for name, column in tables_dict[table].items()}
+                for table in ["sites", "mutations"])
+        else:
+            import tskit
+            tables = tskit.TableCollection.fromdict(tables_dict)
+            tables.provenances.add_row(provenance_record)
+            yield tables.tree_sequence()
@@ -20,8 +20,6 @@
 Common provenance methods used to determine the state and versions
 of various dependencies and the OS.
 """
-import tskit
-
 import _msprime
 
 __version__ = "undefined"
@@ -50,6 +48,7 @@ def get_provenance_dict(parameters=None):
 
 
 def _get_environment():
+    import tskit.provenance
     gsl_version = ".".join(map(str, _msprime.get_gsl_version()))
     libraries = {"gsl": {"version": gsl_version}}
     return tskit.provenance.get_environment(extra_libs=libraries)
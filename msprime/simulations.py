@@ -20,19 +20,24 @@
 Module responsible for running simulations.
 """
 import collections
+import collections.abc
+import functools
 import gzip
+import itertools
 import json
 import math
+import operator
 import random
 import sys
 import os
+import time
 import warnings
 import copy
 import logging
 
-import tskit
 import numpy as np
 
+from . import exceptions
 from . import provenance
 import _msprime
 
@@ -61,6 +66,9 @@ Sample = collections.namedtuple(
     "Sample",
     ["population", "time"])
 
+# The numpy dtype used to pass samples to the low-level code as arrays.
+_sample_dtype = np.dtype([("population", np.int32), ("time", np.float64)])
+
 
 # Some machinery here for generating default random seeds. We need a map
 # indexed by process ID here because we cannot use a global variable
@@ -141,6 +149,48 @@ def model_factory(model, reference_size=1):
     return model_instance
 
 
+def _sample_array(samples):
+    """
+    Returns the specified samples, which must have "population" and "time"
+    columns (such as a numpy structured array or a dictionary of arrays), as
+    a numpy structured array that can be read directly by the low-level code.
+    """
+    try:
+        population = np.asarray(samples["population"])
+        time = np.asarray(samples["time"], dtype=np.float64)
+    except (KeyError, ValueError, IndexError):
+        raise TypeError(
+            "Sample arrays must have 'population' and 'time' columns")
+    if population.ndim != 1 or population.shape != time.shape:
+        raise ValueError(
+            "Sample population and time arrays must be one dimensional and "
+            "of equal length")
+    if population.size > 0 and not np.issubdtype(population.dtype, np.integer):
+        raise TypeError("Sample populations must be integers")
+    array = np.empty(population.shape[0], dtype=_sample_dtype)
+    array["population"] = population
+    array["time"] = time
+    return array
+
+
+def _get_run_limits(max_wall_time, max_events, max_memory):
+    """
+    Checks the specified limits for Simulator.run and returns them as a
+    dictionary of keyword arguments for the low-level run method.
+    """
+    limits = {}
+    if max_wall_time is not None:
+        limits["max_wall_time"] = float(max_wall_time)
+    if max_events is not None:
+        limits["max_events"] = int(max_events)
+    if max_memory is not None:
+        limits["max_memory"] = int(max_memory)
+    for name, value in limits.items():
+        if value <= 0:
+            raise ValueError("{} must be > 0".format(name))
+    return limits
+
+
 def _check_population_configurations(population_configurations):
     err = (
         "Population configurations must be a list of PopulationConfiguration instances")
@@ -150,23 +200,50 @@ def _check_population_configurations(population_configurations):
 
 
 def _replicate_generator(
-        sim, mutation_generator, num_replicates, provenance_dict, end_time):
+        sim, mutation_generator, num_replicates, provenance_dict, end_time,
+        lazy=False, limits=None):
     """
     Generator function for the many-replicates case of the simulate
     function.
     """
+    if limits is None:
+        limits = {}
     # TODO We should encode the replicate index in here with the rest of the
     # parameters. This will provide sufficient information to reproduce the
     # simulation if necessary. Much simpler than encoding the details of
     # the random number generator.
     provenance_record = json.dumps(provenance_dict)
     for j in range(num_replicates):
-        sim.run(end_time)
-        tree_sequence = sim.get_tree_sequence(mutation_generator, provenance_record)
-        yield tree_sequence
+        sim.run(end_time, **limits)
+        if lazy:
+            result = sim.get_result(mutation_generator, provenance_record)
+        else:
+            result = sim.get_tree_sequence(mutation_generator, provenance_record)
+        yield result
         sim.reset()
 
 
+def _build_tree_sequence(tables_dict, provenance_record, population_metadata):
+    """
+    Returns a TreeSequence from the specified dictionary of table columns,
+    adding the specified provenance record and replacing the population
+    table with rows with the specified metadata if it is not None.
+    """
+    # tskit is imported on demand as it is expensive to import; see the
+    # comments in __init__.py.
+    import tskit
+    tables = tskit.TableCollection.fromdict(tables_dict)
+    if provenance_record is not None:
+        tables.provenances.add_row(provenance_record)
+    if population_metadata is not None:
+        # Add the populations with metadata
+        assert len(tables.populations) == len(population_metadata)
+        tables.populations.clear()
+        for metadata in population_metadata:
+            tables.populations.add_row(metadata=metadata)
+    return tables.tree_sequence()
+
+
 def simulator_factory(
         sample_size=None,
         Ne=1,
@@ -186,8 +263,10 @@ def simulator_factory(
         record_full_arg=False,
         num_labels=None):
     """
-    Convenience method to create a simulator instance using the same
-    parameters as the `simulate` function. Primarily used for testing.
+    Returns a :class:`.Simulator` for the specified parameters, which are the
+    same as those of :func:`.simulate`. The simulator can be run repeatedly
+    to generate replicates, and its parameters changed between replicates
+    using :meth:`.Simulator.update`.
     """
     condition = (
         sample_size is None and
@@ -207,8 +286,9 @@ def simulator_factory(
             raise ValueError(
                 "Cannot specify sample size and population_configurations "
                 "simultaneously.")
-        s = Sample(population=0, time=0.0)
-        the_samples = [s for _ in range(sample_size)]
+        # operator.index raises a TypeError for non-integer sample sizes.
+        num_samples = max(operator.index(sample_size), 0)
+        the_samples = np.zeros(num_samples, dtype=_sample_dtype)
     # If we have population configurations we may have embedded sample_size
     # values telling us how many samples to take from each population.
     if population_configurations is not None:
@@ -227,6 +307,8 @@ def simulator_factory(
             the_samples = samples
     elif samples is not None:
         the_samples = samples
+    if isinstance(samples, (np.ndarray, collections.abc.Mapping)):
+        the_samples = _sample_array(samples)
 
     if start_time is not None and start_time < 0:
         raise ValueError("start_time cannot be negative")
@@ -237,6 +319,7 @@ def simulator_factory(
         raise ValueError("Must have at least one structured coalescent label")
 
     if from_ts is not None:
+        import tskit
         if not isinstance(from_ts, tskit.TreeSequence):
             raise TypeError("from_ts must be a TreeSequence instance.")
         population_mismatch_message = (
@@ -314,7 +397,11 @@ def simulate(
         start_time=None,
         end_time=None,
         record_full_arg=False,
-        num_labels=None):
+        num_labels=None,
+        lazy=False,
+        max_wall_time=None,
+        max_events=None,
+        max_memory=None):
     """
     Simulates the coalescent with recombination under the specified model
     parameters and returns the resulting :class:`tskit.TreeSequence`. Note that
@@ -359,8 +446,12 @@ def simulate(
         populations are defined in the ``population_configurations``
         parameter, then the migration matrix must be an
         :math:`N \\times N` matrix with 0 on the diagonal, consisting of
-        :math:`N` lists of length :math:`N` or an :math:`N \\times N` numpy
-        array.
+        :math:`N` lists of length :math:`N`, an :math:`N \\times N` numpy
+        array, a :class:`.SparseMigrationMatrix`, or a sparse matrix with a
+        ``tocoo()`` method, such as a :mod:`scipy.sparse` matrix. The
+        simulation stores only the nonzero rates, so sparse matrices allow
+        large numbers of populations, such as in stepping stone models, to
+        be simulated efficiently (see :func:`.stepping_stone_model`).
     :param list demographic_events: The list of demographic events to
         simulate. Demographic events describe changes to the populations
         in the past. Events should be supplied in non-decreasing
@@ -373,7 +464,11 @@ def simulate(
         parameter. Each sample is a (``population``, ``time``) pair
         such that the sample in position ``j`` in the list of samples
         is drawn in the specified population at the specfied time. Time
-        is measured in generations ago, as elsewhere.
+        is measured in generations ago, as elsewhere. For large numbers of
+        samples it is much more efficient to provide a numpy structured
+        array with ``population`` and ``time`` fields, or a dictionary
+        mapping ``"population"`` and ``"time"`` to arrays of equal length,
+        as these are read directly without creating an object per sample.
     :param int random_seed: The random seed. If this is `None`, a
         random seed will be automatically generated. Valid random
         seeds must be between 1 and :math:`2^{32} - 1`.
@@ -411,6 +506,22 @@ def simulate(
         Please see the :ref:`sec_api_simulation_models` section for more details
         on specifying simulations models.
     :type model: str or simulation model instance
+    :param bool lazy: If True, return a :class:`.SimulationResult` for each
+        replicate rather than a :class:`tskit.TreeSequence`. The tree sequence
+        is then only built when the :attr:`.SimulationResult.tree_sequence`
+        attribute is first accessed, and simple properties of the result
+        can be obtained cheaply without it. (Default: False.)
+    :param float max_wall_time: If specified, stop the simulation and raise a
+        :class:`.SimulationLimitExceeded` exception if it has not completed
+        after this many seconds of wall clock time. If replicates are
+        being simulated, this and the other limits apply to each replicate
+        separately.
+    :param int max_events: If specified, stop the simulation and raise a
+        :class:`.SimulationLimitExceeded` exception if it has not completed
+        after this many events.
+    :param int max_memory: If specified, stop the simulation and raise a
+        :class:`.SimulationLimitExceeded` exception if the estimated memory
+        used to store the state of the simulation exceeds this many bytes.
     :return: The :class:`tskit.TreeSequence` object representing the results
         of the simulation if no replication is performed, or an
         iterator over the independent replicates simulated if the
@@ -422,6 +533,78 @@ def simulate(
         underlying object may be used for every TreeSequence
         returned which will most likely lead to unexpected behaviour.
     """
+    sim, mutation_generator, provenance_dict = _simulation_setup(
+        sample_size=sample_size,
+        Ne=Ne,
+        length=length,
+        recombination_rate=recombination_rate,
+        recombination_map=recombination_map,
+        mutation_rate=mutation_rate,
+        population_configurations=population_configurations,
+        migration_matrix=migration_matrix,
+        demographic_events=demographic_events,
+        samples=samples,
+        model=model,
+        record_migrations=record_migrations,
+        random_seed=random_seed,
+        mutation_generator=mutation_generator,
+        from_ts=from_ts,
+        start_time=start_time,
+        record_full_arg=record_full_arg,
+        num_labels=num_labels)
+    lazy = bool(lazy)
+    limits = {
+        "max_wall_time": max_wall_time,
+        "max_events": max_events,
+        "max_memory": max_memory,
+    }
+    # Check the limits now so that errors are raised before iteration starts.
+    _get_run_limits(**limits)
+    if num_replicates is None:
+        return next(_replicate_generator(
+            sim, mutation_generator, 1, provenance_dict, end_time, lazy, limits))
+    else:
+        return _replicate_generator(
+            sim, mutation_generator, num_replicates, provenance_dict, end_time, lazy,
+            limits)
+
+
+def _get_simulate_provenance_dict(random_seed):
+    """
+    Returns the provenance dictionary for a call to simulate with the
+    specified random seed.
+    """
+    parameters = {
+        "command": "simulate",
+        "random_seed": random_seed,
+        "TODO": "add other simulation parameters"
+    }
+    return provenance.get_provenance_dict(parameters)
+
+
+def _simulation_setup(
+        sample_size=None,
+        Ne=1,
+        length=None,
+        recombination_rate=None,
+        recombination_map=None,
+        mutation_rate=None,
+        population_configurations=None,
+        migration_matrix=None,
+        demographic_events=[],
+        samples=None,
+        model=None,
+        record_migrations=False,
+        random_seed=None,
+        mutation_generator=None,
+        from_ts=None,
+        start_time=None,
+        record_full_arg=False,
+        num_labels=None):
+    """
+    Returns the Simulator, the MutationGenerator (or None) and the provenance
+    dictionary for the specified parameters of the simulate function.
+    """
     seed = random_seed
     if random_seed is None:
         seed = _get_random_seed()
@@ -447,12 +630,7 @@ def simulate(
         record_full_arg=record_full_arg,
         num_labels=num_labels)
 
-    parameters = {
-        "command": "simulate",
-        "random_seed": seed,
-        "TODO": "add other simulation parameters"
-    }
-    provenance_dict = provenance.get_provenance_dict(parameters)
+    provenance_dict = _get_simulate_provenance_dict(seed)
 
     if mutation_generator is not None:
         # This error was added in version 0.6.1.
@@ -481,12 +659,72 @@ def simulate(
                 "start_time. Please use msprime.mutate on the returned "
                 "tree sequence instead")
         mutation_generator = MutationGenerator(rng, mutation_rate)
-    if num_replicates is None:
-        return next(_replicate_generator(
-            sim, mutation_generator, 1, provenance_dict, end_time))
+    return sim, mutation_generator, provenance_dict
+
+
+_summary_statistics = {
+    "num_trees": _msprime.STAT_NUM_TREES,
+    "segregating_sites": _msprime.STAT_SEGREGATING_SITES,
+    "pi": _msprime.STAT_PI,
+    "sfs": _msprime.STAT_SFS,
+}
+
+
+def simulate_summary_statistics(
+        statistics, num_replicates=1, end_time=None, **kwargs):
+    """
+    Simulates ``num_replicates`` independent replicates and returns the
+    specified summary statistics for each as a numpy array of shape
+    ``(num_replicates, num_stats)``. The statistics are computed directly
+    from the low-level tables after each replicate, without creating a
+    :class:`tskit.TreeSequence`, and so this is much faster than
+    computing the same values from the output of :func:`.simulate` when
+    many replicates are required. All other keyword arguments (including
+    ``mutation_rate``) are interpreted as in :func:`.simulate`.
+
+    The ``statistics`` parameter is a list of statistic names, which
+    determines the columns of the returned array. The supported
+    statistics are:
+
+    - ``"num_trees"``: the number of distinct trees;
+    - ``"segregating_sites"``: the number of segregating sites;
+    - ``"pi"``: the mean number of pairwise differences between
+      samples (not normalised by the sequence length);
+    - ``"sfs"``: the unfolded site frequency spectrum, giving the number of
+      sites at which the derived allele is carried by 1, 2, ..., n - 1 of
+      the ``n`` samples. This occupies ``n - 1`` columns.
+
+    :param list statistics: The names of the statistics to compute.
+    :param int num_replicates: The number of replicates to simulate.
+    :param float end_time: If specified, terminate each simulation at the
+        specified time (see :func:`.simulate`).
+    :return: The statistics for each replicate.
+    :rtype: numpy.ndarray
+    """
+    stat_types = []
+    for statistic in statistics:
+        if statistic not in _summary_statistics:
+            raise ValueError("Unknown summary statistic '{}'".format(statistic))
+        stat_types.append(_summary_statistics[statistic])
+    num_replicates = int(num_replicates)
+    if num_replicates < 0:
+        raise ValueError("num_replicates must be >= 0")
+    sim, mutation_generator, _ = _simulation_setup(**kwargs)
+    if sim.from_ts is None:
+        num_samples = len(sim.samples)
     else:
-        return _replicate_generator(
-            sim, mutation_generator, num_replicates, provenance_dict, end_time)
+        num_samples = sim.from_ts.num_samples
+    num_columns = sum(
+        num_samples - 1 if statistic == "sfs" else 1 for statistic in statistics)
+    result = np.zeros((num_replicates, num_columns))
+    stat_types = np.array(stat_types, dtype=np.int32)
+    for j in range(num_replicates):
+        sim.run(end_time)
+        if mutation_generator is not None:
+            mutation_generator.generate(sim.ll_tables)
+        _msprime.summary_stats(sim.ll_tables, stat_types, result[j])
+        sim.reset()
+    return result
 
 
 class Simulator(object):
@@ -513,7 +751,11 @@ class Simulator(object):
         self.random_generator = None
         self.population_configurations = [
             PopulationConfiguration(initial_size=self.model.reference_size)]
-        self.migration_matrix = [[0]]
+        # The indexes of the populations whose size defaults to Ne.
+        self._default_size_populations = [0]
+        # The migration matrix is None if all rates are zero, so that we do
+        # not build a dense matrix for large numbers of populations.
+        self._migration_matrix = None
         self.demographic_events = []
         self.model_change_events = []
         self.store_migrations = False
@@ -567,6 +809,14 @@ class Simulator(object):
     def num_segment_blocks(self):
         return self.ll_sim.get_num_segment_blocks()
 
+    @property
+    def num_events(self):
+        return self.ll_sim.get_num_events()
+
+    @property
+    def used_memory(self):
+        return self.ll_sim.get_used_memory()
+
     @property
     def num_common_ancestor_events(self):
         return self.ll_sim.get_num_common_ancestor_events()
@@ -583,6 +833,18 @@ class Simulator(object):
     def num_populations(self):
         return len(self.population_configurations)
 
+    @property
+    def migration_matrix(self):
+        """
+        The migration matrix, as a list of lists, as a sparse matrix in
+        COO format if a sparse matrix was specified, or as the
+        :class:`.SparseMigrationMatrix` if one was specified.
+        """
+        if self._migration_matrix is None:
+            N = self.num_populations
+            return [[0 for j in range(N)] for k in range(N)]
+        return self._migration_matrix
+
     @property
     def num_migration_events(self):
         N = self.num_populations
@@ -595,7 +857,8 @@ class Simulator(object):
 
     @property
     def total_num_migration_events(self):
-        return sum(self.ll_sim.get_num_migration_events())
+        entries = self.ll_sim.get_sparse_migration_matrix()
+        return int(np.sum(entries["num_events"]))
 
     @property
     def num_multiple_recombination_events(self):
@@ -608,8 +871,22 @@ class Simulator(object):
             "defined in the population_configurations. The diagonal "
             "elements of this matrix must be zero. For example, a "
             "valid matrix for a 3 population system is "
-            "[[0, 1, 1], [1, 0, 1], [1, 1, 0]]")
+            "[[0, 1, 1], [1, 0, 1], [1, 1, 0]], or a sparse matrix with a "
+            "tocoo() method, such as a scipy.sparse matrix.")
         N = len(self.population_configurations)
+        if isinstance(migration_matrix, SparseMigrationMatrix):
+            if migration_matrix.num_populations != N:
+                raise ValueError(err)
+            self._migration_matrix = migration_matrix
+            return
+        if hasattr(migration_matrix, "tocoo"):
+            # Duplicate entries in a sparse matrix are summed.
+            migration_matrix = migration_matrix.tocoo(copy=True)
+            migration_matrix.sum_duplicates()
+            if migration_matrix.shape != (N, N):
+                raise ValueError(err)
+            self._migration_matrix = migration_matrix
+            return
         if not isinstance(migration_matrix, list):
             try:
                 migration_matrix = [list(row) for row in migration_matrix]
@@ -622,19 +899,20 @@ class Simulator(object):
                 raise TypeError(err)
             if len(row) != N:
                 raise ValueError(err)
-        self.migration_matrix = migration_matrix
+        self._migration_matrix = migration_matrix
 
     def set_population_configurations(self, population_configurations):
         _check_population_configurations(population_configurations)
         self.population_configurations = population_configurations
         # For any populations configurations in which the initial size is None,
         # set it to the population size.
-        for pop_conf in self.population_configurations:
+        self._default_size_populations = []
+        for j, pop_conf in enumerate(self.population_configurations):
             if pop_conf.initial_size is None:
                 pop_conf.initial_size = self.model.reference_size
+                self._default_size_populations.append(j)
         # Now set the default migration matrix.
-        N = len(self.population_configurations)
-        self.migration_matrix = [[0 for j in range(N)] for k in range(N)]
+        self._migration_matrix = None
 
     def set_demographic_events(self, demographic_events):
         err = (
@@ -655,16 +933,31 @@ class Simulator(object):
             else:
                 self.demographic_events.append(event)
 
+    def _get_ll_migration_matrix(self):
+        # Sparse matrices are passed as the arrays of their entries, and
+        # dense matrices must be flattened.
+        M = self._migration_matrix
+        if M is None:
+            return {"source": [], "dest": [], "rate": []}
+        if isinstance(M, SparseMigrationMatrix):
+            return M.get_ll_representation()
+        if hasattr(M, "tocoo"):
+            return {
+                "source": M.row.astype(np.int32), "dest": M.col.astype(np.int32),
+                "rate": M.data}
+        d = len(self.population_configurations)
+        ll_migration_matrix = [0 for j in range(d**2)]
+        for j in range(d):
+            for k in range(d):
+                ll_migration_matrix[j * d + k] = M[j][k]
+        return ll_migration_matrix
+
     def create_ll_instance(self):
         # Now, convert the high-level values into their low-level
         # counterparts.
         ll_simulation_model = self.model.get_ll_representation()
         d = len(self.population_configurations)
-        # The migration matrix must be flattened.
-        ll_migration_matrix = [0 for j in range(d**2)]
-        for j in range(d):
-            for k in range(d):
-                ll_migration_matrix[j * d + k] = self.migration_matrix[j][k]
+        ll_migration_matrix = self._get_ll_migration_matrix()
         ll_population_configuration = [
             conf.get_ll_representation() for conf in self.population_configurations]
         ll_demographic_events = [
@@ -692,17 +985,74 @@ class Simulator(object):
             node_mapping_block_size=self.node_mapping_block_size)
         return ll_sim
 
-    def run(self, end_time=None):
+    def run(self, end_time=None, max_wall_time=None, max_events=None, max_memory=None):
         """
-        Runs the simulation until complete coalescence has occurred.
+        Runs the simulation until complete coalescence has occurred. If any
+        of the limits are specified and reached before this, the simulation
+        is stopped and a SimulationLimitExceeded exception raised; the
+        simulation must then be reset before it can be run again.
+        """
+        limits = _get_run_limits(max_wall_time, max_events, max_memory)
+        if self.ll_sim is None:
+            self.ll_sim = self.create_ll_instance()
+        start = time.perf_counter()
+        end_time = sys.float_info.max if end_time is None else end_time
+        end_times = [event.time for event in self.model_change_events] + [end_time]
+        for j, run_end_time in enumerate(end_times):
+            if j > 0:
+                event = self.model_change_events[j - 1]
+                self.ll_sim.set_model(event.model.get_ll_representation())
+                if max_wall_time is not None:
+                    # The wall time limit applies to the run as a whole.
+                    remaining = max_wall_time - (time.perf_counter() - start)
+                    if remaining <= 0:
+                        raise self._limit_exceeded("max_wall_time", start)
+                    limits["max_wall_time"] = remaining
+            try:
+                self.ll_sim.run(run_end_time, **limits)
+            except _msprime.LimitExceededError as e:
+                raise self._limit_exceeded(e.args[0], start) from None
+        self.ll_sim.finalise_tables()
+
+    def _limit_exceeded(self, limit, start):
+        """
+        Returns a SimulationLimitExceeded exception for the specified limit
+        describing the current state of the simulation.
+        """
+        statistics = {
+            "time": self.time,
+            "wall_time": time.perf_counter() - start,
+            "num_events": self.num_events,
+            "num_ancestors": self.ll_sim.get_num_ancestors(),
+            "num_breakpoints": self.ll_sim.get_num_breakpoints(),
+            "num_common_ancestor_events": self.num_common_ancestor_events,
+            "num_rejected_common_ancestor_events":
+                self.num_rejected_common_ancestor_events,
+            "num_recombination_events": self.num_recombination_events,
+            "num_migration_events": self.total_num_migration_events,
+            "num_nodes": self.ll_sim.get_num_nodes(),
+            "num_edges": self.ll_sim.get_num_edges(),
+            "used_memory": self.used_memory,
+        }
+        return exceptions.SimulationLimitExceeded(limit, statistics)
+
+    def run_chunks(self, end_time=None, max_events=10**4):
+        """
+        Returns an iterator that runs the simulation until complete
+        coalescence has occurred (or end_time is reached), simulating at most
+        max_events events each time it is advanced. This allows callers to
+        regain control between chunks of the simulation.
         """
         if self.ll_sim is None:
             self.ll_sim = self.create_ll_instance()
         for event in self.model_change_events:
-            self.ll_sim.run(event.time)
+            while self.ll_sim.run_chunk(event.time, max_events) == \
+                    _msprime.EXIT_MAX_EVENTS:
+                yield
             self.ll_sim.set_model(event.model.get_ll_representation())
         end_time = sys.float_info.max if end_time is None else end_time
-        self.ll_sim.run(end_time)
+        while self.ll_sim.run_chunk(end_time, max_events) == _msprime.EXIT_MAX_EVENTS:
+            yield
         self.ll_sim.finalise_tables()
 
     def get_tree_sequence(self, mutation_generator=None, provenance_record=None):
@@ -711,16 +1061,39 @@ class Simulator(object):
         """
         if mutation_generator is not None:
             mutation_generator.generate(self.ll_tables)
-        tables = tskit.TableCollection.fromdict(self.ll_tables.asdict())
-        if provenance_record is not None:
-            tables.provenances.add_row(provenance_record)
-        if self.from_ts is None:
-            # Add the populations with metadata
-            assert len(tables.populations) == len(self.population_configurations)
-            tables.populations.clear()
-            for pop_config in self.population_configurations:
-                tables.populations.add_row(metadata=pop_config.encoded_metadata)
-        return tables.tree_sequence()
+        return _build_tree_sequence(
+            self.ll_tables.asdict(), provenance_record, self._population_metadata())
+
+    def get_result(self, mutation_generator=None, provenance_record=None):
+        """
+        Returns a SimulationResult holding a copy of the tables representing
+        the state of the simulation.
+        """
+        if mutation_generator is not None:
+            mutation_generator.generate(self.ll_tables)
+        tables_dict = self.ll_tables.asdict()
+        # The arrays in the dictionary refer to the memory in the low-level
+        # tables, which is overwritten by the next replicate.
+        for name, value in tables_dict.items():
+            if isinstance(value, dict):
+                tables_dict[name] = {
+                    column: array.copy() for column, array in value.items()}
+        return SimulationResult(
+            tables_dict, provenance_record, self._population_metadata())
+
+    def format_ms_sites(self, precision=3):
+        """
+        Returns the segregating sites in the output of the simulation as
+        a string in ms format (see :func:`.write_ms_sites`).
+        """
+        return _msprime.format_ms_sites(self.ll_tables, precision)
+
+    def _population_metadata(self):
+        if self.from_ts is not None:
+            return None
+        return [
+            pop_config.encoded_metadata
+            for pop_config in self.population_configurations]
 
     def reset(self):
         """
@@ -729,6 +1102,294 @@ class Simulator(object):
         if self.ll_sim is not None:
             self.ll_sim.reset()
 
+    def update(
+            self, Ne=None, recombination_rate=None, recombination_map=None,
+            population_configurations=None, migration_matrix=None,
+            demographic_events=None):
+        """
+        Updates the parameters of the simulation in place and resets it, so
+        that the next call to :meth:`.run` simulates a replicate under the new
+        parameters. The memory allocated by the low-level simulator is reused,
+        which makes this much cheaper than creating a new simulator when
+        sweeping over parameter values for small simulations.
+
+        The structure of the simulation cannot be changed: the number of
+        populations and the samples are fixed, and a new recombination map
+        must have the same sequence length and number of loci as the
+        current one. The ``recombination_rate`` argument replaces the
+        current map with a uniform map. Population sizes that were not
+        explicitly specified follow changes in ``Ne``. The new migration
+        matrix and demographic events replace the existing ones, and
+        ``sample_size`` must be None or unchanged for each of the new
+        population configurations. If any of the new parameters are
+        rejected, an exception is raised and the parameters of the
+        simulation are left unchanged.
+        """
+        if recombination_rate is not None and recombination_map is not None:
+            raise ValueError(
+                "Cannot specify recombination_rate and recombination_map "
+                "simultaneously")
+        if Ne is not None:
+            if Ne <= 0:
+                raise ValueError("Population size must be positive")
+            if len(self.model_change_events) > 0 and demographic_events is None:
+                raise ValueError(
+                    "Cannot change Ne when simulation model changes are present "
+                    "unless the demographic events are also updated")
+        if recombination_rate is not None:
+            recombination_map = RecombinationMap.uniform_map(
+                self.recombination_map.get_sequence_length(), recombination_rate,
+                num_loci=self.recombination_map.get_num_loci())
+        if recombination_map is not None:
+            if not isinstance(recombination_map, RecombinationMap):
+                raise TypeError("RecombinationMap instance required")
+            if (recombination_map.get_num_loci() !=
+                    self.recombination_map.get_num_loci() or
+                    recombination_map.get_sequence_length() !=
+                    self.recombination_map.get_sequence_length()):
+                raise ValueError(
+                    "The recombination map must have the same sequence length "
+                    "and number of loci as the current map")
+        if population_configurations is not None:
+            _check_population_configurations(population_configurations)
+            if len(population_configurations) != len(self.population_configurations):
+                raise ValueError("The number of populations cannot be changed")
+            for new_conf, conf in zip(
+                    population_configurations, self.population_configurations):
+                if new_conf.sample_size not in (None, conf.sample_size):
+                    raise ValueError("Population sample sizes cannot be changed")
+
+        # The parameters and their low-level representations are computed
+        # before the low-level simulator is changed. If it rejects any of
+        # them, the previous parameters are restored.
+        ll_names = []
+        if Ne is not None:
+            ll_names.append("reference_size")
+        if recombination_map is not None:
+            ll_names.append("recombination_map")
+        if Ne is not None or population_configurations is not None:
+            ll_names.append("population_configuration")
+        if migration_matrix is not None:
+            ll_names.append("migration_matrix")
+        if demographic_events is not None:
+            ll_names.append("demographic_events")
+        state = self._get_update_state()
+        try:
+            if Ne is not None:
+                self.model.reference_size = Ne
+                for j in self._default_size_populations:
+                    self.population_configurations[j].initial_size = Ne
+            if recombination_map is not None:
+                self.recombination_map = recombination_map
+            if population_configurations is not None:
+                migration_matrix_ = self._migration_matrix
+                self.set_population_configurations(population_configurations)
+                self._migration_matrix = migration_matrix_
+            if migration_matrix is not None:
+                self.set_migration_matrix(migration_matrix)
+            if demographic_events is not None:
+                self.set_demographic_events(demographic_events)
+            ll_parameters = self._get_ll_parameters(ll_names)
+            if self.ll_sim is not None:
+                self._set_ll_parameters(ll_parameters)
+        except Exception:
+            self._set_update_state(state)
+            if self.ll_sim is not None:
+                self._set_ll_parameters(self._get_ll_parameters([
+                    "reference_size", "recombination_map",
+                    "population_configuration", "migration_matrix",
+                    "demographic_events"]))
+            raise
+
+    def _get_update_state(self):
+        return (
+            self.model.reference_size, self.recombination_map,
+            self.population_configurations,
+            [conf.initial_size for conf in self.population_configurations],
+            self._default_size_populations, self._migration_matrix,
+            self.demographic_events, self.model_change_events)
+
+    def _set_update_state(self, state):
+        (
+            self.model.reference_size, self.recombination_map,
+            self.population_configurations, initial_sizes,
+            self._default_size_populations, self._migration_matrix,
+            self.demographic_events, self.model_change_events) = state
+        for conf, initial_size in zip(self.population_configurations, initial_sizes):
+            conf.initial_size = initial_size
+
+    def _get_ll_parameters(self, names):
+        """
+        Returns a list of (name, value) tuples giving the low-level
+        representations of the specified parameters, which are set using
+        the set_<name> methods of the low-level simulator.
+        """
+        d = len(self.population_configurations)
+        ll_parameters = []
+        for name in names:
+            if name == "reference_size":
+                value = self.model.reference_size
+            elif name == "recombination_map":
+                value = self.recombination_map.get_ll_recombination_map()
+            elif name == "population_configuration":
+                value = [
+                    conf.get_ll_representation()
+                    for conf in self.population_configurations]
+            elif name == "migration_matrix":
+                value = self._get_ll_migration_matrix()
+            else:
+                value = [
+                    event.get_ll_representation(d)
+                    for event in self.demographic_events]
+            ll_parameters.append((name, value))
+        return ll_parameters
+
+    def _set_ll_parameters(self, ll_parameters):
+        # Resetting restores the initial simulation model, which must be
+        # in place before we set the new parameters.
+        self.ll_sim.reset()
+        for name, value in ll_parameters:
+            getattr(self.ll_sim, "set_" + name)(value)
+        self.ll_sim.reset()
+
+
+class SimulationResult(object):
+    """
+    The result of a simulation performed with ``lazy=True``. This is a
+    lightweight handle on the tables output by the simulation: the
+    :class:`tskit.TreeSequence` is only built (which requires the tables
+    to be copied, sorted and indexed) when the :attr:`.tree_sequence`
+    attribute is first accessed. Simple properties of the result such as
+    the number of nodes and edges, the time of the oldest root and
+    the breakpoints between trees can be obtained directly from the
+    table columns without building the tree sequence.
+    """
+    def __init__(self, tables_dict, provenance_record=None, population_metadata=None):
+        self._tables_dict = tables_dict
+        self._provenance_record = provenance_record
+        self._population_metadata = population_metadata
+        self._tree_sequence = None
+
+    @property
+    def tree_sequence(self):
+        """
+        The :class:`tskit.TreeSequence` representing the result of the
+        simulation. This is built on first access.
+        """
+        if self._tree_sequence is None:
+            self._tree_sequence = _build_tree_sequence(
+                self._tables_dict, self._provenance_record,
+                self._population_metadata)
+        return self._tree_sequence
+
+    @property
+    def sequence_length(self):
+        """
+        The sequence length of the simulation.
+        """
+        return self._tables_dict["sequence_length"]
+
+    @property
+    def num_nodes(self):
+        """
+        The number of nodes output by the simulation.
+        """
+        return len(self._tables_dict["nodes"]["time"])
+
+    @property
+    def num_edges(self):
+        """
+        The number of edges output by the simulation.
+        """
+        return len(self._tables_dict["edges"]["left"])
+
+    @property
+    def num_samples(self):
+        """
+        The number of sample nodes output by the simulation.
+        """
+        flags = self._tables_dict["nodes"]["flags"]
+        return int(np.count_nonzero(flags & _msprime.NODE_IS_SAMPLE))
+
+    @property
+    def num_sites(self):
+        """
+        The number of sites output by the simulation.
+        """
+        return len(self._tables_dict["sites"]["position"])
+
+    @property
+    def num_mutations(self):
+        """
+        The number of mutations output by the simulation.
+        """
+        return len(self._tables_dict["mutations"]["site"])
+
+    @property
+    def max_root_time(self):
+        """
+        The time of the oldest root in any of the trees. If the simulation
+        has completed, this is the time of the most recent common ancestor
+        of the samples at the position with the oldest MRCA.
+        """
+        nodes = self._tables_dict["nodes"]
+        is_sample = (nodes["flags"] & _msprime.NODE_IS_SAMPLE) != 0
+        root_time = np.max(nodes["time"][is_sample], initial=0)
+        parent = self._tables_dict["edges"]["parent"]
+        if len(parent) > 0:
+            root_time = max(root_time, np.max(nodes["time"][parent]))
+        return float(root_time)
+
+    def breakpoints(self):
+        """
+        Returns a numpy array of the sorted breakpoints between trees,
+        including 0 and the sequence length. This is equal to the
+        breakpoints of the :attr:`.tree_sequence`.
+        """
+        edges = self._tables_dict["edges"]
+        return np.unique(np.hstack([
+            [0, self.sequence_length], edges["left"], edges["right"]]))
+
+    @property
+    def num_trees(self):
+        """
+        The number of distinct trees output by the simulation.
+        """
+        return len(self.breakpoints()) - 1
+
+
+def write_ms_sites(tree_sequence, output, precision=3):
+    """
+    Writes the segregating sites of the specified tree sequence to the
+    specified file in the format used by :program:`ms`. This is the
+    ``segsites`` line followed by the ``positions`` line and the haplotype
+    of each sample (or by an empty line if there are no sites), as in each
+    replicate in the output of :program:`mspms`. The output is formatted
+    in the low-level code, and written with a single call to the
+    ``write`` method of the file.
+
+    All sites must have exactly one mutation, and all alleles must be
+    single characters (as is the case for mutations generated by
+    :func:`.simulate` and :func:`.mutate`).
+
+    :param tree_sequence: The tree sequence, or the
+        :class:`.SimulationResult` returned by :func:`.simulate` with
+        ``lazy=True``.
+    :type tree_sequence: :class:`tskit.TreeSequence` or
+        :class:`.SimulationResult`
+    :param output: The text file to write to.
+    :param int precision: The number of decimal places to use when writing
+        the positions of sites, which are given as fractions of the sequence
+        length.
+    """
+    if isinstance(tree_sequence, SimulationResult):
+        tables_dict = tree_sequence._tables_dict
+    else:
+        tables_dict = tree_sequence.tables.asdict()
+    ll_tables = _msprime.LightweightTableCollection()
+    ll_tables.fromdict(tables_dict)
+    output.write(_msprime.format_ms_sites(ll_tables, precision))
+
 
 class RecombinationMap(object):
     """
@@ -950,6 +1611,78 @@ class PopulationConfiguration(object):
         }
 
 
+class SparseMigrationMatrix(object):
+    """
+    A migration matrix for a given number of populations, stored as the
+    arrays of its nonzero entries. The entry ``j`` in these arrays is the
+    rate at which lineages move from population ``source[j]`` to population
+    ``dest[j]``, as described for the ``migration_matrix`` parameter of
+    :func:`.simulate`. The entries are stored sorted by source and then
+    destination. Sparse migration matrices can be used in place of dense
+    migration matrices, and are passed to the simulation without creating
+    an :math:`N \\times N` matrix.
+
+    :param int num_populations: The number of populations.
+    :param array_like source: The source population of each entry.
+    :param array_like dest: The destination population of each entry.
+    :param array_like rate: The migration rate of each entry, or a single
+        rate for all entries.
+    """
+    def __init__(self, num_populations, source, dest, rate):
+        num_populations = int(num_populations)
+        if num_populations < 1:
+            raise ValueError("Must have at least one population")
+        source = np.array(source, dtype=np.int32, ndmin=1)
+        dest = np.array(dest, dtype=np.int32, ndmin=1)
+        if source.shape != dest.shape or len(source.shape) != 1:
+            raise ValueError("source and dest must be 1D arrays of equal length")
+        rate = np.array(
+            np.broadcast_to(np.asarray(rate, dtype=float), source.shape))
+        if np.any(source < 0) or np.any(source >= num_populations):
+            raise ValueError("Source population out of bounds")
+        if np.any(dest < 0) or np.any(dest >= num_populations):
+            raise ValueError("Destination population out of bounds")
+        if np.any(source == dest):
+            raise ValueError("Migration matrix diagonal must be zero")
+        if not np.all(rate >= 0):
+            raise ValueError("Migration rates must be non-negative")
+        order = np.lexsort((dest, source))
+        source = source[order]
+        dest = dest[order]
+        if np.any((source[1:] == source[:-1]) & (dest[1:] == dest[:-1])):
+            raise ValueError("Duplicate migration matrix entry")
+        self.num_populations = num_populations
+        self.source = source
+        self.dest = dest
+        self.rate = rate[order]
+
+    @property
+    def shape(self):
+        return (self.num_populations, self.num_populations)
+
+    @property
+    def num_entries(self):
+        """
+        The number of entries in this matrix.
+        """
+        return len(self.source)
+
+    def toarray(self):
+        """
+        Returns this migration matrix as a dense :math:`N \\times N` numpy
+        array.
+        """
+        M = np.zeros(self.shape)
+        M[self.source, self.dest] = self.rate
+        return M
+
+    def get_ll_representation(self):
+        """
+        Returns the low-level representation of this SparseMigrationMatrix.
+        """
+        return {"source": self.source, "dest": self.dest, "rate": self.rate}
+
+
 class DemographicEvent(object):
     """
     Superclass of demographic events that occur during simulations.
@@ -1022,6 +1755,138 @@ class PopulationParametersChange(DemographicEvent):
         return s
 
 
+_SIZE_FUNCTIONS = {
+    "exponential": _msprime.SIZE_FUNCTION_EXPONENTIAL,
+    "linear": _msprime.SIZE_FUNCTION_LINEAR,
+    "logistic": _msprime.SIZE_FUNCTION_LOGISTIC,
+}
+
+
+class PopulationSizeHistory(DemographicEvent):
+    """
+    Sets the size of a population at each of a series of times, starting at
+    the first of these times, and applies as a single event. Between the
+    times, the size of the population follows the specified size function:
+
+    ``"exponential"``
+        The population grows exponentially at the specified growth rate
+        from each of the times, which is equivalent to a
+        :class:`.PopulationParametersChange` for the population at each of
+        the times.
+    ``"linear"``
+        The population size is interpolated linearly between the times,
+        and is constant after the last of them. Growth rates cannot be
+        specified.
+    ``"logistic"``
+        From each of the times, the population grows logistically (forwards
+        in time) at the specified growth rate towards the specified
+        carrying capacity, so that a population of size :math:`N_k` at time
+        :math:`t_k` with growth rate :math:`r_k` and carrying capacity
+        :math:`K_k` has size
+        :math:`K_k / (1 + (K_k / N_k - 1) e^{r_k (t - t_k)})` at time
+        :math:`t` ago. Going back in time, a population that is larger than
+        its carrying capacity and has a positive growth rate reaches an
+        infinite size in finite time, which must not happen before the next
+        of the times.
+
+    The simulation integrates the coalescence rate over the history
+    directly, exactly or by numerically inverting the integral for the
+    logistic function, rather than stopping at each of the times. Long,
+    finely resolved or smoothly varying size histories are therefore much
+    cheaper to simulate than the equivalent series of population parameter
+    changes. The history applies until the next event that changes the size
+    or growth rate of the population; such an event starts from the size of
+    the population at that time, and for the linear and logistic functions a
+    growth rate of zero. Only exponential size histories are supported by
+    the :class:`.DemographyDebugger`.
+
+    :param int population: The ID of the population affected.
+    :param array_like times: The times at which the population parameters
+        change, in generations, in strictly increasing order.
+    :param array_like sizes: The absolute diploid size of the population at
+        each of the times.
+    :param array_like growth_rates: The per-generation growth rate of the
+        population from each of the times. If None (the default), the
+        growth rates are zero.
+    :param str size_function: The function followed by the population size
+        between the times; one of ``"exponential"`` (the default),
+        ``"linear"`` or ``"logistic"``.
+    :param array_like carrying_capacities: The absolute carrying capacity of
+        the population from each of the times, for the logistic function.
+    """
+    def __init__(
+            self, population, times, sizes, growth_rates=None,
+            size_function="exponential", carrying_capacities=None):
+        if size_function not in _SIZE_FUNCTIONS:
+            raise ValueError("size_function must be one of {}".format(
+                list(_SIZE_FUNCTIONS)))
+        if size_function == "linear" and growth_rates is not None:
+            raise ValueError("Growth rates cannot be specified for linear sizes")
+        if (size_function == "logistic") != (carrying_capacities is not None):
+            raise ValueError(
+                "Carrying capacities must be specified for, and only for, "
+                "logistic sizes")
+        times = np.array(times, dtype=float)
+        sizes = np.array(sizes, dtype=float)
+        if growth_rates is None:
+            growth_rates = np.zeros_like(times)
+        growth_rates = np.array(growth_rates, dtype=float)
+        if times.ndim != 1 or len(times) == 0:
+            raise ValueError("times must be a non-empty one dimensional array")
+        if sizes.shape != times.shape or growth_rates.shape != times.shape:
+            raise ValueError("times, sizes and growth_rates must have the same length")
+        if np.any(np.diff(times) <= 0):
+            raise ValueError("times must be strictly increasing")
+        if np.any(sizes <= 0):
+            raise ValueError("Cannot have a population size <= 0")
+        if carrying_capacities is not None:
+            carrying_capacities = np.array(carrying_capacities, dtype=float)
+            if carrying_capacities.shape != times.shape:
+                raise ValueError(
+                    "times and carrying_capacities must have the same length")
+            if np.any(carrying_capacities <= 0):
+                raise ValueError("Cannot have a carrying capacity <= 0")
+            # Going back in time, a population above its carrying capacity with
+            # a positive growth rate reaches an infinite size after a time of
+            # -log(1 - K / N) / r.
+            for j in range(len(times)):
+                c = carrying_capacities[j] / sizes[j] - 1
+                if c < 0 and growth_rates[j] > 0:
+                    if (j == len(times) - 1 or
+                            growth_rates[j] * (times[j + 1] - times[j]) >= -np.log(-c)):
+                        raise ValueError(
+                            "The logistic population size from time {} (epoch {}) "
+                            "becomes infinite before the next time".format(
+                                times[j], j))
+        super().__init__("population_size_history", times[0])
+        self.population = population
+        self.times = times
+        self.sizes = sizes
+        self.growth_rates = growth_rates
+        self.size_function = size_function
+        self.carrying_capacities = carrying_capacities
+
+    def get_ll_representation(self, num_populations):
+        ret = {
+            "type": self.type,
+            "time": self.time,
+            "population": self.population,
+            "times": self.times,
+            "initial_sizes": self.sizes,
+            "growth_rates": self.growth_rates,
+            "size_function": _SIZE_FUNCTIONS[self.size_function],
+        }
+        if self.carrying_capacities is not None:
+            ret["carrying_capacities"] = self.carrying_capacities
+        return ret
+
+    def __str__(self):
+        return (
+            "Population size history for {}: {} {} breakpoints from {} to {}".format(
+                self.population, len(self.times), self.size_function,
+                self.times[0], self.times[-1]))
+
+
 class MigrationRateChange(DemographicEvent):
     """
     Changes the rate of migration to a new value at a specific time.
@@ -1059,6 +1924,59 @@ class MigrationRateChange(DemographicEvent):
         return ret
 
 
+class MigrationMatrixChange(DemographicEvent):
+    """
+    Replaces the migration matrix with a new matrix at a specific time. All
+    of the rates are changed at once, so this is much more efficient than a
+    :class:`.MigrationRateChange` for each entry when many rates change.
+
+    :param float time: The time at which this event occurs in generations.
+    :param matrix: The new migration matrix, which may be any of the
+        forms accepted for the ``migration_matrix`` parameter of
+        :func:`.simulate`, such as a list of lists or a
+        :class:`.SparseMigrationMatrix`. Rates that are not specified in a
+        sparse matrix are set to zero.
+    """
+    def __init__(self, time, matrix):
+        super().__init__("migration_matrix_change", time)
+        self.matrix = matrix
+
+    def _get_entries(self, num_populations):
+        # Returns the source, dest and rate arrays of the nonzero entries.
+        err = (
+            "The migration matrix of a MigrationMatrixChange must be a N x N "
+            "square matrix, where N is the number of populations")
+        matrix = self.matrix
+        if isinstance(matrix, SparseMigrationMatrix):
+            if matrix.num_populations != num_populations:
+                raise ValueError(err)
+            return matrix.source, matrix.dest, matrix.rate
+        if hasattr(matrix, "tocoo"):
+            matrix = matrix.tocoo(copy=True)
+            matrix.sum_duplicates()
+            if matrix.shape != (num_populations, num_populations):
+                raise ValueError(err)
+            return matrix.row, matrix.col, matrix.data
+        M = np.array(matrix, dtype=float)
+        if M.shape != (num_populations, num_populations):
+            raise ValueError(err)
+        source, dest = np.nonzero(M)
+        return source, dest, M[source, dest]
+
+    def get_ll_representation(self, num_populations):
+        source, dest, rate = self._get_entries(num_populations)
+        return {
+            "type": self.type,
+            "time": self.time,
+            "source": np.asarray(source, dtype=np.int32),
+            "dest": np.asarray(dest, dtype=np.int32),
+            "rate": np.asarray(rate, dtype=np.float64),
+        }
+
+    def __str__(self):
+        return "Migration matrix change"
+
+
 class MassMigration(DemographicEvent):
     """
     A mass migration event in which some fraction of the population in
@@ -1212,18 +2130,31 @@ class CensusEvent(DemographicEvent):
     has coalesced more recently than the census time.
     See the :ref:`tutorial<sec_tutorial_demography_census>` for an example.
 
+    By default, a node is added for each segment of ancestral material of
+    each lineage, so that a lineage with many segments in a recombining
+    genome gives many census nodes. If ``per_lineage`` is True, a single
+    node is added for each lineage instead, with an edge for each of its
+    segments. This records the same ancestry with far fewer nodes and
+    edges.
+
     :param float time: The time at which this event occurs in generations.
+    :param bool per_lineage: If True, add one node for each lineage rather
+        than for each segment of each lineage. Defaults to False.
     """
-    def __init__(self, time):
+    def __init__(self, time, per_lineage=False):
         super().__init__("census_event", time)
+        self.per_lineage = per_lineage
 
     def get_ll_representation(self, num_populations):
         return {
             "type": self.type,
             "time": self.time,
+            "per_lineage": bool(self.per_lineage),
         }
 
     def __str__(self):
+        if self.per_lineage:
+            return "Census event (one node per lineage)"
         return "Census event"
 
 
@@ -1389,6 +2320,14 @@ class Epoch(object):
         return repr(self.__dict__)
 
 
+# The largest argument for which math.exp does not overflow.
+_MAX_EXP_ARGUMENT = math.log(sys.float_info.max)
+
+# The maximum total number of elements in the generator matrices whose
+# eigendecompositions are cached by a DemographyDebugger.
+_COALESCENCE_GENERATOR_CACHE_SIZE = 2**20
+
+
 def _matrix_exponential(A):
     """
     Returns the matrix exponential of A.
@@ -1403,6 +2342,331 @@ def _matrix_exponential(A):
     return np.real_if_close(B, tol=1000)
 
 
+def _exp(x):
+    """
+    Returns the elementwise exponential of the specified array, computed with
+    the same C library function as the simulation engine. This ensures that
+    population sizes are identical to those in the simulation, which is not
+    the case for numpy.exp.
+    """
+    x = np.asarray(x, dtype=float)
+    # math.exp raises an OverflowError rather than returning inf.
+    overflow = x > _MAX_EXP_ARGUMENT
+    ret = np.array([math.exp(y) for y in np.where(overflow, 0, x).flat])
+    ret[overflow.flat] = np.inf
+    return ret.reshape(x.shape)
+
+
+def _expand_size_histories(demographic_events):
+    """
+    Returns a list of the specified demographic events, in which each
+    PopulationSizeHistory is replaced by the equivalent series of
+    PopulationParametersChange events, ending at the next event that
+    changes the same population.
+    """
+    expanded = []
+    for j, event in enumerate(demographic_events):
+        if not isinstance(event, PopulationSizeHistory):
+            expanded.append(event)
+            continue
+        if event.size_function != "exponential":
+            raise ValueError(
+                "Only exponential population size histories are supported by the "
+                "DemographyDebugger")
+        end_time = np.inf
+        for later in demographic_events[j + 1:]:
+            if isinstance(later, PopulationSizeHistory):
+                changes_population = later.population == event.population
+            elif isinstance(later, PopulationParametersChange):
+                changes_population = later.population in (-1, event.population)
+            else:
+                changes_population = False
+            if changes_population:
+                end_time = later.time
+                break
+        for t, size, growth_rate in zip(event.times, event.sizes, event.growth_rates):
+            if t > end_time:
+                break
+            expanded.append(PopulationParametersChange(
+                t, initial_size=size, growth_rate=growth_rate,
+                population=event.population))
+    # The sort is stable, so events at the same time stay in their given order.
+    expanded.sort(key=lambda event: event.time)
+    return expanded
+
+
+def _compile_epochs(
+        model, population_configurations, migration_matrix, demographic_events):
+    """
+    Computes the demographic parameters in each epoch of the specified
+    model directly from the population configurations, migration matrix and
+    demographic events, without creating a simulator or modifying any of
+    the arguments. The epochs are separated by the distinct times of the
+    demographic events, which are applied in the same way as in the
+    simulation.
+
+    Returns a tuple (start_times, end_times, start_sizes, end_sizes,
+    growth_rates, migration_matrices, events), where the first two are
+    arrays of length num_epochs, the next three are arrays of shape
+    (num_epochs, num_pops), migration_matrices has shape (num_epochs,
+    num_pops, num_pops) and events is a list giving the demographic events
+    applied at the start of each epoch.
+    """
+    if population_configurations is None:
+        population_configurations = [PopulationConfiguration()]
+    _check_population_configurations(population_configurations)
+    N = len(population_configurations)
+    initial_size = np.array([
+        model.reference_size if conf.initial_size is None else conf.initial_size
+        for conf in population_configurations], dtype=float)
+    growth_rate = np.array([
+        conf.growth_rate for conf in population_configurations], dtype=float)
+    # The time at which initial_size applies for each population.
+    size_time = np.zeros(N)
+    if migration_matrix is None:
+        M = np.zeros((N, N))
+    else:
+        if hasattr(migration_matrix, "toarray"):
+            migration_matrix = migration_matrix.toarray()
+        M = np.array(migration_matrix, dtype=float)
+        if M.shape != (N, N):
+            raise ValueError(
+                "migration matrix must be a N x N square matrix, where N is the "
+                "number of populations defined in the population_configurations")
+        if np.any(np.diag(M) != 0):
+            raise ValueError(
+                "The diagonal elements of the migration matrix must be zero")
+        if np.any(M < 0):
+            raise ValueError("Migration rates must be non-negative")
+
+    def check_population(population):
+        if population < 0 or population >= N:
+            raise ValueError("Population ID {} out of bounds".format(population))
+
+    last_time = 0
+    for event in demographic_events:
+        if not isinstance(event, DemographicEvent):
+            raise TypeError(
+                "Demographic events must be a list of DemographicEvent instances")
+        if isinstance(event, SimulationModelChange):
+            raise ValueError(
+                "Model changes not currently supported by the DemographyDebugger. "
+                "Please open an issue on GitHub if this feature would be useful to you")
+        if event.time < last_time:
+            raise ValueError(
+                "Demographic events must be non-negative and sorted in "
+                "non-decreasing order of time")
+        last_time = event.time
+    groups = []
+    for event in _expand_size_histories(list(demographic_events)):
+        if len(groups) > 0 and groups[-1][0] == event.time:
+            groups[-1][1].append(event)
+        else:
+            groups.append((event.time, [event]))
+
+    num_epochs = len(groups) + 1
+    start_times = np.zeros(num_epochs)
+    start_times[1:] = [time for time, _ in groups]
+    end_times = np.append(start_times[1:], np.inf)
+    epoch_initial_size = np.zeros((num_epochs, N))
+    epoch_size_time = np.zeros((num_epochs, N))
+    growth_rates = np.zeros((num_epochs, N))
+    migration_matrices = np.zeros((num_epochs, N, N))
+    events = [[]] + [group for _, group in groups]
+    for j in range(num_epochs):
+        time = start_times[j]
+        for event in events[j]:
+            if isinstance(event, PopulationParametersChange):
+                if event.population == -1:
+                    pops = slice(None)
+                else:
+                    check_population(event.population)
+                    pops = event.population
+                if event.initial_size is None:
+                    initial_size[pops] *= _exp(
+                        -growth_rate[pops] * (time - size_time[pops]))
+                else:
+                    initial_size[pops] = event.initial_size
+                if event.growth_rate is not None:
+                    growth_rate[pops] = event.growth_rate
+                size_time[pops] = time
+            elif isinstance(event, MigrationRateChange):
+                if event.rate < 0:
+                    raise ValueError("Migration rates must be non-negative")
+                if event.matrix_index is None:
+                    M[:] = event.rate
+                    np.fill_diagonal(M, 0)
+                else:
+                    source, dest = event.matrix_index
+                    check_population(source)
+                    check_population(dest)
+                    if source == dest:
+                        raise ValueError(
+                            "Cannot set the diagonal elements of the migration matrix")
+                    M[source, dest] = event.rate
+            elif isinstance(event, MigrationMatrixChange):
+                source, dest, rate = event._get_entries(N)
+                if np.any((source == dest) & (rate != 0)) or np.any(rate < 0):
+                    raise ValueError(
+                        "Migration rates must be non-negative, with zero on "
+                        "the diagonal")
+                M[:] = 0
+                M[source, dest] = rate
+            elif isinstance(event, MassMigration):
+                check_population(event.source)
+                check_population(event.dest)
+                if event.source == event.dest:
+                    raise ValueError("Source and dest of a MassMigration must differ")
+        epoch_initial_size[j] = initial_size
+        epoch_size_time[j] = size_time
+        growth_rates[j] = growth_rate
+        migration_matrices[j] = M
+
+    def size_at(t):
+        # Avoid evaluating 0 * inf for constant sized populations.
+        with np.errstate(invalid="ignore"):
+            size = epoch_initial_size * _exp(
+                -growth_rates * (t[:, np.newaxis] - epoch_size_time))
+        return np.where(growth_rates == 0, epoch_initial_size, size)
+
+    start_sizes = size_at(start_times)
+    end_sizes = size_at(end_times)
+    return (
+        start_times, end_times, start_sizes, end_sizes, growth_rates,
+        migration_matrices, events)
+
+
+class _LineageStateSpace(object):
+    """
+    The state space of the lineages of a sample under the structured
+    coalescent. Each state gives the number of lineages of each type in each
+    population. If track_sizes is True the type of a lineage is the number
+    of samples that it subtends, so that the expected site frequency
+    spectrum can be computed, and otherwise all lineages have the same type.
+    The states are enumerated from the initial state in which each sample
+    is a separate lineage, which is state 0.
+    """
+    def __init__(self, num_samples, track_sizes):
+        num_pops = len(num_samples)
+        num_types = sum(num_samples) if track_sizes else 1
+        initial = np.zeros((num_pops, num_types), dtype=int)
+        initial[:, 0] = num_samples
+        self.num_populations = num_pops
+        self.num_types = num_types
+        self.states = [tuple(initial.flat)]
+        self._index = {self.states[0]: 0}
+        coalescence = []
+        migration = []
+
+        def index(state):
+            key = tuple(state.flat)
+            if key not in self._index:
+                self._index[key] = len(self.states)
+                self.states.append(key)
+            return self._index[key]
+
+        j = 0
+        while j < len(self.states):
+            state = np.array(self.states[j]).reshape((num_pops, num_types))
+            for p in range(num_pops):
+                types = np.nonzero(state[p])[0]
+                for a in types:
+                    for q in range(num_pops):
+                        if q != p:
+                            new_state = state.copy()
+                            new_state[p, a] -= 1
+                            new_state[q, a] += 1
+                            migration.append((j, index(new_state), state[p, a], p, q))
+                    for b in types[types >= a]:
+                        if a == b:
+                            num_pairs = state[p, a] * (state[p, a] - 1) // 2
+                        else:
+                            num_pairs = state[p, a] * state[p, b]
+                        if num_pairs > 0:
+                            new_state = state.copy()
+                            new_state[p, a] -= 1
+                            new_state[p, b] -= 1
+                            new_state[p, a + b + 1 if track_sizes else 0] += 1
+                            coalescence.append((j, index(new_state), num_pairs, p))
+            j += 1
+        self.num_states = len(self.states)
+        counts = np.array(self.states).reshape((-1, num_pops, num_types))
+        # The number of lineages in each population, and of each type.
+        self.num_lineages = np.sum(counts, axis=2)
+        self.type_counts = np.sum(counts, axis=1)
+        self._coalescence = np.array(coalescence, dtype=int).reshape((-1, 4))
+        self._migration = np.array(migration, dtype=int).reshape((-1, 5))
+        self._mass_migration_cache = {}
+
+    def generator(self, migration_matrix, coalescence_rates):
+        """
+        Returns the generator matrix of the process for the specified
+        migration matrix and per-pair coalescence rate in each population.
+        """
+        G = np.zeros((self.num_states, self.num_states))
+        source, dest, num_pairs, pop = self._coalescence.T
+        np.add.at(G, (source, dest), num_pairs * coalescence_rates[pop])
+        source, dest, num_lineages, pop, other_pop = self._migration.T
+        np.add.at(
+            G, (source, dest), num_lineages * migration_matrix[pop, other_pop])
+        G[np.diag_indices(self.num_states)] = -np.sum(G, axis=1)
+        return G
+
+    def reachable(self, states, migration_matrix):
+        """
+        Returns a boolean array indicating the states that are reachable
+        from the specified boolean array of states with the specified
+        migration matrix.
+        """
+        source, dest, _, _ = self._coalescence.T
+        edges = [(source, dest)]
+        source, dest, _, pop, other_pop = self._migration.T
+        possible = migration_matrix[pop, other_pop] > 0
+        edges.append((source[possible], dest[possible]))
+        reachable = np.array(states, dtype=bool)
+        num_reachable = -1
+        while num_reachable != np.sum(reachable):
+            num_reachable = np.sum(reachable)
+            for source, dest in edges:
+                reachable[dest[reachable[source]]] = True
+        return reachable
+
+    def mass_migration(self, source, dest, proportion):
+        """
+        Returns the matrix of transition probabilities between states caused
+        by a mass migration, in which each lineage in the source population
+        moves to the destination population with the specified probability.
+        """
+        key = source, dest, proportion
+        if key in self._mass_migration_cache:
+            return self._mass_migration_cache[key]
+        S = np.zeros((self.num_states, self.num_states))
+        shape = self.num_populations, self.num_types
+        for j, state in enumerate(self.states):
+            state = np.array(state).reshape(shape)
+            counts = state[source]
+            for moved in itertools.product(*[range(c + 1) for c in counts]):
+                moved = np.array(moved)
+                probability = np.prod([
+                    _binomial(c, k) * proportion**k * (1 - proportion)**(c - k)
+                    for c, k in zip(counts, moved)])
+                new_state = state.copy()
+                new_state[source] -= moved
+                new_state[dest] += moved
+                S[j, self._index[tuple(new_state.flat)]] += probability
+        self._mass_migration_cache[key] = S
+        return S
+
+
+@functools.lru_cache(maxsize=16)
+def _get_lineage_state_space(num_samples, track_sizes):
+    return _LineageStateSpace(num_samples, track_sizes)
+
+
+def _binomial(n, k):
+    return math.factorial(n) // (math.factorial(k) * math.factorial(n - k))
+
+
 class DemographyDebugger(object):
     """
     A class to facilitate debugging of population parameters and migration
@@ -1415,66 +2679,44 @@ class DemographyDebugger(object):
             demographic_events = []
         self.demographic_events = demographic_events
         self._precision = 3
-        # Make sure that we have a sample size of at least 2 so that we can
-        # initialise the simulator.
-        sample_size = None
-        if population_configurations is None:
-            sample_size = 2
-        else:
-            saved_sample_sizes = [
-                pop_config.sample_size for pop_config in population_configurations]
-            for pop_config in population_configurations:
-                pop_config.sample_size = 2
-        simulator = simulator_factory(
-            sample_size=sample_size, model=model, Ne=Ne,
-            population_configurations=population_configurations,
-            migration_matrix=migration_matrix,
-            demographic_events=demographic_events)
-        if len(simulator.model_change_events) > 0:
-            raise ValueError(
-                "Model changes not currently supported by the DemographyDebugger. "
-                "Please open an issue on GitHub if this feature would be useful to you")
-        assert len(simulator.model_change_events) == 0
-        self._make_epochs(simulator, sorted(demographic_events, key=lambda e: e.time))
-        self.simulation_model = simulator.model
+        self._coalescence_generator_cache = collections.OrderedDict()
+        self.simulation_model = model_factory(model, Ne)
+        (
+            self._epoch_start_times, self._epoch_end_times,
+            self._epoch_start_sizes, self._epoch_end_sizes,
+            self._epoch_growth_rates, self._epoch_migration_matrices,
+            self._epoch_events) = _compile_epochs(
+                self.simulation_model, population_configurations,
+                migration_matrix, demographic_events)
+        self.num_populations = self._epoch_start_sizes.shape[1]
+        self._epochs = None
 
-        if population_configurations is not None:
-            # Restore the saved sample sizes.
-            for pop_config, sample_size in zip(
-                    population_configurations, saved_sample_sizes):
-                pop_config.sample_size = sample_size
-
-    def _make_epochs(self, simulator, demographic_events):
-        self.epochs = []
-        self.num_populations = simulator.num_populations
-        ll_sim = simulator.create_ll_instance()
-        N = simulator.num_populations
-        start_time = 0
-        end_time = 0
-        abs_tol = 1e-9
-        event_index = 0
-        while not math.isinf(end_time):
-            events = []
-            while (
-                    event_index < len(demographic_events) and
-                    almost_equal(
-                        demographic_events[event_index].time,
-                        start_time, abs_tol=abs_tol)):
-                events.append(demographic_events[event_index])
-                event_index += 1
-            end_time = ll_sim.debug_demography()
-            m = ll_sim.get_migration_matrix()
-            migration_matrix = [[m[j * N + k] for k in range(N)] for j in range(N)]
-            growth_rates = [
-                conf["growth_rate"] for conf in ll_sim.get_population_configuration()]
-            populations = [
-                PopulationParameters(
-                    start_size=ll_sim.compute_population_size(j, start_time),
-                    end_size=ll_sim.compute_population_size(j, end_time),
-                    growth_rate=growth_rates[j]) for j in range(N)]
-            self.epochs.append(Epoch(
-                start_time, end_time, populations, migration_matrix, events))
-            start_time = end_time
+    @property
+    def epochs(self):
+        """
+        The list of Epoch objects describing the demographic parameters in
+        each epoch of the model.
+        """
+        # Creating the Epoch objects is comparatively expensive, and they are
+        # not needed by the numerical methods, so do this on demand.
+        if self._epochs is None:
+            self._epochs = []
+            for j in range(self.num_epochs):
+                populations = [
+                    PopulationParameters(
+                        start_size=start_size, end_size=end_size,
+                        growth_rate=growth_rate)
+                    for start_size, end_size, growth_rate in zip(
+                        self._epoch_start_sizes[j].tolist(),
+                        self._epoch_end_sizes[j].tolist(),
+                        self._epoch_growth_rates[j].tolist())]
+                self._epochs.append(Epoch(
+                    start_time=self._epoch_start_times[j].item(),
+                    end_time=self._epoch_end_times[j].item(),
+                    populations=populations,
+                    migration_matrix=self._epoch_migration_matrices[j].tolist(),
+                    demographic_events=self._epoch_events[j]))
+        return self._epochs
 
     def _print_populations(self, epoch, output):
         field_width = self._precision + 6
@@ -1555,12 +2797,22 @@ class DemographyDebugger(object):
             population, whose [i,j]th entry is the size of population
             j at time steps[i] ago.
         """
-        num_pops = self.num_populations
-        N_t = np.zeros([len(steps), num_pops])
-        for j, t in enumerate(steps):
-            N, _ = self._pop_size_and_migration_at_t(t)
-            N_t[j] = N
-        return N_t
+        _, N, _ = self._epoch_pop_size_and_migration_at(steps)
+        return N
+
+    def migration_matrix_trajectory(self, steps):
+        """
+        This function returns an array of the migration matrices defined by the
+        demographic model at the time points given by `steps`.
+
+        :param list steps: List of times ago at which the migration matrix
+            will be computed.
+        :return: Returns a numpy array of shape (len(steps), num_populations,
+            num_populations), whose [i,j,k]th entry is the migration rate
+            from population j to population k at time steps[i] ago.
+        """
+        _, _, M = self._epoch_pop_size_and_migration_at(steps)
+        return M
 
     def mean_coalescence_time(
             self, num_samples, min_pop_size=1, steps=None, rtol=0.005, max_iter=12):
@@ -1757,14 +3009,219 @@ class DemographyDebugger(object):
                     " numerical accuracy.")
         return r, p_t
 
+    def expected_sfs(self, num_samples, steps=None, min_pop_size=1):
+        """
+        Computes the expected site frequency spectrum of a sample with the
+        configuration given by `num_samples`, without simulation. The returned
+        array has length :math:`n + 1`, where :math:`n` is the total number of
+        samples, and its jth entry is the expected total length (in
+        generations) of the branches of the genealogy of the sample that
+        subtend exactly j samples, pooling the samples from all populations.
+        Multiplying by the per-generation mutation rate and the length of the
+        sequence gives the expected number of segregating sites at which
+        j samples carry the derived allele under the infinite sites model.
+
+        The expectation is computed by following the probabilities of the
+        states of the structured coalescent process of the sample, in which a
+        state records the number of lineages subtending each number of samples
+        in each population. The number of states grows very quickly with the
+        number of samples and populations, and so this is only practical for
+        small samples (for instance, up to about 20 samples in a single
+        population, or 10 samples in two populations). Within each interval
+        between consecutive steps and epoch boundaries, population sizes are
+        approximated by their value at the start of the interval, as for
+        :meth:`coalescence_rate_trajectory
+        <.DemographyDebugger.coalescence_rate_trajectory>`, and after the
+        last step population sizes are taken to be constant. The process is
+        then followed exactly, using the eigendecomposition of its generator
+        matrix, which is cached so that it is computed once for each epoch in
+        which population sizes are constant. Mass migrations are supported,
+        but bottlenecks are not.
+
+        :param list num_samples: A list of the same length as the number
+            of populations, so that `num_samples[j]` is the number of sampled
+            chromosomes in subpopulation `j`.
+        :param list steps: The times ago at which population sizes are
+            evaluated. If None (the default), the epoch boundaries are used,
+            along with 100 equally spaced times within each epoch of finite
+            length in which any population size changes. Growth in the final
+            epoch is not taken into account unless suitable steps are given.
+        :param int min_pop_size: See :meth:`coalescence_rate_trajectory
+            <.DemographyDebugger.coalescence_rate_trajectory>`.
+        :return: The expected branch lengths subtending each number of samples.
+        :rtype: numpy.ndarray
+        """
+        space = self._get_lineage_state_space(num_samples, track_sizes=True)
+        time = self._expected_time_in_states(space, steps, min_pop_size)
+        # The single lineage present after the MRCA does not contribute.
+        time[np.sum(space.num_lineages, axis=1) < 2] = 0
+        sfs = np.zeros(space.num_types + 1)
+        sfs[1:] = np.matmul(time, space.type_counts)
+        sfs[-1] = 0
+        return sfs
+
+    def expected_branch_length(self, num_samples, steps=None, min_pop_size=1):
+        """
+        Computes the expected total branch length (in generations) of the
+        genealogy of a sample with the configuration given by `num_samples`,
+        without simulation. This is the sum of the expected site frequency
+        spectrum computed by :meth:`expected_sfs
+        <.DemographyDebugger.expected_sfs>`, but is much cheaper to compute
+        as only the number of lineages in each population needs to be
+        followed. See :meth:`expected_sfs <.DemographyDebugger.expected_sfs>`
+        for details of the parameters and method.
+
+        :param list num_samples: A list of the same length as the number
+            of populations, so that `num_samples[j]` is the number of sampled
+            chromosomes in subpopulation `j`.
+        :param list steps: The times ago at which population sizes are
+            evaluated; see :meth:`expected_sfs <.DemographyDebugger.expected_sfs>`.
+        :param int min_pop_size: See :meth:`coalescence_rate_trajectory
+            <.DemographyDebugger.coalescence_rate_trajectory>`.
+        :return: The expected total branch length.
+        :rtype: float
+        """
+        space = self._get_lineage_state_space(num_samples, track_sizes=False)
+        time = self._expected_time_in_states(space, steps, min_pop_size)
+        num_lineages = np.sum(space.num_lineages, axis=1)
+        num_lineages[num_lineages < 2] = 0
+        return float(np.dot(time, num_lineages))
+
+    def lineage_count_trajectory(self, steps, num_samples, min_pop_size=1):
+        """
+        Computes the expected number of lineages of a sample with the
+        configuration given by `num_samples` in each population at each of
+        the times ago listed by `steps`, without simulation. Population sizes
+        are approximated by their value at the start of each interval between
+        consecutive steps and epoch boundaries; see :meth:`expected_sfs
+        <.DemographyDebugger.expected_sfs>` for details of the method.
+
+        :param list steps: The times ago at which the expected number of
+            lineages will be computed.
+        :param list num_samples: A list of the same length as the number
+            of populations, so that `num_samples[j]` is the number of sampled
+            chromosomes in subpopulation `j`.
+        :param int min_pop_size: See :meth:`coalescence_rate_trajectory
+            <.DemographyDebugger.coalescence_rate_trajectory>`.
+        :return: Returns a numpy array with one column per population, whose
+            [i,j]th entry is the expected number of lineages in population j
+            at time steps[i] ago.
+        :rtype: numpy.ndarray
+        """
+        space = self._get_lineage_state_space(num_samples, track_sizes=False)
+        steps = self._check_steps(steps)
+        P, _ = self._propagate_lineage_states(space, steps, min_pop_size)
+        return np.matmul(P, space.num_lineages)
+
+    def _get_lineage_state_space(self, num_samples, track_sizes):
+        if len(num_samples) != self.num_populations:
+            raise ValueError(
+                "`num_samples` must have the same length as the number of populations")
+        num_samples = tuple(operator.index(k) for k in num_samples)
+        if any(k < 0 for k in num_samples) or sum(num_samples) < 2:
+            raise ValueError(
+                "`num_samples` must be non-negative with a sum of at least 2")
+        for event in self.demographic_events:
+            if isinstance(event, (SimpleBottleneck, InstantaneousBottleneck)):
+                raise ValueError(
+                    "Bottleneck events are not supported for computing expectations")
+        return _get_lineage_state_space(num_samples, track_sizes)
+
+    def _check_steps(self, steps):
+        steps = np.array(steps, dtype=float).reshape(-1)
+        if not np.all(np.diff(steps) > 0):
+            raise ValueError("`steps` must be a sequence of increasing times.")
+        if np.any(steps < 0) or np.any(np.isinf(steps)):
+            raise ValueError("`steps` must be non-negative and finite")
+        return steps
+
+    def _expected_time_in_states(self, space, steps, min_pop_size):
+        """
+        Returns the expected total time that the lineages in the specified
+        state space spend in each state.
+        """
+        if steps is None:
+            epoch_times = list(self._epoch_start_times)
+            steps = [epoch_times]
+            for j in range(self.num_epochs - 1):
+                if np.any(self._epoch_growth_rates[j] != 0):
+                    steps.append(np.linspace(
+                        self._epoch_start_times[j], self._epoch_end_times[j], 101))
+            steps = np.unique(np.concatenate(steps))
+        steps = self._check_steps(steps)
+        _, time = self._propagate_lineage_states(
+            space, steps, min_pop_size, expected_time=True)
+        return time
+
+    def _propagate_lineage_states(
+            self, space, steps, min_pop_size, expected_time=False):
+        """
+        Returns a tuple (P, T), where P is the array of the probabilities of
+        the states of the specified state space at each of the specified
+        steps, and T is the expected time spent in each state, if
+        expected_time is True.
+        """
+        times = np.union1d(steps, self._epoch_start_times)
+        epoch_indexes, N, _ = self._epoch_pop_size_and_migration_at(times)
+        coalescence_rates = 1 / (2 * np.maximum(min_pop_size, N))
+        mass_migrations = collections.defaultdict(list)
+        for event in self.demographic_events:
+            if isinstance(event, MassMigration):
+                mass_migrations[event.time].append(event)
+        P = np.zeros((len(times), space.num_states))
+        T = np.zeros(space.num_states)
+        p = np.zeros(space.num_states)
+        p[0] = 1
+        # The states that the lineages can possibly be in.
+        possible = p > 0
+        for j, t in enumerate(times):
+            for event in mass_migrations[t]:
+                S = space.mass_migration(event.source, event.dest, event.proportion)
+                p = np.matmul(p, S)
+                possible = np.matmul(possible, S > 0)
+            M = self._epoch_migration_matrices[epoch_indexes[j]]
+            possible = space.reachable(possible, M)
+            p[~possible] = 0
+            P[j] = p
+            if j < len(times) - 1:
+                dt = times[j + 1] - t
+                d, Y, Yinv = self._get_lineage_generator(
+                    space, epoch_indexes[j], coalescence_rates[j])
+                x = np.matmul(p, Y)
+                if expected_time:
+                    # The integral of exp(s * d) for s from 0 to dt.
+                    integral = np.full(len(d), dt, dtype=d.dtype)
+                    nonzero = d != 0
+                    integral[nonzero] = np.expm1(dt * d[nonzero]) / d[nonzero]
+                    T += np.real(np.matmul(x * integral, Yinv))
+                p = np.real(np.matmul(x * np.exp(dt * d), Yinv))
+            elif expected_time:
+                # Add the expected time until all lineages have coalesced in
+                # the final interval, which is p_T (-G_T)^-1 where G_T is the
+                # generator restricted to the states with two or more lineages.
+                transient = np.logical_and(
+                    np.sum(space.num_lineages, axis=1) >= 2, possible)
+                G = space.generator(M, coalescence_rates[j])
+                G_T = G[np.ix_(transient, transient)]
+                try:
+                    T[transient] += np.linalg.solve(-G_T.T, p[transient])
+                except np.linalg.LinAlgError:
+                    raise ValueError(
+                        "The sample does not coalesce: the lineages in some "
+                        "populations can never reach each other")
+        return P[np.searchsorted(times, steps)], T
+
     def _calculate_coalescence_rate_trajectory(self, steps, num_samples, min_pop_size):
         num_pops = self.num_populations
-        P = np.zeros([num_pops**2, num_pops**2])
         IA = np.array(range(num_pops**2)).reshape([num_pops, num_pops])
-        Identity = np.eye(num_pops)
+        # We only need the total of the (num_pops^2, num_pops^2) matrix of
+        # probabilities P over the states of the sampled pair of lineages, and
+        # P is only ever multiplied on the right. We therefore propagate the
+        # column sums of P instead, which is a much cheaper vector-matrix product.
+        P = np.zeros(num_pops**2)
         for x in range(num_pops):
             for y in range(num_pops):
-                P[IA[x, y], IA[x, y]] = num_samples[x] * (num_samples[y] - (x == y))
+                P[IA[x, y]] = num_samples[x] * (num_samples[y] - (x == y))
         P = P / np.sum(P)
         # add epoch breaks if not there already but remember which steps they are
         epoch_breaks = list(set([0.0] + [t for t in self.epoch_times
@@ -1782,17 +3239,17 @@ class DemographyDebugger(object):
                 mass_migration_objects.append(demo)
                 mass_migration_times.append(demo.time)
         num_steps = len(steps_b)
+        epoch_indexes, N, _ = self._epoch_pop_size_and_migration_at(steps_b)
+        coalescence_rates = 1 / (2 * np.maximum(min_pop_size, N))
         # recall that steps_b[0] = 0.0
         r = np.zeros(num_steps)
         p_t = np.zeros(num_steps)
         for j in range(num_steps - 1):
             time = steps_b[j]
             dt = steps_b[j + 1] - steps_b[j]
-            N, M = self._pop_size_and_migration_at_t(time)
-            C = np.zeros([num_pops**2, num_pops**2])
-            for idx in range(num_pops):
-                C[IA[idx, idx], IA[idx, idx]] = 1 / (2 * max(min_pop_size, N[idx]))
-            dM = np.diag([sum(s) for s in M])
+            epoch_index = epoch_indexes[j]
+            C = np.zeros(num_pops**2)
+            C[np.diag(IA)] = coalescence_rates[j]
             if time in mass_migration_times:
                 idx = mass_migration_times.index(time)
                 a = mass_migration_objects[idx].source
@@ -1809,13 +3266,68 @@ class DemographyDebugger(object):
                         S[IA[x, a], IA[x, a]] = S[IA[a, x], IA[a, x]] = 1 - p
                 P = np.matmul(P, S)
             p_t[j] = np.sum(P)
-            r[j] = np.sum(np.matmul(P, C)) / np.sum(P)
-            G = (np.kron(M - dM, Identity) + np.kron(Identity, M - dM)) - C
-            P = np.matmul(P, _matrix_exponential(dt * G))
+            r[j] = np.dot(P, C) / p_t[j]
+            # Within an epoch in which all population sizes are constant the
+            # generator is the same for every step, and so the eigenvalues d
+            # and eigenvectors Y of the generator are computed once and reused
+            # to apply exp(dt * G) = Y exp(dt * d) Y^-1 to P for any dt.
+            d, Y, Yinv = self._get_coalescence_generator(epoch_index, C)
+            P = np.real_if_close(
+                np.matmul(np.matmul(P, Y) * np.exp(dt * d), Yinv), tol=1000)
         p_t[num_steps - 1] = np.sum(P)
-        r[num_steps - 1] = np.sum(np.matmul(P, C)) / np.sum(P)
+        r[num_steps - 1] = np.dot(P, C) / p_t[num_steps - 1]
         return r[keep_steps], p_t[keep_steps]
 
+    def _get_coalescence_generator(self, epoch_index, C):
+        """
+        Returns the eigendecomposition (d, Y, Y^-1) of the generator of the
+        process followed by a pair of lineages in the specified epoch, where
+        C gives the coalescence rate in each state. Decompositions are
+        cached, so that they are only computed once for each epoch in which
+        population sizes are constant.
+        """
+        def generator():
+            num_pops = self.num_populations
+            M = self._epoch_migration_matrices[epoch_index]
+            Q = M - np.diag(np.sum(M, axis=1))
+            Identity = np.eye(num_pops)
+            return (np.kron(Q, Identity) + np.kron(Identity, Q)) - np.diag(C)
+
+        return self._get_eigendecomposition((epoch_index, C.tobytes()), generator)
+
+    def _get_lineage_generator(self, space, epoch_index, coalescence_rates):
+        """
+        Returns the eigendecomposition (d, Y, Y^-1) of the generator of the
+        process followed by the lineages in the specified state space in the
+        specified epoch, where coalescence_rates gives the per-pair
+        coalescence rate in each population.
+        """
+        def generator():
+            return space.generator(
+                self._epoch_migration_matrices[epoch_index], coalescence_rates)
+
+        key = space, epoch_index, coalescence_rates.tobytes()
+        return self._get_eigendecomposition(key, generator)
+
+    def _get_eigendecomposition(self, key, generator):
+        """
+        Returns the eigendecomposition (d, Y, Y^-1) of the matrix returned by
+        the specified function, caching the result under the specified key.
+        """
+        cache = self._coalescence_generator_cache
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        G = generator()
+        d, Y = np.linalg.eig(G)
+        value = d, Y, np.linalg.pinv(Y)
+        cache[key] = value
+        # Limit the total size of the cached matrices, but always keep the
+        # most recent decomposition.
+        while len(cache) > 1 and len(cache) * G.size > _COALESCENCE_GENERATOR_CACHE_SIZE:
+            cache.popitem(last=False)
+        return value
+
     def _pop_size_and_migration_at_t(self, t):
         """
         Returns a tuple (N, M) of population sizes (N) and migration rates (M) at
@@ -1829,15 +3341,24 @@ class DemographyDebugger(object):
         :return: A tuple of arrays, of the same form as the population sizes and
             migration rate arrays of the demographic model.
         """
-        j = 0
-        while self.epochs[j].end_time <= t:
-            j += 1
-        N = self.population_size_history[:, j]
-        for i, pop in enumerate(self.epochs[j].populations):
-            s = t - self.epochs[j].start_time
-            g = pop.growth_rate
-            N[i] *= np.exp(-1 * g * s)
-        return N, self.epochs[j].migration_matrix
+        _, N, M = self._epoch_pop_size_and_migration_at([t])
+        return N[0], M[0]
+
+    def _epoch_pop_size_and_migration_at(self, times):
+        """
+        Returns a tuple (j, N, M) of the indexes of the epochs (j) containing
+        each of the specified times ago, and the arrays of population sizes
+        (N) and migration matrices (M) at those times, which have shapes
+        (len(times), num_pops) and (len(times), num_pops, num_pops).
+        """
+        times = np.array(times, dtype=float).reshape(-1)
+        # Epoch j contains the times t with start_time[j] <= t < end_time[j].
+        j = np.searchsorted(self._epoch_end_times, times, side="right")
+        j = np.minimum(j, self.num_epochs - 1)
+        dt = times - self._epoch_start_times[j]
+        N = self._epoch_start_sizes[j] * np.exp(
+            -self._epoch_growth_rates[j] * dt[:, np.newaxis])
+        return j, N, self._epoch_migration_matrices[j]
 
     @property
     def population_size_history(self):
@@ -1845,23 +3366,18 @@ class DemographyDebugger(object):
         Returns a (num_pops, num_epochs) numpy array giving the starting population size
         for each population in each epoch.
         """
-        num_pops = len(self.epochs[0].populations)
-        pop_size = np.zeros((num_pops, len(self.epochs)))
-        for j, epoch in enumerate(self.epochs):
-            for k, pop in enumerate(epoch.populations):
-                pop_size[k, j] = epoch.populations[k].start_size
-        return pop_size
+        return self._epoch_start_sizes.T.copy()
 
     @property
     def epoch_times(self):
         """
         Returns array of epoch times defined by the demographic model
         """
-        return np.array([x.start_time for x in self.epochs])
+        return self._epoch_start_times.copy()
 
     @property
     def num_epochs(self):
         """
         Returns the number of epochs defined by the demographic model.
         """
-        return len(self.epochs)
+        return len(self._epoch_start_times)
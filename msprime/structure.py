@@ -0,0 +1,236 @@
+#
+# Copyright (C) 2019 University of Oxford
+#
+# This file is part of msprime.
+#
+# msprime is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# msprime is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with msprime.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Module responsible for building standard models of population structure,
+such as island and stepping stone models, with large numbers of populations.
+"""
+import numpy as np
+
+from msprime import simulations
+
+
+def _population_array(value, num_populations, name):
+    array = np.asarray(value)
+    if array.shape == ():
+        return np.full(num_populations, value, dtype=array.dtype)
+    if array.shape != (num_populations,):
+        raise ValueError(
+            "{} must be a single value or have one value per population".format(name))
+    return array
+
+
+class PopulationStructure(object):
+    """
+    A model of population structure, consisting of a number of populations
+    and the sparse migration matrix between them, as returned by
+    :func:`.island_model`, :func:`.stepping_stone_model` and
+    :func:`.torus_model`. The :attr:`.population_configurations` and
+    :attr:`.migration_matrix` can be passed directly to :func:`.simulate`
+    or the :class:`.DemographyDebugger`. For example,
+
+    .. code-block:: python
+
+        model = msprime.stepping_stone_model((50, 50), 0.1, sample_size=1)
+        ts = msprime.simulate(
+            population_configurations=model.population_configurations,
+            migration_matrix=model.migration_matrix)
+
+    :ivar num_populations: The number of populations.
+    :vartype num_populations: int
+    :ivar sample_size: The number of samples drawn from each population.
+    :vartype sample_size: numpy.ndarray
+    :ivar initial_size: The initial size of each population, or None
+        for populations with the reference size.
+    :vartype initial_size: numpy.ndarray
+    :ivar growth_rate: The growth rate of each population.
+    :vartype growth_rate: numpy.ndarray
+    :ivar migration_matrix: The migration matrix between the populations.
+    :vartype migration_matrix: :class:`.SparseMigrationMatrix`
+    """
+    def __init__(
+            self, migration_matrix, sample_size=None, initial_size=None,
+            growth_rate=0):
+        N = migration_matrix.num_populations
+        self.num_populations = N
+        self.migration_matrix = migration_matrix
+        self.sample_size = _population_array(sample_size, N, "sample_size")
+        self.initial_size = _population_array(initial_size, N, "initial_size")
+        self.growth_rate = _population_array(growth_rate, N, "growth_rate")
+
+    @property
+    def population_configurations(self):
+        """
+        A new list of the :class:`.PopulationConfiguration` instances
+        describing the populations.
+        """
+        return [
+            simulations.PopulationConfiguration(
+                sample_size=None if sample_size is None else int(sample_size),
+                initial_size=None if initial_size is None else float(initial_size),
+                growth_rate=float(growth_rate))
+            for sample_size, initial_size, growth_rate in zip(
+                self.sample_size.tolist(), self.initial_size.tolist(),
+                self.growth_rate.tolist())]
+
+
+def _grid_shape(shape, num_dimensions=None):
+    shape = tuple(np.array(shape, dtype=int, ndmin=1).tolist())
+    if len(shape) not in (1, 2) or (
+            num_dimensions is not None and len(shape) != num_dimensions):
+        raise ValueError("shape must have {} dimensions".format(
+            "1 or 2" if num_dimensions is None else num_dimensions))
+    if any(n < 1 for n in shape):
+        raise ValueError("shape must be positive")
+    return shape
+
+
+def _grid_neighbours(shape, periodic):
+    """
+    Returns the arrays of the source and destination of each pair of
+    adjacent populations in a grid of the specified shape, in which the
+    populations are numbered in row-major order.
+    """
+    ids = np.arange(int(np.prod(shape))).reshape(shape)
+    source = []
+    dest = []
+    for axis, n in enumerate(shape):
+        for step in (-1, 1):
+            # The neighbour of each population in this direction.
+            neighbours = np.roll(ids, -step, axis=axis)
+            if periodic:
+                keep = np.ones(ids.shape, dtype=bool)
+            else:
+                index = np.arange(n) + step
+                valid = (index >= 0) & (index < n)
+                keep = np.broadcast_to(
+                    valid.reshape([n if j == axis else 1 for j in range(len(shape))]),
+                    ids.shape)
+            source.append(ids[keep])
+            dest.append(neighbours[keep])
+    source = np.concatenate(source)
+    dest = np.concatenate(dest)
+    # Small periodic grids wrap onto the same neighbour or themselves.
+    keep = source != dest
+    pairs = np.unique(np.stack((source[keep], dest[keep]), axis=1), axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def island_model(
+        num_populations, migration_rate, sample_size=None, initial_size=None,
+        growth_rate=0):
+    """
+    Returns the :class:`.PopulationStructure` of an island model, in which
+    there is migration between every pair of populations. The entries of the
+    migration matrix are sorted by source and then destination population,
+    and ``migration_rate`` can be either a single rate for every entry or an
+    array of the rates of the entries in this order.
+
+    :param int num_populations: The number of populations.
+    :param migration_rate: The rate of migration between each pair of
+        populations.
+    :type migration_rate: float or array_like
+    :param sample_size: The number of samples drawn from each population,
+        as a single value or one value per population.
+    :param initial_size: The initial size of each population, as a single
+        value or one value per population. Defaults to the reference
+        population size.
+    :param growth_rate: The growth rate of each population, as a single
+        value or one value per population.
+    :rtype: :class:`.PopulationStructure`
+    """
+    N = int(num_populations)
+    if N < 1:
+        raise ValueError("Must have at least one population")
+    source, dest = np.nonzero(~np.eye(N, dtype=bool))
+    migration_matrix = simulations.SparseMigrationMatrix(
+        N, source, dest, migration_rate)
+    return PopulationStructure(
+        migration_matrix, sample_size=sample_size, initial_size=initial_size,
+        growth_rate=growth_rate)
+
+
+def stepping_stone_model(
+        shape, migration_rate, periodic=False, sample_size=None,
+        initial_size=None, growth_rate=0):
+    """
+    Returns the :class:`.PopulationStructure` of a one or two dimensional
+    stepping stone model, in which there is migration between each
+    population and its neighbours on a line or a grid. The populations are
+    numbered in row-major order, so that the population in row ``j`` and
+    column ``k`` of a grid with ``n`` columns has ID ``j * n + k``. If
+    ``periodic`` is True the populations at the edges of the grid are
+    neighbours of the populations at the opposite edges, forming a circle
+    or a torus.
+
+    The entries of the migration matrix are sorted by source and then
+    destination population, and ``migration_rate`` can be either a single
+    rate for every entry or an array of the rates of the entries in this
+    order. The source and destination of the entries can be found by calling
+    this function with a single rate, and used to compute the rates.
+
+    :param shape: The number of populations on a line, or a tuple giving
+        the number of rows and columns of a grid.
+    :type shape: int or tuple
+    :param migration_rate: The rate of migration between neighbouring
+        populations.
+    :type migration_rate: float or array_like
+    :param bool periodic: If True, the populations at opposite edges are
+        neighbours. Defaults to False.
+    :param sample_size: The number of samples drawn from each population,
+        as a single value or one value per population.
+    :param initial_size: The initial size of each population, as a single
+        value or one value per population. Defaults to the reference
+        population size.
+    :param growth_rate: The growth rate of each population, as a single
+        value or one value per population.
+    :rtype: :class:`.PopulationStructure`
+    """
+    shape = _grid_shape(shape)
+    source, dest = _grid_neighbours(shape, periodic)
+    migration_matrix = simulations.SparseMigrationMatrix(
+        int(np.prod(shape)), source, dest, migration_rate)
+    return PopulationStructure(
+        migration_matrix, sample_size=sample_size, initial_size=initial_size,
+        growth_rate=growth_rate)
+
+
+def torus_model(
+        shape, migration_rate, sample_size=None, initial_size=None,
+        growth_rate=0):
+    """
+    Returns the :class:`.PopulationStructure` of a two dimensional stepping
+    stone model on a torus. This is equivalent to calling
+    :func:`.stepping_stone_model` with ``periodic=True``.
+
+    :param tuple shape: The number of rows and columns of the grid.
+    :param migration_rate: The rate of migration between neighbouring
+        populations.
+    :type migration_rate: float or array_like
+    :param sample_size: The number of samples drawn from each population,
+        as a single value or one value per population.
+    :param initial_size: The initial size of each population, as a single
+        value or one value per population. Defaults to the reference
+        population size.
+    :param growth_rate: The growth rate of each population, as a single
+        value or one value per population.
+    :rtype: :class:`.PopulationStructure`
+    """
+    return stepping_stone_model(
+        _grid_shape(shape, 2), migration_rate, periodic=True,
+        sample_size=sample_size, initial_size=initial_size, growth_rate=growth_rate)
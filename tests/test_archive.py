@@ -0,0 +1,271 @@
+#
+# Copyright (C) 2019 University of Oxford
+#
+# This file is part of msprime.
+#
+# msprime is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# msprime is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with msprime.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for the replicate archive format.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import msprime
+
+
+class TestReplicateArchive(unittest.TestCase):
+    """
+    Tests for writing and reading replicate archives.
+    """
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="msp_archive_")
+        self.path = os.path.join(self.temp_dir, "archive")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def get_replicates(self, num_replicates=5, **kwargs):
+        return list(msprime.simulate(
+            10, recombination_rate=1, mutation_rate=5, random_seed=5,
+            num_replicates=num_replicates, **kwargs))
+
+    def write_archive(self, replicates, kind):
+        with msprime.ReplicateArchiveWriter(self.path, kind) as writer:
+            self.assertEqual(writer.kind, kind)
+            for j, ts in enumerate(replicates):
+                self.assertEqual(writer.num_replicates, j)
+                writer.add(ts)
+            self.assertEqual(writer.num_replicates, len(replicates))
+        return msprime.ReplicateArchive(self.path)
+
+    def verify_tables(self, ts1, ts2):
+        t1 = ts1.dump_tables()
+        t2 = ts2.dump_tables()
+        self.assertEqual(t1, t2)
+
+    def test_haplotypes(self):
+        replicates = self.get_replicates()
+        archive = self.write_archive(replicates, "haplotypes")
+        self.assertEqual(archive.kind, "haplotypes")
+        self.assertEqual(len(archive), len(replicates))
+        self.assertEqual(archive.num_replicates, len(replicates))
+        # Read the replicates in reverse order to check random access.
+        for j in reversed(range(len(replicates))):
+            ts = replicates[j]
+            self.assertGreater(ts.num_sites, 0)
+            self.assertEqual(archive.sequence_length(j), ts.sequence_length)
+            self.assertEqual(archive.num_samples(j), ts.num_samples)
+            self.assertTrue(np.array_equal(
+                archive.positions(j), ts.tables.sites.position))
+            self.assertTrue(np.array_equal(
+                archive.haplotypes(j), ts.genotype_matrix().T))
+            self.assertTrue(np.array_equal(
+                archive.packed_haplotypes(j),
+                np.packbits(ts.genotype_matrix().T, axis=1)))
+        self.assertTrue(np.array_equal(
+            archive.haplotypes(-1), replicates[-1].genotype_matrix().T))
+        with self.assertRaises(ValueError):
+            archive.tree_sequence(0)
+        with self.assertRaises(ValueError):
+            archive.tables_dict(0)
+
+    def test_tables(self):
+        replicates = self.get_replicates()
+        archive = self.write_archive(replicates, "tables")
+        self.assertEqual(archive.kind, "tables")
+        self.assertEqual(len(archive), len(replicates))
+        for j in reversed(range(len(replicates))):
+            ts = replicates[j]
+            self.verify_tables(archive.tree_sequence(j), ts)
+            self.assertTrue(np.array_equal(
+                archive.positions(j), ts.tables.sites.position))
+            self.assertEqual(archive.num_samples(j), ts.num_samples)
+        with self.assertRaises(ValueError):
+            archive.haplotypes(0)
+        with self.assertRaises(ValueError):
+            archive.packed_haplotypes(0)
+
+    def test_simulation_result(self):
+        replicates = self.get_replicates(lazy=True)
+        archive = self.write_archive(replicates, "tables")
+        for j, result in enumerate(replicates):
+            self.verify_tables(archive.tree_sequence(j), result.tree_sequence)
+
+    def test_no_sites(self):
+        replicates = list(msprime.simulate(5, random_seed=1, num_replicates=2))
+        archive = self.write_archive(replicates, "haplotypes")
+        for j in range(2):
+            self.assertEqual(archive.positions(j).shape, (0,))
+            self.assertEqual(archive.haplotypes(j).shape, (5, 0))
+
+    def test_empty(self):
+        for kind in ["haplotypes", "tables"]:
+            archive = self.write_archive([], kind)
+            self.assertEqual(len(archive), 0)
+            with self.assertRaises(IndexError):
+                archive.positions(0)
+
+    def test_read_only_views(self):
+        archive = self.write_archive(self.get_replicates(), "tables")
+        positions = archive.positions(0)
+        self.assertFalse(positions.flags.writeable)
+        archive.close()
+        # Arrays read from the archive remain valid after it is closed.
+        self.assertEqual(len(positions), self.get_replicates()[0].num_sites)
+        with self.assertRaises(ValueError):
+            archive.positions(0)
+
+    def test_context_manager(self):
+        self.write_archive(self.get_replicates(1), "haplotypes")
+        with msprime.ReplicateArchive(self.path) as archive:
+            self.assertEqual(len(archive), 1)
+        with self.assertRaises(ValueError):
+            archive.haplotypes(0)
+
+    def test_index_errors(self):
+        archive = self.write_archive(self.get_replicates(3), "haplotypes")
+        for bad_index in [3, 100, -4]:
+            with self.assertRaises(IndexError):
+                archive.haplotypes(bad_index)
+
+    def test_bad_kind(self):
+        for bad_kind in ["", "trees", None]:
+            with self.assertRaises(ValueError):
+                msprime.ReplicateArchiveWriter(self.path, bad_kind)
+
+    def test_multiallelic_sites(self):
+        ts = self.get_replicates(1)[0]
+        tables = ts.dump_tables()
+        tables.mutations.add_row(
+            site=0, node=tables.mutations.node[0], derived_state="2")
+        tables.sort()
+        tables.build_index()
+        tables.compute_mutation_parents()
+        with msprime.ReplicateArchiveWriter(self.path) as writer:
+            with self.assertRaises(ValueError):
+                writer.add(tables.tree_sequence())
+
+    def test_add_after_close(self):
+        writer = msprime.ReplicateArchiveWriter(self.path)
+        writer.close()
+        writer.close()
+        with self.assertRaises(ValueError):
+            writer.add(self.get_replicates(1)[0])
+
+    def test_unclosed_archive(self):
+        replicates = self.get_replicates(3)
+        for kind in ["haplotypes", "tables"]:
+            writer = msprime.ReplicateArchiveWriter(self.path, kind)
+            for j, ts in enumerate(replicates):
+                writer.add(ts)
+                # The writer is never closed, as when the process is killed.
+                with msprime.ReplicateArchive(self.path) as archive:
+                    self.assertEqual(archive.kind, kind)
+                    self.assertEqual(len(archive), j + 1)
+                    self.assertTrue(np.array_equal(
+                        archive.positions(j), ts.tables.sites.position))
+            writer.close()
+            self.assertEqual(len(msprime.ReplicateArchive(self.path)), 3)
+
+    def test_append_unclosed_archive(self):
+        replicates = self.get_replicates(5)
+        writer = msprime.ReplicateArchiveWriter(self.path, "tables")
+        for ts in replicates[:2]:
+            writer.add(ts)
+        with msprime.ReplicateArchiveWriter(self.path, "tables", True) as writer:
+            self.assertEqual(writer.num_replicates, 2)
+            writer.add(replicates[2])
+        writer = msprime.ReplicateArchiveWriter(self.path, "tables", True)
+        for ts in replicates[3:]:
+            writer.add(ts)
+        with msprime.ReplicateArchive(self.path) as archive:
+            self.assertEqual(len(archive), 5)
+            for j, ts in enumerate(replicates):
+                self.verify_tables(archive.tree_sequence(j), ts)
+
+    def test_partly_written_record(self):
+        replicates = self.get_replicates(3)
+        writer = msprime.ReplicateArchiveWriter(self.path, "tables")
+        for ts in replicates[:2]:
+            writer.add(ts)
+        size = os.path.getsize(self.path)
+        writer.add(replicates[2])
+        with open(self.path, "rb") as f:
+            contents = f.read()
+        # Only some of the last record was written before the process died.
+        for end in [size + 1, size + 100, len(contents) - 10]:
+            with open(self.path, "wb") as f:
+                f.write(contents[:end])
+            with msprime.ReplicateArchive(self.path) as archive:
+                self.assertEqual(len(archive), 2)
+            with msprime.ReplicateArchiveWriter(self.path, "tables", True) as writer:
+                self.assertEqual(writer.num_replicates, 2)
+                writer.add(replicates[2])
+            with msprime.ReplicateArchive(self.path) as archive:
+                self.assertEqual(len(archive), 3)
+                for j, ts in enumerate(replicates):
+                    self.verify_tables(archive.tree_sequence(j), ts)
+
+    def test_bad_files(self):
+        for contents in [b"", b"12345", b"x" * 1000]:
+            with open(self.path, "wb") as f:
+                f.write(contents)
+            with self.assertRaises(ValueError):
+                msprime.ReplicateArchive(self.path)
+
+    def test_truncated_file(self):
+        self.write_archive(self.get_replicates(2), "tables")
+        with open(self.path, "rb") as f:
+            contents = f.read()
+        with open(self.path, "wb") as f:
+            f.write(contents[:-10])
+        with self.assertRaises(ValueError):
+            msprime.ReplicateArchive(self.path)
+
+    def test_append(self):
+        replicates = self.get_replicates(6)
+        self.write_archive(replicates[:2], "tables")
+        for j in range(2, 6):
+            with msprime.ReplicateArchiveWriter(self.path, "tables", True) as writer:
+                self.assertEqual(writer.num_replicates, j)
+                writer.add(replicates[j])
+        with msprime.ReplicateArchive(self.path) as archive:
+            self.assertEqual(len(archive), 6)
+            for j, ts in enumerate(replicates):
+                self.verify_tables(archive.tree_sequence(j), ts)
+
+    def test_append_new_file(self):
+        replicates = self.get_replicates(2)
+        with msprime.ReplicateArchiveWriter(self.path, append=True) as writer:
+            self.assertEqual(writer.num_replicates, 0)
+            for ts in replicates:
+                writer.add(ts)
+        with msprime.ReplicateArchive(self.path) as archive:
+            self.assertEqual(len(archive), 2)
+
+    def test_append_errors(self):
+        self.write_archive(self.get_replicates(1), "tables")
+        with self.assertRaises(ValueError):
+            msprime.ReplicateArchiveWriter(self.path, "haplotypes", append=True)
+        # The archive is unchanged.
+        self.assertEqual(len(msprime.ReplicateArchive(self.path)), 1)
+        with open(self.path, "wb") as f:
+            f.write(b"not an archive")
+        with self.assertRaises(ValueError):
+            msprime.ReplicateArchiveWriter(self.path, append=True)
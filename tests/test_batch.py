@@ -0,0 +1,255 @@
+#
+# Copyright (C) 2019 University of Oxford
+#
+# This file is part of msprime.
+#
+# msprime is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# msprime is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with msprime.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for running batches of simulations.
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import msprime
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="msp_batch_")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def get_jobs(self):
+        jobs = [
+            {
+                "sample_size": 10, "Ne": Ne, "recombination_rate": rate,
+                "length": 100, "mutation_rate": 0.01, "random_seed": seed}
+            for Ne in [1, 5] for rate in [0, 0.1] for seed in [1, 2]]
+        jobs.append({"sample_size": 5, "random_seed": 4, "model": "dtwf", "Ne": 20})
+        jobs.append({"sample_size": 6, "random_seed": 5, "end_time": 0.1})
+        return jobs
+
+    def verify_equal(self, ts1, ts2):
+        t1 = ts1.dump_tables()
+        t2 = ts2.dump_tables()
+        t1.provenances.clear()
+        t2.provenances.clear()
+        self.assertEqual(t1, t2)
+
+    def verify_job(self, job, ts):
+        job = dict(job)
+        job.pop("id", None)
+        self.verify_equal(ts, msprime.simulate(**job))
+
+
+class TestSimulateBatch(BatchTestCase):
+    """
+    Tests for the simulate_batch function.
+    """
+    def verify_output_dir(self, jobs, num_threads=None):
+        output_dir = os.path.join(self.temp_dir, "output")
+        num_run = msprime.simulate_batch(
+            jobs, output_dir=output_dir, num_threads=num_threads)
+        self.assertEqual(num_run, len(jobs))
+        self.assertEqual(len(os.listdir(output_dir)), len(jobs))
+        for j, job in enumerate(jobs):
+            job_id = str(job.get("id", j))
+            ts = msprime.load(os.path.join(output_dir, job_id + ".trees"))
+            self.verify_job(job, ts)
+        shutil.rmtree(output_dir)
+
+    def test_output_dir(self):
+        self.verify_output_dir(self.get_jobs())
+
+    def test_output_dir_threads(self):
+        for num_threads in [1, 3]:
+            self.verify_output_dir(self.get_jobs(), num_threads)
+
+    def test_ids(self):
+        jobs = self.get_jobs()
+        for j, job in enumerate(jobs):
+            job["id"] = "job_{}".format(j)
+        self.verify_output_dir(jobs)
+
+    def test_archive(self):
+        jobs = self.get_jobs()
+        for num_threads in [None, 2]:
+            path = os.path.join(self.temp_dir, "archive")
+            num_run = msprime.simulate_batch(
+                jobs, archive_path=path, num_threads=num_threads)
+            self.assertEqual(num_run, len(jobs))
+            with msprime.ReplicateArchive(path) as archive:
+                self.assertEqual(archive.kind, "tables")
+                self.assertEqual(len(archive), len(jobs))
+                for j, job in enumerate(jobs):
+                    self.verify_job(job, archive.tree_sequence(j))
+            os.unlink(path)
+
+    def test_haplotypes_archive(self):
+        jobs = self.get_jobs()
+        path = os.path.join(self.temp_dir, "archive")
+        msprime.simulate_batch(jobs, archive_path=path, archive_kind="haplotypes")
+        with msprime.ReplicateArchive(path) as archive:
+            self.assertEqual(archive.kind, "haplotypes")
+            self.assertEqual(len(archive), len(jobs))
+
+    def test_resume_output_dir(self):
+        jobs = self.get_jobs()
+        output_dir = os.path.join(self.temp_dir, "output")
+        self.assertEqual(msprime.simulate_batch(jobs[:3], output_dir=output_dir), 3)
+        os.unlink(os.path.join(output_dir, "1.trees"))
+        self.assertEqual(
+            msprime.simulate_batch(jobs, output_dir=output_dir), len(jobs) - 2)
+        self.assertEqual(msprime.simulate_batch(jobs, output_dir=output_dir), 0)
+        for j, job in enumerate(jobs):
+            ts = msprime.load(os.path.join(output_dir, "{}.trees".format(j)))
+            self.verify_job(job, ts)
+
+    def test_resume_archive(self):
+        jobs = self.get_jobs()
+        path = os.path.join(self.temp_dir, "archive")
+        self.assertEqual(msprime.simulate_batch(jobs[:4], archive_path=path), 4)
+        self.assertEqual(
+            msprime.simulate_batch(jobs, archive_path=path, num_threads=2),
+            len(jobs) - 4)
+        self.assertEqual(msprime.simulate_batch(jobs, archive_path=path), 0)
+        with msprime.ReplicateArchive(path) as archive:
+            self.assertEqual(len(archive), len(jobs))
+            for j, job in enumerate(jobs):
+                self.verify_job(job, archive.tree_sequence(j))
+
+    def test_interrupted_archive(self):
+        jobs = self.get_jobs()
+        jobs.insert(3, {"sample_size": 1})
+        path = os.path.join(self.temp_dir, "archive")
+        with self.assertRaises(ValueError):
+            msprime.simulate_batch(jobs, archive_path=path)
+        # The jobs before the failure are stored in the archive.
+        with msprime.ReplicateArchive(path) as archive:
+            self.assertEqual(len(archive), 3)
+        del jobs[3]
+        self.assertEqual(
+            msprime.simulate_batch(jobs, archive_path=path), len(jobs) - 3)
+        with msprime.ReplicateArchive(path) as archive:
+            for j, job in enumerate(jobs):
+                self.verify_job(job, archive.tree_sequence(j))
+
+    def test_structured_jobs(self):
+        population_configurations = [
+            msprime.PopulationConfiguration(5), msprime.PopulationConfiguration(5)]
+        demographic_events = [
+            msprime.MassMigration(time=0.5, source=1, dest=0),
+            msprime.PopulationParametersChange(time=1, initial_size=2)]
+        jobs = [
+            {
+                "population_configurations": population_configurations,
+                "migration_matrix": np.array([[0, 1], [1, 0]]),
+                "demographic_events": demographic_events, "random_seed": seed}
+            for seed in [1, 2]]
+        jobs.append({
+            "sample_size": 5, "random_seed": 3,
+            "recombination_map": msprime.RecombinationMap.uniform_map(10, 0.1)})
+        jobs.extend(self.get_jobs()[:2])
+        self.verify_output_dir(jobs)
+        self.verify_output_dir(jobs, num_threads=2)
+
+    def test_killed_archive(self):
+        jobs = self.get_jobs()
+        path = os.path.join(self.temp_dir, "archive")
+        # A writer that is never closed, as when the process is killed.
+        writer = msprime.ReplicateArchiveWriter(path, "tables")
+        for job in jobs[:3]:
+            writer.add(msprime.simulate(**job))
+        self.assertEqual(
+            msprime.simulate_batch(jobs, archive_path=path), len(jobs) - 3)
+        with msprime.ReplicateArchive(path) as archive:
+            self.assertEqual(len(archive), len(jobs))
+            for j, job in enumerate(jobs):
+                self.verify_job(job, archive.tree_sequence(j))
+
+    def test_random_seeds(self):
+        jobs = [{"sample_size": 10}, {"sample_size": 10}]
+        output_dir = os.path.join(self.temp_dir, "output")
+        msprime.simulate_batch(jobs, output_dir=output_dir)
+        seeds = []
+        for j in range(2):
+            ts = msprime.load(os.path.join(output_dir, "{}.trees".format(j)))
+            record = json.loads(ts.provenance(0).record)
+            seeds.append(record["parameters"]["random_seed"])
+            self.verify_job(dict(jobs[j], random_seed=seeds[-1]), ts)
+        self.assertNotEqual(seeds[0], seeds[1])
+
+    def test_bad_arguments(self):
+        jobs = self.get_jobs()
+        path = os.path.join(self.temp_dir, "archive")
+        with self.assertRaises(ValueError):
+            msprime.simulate_batch(jobs)
+        with self.assertRaises(ValueError):
+            msprime.simulate_batch(jobs, output_dir=self.temp_dir, archive_path=path)
+        for bad_threads in [0, -1]:
+            with self.assertRaises(ValueError):
+                msprime.simulate_batch(
+                    jobs, output_dir=self.temp_dir, num_threads=bad_threads)
+        with self.assertRaises(ValueError):
+            msprime.simulate_batch(
+                [{"sample_size": 2, "num_replicates": 2}], output_dir=self.temp_dir)
+        with self.assertRaises(ValueError):
+            msprime.simulate_batch(
+                [{"sample_size": 2, "id": 1}, {"sample_size": 2, "id": "1"}],
+                output_dir=self.temp_dir)
+        with self.assertRaises(TypeError):
+            msprime.simulate_batch(
+                [{"sample_size": 2, "not_a_parameter": 1}], output_dir=self.temp_dir)
+
+
+class TestReadBatchJobs(BatchTestCase):
+    """
+    Tests for reading the parameters of batch jobs from files.
+    """
+    def test_json_lines(self):
+        jobs = self.get_jobs()
+        path = os.path.join(self.temp_dir, "jobs.jsonl")
+        with open(path, "w") as f:
+            for job in jobs:
+                print(json.dumps(job), file=f)
+            print(file=f)
+        self.assertEqual(msprime.read_batch_jobs(path), jobs)
+
+    def test_csv(self):
+        path = os.path.join(self.temp_dir, "jobs.csv")
+        with open(path, "w") as f:
+            print("id,sample_size,Ne,model,record_migrations,random_seed", file=f)
+            print("001,10,0.5,hudson,true,1", file=f)
+            print("002,5,,dtwf,False,", file=f)
+        self.assertEqual(msprime.read_batch_jobs(path), [
+            {
+                "id": "001", "sample_size": 10, "Ne": 0.5, "model": "hudson",
+                "record_migrations": True, "random_seed": 1},
+            {
+                "id": "002", "sample_size": 5, "model": "dtwf",
+                "record_migrations": False}])
+
+    def test_empty(self):
+        for name in ["jobs.csv", "jobs.jsonl"]:
+            path = os.path.join(self.temp_dir, name)
+            with open(path, "w"):
+                pass
+            self.assertEqual(msprime.read_batch_jobs(path), [])
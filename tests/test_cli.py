@@ -19,15 +19,18 @@
 """
 Test cases for the command line interfaces to msprime
 """
+import gzip
 import io
 import itertools
 import os
 import random
+import shutil
 import sys
 import tempfile
 import unittest
 
 import newick
+import numpy as np
 import tskit
 
 import msprime
@@ -112,6 +115,19 @@ class TestRandomSeeds(unittest.TestCase):
             self.assertNotIn(s, seeds)
             seeds.add(s)
 
+    def test_replicate_seeds(self):
+        for seeds in [(1, 2, 3), (2**31, 1, 1), (5, 5, 5)]:
+            replicate_seeds = set()
+            for j in range(100):
+                seed = cli.get_replicate_seed(seeds, j)
+                self.assertEqual(seed, cli.get_replicate_seed(seeds, j))
+                self.assertGreater(seed, 0)
+                self.assertLess(seed, 2**32)
+                replicate_seeds.add(seed)
+            self.assertEqual(len(replicate_seeds), 100)
+        self.assertNotEqual(
+            cli.get_replicate_seed([1, 2, 3], 0), cli.get_replicate_seed([1, 2, 4], 0))
+
 
 class TestCli(unittest.TestCase):
     """
@@ -178,6 +194,16 @@ class TestMspmsArgumentParser(unittest.TestCase):
         parser = cli.get_mspms_parser()
         return parser.parse_args(args)
 
+    def test_archive(self):
+        args = self.parse_args(["4", "2", "-t", "5.0"])
+        self.assertIsNone(args.archive)
+        self.assertEqual(args.archive_kind, "haplotypes")
+        args = self.parse_args([
+            "4", "2", "-t", "5.0", "--archive", "out.archive", "--archive-kind",
+            "tables"])
+        self.assertEqual(args.archive, "out.archive")
+        self.assertEqual(args.archive_kind, "tables")
+
     def test_msdoc_examples(self):
         args = self.parse_args(["4", "2", "-t", "5.0"])
         self.assertEqual(args.sample_size, 4)
@@ -317,6 +343,17 @@ class TestMspmsCreateSimulationRunnerErrors(TestCli):
             CustomExceptionForTesting, cli.create_simulation_runner,
             self.parser, split_cmd[:2] + ["-f", self.temp_file])
 
+    def test_threads(self):
+        self.assert_parser_error("10 1 -T --threads")
+        self.assert_parser_error("10 1 -T --threads 0")
+        self.assert_parser_error("10 1 -T --threads -1")
+        self.assert_parser_error("10 1 -T --threads x")
+
+    def test_archive(self):
+        self.assert_parser_error("10 1 -T --archive")
+        self.assert_parser_error("10 1 -T --archive x --archive-kind")
+        self.assert_parser_error("10 1 -T --archive x --archive-kind trees")
+
     def test_trees_or_mutations(self):
         self.assert_parser_error("10 1")
         self.assert_parser_error("10 1 -G 1")
@@ -532,6 +569,21 @@ class TestMspmsCreateSimulationRunner(unittest.TestCase):
     def create_simulator(self, command_line):
         return self.create_runner(command_line).get_simulator()
 
+    def test_threads(self):
+        runner = self.create_runner("2 1 -T")
+        self.assertIsNone(runner.get_num_threads())
+        runner = self.create_runner("2 1 -T --threads 4")
+        self.assertEqual(runner.get_num_threads(), 4)
+
+    def test_archive(self):
+        runner = self.create_runner("2 1 -T")
+        self.assertIsNone(runner.get_archive())
+        runner = self.create_runner("2 1 -T --archive out.archive")
+        self.assertEqual(runner.get_archive(), ("out.archive", "haplotypes"))
+        runner = self.create_runner(
+            "2 1 -T --archive out.archive --archive-kind tables")
+        self.assertEqual(runner.get_archive(), ("out.archive", "tables"))
+
     def test_mutation_rates(self):
         # Mutation rates over a sequence length 1
         runner = self.create_runner("2 1 -t 1")
@@ -889,7 +941,7 @@ class TestMspmsOutput(TestCli):
     def verify_output(
             self, sample_size=2, num_loci=1, recombination_rate=0,
             num_replicates=1, mutation_rate=0.0, print_trees=True,
-            precision=3, random_seeds=[1, 2, 3]):
+            precision=3, random_seeds=[1, 2, 3], num_threads=None):
         """
         Runs the UI for the specified parameters, and parses the output
         to ensure it's consistent.
@@ -902,7 +954,7 @@ class TestMspmsOutput(TestCli):
             scaled_recombination_rate=recombination_rate,
             num_replicates=num_replicates, scaled_mutation_rate=mutation_rate,
             print_trees=print_trees, precision=precision,
-            random_seeds=random_seeds)
+            random_seeds=random_seeds, num_threads=num_threads)
         with open(self.temp_file, "w+") as f:
             sr.run(f)
             f.seek(0)
@@ -1027,6 +1079,86 @@ class TestMspmsOutput(TestCli):
         self.verify_output(random_seeds=None)
         self.verify_output(random_seeds=[2, 3, 4])
 
+    def test_threads_output(self):
+        for num_threads in [1, 2, 5]:
+            self.verify_output(
+                sample_size=10, mutation_rate=10, num_loci=10,
+                recombination_rate=10, num_replicates=7, num_threads=num_threads)
+            self.verify_output(
+                sample_size=5, mutation_rate=0, num_replicates=3,
+                num_threads=num_threads)
+
+    def get_output(self, **kwargs):
+        sr = cli.SimulationRunner(**kwargs)
+        output = io.StringIO()
+        sr.run(output)
+        return output.getvalue()
+
+    def test_threads_equivalence(self):
+        # The output must be the same for any number of threads, and the
+        # same as the serial output.
+        kwargs = {
+            "sample_size": 10, "num_loci": 100, "scaled_recombination_rate": 10,
+            "scaled_mutation_rate": 10, "num_replicates": 20, "print_trees": True,
+            "random_seeds": [5, 6, 7],
+            "population_configurations": [
+                msprime.PopulationConfiguration(5),
+                msprime.PopulationConfiguration(5)],
+            "migration_matrix": [[0, 1], [1, 0]]}
+        output = self.get_output(**kwargs)
+        for num_threads in [1, 2, 3, 8]:
+            self.assertEqual(output, self.get_output(num_threads=num_threads, **kwargs))
+        # Replicates are independent of each other.
+        replicates = output.split("\n//\n")[1:]
+        self.assertEqual(len(replicates), 20)
+        self.assertEqual(len(set(replicates)), 20)
+        kwargs["num_replicates"] = 5
+        self.assertEqual(
+            self.get_output(num_threads=2, **kwargs).split("\n//\n")[1:],
+            replicates[:5])
+
+    def verify_archive(self, num_threads=None):
+        kwargs = {
+            "sample_size": 10, "num_loci": 100, "scaled_recombination_rate": 10,
+            "scaled_mutation_rate": 10, "num_replicates": 5,
+            "random_seeds": [5, 6, 7], "num_threads": num_threads}
+        replicates = self.get_output(**kwargs).split("\n//\n")[1:]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "archive")
+            sr = cli.SimulationRunner(archive=path, **kwargs)
+            output = io.StringIO()
+            sr.run(output)
+            self.assertEqual(output.getvalue(), "")
+            archive = msprime.ReplicateArchive(path)
+            self.assertEqual(archive.kind, "haplotypes")
+            self.assertEqual(len(archive), len(replicates))
+            for j, replicate in enumerate(replicates):
+                lines = replicate.splitlines()
+                positions = [float(x) for x in lines[1].split()[1:]]
+                self.assertTrue(np.allclose(
+                    archive.positions(j) / archive.sequence_length(j),
+                    positions, atol=1e-3))
+                haplotypes = [
+                    "".join(map(str, row)) for row in archive.haplotypes(j)]
+                self.assertEqual(haplotypes, lines[2:])
+            archive.close()
+            sr = cli.SimulationRunner(archive=path, archive_kind="tables", **kwargs)
+            sr.run(output)
+            archive = msprime.ReplicateArchive(path)
+            self.assertEqual(archive.kind, "tables")
+            self.assertEqual(len(archive), len(replicates))
+            for j, replicate in enumerate(replicates):
+                ts = archive.tree_sequence(j)
+                self.assertEqual(
+                    [h for h in ts.haplotypes()], replicate.splitlines()[2:])
+
+    def test_archive(self):
+        self.verify_archive()
+
+    def test_archive_threads(self):
+        for num_threads in [1, 3]:
+            self.verify_archive(num_threads)
+
     def test_correct_streams(self):
         args = "15 1 -r 0 1.0 -eG 1.0 5.25 -eG 2.0 10 -G 4 -eN 3.0 1.0 -T"
         stdout, stderr = capture_output(cli.mspms_main, args.split())
@@ -1075,6 +1207,20 @@ class TestMspArgumentParser(unittest.TestCase):
         self.assertEqual(args.effective_population_size, 1)
         self.assertEqual(args.random_seed, None)
         self.assertEqual(args.compress, False)
+        self.assertEqual(args.num_replicates, 1)
+        self.assertEqual(args.archive, None)
+
+    def test_simulate_archive_args(self):
+        parser = cli.get_msp_parser()
+        args = parser.parse_args([
+            "simulate", "10", "out.archive", "--num-replicates", "20",
+            "--archive", "tables"])
+        self.assertEqual(args.num_replicates, 20)
+        self.assertEqual(args.archive, "tables")
+        args = parser.parse_args([
+            "simulate", "10", "out.archive", "--archive", "haplotypes"])
+        self.assertEqual(args.num_replicates, 1)
+        self.assertEqual(args.archive, "haplotypes")
 
     def test_simulate_short_args(self):
         parser = cli.get_msp_parser()
@@ -1109,6 +1255,34 @@ class TestMspArgumentParser(unittest.TestCase):
         self.assertEqual(args.random_seed, 123)
         self.assertEqual(args.compress, True)
 
+    def test_batch_default_values(self):
+        parser = cli.get_msp_parser()
+        args = parser.parse_args(["batch", "jobs.csv", "-o", "out"])
+        self.assertEqual(args.jobs, "jobs.csv")
+        self.assertEqual(args.output_dir, "out")
+        self.assertEqual(args.archive, None)
+        self.assertEqual(args.archive_kind, "tables")
+        self.assertEqual(args.threads, None)
+
+    def test_batch_long_args(self):
+        parser = cli.get_msp_parser()
+        args = parser.parse_args([
+            "batch", "jobs.jsonl", "--archive", "out.archive", "--archive-kind",
+            "haplotypes", "--threads", "4"])
+        self.assertEqual(args.jobs, "jobs.jsonl")
+        self.assertEqual(args.output_dir, None)
+        self.assertEqual(args.archive, "out.archive")
+        self.assertEqual(args.archive_kind, "haplotypes")
+        self.assertEqual(args.threads, 4)
+
+    def test_batch_errors(self):
+        parser = cli.get_msp_parser()
+        for bad_args in [
+                "batch jobs.csv", "batch jobs.csv -o out --archive x",
+                "batch jobs.csv -o out --threads 0"]:
+            with self.assertRaises(SystemExit):
+                capture_output(parser.parse_args, bad_args.split())
+
     def test_nodes_default_values(self):
         parser = cli.get_msp_parser()
         cmd = "nodes"
@@ -1239,24 +1413,30 @@ class TestMspArgumentParser(unittest.TestCase):
         args = parser.parse_args([cmd, tree_sequence])
         self.assertEqual(args.tree_sequence, tree_sequence)
         self.assertEqual(args.ploidy, 1)
+        self.assertEqual(args.processes, None)
+        self.assertEqual(args.compression, None)
 
     def test_vcf_short_args(self):
         parser = cli.get_msp_parser()
         cmd = "vcf"
         tree_sequence = "test.trees"
         args = parser.parse_args([
-            cmd, tree_sequence, "-P", "2"])
+            cmd, tree_sequence, "-P", "2", "-j", "4"])
         self.assertEqual(args.tree_sequence, tree_sequence)
         self.assertEqual(args.ploidy, 2)
+        self.assertEqual(args.processes, 4)
 
     def test_vcf_long_args(self):
         parser = cli.get_msp_parser()
         cmd = "vcf"
         tree_sequence = "test.trees"
         args = parser.parse_args([
-            cmd, tree_sequence, "--ploidy", "5"])
+            cmd, tree_sequence, "--ploidy", "5", "--processes", "3",
+            "--compression", "bgzf"])
         self.assertEqual(args.tree_sequence, tree_sequence)
         self.assertEqual(args.ploidy, 5)
+        self.assertEqual(args.processes, 3)
+        self.assertEqual(args.compression, "bgzf")
 
     def test_haplotypes_default_values(self):
         parser = cli.get_msp_parser()
@@ -1349,6 +1529,84 @@ class TestMspSimulateOutput(unittest.TestCase):
         self.assertEqual(tree_sequence.get_sequence_length(), 100)
         self.assertGreater(tree_sequence.get_num_mutations(), 0)
 
+    def test_archive(self):
+        for kind in ["haplotypes", "tables"]:
+            stdout, stderr = capture_output(cli.msp_main, [
+                "simulate", "10", self._tree_sequence, "-u", "2", "-r", "1",
+                "-s", "2", "--num-replicates", "4", "--archive", kind])
+            self.assertEqual(len(stdout), 0)
+            self.assertEqual(len(stderr), 0)
+            replicates = msprime.simulate(
+                10, mutation_rate=2, recombination_rate=1, random_seed=2,
+                num_replicates=4)
+            archive = msprime.ReplicateArchive(self._tree_sequence)
+            self.assertEqual(archive.kind, kind)
+            self.assertEqual(len(archive), 4)
+            for j, ts in enumerate(replicates):
+                self.assertTrue(np.array_equal(
+                    archive.positions(j), ts.tables.sites.position))
+                if kind == "tables":
+                    self.assertEqual(
+                        list(archive.tree_sequence(j).haplotypes()),
+                        list(ts.haplotypes()))
+                else:
+                    self.assertTrue(np.array_equal(
+                        archive.haplotypes(j), ts.genotype_matrix().T))
+            archive.close()
+
+    def test_num_replicates_requires_archive(self):
+        with self.assertRaises(SystemExit) as context:
+            cli.msp_main([
+                "simulate", "10", self._tree_sequence, "--num-replicates", "2"])
+        self.assertEqual(
+            context.exception.code, "Error: --num-replicates requires --archive")
+
+
+class TestMspBatchOutput(unittest.TestCase):
+    """
+    Tests the output of msp batch.
+    """
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="msp_cli_")
+        self.jobs_file = os.path.join(self.temp_dir, "jobs.csv")
+        with open(self.jobs_file, "w") as f:
+            print("id,sample_size,Ne,mutation_rate,random_seed", file=f)
+            for j in range(4):
+                print("job{},5,{},1,{}".format(j, j + 1, j + 1), file=f)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def verify_tree_sequence(self, j, ts):
+        expected = msprime.simulate(
+            5, Ne=j + 1, mutation_rate=1, random_seed=j + 1)
+        t1 = ts.dump_tables()
+        t2 = expected.dump_tables()
+        t1.provenances.clear()
+        t2.provenances.clear()
+        self.assertEqual(t1, t2)
+
+    def test_output_dir(self):
+        output_dir = os.path.join(self.temp_dir, "output")
+        stdout, stderr = capture_output(cli.msp_main, [
+            "batch", self.jobs_file, "-o", output_dir, "--threads", "2"])
+        self.assertEqual(len(stdout), 0)
+        self.assertEqual(len(stderr), 0)
+        for j in range(4):
+            ts = tskit.load(os.path.join(output_dir, "job{}.trees".format(j)))
+            self.verify_tree_sequence(j, ts)
+
+    def test_archive(self):
+        path = os.path.join(self.temp_dir, "archive")
+        stdout, stderr = capture_output(cli.msp_main, [
+            "batch", self.jobs_file, "--archive", path])
+        self.assertEqual(len(stdout), 0)
+        self.assertEqual(len(stderr), 0)
+        with msprime.ReplicateArchive(path) as archive:
+            self.assertEqual(len(archive), 4)
+            for j in range(4):
+                self.verify_tree_sequence(j, archive.tree_sequence(j))
+
 
 class TestMspConversionOutput(unittest.TestCase):
     """
@@ -1455,9 +1713,9 @@ class TestMspConversionOutput(unittest.TestCase):
         # TODO Check the actual output here.
         self.assertGreater(len(output_provenances), 0)
 
-    def verify_vcf(self, output_vcf):
+    def verify_vcf(self, output_vcf, ploidy=1):
         with tempfile.TemporaryFile("w+") as f:
-            self._tree_sequence.write_vcf(f)
+            self._tree_sequence.write_vcf(f, ploidy)
             f.seek(0)
             vcf = f.read()
         self.assertEqual(output_vcf, vcf)
@@ -1468,6 +1726,128 @@ class TestMspConversionOutput(unittest.TestCase):
         self.assertEqual(len(stderr), 0)
         self.verify_vcf(stdout)
 
+    def test_vcf_processes(self):
+        stdout, stderr = capture_output(
+            cli.msp_main, ["vcf", self._tree_sequence_file, "-j", "2"])
+        self.assertEqual(len(stderr), 0)
+        self.verify_vcf(stdout)
+
+    def test_vcf_regions(self):
+        self.assertGreater(self._tree_sequence.num_sites, 10)
+        for num_processes in [None, 1, 3]:
+            for sites_per_region in [1, 3, 10**6]:
+                for ploidy in [1, 2]:
+                    output = io.StringIO()
+                    cli.write_vcf(
+                        self._tree_sequence_file, output, ploidy, num_processes,
+                        sites_per_region=sites_per_region)
+                    self.verify_vcf(output.getvalue(), ploidy)
+
+    def test_vcf_no_sites(self):
+        ts = msprime.simulate(10, random_seed=1)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, "no_sites.trees")
+            ts.dump(filename)
+            expected = io.StringIO()
+            ts.write_vcf(expected)
+            for num_processes in [None, 2]:
+                output = io.StringIO()
+                cli.write_vcf(filename, output, num_processes=num_processes)
+                self.assertEqual(output.getvalue(), expected.getvalue())
+
+    def test_vcf_multiple_alleles(self):
+        ts = msprime.simulate(6, mutation_rate=2, random_seed=3)
+        tables = ts.dump_tables()
+        tables.mutations.clear()
+        for site in ts.sites():
+            node = site.mutations[0].node
+            tables.mutations.add_row(site.id, node, "1")
+            if site.id % 2 == 0:
+                tables.mutations.add_row(
+                    site.id, node, "2", parent=len(tables.mutations) - 1)
+        ts = tables.tree_sequence()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, "alleles.trees")
+            ts.dump(filename)
+            expected = io.StringIO()
+            ts.write_vcf(expected, 2)
+            for num_processes in [None, 2]:
+                output = io.StringIO()
+                cli.write_vcf(
+                    filename, output, 2, num_processes, sites_per_region=3)
+                self.assertEqual(output.getvalue(), expected.getvalue())
+
+    def test_vcf_compression(self):
+        for compression in ["gzip", "bgzf"]:
+            for num_processes in [None, 2]:
+                output = io.BytesIO()
+                cli.write_vcf(
+                    self._tree_sequence_file, output, 2, num_processes,
+                    compression, sites_per_region=5)
+                data = output.getvalue()
+                self.verify_vcf(gzip.decompress(data).decode(), 2)
+                if compression == "bgzf":
+                    self.assertTrue(data.endswith(cli._BGZF_EOF))
+
+    def verify_vcf_matches_tskit(self, ts, ploidy):
+        expected = io.StringIO()
+        ts.write_vcf(expected, ploidy)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, "vcf.trees")
+            ts.dump(filename)
+            for sites_per_region in [1, 4, 10**6]:
+                output = io.StringIO()
+                cli.write_vcf(
+                    filename, output, ploidy, sites_per_region=sites_per_region)
+                self.assertEqual(output.getvalue(), expected.getvalue())
+                for compression in ["gzip", "bgzf"]:
+                    output = io.BytesIO()
+                    cli.write_vcf(
+                        filename, output, ploidy, compression=compression,
+                        sites_per_region=sites_per_region)
+                    self.assertEqual(
+                        gzip.decompress(output.getvalue()).decode(),
+                        expected.getvalue())
+
+    def test_vcf_matches_tskit(self):
+        # The sequence length and site positions are not integers, so that
+        # the positions and contig length are rounded.
+        ts = msprime.simulate(12, mutation_rate=2, length=10.6, random_seed=5)
+        self.assertGreater(ts.num_sites, 10)
+        for ploidy in [1, 2, 3, 4, 12]:
+            self.verify_vcf_matches_tskit(ts, ploidy)
+        self.assertRaises(
+            ValueError, cli.write_vcf, self._tree_sequence_file, io.StringIO(), 0)
+
+    def test_vcf_individuals(self):
+        ts = msprime.simulate(9, mutation_rate=2, random_seed=6)
+        tables = ts.dump_tables()
+        individual = tables.nodes.individual
+        for nodes in [[0, 5], [1], [2, 3, 8], [4, 6, 7]]:
+            individual[nodes] = tables.individuals.add_row()
+        tables.nodes.individual = individual
+        self.verify_vcf_matches_tskit(tables.tree_sequence(), None)
+
+    def test_bgzf_blocks(self):
+        data = bytes(random.getrandbits(8) for _ in range(150000))
+        compressed = cli.bgzf_compress(data)
+        self.assertEqual(gzip.decompress(compressed), data)
+        # Walk through the blocks using the BSIZE field of each header.
+        offset = 0
+        sizes = []
+        while offset < len(compressed):
+            header = compressed[offset: offset + 18]
+            self.assertEqual(header[:4], bytes([31, 139, 8, 4]))
+            self.assertEqual(header[12:16], bytes([66, 67, 2, 0]))
+            block_size = int.from_bytes(header[16:18], "little") + 1
+            sizes.append(int.from_bytes(
+                compressed[offset + block_size - 4: offset + block_size], "little"))
+            offset += block_size
+        self.assertEqual(offset, len(compressed))
+        self.assertEqual(sizes, [0xff00, 0xff00, 150000 - 2 * 0xff00])
+        self.assertEqual(cli.bgzf_compress(b""), b"")
+        self.assertEqual(gzip.decompress(cli._BGZF_EOF), b"")
+
     def verify_haplotypes(self, output_haplotypes):
         haplotypes = list(self._tree_sequence.haplotypes())
         self.assertEqual(len(haplotypes), len(output_haplotypes))
@@ -29,6 +29,7 @@ from unittest import mock
 
 import numpy as np
 import scipy.linalg
+import scipy.sparse
 import tskit
 
 import msprime
@@ -128,6 +129,7 @@ class TestDemographicEventStr(unittest.TestCase):
         events = [
             msprime.PopulationParametersChange(0, initial_size=1),
             msprime.MigrationRateChange(0, 1),
+            msprime.MigrationMatrixChange(0, [[0]]),
             msprime.MassMigration(0, 0),
             msprime.SimulationModelChange(0, msprime.StandardCoalescent(1)),
             msprime.SimpleBottleneck(0),
@@ -595,6 +597,233 @@ class TestDemographyDebugger(unittest.TestCase):
             self.assertEqual(e.populations[1].end_size, n1)
 
 
+class TestEpochCompiler(unittest.TestCase):
+    """
+    Tests that the epochs computed by the DemographyDebugger without a
+    simulator agree with the state of the simulation engine.
+    """
+    def get_simulator_epochs(
+            self, population_configurations, migration_matrix, demographic_events,
+            model="hudson"):
+        population_configurations = [
+            msprime.PopulationConfiguration(
+                sample_size=2, initial_size=conf.initial_size,
+                growth_rate=conf.growth_rate)
+            for conf in population_configurations]
+        sim = msprime.simulator_factory(
+            Ne=10, model=model, population_configurations=population_configurations,
+            migration_matrix=migration_matrix,
+            demographic_events=demographic_events)
+        ll_sim = sim.create_ll_instance()
+        N = sim.num_populations
+        epochs = []
+        start_time = 0
+        end_time = 0
+        while not math.isinf(end_time):
+            end_time = ll_sim.debug_demography()
+            sizes = [
+                [ll_sim.compute_population_size(j, t) for j in range(N)]
+                for t in [start_time, end_time]]
+            growth_rates = [
+                conf["growth_rate"] for conf in ll_sim.get_population_configuration()]
+            M = np.array(ll_sim.get_migration_matrix()).reshape((N, N))
+            epochs.append((start_time, end_time, sizes, growth_rates, M))
+            start_time = end_time
+        return epochs
+
+    def verify(
+            self, population_configurations, migration_matrix=None,
+            demographic_events=[], model="hudson"):
+        dd = msprime.DemographyDebugger(
+            Ne=10, model=model, population_configurations=population_configurations,
+            migration_matrix=migration_matrix, demographic_events=demographic_events)
+        epochs = self.get_simulator_epochs(
+            population_configurations, migration_matrix, demographic_events, model)
+        self.assertEqual(dd.num_epochs, len(epochs))
+        for epoch, (start_time, end_time, sizes, growth_rates, M) in zip(
+                dd.epochs, epochs):
+            self.assertAlmostEqual(epoch.start_time, start_time)
+            self.assertAlmostEqual(epoch.end_time, end_time)
+            for j, pop in enumerate(epoch.populations):
+                self.assertTrue(np.isclose(pop.start_size, sizes[0][j]))
+                self.assertTrue(np.isclose(pop.end_size, sizes[1][j]))
+                self.assertAlmostEqual(pop.growth_rate, growth_rates[j])
+            self.assertTrue(np.allclose(epoch.migration_matrix, M))
+        events = [event for epoch in dd.epochs for event in epoch.demographic_events]
+        self.assertEqual(events, demographic_events)
+
+    def test_no_events(self):
+        self.verify([msprime.PopulationConfiguration()])
+        self.verify([
+            msprime.PopulationConfiguration(initial_size=5, growth_rate=0.1),
+            msprime.PopulationConfiguration(initial_size=2, growth_rate=-0.1)],
+            migration_matrix=[[0, 1], [2, 0]])
+
+    def test_population_parameter_changes(self):
+        for model in ["hudson", "dtwf"]:
+            self.verify(
+                [
+                    msprime.PopulationConfiguration(initial_size=100, growth_rate=0.01),
+                    msprime.PopulationConfiguration(initial_size=10)],
+                demographic_events=[
+                    msprime.PopulationParametersChange(0, initial_size=50),
+                    msprime.PopulationParametersChange(5, growth_rate=-0.02),
+                    msprime.PopulationParametersChange(
+                        5, growth_rate=0.1, population=1),
+                    msprime.PopulationParametersChange(
+                        12, initial_size=7, population=0),
+                    msprime.PopulationParametersChange(20, growth_rate=0)],
+                model=model)
+
+    def test_migration_rate_changes(self):
+        self.verify(
+            [msprime.PopulationConfiguration() for _ in range(3)],
+            migration_matrix=[[0, 1, 0], [0, 0, 1], [1, 0, 0]],
+            demographic_events=[
+                msprime.MigrationRateChange(1, rate=0.5, matrix_index=(0, 2)),
+                msprime.MassMigration(2, source=1, dest=0),
+                msprime.MigrationRateChange(2, rate=0.25),
+                msprime.MigrationRateChange(3, rate=0, matrix_index=(2, 1)),
+                msprime.InstantaneousBottleneck(4, population=0, strength=1),
+                msprime.CensusEvent(5)])
+
+    def test_arguments_not_modified(self):
+        population_configurations = [
+            msprime.PopulationConfiguration(sample_size=5),
+            msprime.PopulationConfiguration(initial_size=3)]
+        dd = msprime.DemographyDebugger(
+            Ne=20, population_configurations=population_configurations)
+        self.assertEqual(list(dd.population_size_history[:, 0]), [20, 3])
+        self.assertEqual(population_configurations[0].sample_size, 5)
+        self.assertIsNone(population_configurations[0].initial_size)
+        self.assertIsNone(population_configurations[1].sample_size)
+
+    def test_simulator_not_created(self):
+        with mock.patch("msprime.simulations.Simulator") as simulator:
+            msprime.DemographyDebugger(
+                population_configurations=[msprime.PopulationConfiguration()],
+                demographic_events=[msprime.MigrationRateChange(1, rate=0)])
+            simulator.assert_not_called()
+
+    def test_array_properties(self):
+        dd = msprime.DemographyDebugger(
+            population_configurations=[
+                msprime.PopulationConfiguration(initial_size=4),
+                msprime.PopulationConfiguration(initial_size=8)],
+            demographic_events=[
+                msprime.PopulationParametersChange(1, initial_size=2, population=1),
+                msprime.PopulationParametersChange(3, initial_size=1)])
+        self.assertTrue(np.array_equal(dd.epoch_times, [0, 1, 3]))
+        self.assertTrue(np.array_equal(
+            dd.population_size_history, [[4, 4, 1], [8, 2, 1]]))
+        self.assertEqual(dd.num_epochs, 3)
+        self.assertEqual(dd.num_populations, 2)
+
+    def test_bad_migration_matrix(self):
+        population_configurations = [
+            msprime.PopulationConfiguration(), msprime.PopulationConfiguration()]
+        for matrix in [[[0]], [[0, 1], [1, 0], [1, 1]], [[1, 0], [0, 0]],
+                       [[0, -1], [0, 0]]]:
+            with self.assertRaises(ValueError):
+                msprime.DemographyDebugger(
+                    population_configurations=population_configurations,
+                    migration_matrix=matrix)
+
+    def test_bad_events(self):
+        population_configurations = [
+            msprime.PopulationConfiguration(), msprime.PopulationConfiguration()]
+        for events in [
+                [msprime.MigrationRateChange(-1, rate=0)],
+                [msprime.MigrationRateChange(2, rate=0),
+                 msprime.MigrationRateChange(1, rate=0)],
+                [msprime.MigrationRateChange(1, rate=-1)],
+                [msprime.MigrationRateChange(1, rate=1, matrix_index=(0, 0))],
+                [msprime.MigrationRateChange(1, rate=1, matrix_index=(0, 2))],
+                [msprime.PopulationParametersChange(1, initial_size=1, population=2)],
+                [msprime.MassMigration(1, source=0, dest=2)],
+                [msprime.MassMigration(1, source=1, dest=1)]]:
+            with self.assertRaises(ValueError):
+                msprime.DemographyDebugger(
+                    population_configurations=population_configurations,
+                    demographic_events=events)
+        with self.assertRaises(TypeError):
+            msprime.DemographyDebugger(
+                population_configurations=population_configurations,
+                demographic_events=[None])
+
+
+class TestTimePointQueries(unittest.TestCase):
+    """
+    Tests for the population sizes and migration matrices returned by the
+    DemographyDebugger at arbitrary times.
+    """
+    def get_debugger(self):
+        return msprime.DemographyDebugger(
+            population_configurations=[
+                msprime.PopulationConfiguration(initial_size=100, growth_rate=0.01),
+                msprime.PopulationConfiguration(initial_size=10),
+                msprime.PopulationConfiguration(initial_size=1, growth_rate=-0.1)],
+            migration_matrix=[[0, 1, 0], [0, 0, 1], [1, 0, 0]],
+            demographic_events=[
+                msprime.PopulationParametersChange(5, growth_rate=0.05, population=1),
+                msprime.MigrationRateChange(5, rate=0.5),
+                msprime.PopulationParametersChange(10, initial_size=20),
+                msprime.MigrationRateChange(12, rate=2, matrix_index=(1, 0)),
+                msprime.PopulationParametersChange(20, growth_rate=0)])
+
+    def verify(self, dd, steps):
+        N = dd.population_size_trajectory(steps)
+        M = dd.migration_matrix_trajectory(steps)
+        num_pops = dd.num_populations
+        self.assertEqual(N.shape, (len(steps), num_pops))
+        self.assertEqual(M.shape, (len(steps), num_pops, num_pops))
+        for t, N_t, M_t in zip(steps, N, M):
+            epoch = [e for e in dd.epochs if e.start_time <= t < e.end_time][0]
+            for k, pop in enumerate(epoch.populations):
+                size = pop.start_size * math.exp(
+                    -pop.growth_rate * (t - epoch.start_time))
+                self.assertAlmostEqual(N_t[k], size)
+            self.assertTrue(np.array_equal(M_t, epoch.migration_matrix))
+
+    def test_random_times(self):
+        dd = self.get_debugger()
+        self.verify(dd, np.random.RandomState(5).uniform(0, 30, size=100))
+
+    def test_epoch_boundaries(self):
+        dd = self.get_debugger()
+        self.verify(dd, dd.epoch_times)
+        self.verify(dd, [0, 4.999, 5, 5.001, 12, 20, 100])
+
+    def test_unsorted_times(self):
+        dd = self.get_debugger()
+        steps = [25, 3, 11, 0, 6]
+        N = dd.population_size_trajectory(steps)
+        M = dd.migration_matrix_trajectory(steps)
+        for j in np.argsort(steps):
+            self.assertTrue(np.array_equal(N[j], dd.population_size_trajectory(
+                [steps[j]])[0]))
+            self.assertTrue(np.array_equal(M[j], dd.migration_matrix_trajectory(
+                [steps[j]])[0]))
+
+    def test_events_at_time_zero(self):
+        dd = msprime.DemographyDebugger(
+            population_configurations=[
+                msprime.PopulationConfiguration(initial_size=1),
+                msprime.PopulationConfiguration(initial_size=1)],
+            demographic_events=[
+                msprime.PopulationParametersChange(0, initial_size=3),
+                msprime.MigrationRateChange(0, rate=0.5)])
+        N = dd.population_size_trajectory([0, 1])
+        M = dd.migration_matrix_trajectory([0, 1])
+        self.assertTrue(np.array_equal(N, [[3, 3], [3, 3]]))
+        self.assertTrue(np.array_equal(M, [[[0, 0.5], [0.5, 0]]] * 2))
+
+    def test_empty_steps(self):
+        dd = self.get_debugger()
+        self.assertEqual(dd.population_size_trajectory([]).shape, (0, 3))
+        self.assertEqual(dd.migration_matrix_trajectory([]).shape, (0, 3, 3))
+
+
 class TestDemographyTrajectories(unittest.TestCase):
     """
     Tests that methods msprime.DemographyDebugger.population_size_trajectory
@@ -1073,6 +1302,250 @@ class TestDemographyTrajectories(unittest.TestCase):
         self.assertLess(abs(coaltime - coaltime2), 2)
 
 
+class TestCoalescenceRateTrajectoryPropagation(unittest.TestCase):
+    """
+    Tests that the coalescence rate trajectory is equal to a direct
+    calculation using full matrix exponentials of the generator.
+    """
+    def reference_trajectory(self, ddb, steps, num_samples, min_pop_size=1):
+        # Straightforward calculation using the full (num_pops^2, num_pops^2)
+        # probability matrix, without any mass migrations.
+        num_pops = ddb.num_populations
+        IA = np.arange(num_pops**2).reshape([num_pops, num_pops])
+        P = np.zeros([num_pops**2, num_pops**2])
+        for x in range(num_pops):
+            for y in range(num_pops):
+                P[IA[x, y], IA[x, y]] = num_samples[x] * (num_samples[y] - (x == y))
+        P /= np.sum(P)
+        r = np.zeros(len(steps))
+        p_t = np.zeros(len(steps))
+        for j, time in enumerate(steps):
+            N, M = ddb._pop_size_and_migration_at_t(time)
+            M = np.array(M)
+            C = np.zeros([num_pops**2, num_pops**2])
+            for k in range(num_pops):
+                C[IA[k, k], IA[k, k]] = 1 / (2 * max(min_pop_size, N[k]))
+            p_t[j] = np.sum(P)
+            r[j] = np.sum(np.matmul(P, C)) / p_t[j]
+            if j < len(steps) - 1:
+                Q = M - np.diag(np.sum(M, axis=1))
+                G = np.kron(Q, np.eye(num_pops)) + np.kron(np.eye(num_pops), Q) - C
+                P = np.matmul(P, scipy.linalg.expm((steps[j + 1] - time) * G))
+        return r, p_t
+
+    def get_example(self, num_pops, growth_rate):
+        random.seed(num_pops)
+        population_configurations = [
+            msprime.PopulationConfiguration(
+                initial_size=random.uniform(10, 100), growth_rate=growth_rate)
+            for _ in range(num_pops)]
+        migration_matrix = [
+            [random.uniform(0, 0.1) * (j != k) for k in range(num_pops)]
+            for j in range(num_pops)]
+        demographic_events = [
+            msprime.PopulationParametersChange(time=20, initial_size=50, growth_rate=0),
+            msprime.MigrationRateChange(time=40, rate=0.01)]
+        return msprime.DemographyDebugger(
+            population_configurations=population_configurations,
+            migration_matrix=migration_matrix,
+            demographic_events=demographic_events)
+
+    def verify(self, ddb, steps):
+        num_samples = [2] * ddb.num_populations
+        r1, p1 = ddb.coalescence_rate_trajectory(steps, num_samples)
+        r2, p2 = self.reference_trajectory(ddb, steps, num_samples)
+        self.assertTrue(np.allclose(r1, r2))
+        self.assertTrue(np.allclose(p1, p2))
+
+    def test_constant_sizes(self):
+        for num_pops in [1, 2, 3]:
+            ddb = self.get_example(num_pops, 0)
+            # Include the epoch boundaries, so that no extra steps are added.
+            self.verify(ddb, np.linspace(0, 100, 21))
+            self.verify(ddb, np.array([0, 5, 20, 21, 40, 100, 1000]))
+
+    def test_growth(self):
+        for num_pops in [1, 2, 3]:
+            ddb = self.get_example(num_pops, 0.01)
+            self.verify(ddb, np.linspace(0, 100, 101))
+
+    def test_generator_cache(self):
+        ddb = self.get_example(3, 0)
+        steps = np.linspace(0, 100, 101)
+        ddb.coalescence_rate_trajectory(steps, [2, 2, 2])
+        # There is one generator for each epoch.
+        self.assertEqual(len(ddb._coalescence_generator_cache), ddb.num_epochs)
+        r, p = ddb.coalescence_rate_trajectory(steps, [2, 2, 2])
+        self.assertEqual(len(ddb._coalescence_generator_cache), ddb.num_epochs)
+        ddb._coalescence_generator_cache.clear()
+        r2, p2 = ddb.coalescence_rate_trajectory(steps, [2, 2, 2])
+        self.assertTrue(np.array_equal(r, r2))
+        self.assertTrue(np.array_equal(p, p2))
+        # The generator depends on min_pop_size.
+        ddb.coalescence_rate_trajectory(steps, [2, 2, 2], min_pop_size=1000)
+        self.assertEqual(len(ddb._coalescence_generator_cache), 2 * ddb.num_epochs)
+
+    def test_cache_size_limit(self):
+        ddb = self.get_example(2, 0.01)
+        with mock.patch("msprime.simulations._COALESCENCE_GENERATOR_CACHE_SIZE", 160):
+            r1, p1 = ddb.coalescence_rate_trajectory(np.linspace(0, 100, 101), [2, 2])
+            self.assertEqual(len(ddb._coalescence_generator_cache), 10)
+        ddb._coalescence_generator_cache.clear()
+        r2, p2 = ddb.coalescence_rate_trajectory(np.linspace(0, 100, 101), [2, 2])
+        self.assertTrue(np.array_equal(r1, r2))
+        self.assertTrue(np.array_equal(p1, p2))
+
+
+class TestExpectedSfs(unittest.TestCase):
+    """
+    Tests for the expected site frequency spectrum, branch lengths and
+    lineage counts computed by the DemographyDebugger.
+    """
+    def get_two_population_example(self):
+        return msprime.DemographyDebugger(
+            population_configurations=[
+                msprime.PopulationConfiguration(initial_size=100),
+                msprime.PopulationConfiguration(initial_size=50)],
+            migration_matrix=[[0, 0.005], [0.01, 0]],
+            demographic_events=[
+                msprime.PopulationParametersChange(20, initial_size=200, population=1),
+                msprime.MassMigration(50, source=1, dest=0, proportion=0.7),
+                msprime.MigrationRateChange(50, rate=0.001)])
+
+    def test_constant_size(self):
+        N = 100
+        dd = msprime.DemographyDebugger(
+            population_configurations=[msprime.PopulationConfiguration(initial_size=N)])
+        for n in [2, 3, 5, 10]:
+            sfs = dd.expected_sfs([n])
+            self.assertEqual(sfs.shape, (n + 1,))
+            self.assertEqual(sfs[0], 0)
+            self.assertEqual(sfs[n], 0)
+            self.assertTrue(np.allclose(sfs[1:n], 4 * N / np.arange(1, n)))
+            self.assertAlmostEqual(
+                dd.expected_branch_length([n]), 4 * N * np.sum(1 / np.arange(1, n)))
+
+    def test_size_change(self):
+        # Two samples coalesce at rate 1 / (2 N0) until T, and at rate
+        # 1 / (2 N1) afterwards.
+        N0, N1, T = 100, 300, 50
+        dd = msprime.DemographyDebugger(
+            population_configurations=[msprime.PopulationConfiguration(initial_size=N0)],
+            demographic_events=[msprime.PopulationParametersChange(T, initial_size=N1)])
+        expected = 2 * N0 * (1 - np.exp(-T / (2 * N0))) + np.exp(-T / (2 * N0)) * 2 * N1
+        self.assertAlmostEqual(dd.expected_branch_length([2]), 2 * expected)
+        self.assertTrue(np.allclose(dd.expected_sfs([2]), [0, 2 * expected, 0]))
+
+    def test_split(self):
+        # Samples in isolated populations can only coalesce after they merge.
+        N, T = 100, 40
+        dd = msprime.DemographyDebugger(
+            population_configurations=[
+                msprime.PopulationConfiguration(initial_size=N),
+                msprime.PopulationConfiguration(initial_size=N)],
+            demographic_events=[msprime.MassMigration(T, source=1, dest=0)])
+        self.assertAlmostEqual(dd.expected_branch_length([1, 1]), 2 * (T + 2 * N))
+        trajectory = dd.lineage_count_trajectory([0, T / 2, T, T + 2 * N], [1, 1])
+        self.assertTrue(np.allclose(trajectory[:2], [[1, 1], [1, 1]]))
+        self.assertTrue(np.allclose(trajectory[2], [2, 0]))
+        self.assertTrue(np.allclose(trajectory[3], [1 + np.exp(-1), 0]))
+        dd = msprime.DemographyDebugger(
+            population_configurations=[
+                msprime.PopulationConfiguration(initial_size=N),
+                msprime.PopulationConfiguration(initial_size=N)])
+        with self.assertRaises(ValueError):
+            dd.expected_sfs([1, 1])
+
+    def test_sfs_consistent_with_branch_length(self):
+        dd = self.get_two_population_example()
+        for num_samples in [[2, 0], [1, 1], [3, 2], [0, 4]]:
+            sfs = dd.expected_sfs(num_samples)
+            self.assertAlmostEqual(
+                np.sum(sfs), dd.expected_branch_length(num_samples), places=6)
+
+    def test_pair_coalescence(self):
+        # For two samples, the expected number of lineages is one more than
+        # the probability that they have not coalesced.
+        for growth_rate in [0, 0.01]:
+            dd = msprime.DemographyDebugger(
+                population_configurations=[
+                    msprime.PopulationConfiguration(
+                        initial_size=100, growth_rate=growth_rate),
+                    msprime.PopulationConfiguration(initial_size=50)],
+                migration_matrix=[[0, 0.005], [0.01, 0]],
+                demographic_events=[
+                    msprime.PopulationParametersChange(30, growth_rate=0)])
+            steps = np.linspace(0, 300, 61)
+            for num_samples in [[2, 0], [1, 1], [0, 2]]:
+                _, p = dd.coalescence_rate_trajectory(
+                    steps, num_samples, double_step_validation=False)
+                trajectory = dd.lineage_count_trajectory(steps, num_samples)
+                self.assertTrue(np.allclose(np.sum(trajectory, axis=1), 1 + p))
+
+    def test_lineage_counts(self):
+        N = 100
+        dd = msprime.DemographyDebugger(
+            population_configurations=[msprime.PopulationConfiguration(initial_size=N)])
+        steps = np.array([0, 10, 100, 1000])
+        trajectory = dd.lineage_count_trajectory(steps, [2])
+        self.assertEqual(trajectory.shape, (4, 1))
+        self.assertTrue(np.allclose(trajectory[:, 0], 1 + np.exp(-steps / (2 * N))))
+        trajectory = dd.lineage_count_trajectory([0, 10], [5])
+        self.assertEqual(trajectory[0, 0], 5)
+        self.assertTrue(1 < trajectory[1, 0] < 5)
+
+    def test_simulation(self):
+        dd = self.get_two_population_example()
+        sfs = dd.expected_sfs([2, 2])
+        num_replicates = 2000
+        observed = np.zeros(5)
+        replicates = msprime.simulate(
+            population_configurations=[
+                msprime.PopulationConfiguration(2, 100),
+                msprime.PopulationConfiguration(2, 50)],
+            migration_matrix=[[0, 0.005], [0.01, 0]],
+            demographic_events=dd.demographic_events,
+            num_replicates=num_replicates, random_seed=2)
+        for ts in replicates:
+            tree = ts.first()
+            for u in tree.nodes():
+                if u != tree.root:
+                    observed[tree.num_samples(u)] += tree.branch_length(u)
+        observed /= num_replicates
+        self.assertTrue(np.allclose(sfs, observed, rtol=0.1))
+
+    def test_generator_cache(self):
+        dd = self.get_two_population_example()
+        sfs = dd.expected_sfs([2, 2])
+        # There is one generator for each epoch, except the last, in which
+        # the expected times are computed directly from the generator.
+        self.assertEqual(len(dd._coalescence_generator_cache), dd.num_epochs - 1)
+        dd.expected_sfs([2, 2])
+        self.assertEqual(len(dd._coalescence_generator_cache), dd.num_epochs - 1)
+        dd._coalescence_generator_cache.clear()
+        self.assertTrue(np.array_equal(sfs, dd.expected_sfs([2, 2])))
+
+    def test_bad_arguments(self):
+        dd = self.get_two_population_example()
+        for num_samples in [[2], [2, 2, 2], [1, 0], [-1, 3]]:
+            with self.assertRaises(ValueError):
+                dd.expected_sfs(num_samples)
+            with self.assertRaises(ValueError):
+                dd.expected_branch_length(num_samples)
+            with self.assertRaises(ValueError):
+                dd.lineage_count_trajectory([0, 1], num_samples)
+        for steps in [[1, 0], [-1, 1], [0, np.inf]]:
+            with self.assertRaises(ValueError):
+                dd.expected_sfs([2, 2], steps=steps)
+            with self.assertRaises(ValueError):
+                dd.lineage_count_trajectory(steps, [2, 2])
+        dd = msprime.DemographyDebugger(
+            population_configurations=[msprime.PopulationConfiguration()],
+            demographic_events=[msprime.InstantaneousBottleneck(1, 0, strength=1)])
+        with self.assertRaises(ValueError):
+            dd.expected_sfs([2])
+
+
 class TestMatrixExponential(unittest.TestCase):
     """
     Test cases for the matrix exponential function.
@@ -2618,3 +3091,448 @@ class TestCensusEvent(unittest.TestCase):
             sample_size=2, random_seed=525,
             demographic_events=[msprime.CensusEvent(time=2000)])
         self.assertEqual(ts.tables.nodes, tsc.tables.nodes)
+
+    def test_ll_representation(self):
+        for per_lineage in [False, True]:
+            event = msprime.CensusEvent(time=2, per_lineage=per_lineage)
+            self.assertEqual(event.get_ll_representation(1), {
+                "type": "census_event", "time": 2, "per_lineage": per_lineage})
+            self.assertGreater(len(str(event)), 0)
+
+    def test_per_lineage_multiple_trees(self):
+        census_time = 0.5
+        ts = msprime.simulate(
+                sample_size=5, random_seed=1, recombination_rate=0.4,
+                demographic_events=[
+                    msprime.CensusEvent(time=census_time, per_lineage=True)])
+        self.verify(ts, census_time)
+
+    def test_per_lineage_population_IDs(self):
+        census_time = 100
+        pop = msprime.PopulationConfiguration(sample_size=8, initial_size=500)
+        ts = msprime.simulate(
+            population_configurations=[pop, pop], length=1000,
+            demographic_events=[
+                msprime.CensusEvent(time=census_time, per_lineage=True),
+                msprime.MigrationRateChange(time=200, rate=0.05)],
+            recombination_rate=1e-5, random_seed=142)
+        self.verify(ts, census_time)
+        nodes = ts.tables.nodes
+        for row in ts.tables.edges:
+            if nodes.flags[row.parent] == msprime.NODE_IS_CEN_EVENT:
+                self.assertEqual(
+                    nodes.population[row.parent], nodes.population[row.child])
+
+    def test_per_lineage_same_ancestry(self):
+        census_time = 200
+        num_census_nodes = []
+        census_spans = []
+        for per_lineage in [False, True]:
+            ts = msprime.simulate(
+                sample_size=10, Ne=1000, length=1e6, recombination_rate=1e-7,
+                demographic_events=[
+                    msprime.CensusEvent(time=census_time, per_lineage=per_lineage)],
+                random_seed=5)
+            self.verify(ts, census_time)
+            census_nodes = np.where(
+                ts.tables.nodes.flags == msprime.NODE_IS_CEN_EVENT)[0]
+            num_census_nodes.append(len(census_nodes))
+            edges = ts.tables.edges
+            is_census = np.isin(edges.parent, census_nodes)
+            census_spans.append(np.sum((edges.right - edges.left)[is_census]))
+            # The edges of each census node do not overlap.
+            for u in census_nodes:
+                intervals = sorted(
+                    zip(edges.left[edges.parent == u], edges.right[edges.parent == u]))
+                for (_, right), (left, _) in zip(intervals[:-1], intervals[1:]):
+                    self.assertLessEqual(right, left)
+        # The simulations are identical up to the census, and so the census
+        # nodes cover the same segments of ancestry. Lineages carry many
+        # segments, so far fewer nodes are needed with one per lineage.
+        self.assertAlmostEqual(census_spans[0], census_spans[1])
+        self.assertLess(2 * num_census_nodes[1], num_census_nodes[0])
+
+
+class TestPopulationSizeHistory(unittest.TestCase):
+    """
+    Tests for the array-backed PopulationSizeHistory event.
+    """
+    def get_events(self):
+        times = np.array([10, 20, 25, 40, 60, 80])
+        sizes = np.array([500, 100, 2000, 50, 1000, 800])
+        growth_rates = np.array([0, 0.01, -0.02, 0.05, 0.001, 0])
+        history = msprime.PopulationSizeHistory(0, times, sizes, growth_rates)
+        parameter_changes = [
+            msprime.PopulationParametersChange(
+                t, initial_size=size, growth_rate=rate, population=0)
+            for t, size, rate in zip(times, sizes, growth_rates)]
+        return history, parameter_changes
+
+    def test_errors(self):
+        for times, sizes in [
+                ([], []), ([[1, 2]], [[1, 2]]), ([1, 2], [1]), ([1, 1], [1, 1]),
+                ([2, 1], [1, 1]), ([1, 2], [1, 0]), ([1, 2], [-1, 1])]:
+            self.assertRaises(
+                ValueError, msprime.PopulationSizeHistory, 0, times, sizes)
+        self.assertRaises(
+            ValueError, msprime.PopulationSizeHistory, 0, [1, 2], [1, 1], [0])
+
+    def test_ll_representation(self):
+        event = msprime.PopulationSizeHistory(1, [2, 3], [10, 20])
+        self.assertEqual(event.time, 2)
+        d = event.get_ll_representation(2)
+        self.assertEqual(d["type"], "population_size_history")
+        self.assertEqual(d["time"], 2)
+        self.assertEqual(d["population"], 1)
+        self.assertEqual(list(d["times"]), [2, 3])
+        self.assertEqual(list(d["initial_sizes"]), [10, 20])
+        self.assertEqual(list(d["growth_rates"]), [0, 0])
+        self.assertGreater(len(str(event)), 0)
+
+    def verify_debugger(self, events, equivalent_events, num_populations=1):
+        population_configurations = [
+            msprime.PopulationConfiguration(initial_size=1000)
+            for _ in range(num_populations)]
+        dd1 = msprime.DemographyDebugger(
+            population_configurations=population_configurations,
+            demographic_events=events)
+        dd2 = msprime.DemographyDebugger(
+            population_configurations=population_configurations,
+            demographic_events=equivalent_events)
+        self.assertTrue(np.array_equal(dd1.epoch_times, dd2.epoch_times))
+        self.assertTrue(np.array_equal(
+            dd1.population_size_history, dd2.population_size_history))
+        steps = np.linspace(0, 100, 401)
+        sizes = dd1.population_size_trajectory(steps)
+        self.assertTrue(np.array_equal(sizes, dd2.population_size_trajectory(steps)))
+        # Check the sizes against the simulation engine.
+        sim = msprime.simulator_factory(
+            Ne=1000, population_configurations=[
+                msprime.PopulationConfiguration(2, initial_size=1000)
+                for _ in range(num_populations)],
+            migration_matrix=np.ones((num_populations, num_populations)) - np.eye(
+                num_populations),
+            demographic_events=events)
+        ll_sim = sim.create_ll_instance()
+        start_time = 0
+        end_time = 0
+        while not math.isinf(end_time):
+            end_time = ll_sim.debug_demography()
+            for j, t in enumerate(steps):
+                if start_time <= t < end_time:
+                    for k in range(num_populations):
+                        self.assertAlmostEqual(
+                            ll_sim.compute_population_size(k, t), sizes[j, k])
+            start_time = end_time
+
+    def test_debugger(self):
+        history, parameter_changes = self.get_events()
+        self.verify_debugger([history], parameter_changes)
+
+    def test_debugger_replaced_by_later_change(self):
+        history, parameter_changes = self.get_events()
+        for population in [-1, 0]:
+            change = msprime.PopulationParametersChange(
+                40, growth_rate=0.02, population=population)
+            self.verify_debugger(
+                [history, change], parameter_changes[:4] + [change], 2)
+            change = msprime.PopulationParametersChange(
+                30, initial_size=20, population=population)
+            self.verify_debugger(
+                [history, change], parameter_changes[:3] + [change], 2)
+        # Changes to other populations do not affect the history.
+        change = msprime.PopulationParametersChange(30, initial_size=20, population=1)
+        self.verify_debugger(
+            [history, change], parameter_changes[:3] + [change] + parameter_changes[3:],
+            2)
+        other = msprime.PopulationSizeHistory(0, [50, 70], [10, 20])
+        self.verify_debugger(
+            [history, other],
+            parameter_changes[:4] + [
+                msprime.PopulationParametersChange(t, s, 0, population=0)
+                for t, s in [(50, 10), (70, 20)]])
+
+    def test_mean_coalescence_time(self):
+        history, _ = self.get_events()
+        dd = msprime.DemographyDebugger(Ne=1000, demographic_events=[history])
+        expected = dd.expected_branch_length([2]) / 2
+        num_replicates = 2000
+        times = np.zeros(num_replicates)
+        replicates = msprime.simulate(
+            2, Ne=1000, demographic_events=[history], random_seed=5,
+            num_replicates=num_replicates)
+        for j, ts in enumerate(replicates):
+            times[j] = ts.first().time(ts.first().root)
+        self.assertAlmostEqual(np.mean(times) / expected, 1, delta=0.1)
+
+    def test_dense_history_with_recombination(self):
+        times = np.arange(0, 5000, 0.5)
+        sizes = 1000 * (1.5 + np.sin(times / 100))
+        ts = msprime.simulate(
+            10, Ne=1000, length=1e5, recombination_rate=1e-8, random_seed=2,
+            demographic_events=[msprime.PopulationSizeHistory(0, times, sizes)])
+        self.assertGreater(ts.num_trees, 1)
+
+    def test_dtwf(self):
+        history, _ = self.get_events()
+        ts = msprime.simulate(
+            10, Ne=1000, model="dtwf", demographic_events=[history], random_seed=3)
+        self.assertEqual(ts.num_trees, 1)
+        self.assertEqual(ts.first().num_roots, 1)
+
+
+class TestPopulationSizeFunctions(unittest.TestCase):
+    """
+    Tests for the linear and logistic size functions of PopulationSizeHistory.
+    """
+    def get_linear_history(self):
+        return msprime.PopulationSizeHistory(
+            0, [0, 500, 1500, 3000], [1000, 3000, 200, 1500], size_function="linear")
+
+    def get_logistic_history(self):
+        return msprime.PopulationSizeHistory(
+            0, [0, 1000, 2500], [500, 1500, 800], [0.01, -0.005, -0.002],
+            size_function="logistic", carrying_capacities=[2000, 1000, 600])
+
+    def linear_size(self, history, t):
+        if t >= history.times[-1]:
+            return history.sizes[-1]
+        return np.interp(t, history.times, history.sizes)
+
+    def logistic_size(self, history, t):
+        k = np.searchsorted(history.times, t, side="right") - 1
+        dt = t - history.times[k]
+        K = history.carrying_capacities[k]
+        r = history.growth_rates[k]
+        return K / (1 + (K / history.sizes[k] - 1) * np.exp(r * dt))
+
+    def test_errors(self):
+        self.assertRaises(
+            ValueError, msprime.PopulationSizeHistory, 0, [0, 1], [1, 1],
+            size_function="quadratic")
+        self.assertRaises(
+            ValueError, msprime.PopulationSizeHistory, 0, [0, 1], [1, 1], [0, 0],
+            size_function="linear")
+        for size_function in ["exponential", "linear"]:
+            self.assertRaises(
+                ValueError, msprime.PopulationSizeHistory, 0, [0, 1], [1, 1],
+                size_function=size_function, carrying_capacities=[1, 1])
+        self.assertRaises(
+            ValueError, msprime.PopulationSizeHistory, 0, [0, 1], [1, 1], [0, 0],
+            size_function="logistic")
+        for carrying_capacities in [[1], [1, 2, 3], [1, 0], [-1, 1]]:
+            self.assertRaises(
+                ValueError, msprime.PopulationSizeHistory, 0, [0, 1], [1, 1],
+                [0, 0], size_function="logistic",
+                carrying_capacities=carrying_capacities)
+
+    def test_infinite_logistic_size(self):
+        # Going back in time, the size from time 10 becomes infinite after
+        # log(2) / 0.1 generations.
+        for times, epoch in [([0, 10], 1), ([0, 10, 20], 1), ([0, 10, 16], None)]:
+            growth_rates = [0.01, 0.1, 0][:len(times)]
+            sizes = [1, 2, 1][:len(times)]
+            kwargs = {
+                "size_function": "logistic",
+                "carrying_capacities": [2, 1, 1][:len(times)]}
+            if epoch is None:
+                history = msprime.PopulationSizeHistory(
+                    0, times, sizes, growth_rates, **kwargs)
+                ts = msprime.simulate(10, demographic_events=[history], random_seed=1)
+                self.assertEqual(ts.num_samples, 10)
+            else:
+                with self.assertRaisesRegex(ValueError, "epoch {}".format(epoch)):
+                    msprime.PopulationSizeHistory(
+                        0, times, sizes, growth_rates, **kwargs)
+
+    def test_ll_representation(self):
+        d = self.get_linear_history().get_ll_representation(1)
+        self.assertEqual(d["size_function"], _msprime.SIZE_FUNCTION_LINEAR)
+        self.assertNotIn("carrying_capacities", d)
+        d = self.get_logistic_history().get_ll_representation(1)
+        self.assertEqual(d["size_function"], _msprime.SIZE_FUNCTION_LOGISTIC)
+        self.assertEqual(list(d["carrying_capacities"]), [2000, 1000, 600])
+        d = msprime.PopulationSizeHistory(0, [0], [1]).get_ll_representation(1)
+        self.assertEqual(d["size_function"], _msprime.SIZE_FUNCTION_EXPONENTIAL)
+
+    def test_debugger_unsupported(self):
+        for history in [self.get_linear_history(), self.get_logistic_history()]:
+            self.assertRaises(
+                ValueError, msprime.DemographyDebugger, Ne=1000,
+                demographic_events=[history])
+
+    def verify_sizes(self, history, size):
+        sim = msprime.simulator_factory(2, Ne=1000, demographic_events=[history])
+        ll_sim = sim.create_ll_instance()
+        self.assertEqual(ll_sim.debug_demography(), 0)
+        self.assertTrue(math.isinf(ll_sim.debug_demography()))
+        for t in np.linspace(0, 4000, 81):
+            self.assertAlmostEqual(
+                ll_sim.compute_population_size(0, t) / size(history, t), 1)
+
+    def test_linear_sizes(self):
+        self.verify_sizes(self.get_linear_history(), self.linear_size)
+
+    def test_logistic_sizes(self):
+        self.verify_sizes(self.get_logistic_history(), self.logistic_size)
+
+    def verify_mean_coalescence_time(self, history, size):
+        # The mean time to the first coalescence of two lineages is the
+        # integral of the probability that they have not coalesced, with
+        # coalescence rate 1 / (2N) per generation.
+        t = np.linspace(0, 50000, 500001)
+        rate = 1 / (2 * np.array([size(history, x) for x in t]))
+        hazard = np.concatenate(
+            [[0], np.cumsum((rate[1:] + rate[:-1]) / 2 * np.diff(t))])
+        expected = np.trapz(np.exp(-hazard), t)
+        replicates = msprime.simulate(
+            2, Ne=1000, demographic_events=[history], random_seed=5,
+            num_replicates=2000)
+        times = [ts.first().time(ts.first().root) for ts in replicates]
+        self.assertAlmostEqual(np.mean(times) / expected, 1, delta=0.1)
+
+    def test_linear_mean_coalescence_time(self):
+        self.verify_mean_coalescence_time(self.get_linear_history(), self.linear_size)
+
+    def test_logistic_mean_coalescence_time(self):
+        self.verify_mean_coalescence_time(
+            self.get_logistic_history(), self.logistic_size)
+
+    def test_replaced_by_later_change(self):
+        history = self.get_linear_history()
+        change = msprime.PopulationParametersChange(250, growth_rate=0.001, population=0)
+        sim = msprime.simulator_factory(
+            2, Ne=1000, demographic_events=[history, change])
+        ll_sim = sim.create_ll_instance()
+        self.assertEqual(ll_sim.debug_demography(), 0)
+        self.assertEqual(ll_sim.debug_demography(), 250)
+        self.assertTrue(math.isinf(ll_sim.debug_demography()))
+        # The later change starts from the size of the history at its time.
+        self.assertAlmostEqual(ll_sim.compute_population_size(0, 250), 2000)
+        self.assertAlmostEqual(
+            ll_sim.compute_population_size(0, 350), 2000 * np.exp(-0.1))
+
+    def test_dtwf(self):
+        for history in [self.get_linear_history(), self.get_logistic_history()]:
+            ts = msprime.simulate(
+                10, Ne=1000, model="dtwf", demographic_events=[history],
+                random_seed=3)
+            self.assertEqual(ts.first().num_roots, 1)
+
+
+class TestMigrationMatrixChange(unittest.TestCase):
+    """
+    Tests for the MigrationMatrixChange event.
+    """
+    def get_matrices(self):
+        dense = [[0, 0, 0.5], [0.25, 0, 0], [0, 2, 0]]
+        return [
+            dense, np.array(dense), scipy.sparse.csr_matrix(dense),
+            msprime.SparseMigrationMatrix(3, [2, 0, 1], [1, 2, 0], [2, 0.5, 0.25])]
+
+    def test_ll_representation(self):
+        for matrix in self.get_matrices():
+            event = msprime.MigrationMatrixChange(5, matrix)
+            d = event.get_ll_representation(3)
+            self.assertEqual(d["type"], "migration_matrix_change")
+            self.assertEqual(d["time"], 5)
+            self.assertEqual(d["source"].dtype, np.int32)
+            self.assertEqual(d["dest"].dtype, np.int32)
+            entries = sorted(zip(d["source"], d["dest"], d["rate"]))
+            self.assertEqual(entries, [(0, 2, 0.5), (1, 0, 0.25), (2, 1, 2)])
+
+    def test_bad_shape(self):
+        for matrix in [
+                [[0, 1], [1, 0]], [0, 1, 1], np.zeros((3, 2)),
+                scipy.sparse.csr_matrix((2, 2)),
+                msprime.SparseMigrationMatrix(2, [0], [1], [1])]:
+            event = msprime.MigrationMatrixChange(1, matrix)
+            self.assertRaises(ValueError, event.get_ll_representation, 3)
+            self.assertRaises(
+                ValueError, msprime.simulate,
+                population_configurations=[
+                    msprime.PopulationConfiguration(2) for _ in range(3)],
+                migration_matrix=np.ones((3, 3)) - np.eye(3),
+                demographic_events=[event])
+
+    def test_bad_rates(self):
+        for matrix in [[[0, -1], [1, 0]], [[1, 1], [1, 0]]]:
+            events = [msprime.MigrationMatrixChange(1, matrix)]
+            population_configurations = [
+                msprime.PopulationConfiguration(2) for _ in range(2)]
+            migration_matrix = [[0, 1], [1, 0]]
+            self.assertRaises(
+                _msprime.InputError, msprime.simulate,
+                population_configurations=population_configurations,
+                migration_matrix=migration_matrix, demographic_events=events)
+            self.assertRaises(
+                ValueError, msprime.DemographyDebugger,
+                population_configurations=population_configurations,
+                migration_matrix=migration_matrix, demographic_events=events)
+
+    def verify_equivalent_rate_changes(self, model):
+        N = 4
+        population_configurations = [
+            msprime.PopulationConfiguration(3) for _ in range(N)]
+        migration_matrix = np.zeros((N, N))
+        for j in range(N):
+            migration_matrix[j, (j + 1) % N] = 1
+        new_matrix = np.zeros((N, N))
+        new_matrix[0, 2] = 0.5
+        new_matrix[1, 0] = 2
+        new_matrix[2, 3] = 1
+        new_matrix[3, 1] = 0.25
+        t = 0.5
+        rate_changes = [
+            msprime.MigrationRateChange(t, rate=new_matrix[j, k], matrix_index=(j, k))
+            for j in range(N) for k in range(N) if j != k]
+        for matrix in [new_matrix, scipy.sparse.coo_matrix(new_matrix)]:
+            tables = []
+            for events in [[msprime.MigrationMatrixChange(t, matrix)], rate_changes]:
+                ts = msprime.simulate(
+                    Ne=10, model=model,
+                    population_configurations=population_configurations,
+                    migration_matrix=migration_matrix, demographic_events=events,
+                    random_seed=12, record_migrations=True)
+                ts_tables = ts.dump_tables()
+                ts_tables.provenances.clear()
+                tables.append(ts_tables)
+            self.assertGreater(tables[0].migrations.num_rows, 0)
+            self.assertEqual(tables[0], tables[1])
+
+    def test_equivalent_rate_changes_hudson(self):
+        self.verify_equivalent_rate_changes("hudson")
+
+    def test_equivalent_rate_changes_dtwf(self):
+        self.verify_equivalent_rate_changes("dtwf")
+
+    def test_simulator_state(self):
+        population_configurations = [
+            msprime.PopulationConfiguration(2) for _ in range(3)]
+        for matrix in self.get_matrices():
+            sim = msprime.simulator_factory(
+                Ne=100, population_configurations=population_configurations,
+                migration_matrix=np.ones((3, 3)) - np.eye(3),
+                demographic_events=[msprime.MigrationMatrixChange(1, matrix)])
+            sim.run(end_time=2)
+            self.assertTrue(np.array_equal(
+                np.reshape(sim.ll_sim.get_migration_matrix(), (3, 3)),
+                self.get_matrices()[0]))
+
+    def test_demography_debugger(self):
+        population_configurations = [
+            msprime.PopulationConfiguration(2) for _ in range(3)]
+        for matrix in self.get_matrices():
+            dd = msprime.DemographyDebugger(
+                population_configurations=population_configurations,
+                migration_matrix=np.ones((3, 3)) - np.eye(3),
+                demographic_events=[
+                    msprime.MigrationRateChange(1, rate=3, matrix_index=(0, 1)),
+                    msprime.MigrationMatrixChange(1, matrix),
+                    msprime.MigrationRateChange(2, rate=3, matrix_index=(0, 1))])
+            self.assertEqual(len(dd.epochs), 3)
+            self.assertTrue(np.array_equal(
+                dd.epochs[1].migration_matrix, self.get_matrices()[0]))
+            expected = np.array(self.get_matrices()[0])
+            expected[0, 1] = 3
+            self.assertTrue(np.array_equal(dd.epochs[2].migration_matrix, expected))
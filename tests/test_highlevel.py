@@ -19,19 +19,25 @@
 """
 Test cases for the high level interface to msprime.
 """
+import concurrent.futures
 import datetime
+import io
 import json
 import os
+import pickle
 import random
 import shutil
+import subprocess
 import sys
 import tempfile
 import unittest
 import multiprocessing
 
 import numpy as np
+import scipy.sparse
 
 import msprime
+import _msprime
 import tests
 
 
@@ -412,6 +418,301 @@ class TestSimulator(HighLevelTestCase):
         self.assertRaises(ValueError, msprime.Simulator, [(0, 0)], recomb_map)
 
 
+class TestSimulationLimits(unittest.TestCase):
+    """
+    Tests for the wall time, event and memory limits on simulations.
+    """
+    def verify_limit_exceeded(self, limit, **kwargs):
+        with self.assertRaises(msprime.SimulationLimitExceeded) as context:
+            msprime.simulate(**kwargs)
+        e = context.exception
+        self.assertEqual(e.limit, limit)
+        self.assertIn(limit, str(e))
+        self.assertGreater(e.statistics["num_ancestors"], 0)
+        self.assertGreater(e.statistics["num_events"], 0)
+        self.assertGreater(e.statistics["used_memory"], 0)
+        self.assertGreaterEqual(e.statistics["wall_time"], 0)
+        self.assertGreater(e.statistics["time"], 0)
+        return e
+
+    def test_max_events(self):
+        e = self.verify_limit_exceeded(
+            "max_events", sample_size=100, recombination_rate=10, max_events=50,
+            random_seed=2)
+        self.assertEqual(e.statistics["num_events"], 50)
+        self.assertEqual(
+            e.statistics["num_common_ancestor_events"] +
+            e.statistics["num_recombination_events"], 50)
+
+    def test_max_events_model_change(self):
+        # The event limit applies to the whole simulation, not just the
+        # period between model changes.
+        e = self.verify_limit_exceeded(
+            "max_events", sample_size=100, recombination_rate=10, max_events=50,
+            random_seed=2, demographic_events=[
+                msprime.SimulationModelChange(1e-3, "smc"),
+                msprime.SimulationModelChange(2e-3, "hudson")])
+        self.assertEqual(e.statistics["num_events"], 50)
+
+    def test_max_memory(self):
+        e = self.verify_limit_exceeded(
+            "max_memory", sample_size=100, recombination_rate=100, max_memory=1,
+            random_seed=2)
+        self.assertGreater(e.statistics["used_memory"], 1)
+
+    def test_max_wall_time(self):
+        self.verify_limit_exceeded(
+            "max_wall_time", sample_size=1000, recombination_rate=100,
+            max_wall_time=1e-9, random_seed=2)
+
+    def test_limits_not_reached(self):
+        kwargs = {"sample_size": 10, "recombination_rate": 1, "random_seed": 2}
+        ts1 = msprime.simulate(**kwargs)
+        ts2 = msprime.simulate(
+            max_wall_time=1e6, max_events=10**9, max_memory=2**40, **kwargs)
+        self.assertEqual(ts1.tables.edges, ts2.tables.edges)
+        self.assertEqual(ts1.tables.nodes, ts2.tables.nodes)
+
+    def test_replicates(self):
+        replicates = msprime.simulate(
+            100, recombination_rate=10, num_replicates=5, max_events=50)
+        self.assertRaises(msprime.SimulationLimitExceeded, next, replicates)
+        self.assertRaises(StopIteration, next, replicates)
+
+    def test_simulator_reset(self):
+        sim = msprime.simulator_factory(100, recombination_rate=10)
+        self.assertRaises(msprime.SimulationLimitExceeded, sim.run, max_events=50)
+        self.assertEqual(sim.num_events, 50)
+        sim.reset()
+        self.assertEqual(sim.num_events, 0)
+        sim.run()
+        ts = sim.get_tree_sequence()
+        self.assertTrue(all(tree.num_roots == 1 for tree in ts.trees()))
+
+    def test_pickle(self):
+        statistics = {"time": 1.5, "num_events": 10, "num_ancestors": 2}
+        e = msprime.SimulationLimitExceeded("max_events", statistics)
+        other = pickle.loads(pickle.dumps(e))
+        self.assertEqual(other.limit, "max_events")
+        self.assertEqual(other.statistics, statistics)
+        self.assertEqual(str(other), str(e))
+
+    def test_bad_limits(self):
+        for name in ["max_wall_time", "max_events", "max_memory"]:
+            for bad_value in [0, -1]:
+                self.assertRaises(
+                    ValueError, msprime.simulate, 10, **{name: bad_value})
+                self.assertRaises(
+                    ValueError, msprime.simulate, 10, num_replicates=2,
+                    **{name: bad_value})
+            self.assertRaises(TypeError, msprime.simulate, 10, **{name: []})
+
+
+class TestSimulatorUpdate(unittest.TestCase):
+    """
+    Tests for updating the parameters of a simulator in place.
+    """
+    def get_epochs(self, ll_sim):
+        # Step through the demographic events of the low-level simulator,
+        # recording the end time and parameters of each epoch.
+        epochs = []
+        end_time = 0
+        while end_time != np.inf:
+            end_time = ll_sim.debug_demography()
+            epochs.append((
+                end_time, ll_sim.get_population_configuration(),
+                ll_sim.get_migration_matrix()))
+        ll_sim.reset()
+        return epochs
+
+    def verify_parameters(self, sim, **kwargs):
+        # The low-level state of the updated simulator must be the same as
+        # that of a new simulator created with the same parameters.
+        other = msprime.simulator_factory(**kwargs)
+        ll_sim = other.create_ll_instance()
+        self.assertEqual(sim.ll_sim.get_model(), ll_sim.get_model())
+        self.assertEqual(
+            sim.ll_sim.get_population_configuration(),
+            ll_sim.get_population_configuration())
+        self.assertEqual(
+            sim.ll_sim.get_migration_matrix(), ll_sim.get_migration_matrix())
+        self.assertAlmostEqual(
+            sim.ll_sim.get_recombination_rate(), ll_sim.get_recombination_rate())
+        self.assertEqual(self.get_epochs(sim.ll_sim), self.get_epochs(ll_sim))
+        self.assertEqual(sim.ll_sim.get_time(), 0)
+        sim.run()
+        ts = sim.get_tree_sequence()
+        self.assertEqual(ts.num_samples, len(sim.samples))
+        self.assertTrue(all(tree.num_roots == 1 for tree in ts.trees()))
+        return ts
+
+    def test_update_ne(self):
+        sim = msprime.simulator_factory(10, Ne=1)
+        sim.run()
+        sim.update(Ne=100)
+        self.assertEqual(sim.model.reference_size, 100)
+        self.assertEqual(sim.population_configurations[0].initial_size, 100)
+        self.verify_parameters(sim, sample_size=10, Ne=100)
+
+    def test_update_ne_explicit_sizes(self):
+        population_configurations = [
+            msprime.PopulationConfiguration(5, initial_size=2),
+            msprime.PopulationConfiguration(5)]
+        sim = msprime.simulator_factory(
+            population_configurations=population_configurations,
+            migration_matrix=[[0, 1], [1, 0]], Ne=1)
+        sim.run()
+        sim.update(Ne=4)
+        # Only the population sizes that default to Ne are updated.
+        sizes = [conf.initial_size for conf in sim.population_configurations]
+        self.assertEqual(sizes, [2, 4])
+        self.verify_parameters(
+            sim, population_configurations=[
+                msprime.PopulationConfiguration(5, initial_size=2),
+                msprime.PopulationConfiguration(5, initial_size=4)],
+            migration_matrix=[[0, 1], [1, 0]], Ne=4)
+
+    def test_update_all(self):
+        sim = msprime.simulator_factory(
+            population_configurations=[
+                msprime.PopulationConfiguration(5),
+                msprime.PopulationConfiguration(5, growth_rate=0.1)],
+            migration_matrix=[[0, 1], [1, 0]], Ne=1,
+            recombination_rate=0.5, length=10,
+            demographic_events=[msprime.MassMigration(10, 1, 0)])
+        for j in range(3):
+            sim.run()
+            kwargs = {
+                "Ne": j + 2,
+                "recombination_rate": j / 4,
+                "length": 10,
+                "population_configurations": [
+                    msprime.PopulationConfiguration(initial_size=j + 1),
+                    msprime.PopulationConfiguration(5, initial_size=1 / (j + 1))],
+                "migration_matrix": [[0, j], [1 / (j + 1), 0]],
+                "demographic_events": [
+                    msprime.PopulationParametersChange(0.5, growth_rate=0),
+                    msprime.MassMigration(j + 1, 1, 0)],
+            }
+            sim.update(**{k: v for k, v in kwargs.items() if k != "length"})
+            kwargs["population_configurations"][0].sample_size = 5
+            self.verify_parameters(sim, **kwargs)
+
+    def test_update_before_run(self):
+        sim = msprime.simulator_factory(
+            10, Ne=1, recombination_rate=1, length=10,
+            random_generator=msprime.RandomGenerator(5))
+        sim.update(Ne=2, recombination_rate=2)
+        self.assertIsNone(sim.ll_sim)
+        sim.run()
+        ts = sim.get_tree_sequence()
+        other = msprime.simulator_factory(
+            10, Ne=2, recombination_rate=2, length=10,
+            random_generator=msprime.RandomGenerator(5))
+        other.run()
+        self.assertEqual(ts.tables.nodes, other.get_tree_sequence().tables.nodes)
+
+    def test_update_recombination_map(self):
+        recomb_map = msprime.RecombinationMap([0, 5, 10], [1, 2, 0], num_loci=100)
+        sim = msprime.simulator_factory(10, recombination_map=recomb_map)
+        sim.run()
+        new_map = msprime.RecombinationMap([0, 2, 10], [4, 0.5, 0], num_loci=100)
+        sim.update(recombination_map=new_map)
+        self.assertIs(sim.recombination_map, new_map)
+        self.verify_parameters(sim, sample_size=10, recombination_map=new_map)
+
+    def test_update_demographic_events(self):
+        sim = msprime.simulator_factory(10, Ne=1)
+        sim.run()
+        demographic_events = [
+            msprime.SimulationModelChange(0.5, "smc"),
+            msprime.InstantaneousBottleneck(1, population=0, strength=100)]
+        sim.update(demographic_events=demographic_events)
+        self.assertEqual(len(sim.model_change_events), 1)
+        self.assertEqual(len(sim.demographic_events), 1)
+        ts = self.verify_parameters(
+            sim, sample_size=10, Ne=1, demographic_events=demographic_events)
+        self.assertLessEqual(ts.tables.nodes.time.max(), 1)
+        sim.update(Ne=2, demographic_events=[])
+        self.assertEqual(sim.model_change_events, [])
+        self.verify_parameters(sim, sample_size=10, Ne=2)
+
+    def test_bad_updates(self):
+        sim = msprime.simulator_factory(
+            population_configurations=[
+                msprime.PopulationConfiguration(5),
+                msprime.PopulationConfiguration(5)],
+            migration_matrix=[[0, 1], [1, 0]], recombination_rate=1, length=10)
+        sim.run()
+        for bad_ne in [0, -1]:
+            self.assertRaises(ValueError, sim.update, Ne=bad_ne)
+        self.assertRaises(
+            ValueError, sim.update, recombination_rate=1,
+            recombination_map=msprime.RecombinationMap.uniform_map(10, 1))
+        self.assertRaises(TypeError, sim.update, recombination_map="map")
+        for bad_map in [
+                msprime.RecombinationMap.uniform_map(11, 1),
+                msprime.RecombinationMap.uniform_map(10, 1, num_loci=2)]:
+            self.assertRaises(ValueError, sim.update, recombination_map=bad_map)
+        self.assertRaises(
+            TypeError, sim.update, population_configurations=[None, None])
+        self.assertRaises(
+            ValueError, sim.update,
+            population_configurations=[msprime.PopulationConfiguration(10)])
+        self.assertRaises(
+            ValueError, sim.update, population_configurations=[
+                msprime.PopulationConfiguration(10),
+                msprime.PopulationConfiguration(0)])
+        self.assertRaises(ValueError, sim.update, migration_matrix=[[0]])
+        self.assertRaises(TypeError, sim.update, demographic_events=[None])
+
+    def test_rejected_updates(self):
+        # Updates rejected by the low-level simulator leave all the
+        # parameters unchanged.
+        kwargs = {
+            "population_configurations": [
+                msprime.PopulationConfiguration(5),
+                msprime.PopulationConfiguration(5, initial_size=2)],
+            "migration_matrix": [[0, 1], [1, 0]],
+            "demographic_events": [msprime.MassMigration(1, 1, 0)],
+            "recombination_rate": 1, "length": 10, "Ne": 1}
+        sim = msprime.simulator_factory(**kwargs)
+        sim.run()
+        bad_updates = [
+            {"migration_matrix": [[0, -1], [1, 0]]},
+            {"Ne": 4, "migration_matrix": [[0, -1], [1, 0]]},
+            {"demographic_events": [msprime.MassMigration(1, 0, 2)]},
+            {
+                "Ne": 4, "recombination_rate": 2,
+                "population_configurations": [
+                    msprime.PopulationConfiguration(),
+                    msprime.PopulationConfiguration(growth_rate=1)],
+                "migration_matrix": [[0, 2], [2, 0]],
+                "demographic_events": [msprime.MassMigration(1, 0, 2)]}]
+        for bad_update in bad_updates:
+            recombination_map = sim.recombination_map
+            migration_matrix = sim._migration_matrix
+            population_configurations = sim.population_configurations
+            self.assertRaises(
+                (ValueError, _msprime.InputError), sim.update, **bad_update)
+            self.assertEqual(sim.model.reference_size, 1)
+            self.assertIs(sim.recombination_map, recombination_map)
+            self.assertIs(sim._migration_matrix, migration_matrix)
+            self.assertIs(sim.population_configurations, population_configurations)
+            sizes = [conf.initial_size for conf in sim.population_configurations]
+            self.assertEqual(sizes, [1, 2])
+            self.assertEqual(len(sim.demographic_events), 1)
+            self.verify_parameters(sim, **kwargs)
+
+    def test_ne_with_model_changes(self):
+        sim = msprime.simulator_factory(
+            10, demographic_events=[msprime.SimulationModelChange(1, "smc")])
+        self.assertRaises(ValueError, sim.update, Ne=2)
+        sim.update(Ne=2, demographic_events=[
+            msprime.SimulationModelChange(1, "smc")])
+        self.assertEqual(sim.model_change_events[0].model.reference_size, 2)
+
+
 class TestSimulatorFactory(unittest.TestCase):
     """
     Tests that the simulator factory high-level function correctly
@@ -562,6 +863,79 @@ class TestSimulatorFactory(unittest.TestCase):
         ll_sim = sim.create_ll_instance()
         self.assertEqual(ll_sim.get_migration_matrix(), [0.0])
 
+    def test_sparse_migration_matrix(self):
+        N = 5
+        pop_configs = [msprime.PopulationConfiguration(2) for _ in range(N)]
+        dense = np.zeros((N, N))
+        for j in range(N):
+            dense[j, (j + 1) % N] = 1
+            dense[j, (j - 1) % N] = 0.5
+        for sparse in [
+                scipy.sparse.coo_matrix(dense), scipy.sparse.csr_matrix(dense),
+                scipy.sparse.lil_matrix(dense)]:
+            sim = msprime.simulator_factory(
+                population_configurations=pop_configs, migration_matrix=sparse)
+            self.assertTrue(scipy.sparse.isspmatrix_coo(sim.migration_matrix))
+            self.assertTrue(np.array_equal(sim.migration_matrix.toarray(), dense))
+            ll_sim = sim.create_ll_instance()
+            self.assertEqual(ll_sim.get_migration_matrix(), list(dense.flatten()))
+            entries = ll_sim.get_sparse_migration_matrix()
+            self.assertEqual(len(entries["rate"]), 2 * N)
+            self.assertTrue(np.array_equal(
+                dense[entries["source"], entries["dest"]], entries["rate"]))
+            # The simulation is the same as for the dense matrix.
+            ts1 = msprime.simulate(
+                population_configurations=pop_configs, migration_matrix=sparse,
+                random_seed=2)
+            ts2 = msprime.simulate(
+                population_configurations=pop_configs, migration_matrix=dense,
+                random_seed=2)
+            self.assertEqual(ts1.tables.nodes, ts2.tables.nodes)
+            self.assertEqual(ts1.tables.edges, ts2.tables.edges)
+            dd = msprime.DemographyDebugger(
+                population_configurations=pop_configs, migration_matrix=sparse)
+            self.assertTrue(np.array_equal(dd.epochs[0].migration_matrix, dense))
+            sim.run()
+            events = np.array(sim.num_migration_events)
+            self.assertTrue(np.all(events[dense == 0] == 0))
+            self.assertEqual(sim.total_num_migration_events, np.sum(events))
+
+        # Duplicate entries are summed.
+        rows = [0, 0, 1]
+        cols = [1, 1, 0]
+        sim = msprime.simulator_factory(
+            population_configurations=pop_configs[:2],
+            migration_matrix=scipy.sparse.coo_matrix(([1, 2, 1], (rows, cols))))
+        self.assertEqual(sim.create_ll_instance().get_migration_matrix(), [0, 3, 1, 0])
+        for bad_shape in [(N - 1, N - 1), (N, N + 1)]:
+            self.assertRaises(
+                ValueError, msprime.simulator_factory,
+                population_configurations=pop_configs,
+                migration_matrix=scipy.sparse.coo_matrix(bad_shape))
+        for bad_matrix in [scipy.sparse.eye(N), -scipy.sparse.csr_matrix(dense)]:
+            sim = msprime.simulator_factory(
+                population_configurations=pop_configs, migration_matrix=bad_matrix)
+            self.assertRaises(_msprime.InputError, sim.create_ll_instance)
+
+    def test_sparse_migration_matrix_many_populations(self):
+        # A stepping stone model that would need a dense matrix with 6.25M
+        # entries.
+        N = 2500
+        source = np.arange(N)
+        dest = (source + 1) % N
+        matrix = scipy.sparse.coo_matrix(
+            (np.ones(2 * N), (np.hstack([source, dest]), np.hstack([dest, source]))),
+            shape=(N, N))
+        pop_configs = [msprime.PopulationConfiguration(0) for _ in range(N)]
+        pop_configs[0].sample_size = 2
+        pop_configs[N // 2].sample_size = 2
+        sim = msprime.simulator_factory(
+            population_configurations=pop_configs, migration_matrix=matrix,
+            random_generator=msprime.RandomGenerator(1))
+        sim.run(end_time=100)
+        self.assertGreater(sim.total_num_migration_events, 0)
+        self.assertEqual(len(sim.ll_sim.get_sparse_migration_matrix()["rate"]), 2 * N)
+
     def test_demographic_events(self):
         for bad_type in ["sdf", 234, [12], [None]]:
             self.assertRaises(
@@ -704,6 +1078,41 @@ class TestSimulatorFactory(unittest.TestCase):
         ll_sim = sim.create_ll_instance()
         self.assertEqual(ll_sim.get_samples(), samples)
 
+    def test_sample_arrays(self):
+        pop_configs = [
+            msprime.PopulationConfiguration(),
+            msprime.PopulationConfiguration()]
+        samples = [
+            msprime.Sample(population=0, time=0),
+            msprime.Sample(population=1, time=0.5),
+            msprime.Sample(population=1, time=1)]
+        structured = np.array(
+            [(s.population, s.time) for s in samples],
+            dtype=[("population", np.int32), ("time", np.float64)])
+        columns = {
+            "population": np.array([s.population for s in samples]),
+            "time": np.array([s.time for s in samples])}
+        for array_samples in [structured, columns]:
+            sim = msprime.simulator_factory(
+                Ne=1/4, samples=array_samples, population_configurations=pop_configs)
+            self.assertEqual(len(sim.samples), len(samples))
+            ll_sim = sim.create_ll_instance()
+            self.assertEqual(ll_sim.get_samples(), samples)
+
+    def test_bad_sample_arrays(self):
+        for bad_samples in [
+                {"population": [0, 0]},
+                {"time": [0, 0]},
+                {"population": [0.5, 0], "time": [0, 0]},
+                np.zeros(2, dtype=[("population", np.int32)])]:
+            self.assertRaises(
+                TypeError, msprime.simulator_factory, samples=bad_samples)
+        for bad_samples in [
+                {"population": [0, 0], "time": [0]},
+                {"population": [[0, 0]], "time": [[0, 0]]}]:
+            self.assertRaises(
+                ValueError, msprime.simulator_factory, samples=bad_samples)
+
 
 class TestSimulateInterface(unittest.TestCase):
     """
@@ -761,6 +1170,16 @@ class TestSimulateInterface(unittest.TestCase):
             self.assertEqual(ts.get_num_trees(), 1)
         self.assertEqual(num_replicates, count)
 
+    def test_sample_arrays_equal_list(self):
+        samples = [msprime.Sample(0, 0), msprime.Sample(0, 0), msprime.Sample(0, 1)]
+        array_samples = {
+            "population": np.zeros(3, dtype=np.int64),
+            "time": np.array([0, 0, 1.0])}
+        ts1 = msprime.simulate(samples=samples, random_seed=5)
+        ts2 = msprime.simulate(samples=array_samples, random_seed=5)
+        self.assertEqual(ts1.tables.nodes, ts2.tables.nodes)
+        self.assertEqual(ts1.tables.edges, ts2.tables.edges)
+
     def test_mutations(self):
         n = 10
         ts = msprime.simulate(n, mutation_rate=10)
@@ -807,11 +1226,344 @@ class TestSimulateInterface(unittest.TestCase):
             self.assertEqual(t, tables[0])
 
 
+class TestLazySimulation(unittest.TestCase):
+    """
+    Tests for the lazy=True option to simulate.
+    """
+    def verify_result(self, result):
+        self.assertIsInstance(result, msprime.SimulationResult)
+        ts = result.tree_sequence
+        self.assertIsInstance(ts, msprime.TreeSequence)
+        self.assertIs(ts, result.tree_sequence)
+        self.assertEqual(result.sequence_length, ts.sequence_length)
+        self.assertEqual(result.num_nodes, ts.num_nodes)
+        self.assertEqual(result.num_edges, ts.num_edges)
+        self.assertEqual(result.num_samples, ts.num_samples)
+        self.assertEqual(result.num_sites, ts.num_sites)
+        self.assertEqual(result.num_mutations, ts.num_mutations)
+        self.assertEqual(result.num_trees, ts.num_trees)
+        self.assertTrue(np.array_equal(
+            result.breakpoints(), np.array(list(ts.breakpoints()))))
+        root_time = max(tree.time(root) for tree in ts.trees() for root in tree.roots)
+        self.assertEqual(result.max_root_time, root_time)
+
+    def verify_equal(self, ts1, ts2):
+        t1 = ts1.dump_tables()
+        t2 = ts2.dump_tables()
+        t1.provenances.clear()
+        t2.provenances.clear()
+        self.assertEqual(t1, t2)
+
+    def test_single_replicate(self):
+        result = msprime.simulate(10, recombination_rate=1, random_seed=2, lazy=True)
+        self.verify_result(result)
+        self.assertEqual(result.tree_sequence.num_provenances, 1)
+        ts = msprime.simulate(10, recombination_rate=1, random_seed=2)
+        self.verify_equal(ts, result.tree_sequence)
+
+    def test_replicates(self):
+        kwargs = {"recombination_rate": 2, "mutation_rate": 2, "random_seed": 5}
+        results = list(msprime.simulate(10, num_replicates=5, lazy=True, **kwargs))
+        replicates = msprime.simulate(10, num_replicates=5, **kwargs)
+        for result, ts in zip(results, replicates):
+            self.verify_result(result)
+            self.verify_equal(ts, result.tree_sequence)
+
+    def test_end_time(self):
+        result = msprime.simulate(
+            10, recombination_rate=2, end_time=0.1, random_seed=3, lazy=True)
+        self.verify_result(result)
+        self.assertGreater(result.tree_sequence.first().num_roots, 1)
+        self.assertEqual(result.max_root_time, 0.1)
+
+    def test_population_metadata(self):
+        pop_configs = [
+            msprime.PopulationConfiguration(sample_size=2, metadata={"x": 1}),
+            msprime.PopulationConfiguration(sample_size=2)]
+        result = msprime.simulate(
+            population_configurations=pop_configs, migration_matrix=[[0, 1], [1, 0]],
+            random_seed=4, lazy=True)
+        self.verify_result(result)
+        ts = msprime.simulate(
+            population_configurations=pop_configs, migration_matrix=[[0, 1], [1, 0]],
+            random_seed=4)
+        self.verify_equal(ts, result.tree_sequence)
+
+    def test_from_ts(self):
+        base_ts = msprime.simulate(10, end_time=0.1, random_seed=5)
+        result = msprime.simulate(from_ts=base_ts, random_seed=6, lazy=True)
+        self.verify_result(result)
+        self.assertEqual(result.tree_sequence.first().num_roots, 1)
+
+
+class TestWriteMsSites(unittest.TestCase):
+    """
+    Tests for the write_ms_sites function.
+    """
+    def get_expected(self, ts, precision=3):
+        if ts.num_sites == 0:
+            return "segsites: 0\n\n"
+        positions = " ".join(
+            "{:.{}f}".format(site.position / ts.sequence_length, precision)
+            for site in ts.sites())
+        return "segsites: {}\npositions: {} \n{}\n".format(
+            ts.num_sites, positions, "\n".join(ts.haplotypes()))
+
+    def verify(self, ts, precision=3):
+        output = io.StringIO()
+        msprime.write_ms_sites(ts, output, precision)
+        self.assertEqual(output.getvalue(), self.get_expected(ts, precision))
+
+    def test_tree_sequence(self):
+        ts = msprime.simulate(
+            10, mutation_rate=5, recombination_rate=1, random_seed=2)
+        self.assertGreater(ts.num_sites, 0)
+        for precision in [0, 1, 3, 10]:
+            self.verify(ts, precision)
+
+    def test_simulation_result(self):
+        result = msprime.simulate(
+            5, mutation_rate=5, random_seed=3, lazy=True)
+        ts = result.tree_sequence
+        self.assertGreater(ts.num_sites, 0)
+        output = io.StringIO()
+        msprime.write_ms_sites(result, output)
+        self.assertEqual(output.getvalue(), self.get_expected(ts))
+
+    def test_no_sites(self):
+        ts = msprime.simulate(5, random_seed=3)
+        self.verify(ts)
+
+    def test_bad_precision(self):
+        ts = msprime.simulate(5, mutation_rate=1, random_seed=3)
+        with self.assertRaises(ValueError):
+            msprime.write_ms_sites(ts, io.StringIO(), -1)
+
+    def test_multiple_mutations(self):
+        ts = msprime.simulate(5, mutation_rate=5, random_seed=3)
+        tables = ts.dump_tables()
+        tables.mutations.add_row(
+            site=0, node=tables.mutations.node[0], derived_state="0")
+        tables.sort()
+        tables.build_index()
+        tables.compute_mutation_parents()
+        with self.assertRaises(_msprime.LibraryError):
+            msprime.write_ms_sites(tables.tree_sequence(), io.StringIO())
+
+
+class TestSimulateSummaryStatistics(unittest.TestCase):
+    """
+    Tests for the simulate_summary_statistics function.
+    """
+    def get_stats(self, ts, statistics):
+        n = ts.num_samples
+        row = []
+        for statistic in statistics:
+            if statistic == "num_trees":
+                row.append(ts.num_trees)
+            elif statistic == "segregating_sites":
+                row.append(ts.num_sites)
+            elif statistic == "pi":
+                row.append(ts.pairwise_diversity() if ts.num_sites > 0 else 0)
+            elif statistic == "sfs":
+                sfs = np.zeros(n + 1)
+                for variant in ts.variants():
+                    sfs[np.sum(variant.genotypes)] += 1
+                row.extend(sfs[1:n])
+        return row
+
+    def verify(self, statistics, num_replicates=5, **kwargs):
+        result = msprime.simulate_summary_statistics(
+            statistics, num_replicates=num_replicates, random_seed=5, **kwargs)
+        replicates = msprime.simulate(
+            num_replicates=num_replicates, random_seed=5, **kwargs)
+        self.assertEqual(result.shape[0], num_replicates)
+        for row, ts in zip(result, replicates):
+            expected = self.get_stats(ts, statistics)
+            self.assertEqual(len(row), len(expected))
+            self.assertTrue(np.allclose(row, expected))
+        return result
+
+    def test_all_stats(self):
+        stats = ["num_trees", "segregating_sites", "pi", "sfs"]
+        result = self.verify(
+            stats, sample_size=10, recombination_rate=1, mutation_rate=2)
+        self.assertEqual(result.shape, (5, 3 + 9))
+        self.assertGreater(np.sum(result[:, 1]), 0)
+
+    def test_single_stats(self):
+        for stat in ["num_trees", "segregating_sites", "pi", "sfs"]:
+            self.verify([stat], sample_size=4, recombination_rate=2, mutation_rate=1)
+
+    def test_repeated_stats(self):
+        result = self.verify(
+            ["pi", "pi", "num_trees"], sample_size=5, mutation_rate=1)
+        self.assertTrue(np.array_equal(result[:, 0], result[:, 1]))
+
+    def test_no_mutations(self):
+        result = self.verify(
+            ["num_trees", "segregating_sites", "sfs"], sample_size=3,
+            recombination_rate=5)
+        self.assertTrue(np.all(result[:, 1:] == 0))
+
+    def test_samples_and_populations(self):
+        self.verify(
+            ["segregating_sites", "sfs"],
+            population_configurations=[
+                msprime.PopulationConfiguration(3),
+                msprime.PopulationConfiguration(2)],
+            migration_matrix=[[0, 1], [1, 0]], mutation_rate=2)
+
+    def test_end_time(self):
+        self.verify(
+            ["num_trees", "sfs"], sample_size=6, recombination_rate=2,
+            mutation_rate=2, end_time=0.2)
+
+    def test_from_ts(self):
+        from_ts = msprime.simulate(5, recombination_rate=1, end_time=0.1, random_seed=2)
+        result = msprime.simulate_summary_statistics(
+            ["num_trees", "sfs"], from_ts=from_ts, num_replicates=3, random_seed=2)
+        self.assertEqual(result.shape, (3, 5))
+
+    def test_zero_replicates(self):
+        result = msprime.simulate_summary_statistics(["pi"], 0, sample_size=2)
+        self.assertEqual(result.shape, (0, 1))
+
+    def test_errors(self):
+        f = msprime.simulate_summary_statistics
+        self.assertRaises(ValueError, f, ["xxx"], sample_size=2)
+        self.assertRaises(ValueError, f, ["pi"], -1, sample_size=2)
+        self.assertRaises(TypeError, f, ["pi"], sample_size=2, lazy=True)
+
+
 # Convenience method for getting seeds in a subprocess.
 def _get_seed(x):
     return msprime.simulations._get_random_seed()
 
 
+@unittest.skipIf(sys.version_info < (3, 5), "Coroutines need Python 3.5")
+class TestSimulateAsync(unittest.TestCase):
+    """
+    Tests for the asyncio versions of simulate.
+    """
+    def setUp(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_async(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    def verify_equal(self, ts1, ts2):
+        tables1 = ts1.dump_tables()
+        tables2 = ts2.dump_tables()
+        tables1.provenances.clear()
+        tables2.provenances.clear()
+        self.assertEqual(tables1, tables2)
+
+    def test_equal_to_simulate(self):
+        for kwargs in [
+                {"sample_size": 10},
+                {"sample_size": 10, "recombination_rate": 1, "mutation_rate": 1},
+                {"sample_size": 10, "end_time": 0.1},
+                {"population_configurations": [
+                    msprime.PopulationConfiguration(5),
+                    msprime.PopulationConfiguration(5)],
+                 "migration_matrix": [[0, 1], [1, 0]]}]:
+            ts = msprime.simulate(random_seed=5, **kwargs)
+            for chunk_size in [1, 10, 10**6]:
+                other = self.run_async(msprime.simulate_async(
+                    random_seed=5, chunk_size=chunk_size, **kwargs))
+                self.verify_equal(ts, other)
+
+    def test_model_changes(self):
+        demographic_events = [
+            msprime.SimulationModelChange(0.1, "smc"),
+            msprime.SimulationModelChange(0.5, "hudson")]
+        ts = msprime.simulate(
+            20, recombination_rate=5, demographic_events=demographic_events,
+            random_seed=2)
+        other = self.run_async(msprime.simulate_async(
+            20, recombination_rate=5, demographic_events=demographic_events,
+            random_seed=2, chunk_size=3))
+        self.verify_equal(ts, other)
+
+    def test_lazy(self):
+        result = self.run_async(
+            msprime.simulate_async(10, random_seed=1, lazy=True))
+        self.assertIsInstance(result, msprime.SimulationResult)
+        self.verify_equal(result.tree_sequence, msprime.simulate(10, random_seed=1))
+
+    def test_bad_arguments(self):
+        for bad_chunk_size in [0, -1]:
+            self.assertRaises(
+                ValueError, self.run_async,
+                msprime.simulate_async(10, chunk_size=bad_chunk_size))
+        self.assertRaises(
+            TypeError, self.run_async, msprime.simulate_async(10, num_replicates=2))
+        self.assertRaises(ValueError, self.run_async, msprime.simulate_async())
+
+    def test_concurrent(self):
+        seeds = range(1, 11)
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            tasks = [
+                self.loop.create_task(msprime.simulate_async(
+                    20, recombination_rate=2, random_seed=seed, executor=executor,
+                    chunk_size=10))
+                for seed in seeds]
+            # The tasks all run concurrently while we wait for each in turn.
+            results = [self.run_async(task) for task in tasks]
+        for seed, ts in zip(seeds, results):
+            self.verify_equal(
+                ts, msprime.simulate(20, recombination_rate=2, random_seed=seed))
+
+    def test_cancel(self):
+        import asyncio
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            task = self.loop.create_task(msprime.simulate_async(
+                1000, recombination_rate=1000, random_seed=1, executor=executor,
+                chunk_size=100))
+            self.run_async(asyncio.sleep(0.01))
+            task.cancel()
+            self.assertRaises(asyncio.CancelledError, self.run_async, task)
+        # Leaving the with block waits for the current chunk to finish.
+
+    def test_replicates(self):
+        replicates = msprime.simulate(
+            10, recombination_rate=1, num_replicates=5, random_seed=3)
+        iterator = msprime.simulate_replicates_async(
+            5, 10, recombination_rate=1, random_seed=3, chunk_size=5)
+        self.assertIsInstance(iterator, msprime.SimulationReplicates)
+        self.assertIs(iterator.__aiter__(), iterator)
+        for j, ts in enumerate(replicates):
+            self.assertEqual(iterator.index, j)
+            self.verify_equal(ts, self.run_async(iterator.__anext__()))
+        self.assertEqual(iterator.index, 5)
+        self.assertRaises(StopAsyncIteration, self.run_async, iterator.__anext__())
+
+    def test_replicates_lazy(self):
+        iterator = msprime.simulate_replicates_async(2, 10, random_seed=3, lazy=True)
+        for _ in range(2):
+            result = self.run_async(iterator.__anext__())
+            self.assertIsInstance(result, msprime.SimulationResult)
+            self.assertEqual(result.num_samples, 10)
+
+    def test_replicates_cancel(self):
+        import asyncio
+        iterator = msprime.simulate_replicates_async(
+            5, 1000, recombination_rate=1000, random_seed=1, chunk_size=100)
+        task = self.loop.create_task(iterator.__anext__())
+        self.run_async(asyncio.sleep(0.01))
+        self.assertRaises(
+            RuntimeError, self.run_async, iterator.__anext__())
+        task.cancel()
+        self.assertRaises(asyncio.CancelledError, self.run_async, task)
+        # The iterator cannot be used again after cancellation.
+        self.assertRaises(StopAsyncIteration, self.run_async, iterator.__anext__())
+
+
 class TestDefaultRandomSeeds(unittest.TestCase):
     """
     Tests for the default random seed generator.
@@ -852,3 +1604,51 @@ class TestDefaultRandomSeeds(unittest.TestCase):
         self.assertEqual(len(set(seeds)), n)
         pool.terminate()
         pool.join()
+
+
+class TestLazyImports(unittest.TestCase):
+    """
+    Tests that tskit is only imported when it is needed.
+    """
+    def run_python(self, code):
+        return subprocess.check_output(
+            [sys.executable, "-c", code], universal_newlines=True).split()
+
+    @unittest.skipIf(sys.version_info < (3, 7), "Module __getattr__ needs Python 3.7")
+    def test_import_msprime(self):
+        output = self.run_python(
+            "import sys; import msprime; print('tskit' in sys.modules)")
+        self.assertEqual(output, ["False"])
+
+    @unittest.skipIf(sys.version_info < (3, 7), "Module __getattr__ needs Python 3.7")
+    def test_import_cli(self):
+        output = self.run_python(
+            "import sys; import msprime.cli; print('tskit' in sys.modules)")
+        self.assertEqual(output, ["False"])
+
+    def test_simulate_imports_tskit(self):
+        output = self.run_python(
+            "import sys; import msprime; msprime.simulate(2, random_seed=1); "
+            "print('tskit' in sys.modules)")
+        self.assertEqual(output, ["True"])
+
+    def test_tskit_names(self):
+        import tskit
+        self.assertIs(msprime.TreeSequence, tskit.TreeSequence)
+        self.assertIs(msprime.SparseTree, tskit.Tree)
+        self.assertIs(msprime.load, tskit.load)
+        self.assertEqual(msprime.NULL_NODE, tskit.NULL)
+        self.assertEqual(msprime.NODE_IS_SAMPLE, tskit.NODE_IS_SAMPLE)
+        for name in ["TreeSequence", "TableCollection", "NULL_NODE", "simulate"]:
+            self.assertIn(name, dir(msprime))
+        with self.assertRaises(AttributeError):
+            msprime.not_an_attribute
+
+    def test_star_import(self):
+        namespace = {}
+        exec("from msprime import *", namespace)
+        import tskit
+        self.assertIs(namespace["load"], tskit.load)
+        self.assertIs(namespace["TreeSequence"], tskit.TreeSequence)
+        self.assertEqual(namespace["NODE_IS_SAMPLE"], tskit.NODE_IS_SAMPLE)
+        self.assertIs(namespace["simulate"], msprime.simulate)
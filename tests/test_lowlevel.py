@@ -23,8 +23,10 @@ import heapq
 import itertools
 import math
 import random
+import sys
 import unittest
 
+import numpy as np
 import tskit
 
 import tests
@@ -132,6 +134,22 @@ def get_growth_rate_change_event(time=0.0, growth_rate=1.0, population=-1):
         time, population, growth_rate=growth_rate)
 
 
+def get_population_size_history_event(
+        times=(0.0, 1.0), population=0, initial_sizes=(1.0, 2.0),
+        growth_rates=(0.0, 0.0)):
+    """
+    Returns a population size history event for the specified values.
+    """
+    return {
+        "type": "population_size_history",
+        "time": times[0],
+        "population": population,
+        "times": times,
+        "initial_sizes": initial_sizes,
+        "growth_rates": growth_rates,
+    }
+
+
 def get_migration_rate_change_event(
         time=0.0, migration_rate=1.0, matrix_index=-1):
     """
@@ -145,6 +163,20 @@ def get_migration_rate_change_event(
     }
 
 
+def get_migration_matrix_change_event(
+        time=0.0, source=(0, 1), dest=(1, 0), rate=(1.0, 1.0)):
+    """
+    Returns a migration_matrix_change demographic event.
+    """
+    return {
+        "type": "migration_matrix_change",
+        "time": time,
+        "source": source,
+        "dest": dest,
+        "rate": rate,
+    }
+
+
 def get_mass_migration_event(time=0.0, source=0, dest=1, proportion=1):
     """
     Returns a mass_migration demographic event.
@@ -1167,6 +1199,50 @@ class TestSimulator(LowLevelTestCase):
             migration_matrix=[0 for j in range(N * N)])
         self.assertEqual(samples, sim.get_samples())
 
+    def test_array_samples(self):
+        N = 4
+        samples = [
+            (random.randint(0, N - 1), random.random()) for _ in range(10)]
+        samples[-1] = (0, 0)
+        population = np.array([s[0] for s in samples], dtype=np.int32)
+        time = np.array([s[1] for s in samples])
+        structured = np.array(
+            samples, dtype=[("population", np.int32), ("time", np.float64)])
+        for array_samples in [
+                structured, {"population": population, "time": time},
+                {"population": list(population), "time": list(time)}]:
+            rng = _msprime.RandomGenerator(1)
+            sim = _msprime.Simulator(
+                array_samples, uniform_recombination_map(), rng,
+                _msprime.LightweightTableCollection(),
+                population_configuration=[
+                    get_population_configuration() for _ in range(N)],
+                migration_matrix=[0 for j in range(N * N)])
+            self.assertEqual(samples, sim.get_samples())
+
+    def test_bad_array_samples(self):
+        rng = _msprime.RandomGenerator(1)
+
+        def f(population, time):
+            return _msprime.Simulator(
+                {"population": population, "time": time},
+                uniform_recombination_map(), rng,
+                _msprime.LightweightTableCollection())
+
+        self.assertRaises(ValueError, f, [0, 0], None)
+        self.assertRaises(ValueError, f, None, [0, 0])
+        # Populations are not silently truncated.
+        self.assertRaises(TypeError, f, np.zeros(2, dtype=np.int64), [0, 0])
+        self.assertRaises(ValueError, f, [0, 0], [0, 0, 0])
+        self.assertRaises(ValueError, f, [[0, 0]], [[0, 0]])
+        self.assertRaises(ValueError, f, [0, -1], [0, 0])
+        self.assertRaises(ValueError, f, [0, 0], [0, -1])
+        self.assertRaises(_msprime.InputError, f, [], [])
+        self.assertRaises(_msprime.InputError, f, [0], [0])
+        self.assertRaises(
+            TypeError, _msprime.Simulator, {"time": [0, 0]},
+            uniform_recombination_map(), rng, _msprime.LightweightTableCollection())
+
     def test_deleting_tables(self):
         rng = _msprime.RandomGenerator(1)
         tables = _msprime.LightweightTableCollection()
@@ -1280,6 +1356,50 @@ class TestSimulator(LowLevelTestCase):
         f(2, [(2, 0), (0.5, 0.1)])
         f(5, [(1, 0.25), (2, 0.5), (3, 0.75), (4, 1)])
 
+    def test_sparse_migration_matrix(self):
+        def f(num_populations, migration_matrix):
+            population_configuration = [
+                get_population_configuration()
+                for j in range(num_populations)]
+            return _msprime.Simulator(
+                get_samples(2), uniform_recombination_map(), _msprime.RandomGenerator(1),
+                _msprime.LightweightTableCollection(),
+                population_configuration=population_configuration,
+                migration_matrix=migration_matrix)
+
+        sim = f(3, {"source": [2, 0, 0, 1], "dest": [0, 2, 1, 1], "rate": [3, 2, 1, 0]})
+        self.assertEqual(sim.get_migration_matrix(), [0, 1, 2, 0, 0, 0, 3, 0, 0])
+        entries = sim.get_sparse_migration_matrix()
+        self.assertEqual(list(entries["source"]), [0, 0, 2])
+        self.assertEqual(list(entries["dest"]), [1, 2, 0])
+        self.assertEqual(list(entries["rate"]), [1, 2, 3])
+        self.assertEqual(list(entries["num_events"]), [0, 0, 0])
+        sim.run()
+        entries = sim.get_sparse_migration_matrix()
+        self.assertEqual(
+            list(entries["num_events"]),
+            [sim.get_num_migration_events()[j] for j in [1, 2, 6]])
+        sim = f(2, {"source": [], "dest": [], "rate": []})
+        self.assertEqual(sim.get_migration_matrix(), [0, 0, 0, 0])
+        self.assertEqual(len(sim.get_sparse_migration_matrix()["rate"]), 0)
+        sim = f(1, {"source": [], "dest": [], "rate": []})
+        sim.set_migration_matrix([0])
+        sim.set_migration_matrix({"source": [0], "dest": [0], "rate": [0]})
+
+        for key in ["source", "dest", "rate"]:
+            matrix = {"source": [0], "dest": [1], "rate": [1]}
+            del matrix[key]
+            self.assertRaises(ValueError, f, 2, matrix)
+            for bad_array in [[[0]], [], [0, 1]]:
+                matrix = {"source": [0], "dest": [1], "rate": [1]}
+                matrix[key] = bad_array
+                self.assertRaises(ValueError, f, 2, matrix)
+        for source, dest, rate in [
+                ([-1], [0], [1]), ([2], [0], [1]), ([0], [2], [1]), ([0], [-1], [1]),
+                ([0], [1], [-1]), ([0], [0], [1]), ([0, 0], [1, 1], [1, 1])]:
+            matrix = {"source": source, "dest": dest, "rate": rate}
+            self.assertRaises(_msprime.InputError, f, 2, matrix)
+
     def test_bad_migration_matrix(self):
         def f(num_populations, migration_matrix):
             population_configuration = [
@@ -1291,10 +1411,12 @@ class TestSimulator(LowLevelTestCase):
                 _msprime.LightweightTableCollection(),
                 population_configuration=population_configuration,
                 migration_matrix=migration_matrix)
-        for bad_type in ["", {}, None, 2, [""], [[]], [None]]:
+        for bad_type in ["", (), None, 2, [""], [[]], [None]]:
             self.assertRaises(TypeError, f, 1, bad_type)
         for bad_value in [[1, 2], [-1], [1, 2, 3]]:
             self.assertRaises(ValueError, f, 1, bad_value)
+        # Sparse matrices with missing keys
+        self.assertRaises(ValueError, f, 1, {})
 
         # Providing the wrong number of populations provokes a ValueError
         self.assertRaises(ValueError, f, 1, [1, 1])
@@ -1357,7 +1479,7 @@ class TestSimulator(LowLevelTestCase):
                 _msprime.LightweightTableCollection(), demographic_events=events)
         event_generators = [
             get_size_change_event, get_growth_rate_change_event,
-            get_migration_rate_change_event,
+            get_migration_rate_change_event, get_migration_matrix_change_event,
             get_mass_migration_event, get_simple_bottleneck_event,
             get_instantaneous_bottleneck_event]
         for bad_type in [None, {}, "", 1]:
@@ -1423,7 +1545,7 @@ class TestSimulator(LowLevelTestCase):
                 migration_matrix=get_migration_matrix(num_populations))
         event_generators = [
             get_size_change_event, get_growth_rate_change_event,
-            get_migration_rate_change_event,
+            get_migration_rate_change_event, get_migration_matrix_change_event,
             get_mass_migration_event, get_simple_bottleneck_event,
             get_instantaneous_bottleneck_event]
         for event_generator in event_generators:
@@ -1497,6 +1619,173 @@ class TestSimulator(LowLevelTestCase):
             _msprime.LightweightTableCollection(),
             demographic_events=events)
 
+    def test_population_size_history_event(self):
+        def f(events, num_populations=2):
+            population_configuration = [get_population_configuration(2)] + [
+                get_population_configuration(0)
+                for _ in range(num_populations - 1)]
+            sim = _msprime.Simulator(
+                get_samples(2), uniform_recombination_map(), _msprime.RandomGenerator(1),
+                _msprime.LightweightTableCollection(), demographic_events=events,
+                population_configuration=population_configuration,
+                migration_matrix=get_migration_matrix(num_populations))
+            sim.run()
+        f([get_population_size_history_event(
+            times=np.arange(100) / 10, initial_sizes=np.ones(100) / 4,
+            growth_rates=np.zeros(100))])
+        f([
+            get_population_size_history_event(population=1),
+            get_size_change_event(time=0.5, population=1)])
+
+        for key in ["population", "times", "initial_sizes", "growth_rates"]:
+            event = get_population_size_history_event()
+            del event[key]
+            self.assertRaises(ValueError, f, [event])
+        for bad_array in [[[1, 2]], ["x"], None]:
+            event = get_population_size_history_event()
+            event["times"] = bad_array
+            self.assertRaises(ValueError, f, [event])
+        event = get_population_size_history_event()
+        for key in ["times", "initial_sizes", "growth_rates"]:
+            event[key] = []
+        self.assertRaises(_msprime.InputError, f, [event])
+        for key in ["initial_sizes", "growth_rates"]:
+            for bad_length in [[], [1], [1, 2, 3]]:
+                event = get_population_size_history_event()
+                event[key] = bad_length
+                self.assertRaises(ValueError, f, [event])
+        for bad_pop_id in [-2, -1, 2, 10**6]:
+            event = get_population_size_history_event(population=bad_pop_id)
+            self.assertRaises(_msprime.InputError, f, [event])
+        for bad_times in [(0, 0), (1, 0), (0, np.nan)]:
+            event = get_population_size_history_event(times=bad_times)
+            self.assertRaises(_msprime.InputError, f, [event])
+        for bad_sizes in [(1, 0), (-1, 1), (1, np.nan)]:
+            event = get_population_size_history_event(initial_sizes=bad_sizes)
+            self.assertRaises(_msprime.InputError, f, [event])
+        event = get_population_size_history_event(growth_rates=(0, np.inf))
+        self.assertRaises(_msprime.InputError, f, [event])
+        # The events are ordered by the first time of the history.
+        events = [
+            get_size_change_event(time=0.5),
+            get_population_size_history_event(times=(0.25, 1))]
+        self.assertRaises(_msprime.InputError, f, events)
+
+    def test_population_size_history_functions(self):
+        def f(event):
+            sim = _msprime.Simulator(
+                get_samples(2), uniform_recombination_map(), _msprime.RandomGenerator(1),
+                _msprime.LightweightTableCollection(), demographic_events=[event])
+            sim.run()
+            return sim
+
+        event = get_population_size_history_event(initial_sizes=(1, 0.5))
+        event["size_function"] = _msprime.SIZE_FUNCTION_LINEAR
+        f(event)
+        event["carrying_capacities"] = None
+        f(event)
+        event = get_population_size_history_event(growth_rates=(1, -1))
+        event["size_function"] = _msprime.SIZE_FUNCTION_LOGISTIC
+        event["carrying_capacities"] = (2, 3)
+        f(event)
+        event["carrying_capacities"] = np.array([2.0, 3.0])
+        f(event)
+
+        for bad_type in ["x", [], {}]:
+            event = get_population_size_history_event()
+            event["size_function"] = bad_type
+            self.assertRaises(TypeError, f, event)
+        for bad_function in [-1, 3, 10**6]:
+            event = get_population_size_history_event()
+            event["size_function"] = bad_function
+            self.assertRaises(_msprime.InputError, f, event)
+        for bad_array in [[[1, 2]], ["x"], [1], [1, 2, 3]]:
+            event = get_population_size_history_event()
+            event["size_function"] = _msprime.SIZE_FUNCTION_LOGISTIC
+            event["carrying_capacities"] = bad_array
+            self.assertRaises(ValueError, f, event)
+        event = get_population_size_history_event()
+        event["size_function"] = _msprime.SIZE_FUNCTION_LOGISTIC
+        self.assertRaises(_msprime.InputError, f, event)
+        for bad_capacities in [(1, 0), (-1, 1), (1, np.nan), (1, np.inf)]:
+            event["carrying_capacities"] = bad_capacities
+            self.assertRaises(_msprime.InputError, f, event)
+        # A logistic population that is larger than its carrying capacity
+        # and growing reaches an infinite size in finite time going back.
+        event = get_population_size_history_event(
+            times=(0, 10), initial_sizes=(2, 1), growth_rates=(1, 0))
+        event["size_function"] = _msprime.SIZE_FUNCTION_LOGISTIC
+        event["carrying_capacities"] = (1, 1)
+        self.assertRaises(_msprime.InputError, f, event)
+
+    def test_migration_matrix_change_event(self):
+        def f(events, num_populations=2):
+            population_configuration = [
+                get_population_configuration(2) for _ in range(num_populations)]
+            sim = _msprime.Simulator(
+                get_population_samples(*([2] * num_populations)),
+                uniform_recombination_map(), _msprime.RandomGenerator(1),
+                _msprime.LightweightTableCollection(), demographic_events=events,
+                population_configuration=population_configuration,
+                migration_matrix=get_migration_matrix(num_populations))
+            sim.run()
+            return sim
+
+        sim = f([get_migration_matrix_change_event()])
+        self.assertEqual(sim.get_migration_matrix(), [0, 1, 1, 0])
+        sim = f([get_migration_matrix_change_event(
+            source=np.array([1, 0, 2], dtype=np.int32), dest=[0, 2, 1],
+            rate=np.array([0.5, 0.25, 0]))], 3)
+        self.assertEqual(
+            sim.get_migration_matrix(), [0, 0, 0.25, 0.5, 0, 0, 0, 0, 0])
+        sim = f([
+            get_migration_matrix_change_event(time=0.0001),
+            get_migration_matrix_change_event(time=0.0002, source=[], dest=[], rate=[]),
+            get_migration_matrix_change_event(time=0.0003)])
+        self.assertEqual(sim.get_migration_matrix(), [0, 1, 1, 0])
+
+        for key in ["source", "dest", "rate"]:
+            event = get_migration_matrix_change_event()
+            del event[key]
+            self.assertRaises(ValueError, f, [event])
+        for bad_array in [[[1, 2]], ["x"], None]:
+            event = get_migration_matrix_change_event()
+            event["source"] = bad_array
+            self.assertRaises(ValueError, f, [event])
+        for key in ["dest", "rate"]:
+            for bad_length in [[], [1], [1, 0, 1]]:
+                event = get_migration_matrix_change_event()
+                event[key] = bad_length
+                self.assertRaises(ValueError, f, [event])
+        for source, dest in [(-1, 0), (2, 0), (0, 2), (0, -1), (1, 1)]:
+            event = get_migration_matrix_change_event(
+                source=[0, source], dest=[1, dest])
+            self.assertRaises(_msprime.InputError, f, [event])
+        for bad_rate in [-1, np.nan]:
+            event = get_migration_matrix_change_event(rate=[1, bad_rate])
+            self.assertRaises(_msprime.InputError, f, [event])
+        event = get_migration_matrix_change_event(source=[0, 0], dest=[1, 1])
+        self.assertRaises(_msprime.InputError, f, [event])
+
+    def test_census_event(self):
+        def f(event):
+            tables = _msprime.LightweightTableCollection()
+            sim = _msprime.Simulator(
+                get_samples(5), uniform_recombination_map(num_loci=100, rate=10),
+                _msprime.RandomGenerator(1), tables, demographic_events=[event])
+            sim.run()
+            sim.finalise_tables()
+            flags = tables.asdict()["nodes"]["flags"]
+            return np.sum(flags == _msprime.NODE_IS_CEN_EVENT)
+
+        event = {"type": "census_event", "time": 0.1}
+        num_nodes = f(event)
+        self.assertGreater(num_nodes, 0)
+        event["per_lineage"] = False
+        self.assertEqual(f(event), num_nodes)
+        event["per_lineage"] = True
+        self.assertLess(f(event), num_nodes)
+
     def test_seed_equality(self):
         simulations = [
             {
@@ -1758,6 +2047,234 @@ class TestSimulator(LowLevelTestCase):
             self.assertEqual(sim.get_time(), 0)
 
 
+class TestSimulatorRunChunk(LowLevelTestCase):
+    """
+    Tests for running the simulator in chunks of events.
+    """
+    def test_run_chunk(self):
+        sim, _ = get_example_simulator(num_samples=20)
+        other, _ = get_example_simulator(num_samples=20)
+        other.run()
+        num_chunks = 0
+        while sim.run_chunk(sys.float_info.max, 5) == _msprime.EXIT_MAX_EVENTS:
+            num_chunks += 1
+        self.assertGreater(num_chunks, 1)
+        self.assertEqual(sim.get_num_ancestors(), 0)
+        self.assertEqual(sim.get_time(), other.get_time())
+        self.assertEqual(sim.get_edges(), other.get_edges())
+
+    def test_end_time(self):
+        sim, _ = get_example_simulator(num_samples=20)
+        status = sim.run_chunk(1e-6, 2**62)
+        self.assertEqual(status, _msprime.EXIT_MAX_TIME)
+        self.assertEqual(sim.get_time(), 1e-6)
+        self.assertEqual(sim.run_chunk(sys.float_info.max, 1), _msprime.EXIT_MAX_EVENTS)
+        status = sim.run_chunk(sys.float_info.max, 10**9)
+        self.assertEqual(status, _msprime.EXIT_COALESCENCE)
+
+    def test_bad_args(self):
+        sim, _ = get_example_simulator()
+        self.assertRaises(TypeError, sim.run_chunk)
+        self.assertRaises(TypeError, sim.run_chunk, 1)
+        self.assertRaises(TypeError, sim.run_chunk, "1", 1)
+        self.assertRaises(TypeError, sim.run_chunk, 1, "1")
+        self.assertRaises(ValueError, sim.run_chunk, -1, 1)
+        for bad_max_events in [0, -1]:
+            self.assertRaises(ValueError, sim.run_chunk, 1, bad_max_events)
+
+
+class TestSimulatorRunLimits(LowLevelTestCase):
+    """
+    Tests for the wall time, event and memory limits on Simulator.run.
+    """
+    def test_num_events(self):
+        sim, _ = get_example_simulator(num_samples=20)
+        self.assertEqual(sim.get_num_events(), 0)
+        sim.run_event()
+        self.assertEqual(sim.get_num_events(), 1)
+        sim.run_chunk(sys.float_info.max, 5)
+        self.assertEqual(sim.get_num_events(), 6)
+        sim.run()
+        self.assertGreaterEqual(
+            sim.get_num_events(),
+            sim.get_num_common_ancestor_events() + sim.get_num_recombination_events())
+        sim.reset()
+        self.assertEqual(sim.get_num_events(), 0)
+
+    def test_used_memory(self):
+        sim, _ = get_example_simulator(num_samples=20)
+        before = sim.get_used_memory()
+        self.assertGreater(before, 0)
+        sim.run()
+        self.assertGreaterEqual(sim.get_used_memory(), before)
+
+    def test_max_events(self):
+        sim, _ = get_example_simulator(num_samples=100)
+        other, _ = get_example_simulator(num_samples=100)
+        other.run()
+        for max_events in [10, 11, 50]:
+            with self.assertRaises(_msprime.LimitExceededError) as context:
+                sim.run(max_events=max_events)
+            self.assertEqual(context.exception.args[0], "max_events")
+            self.assertEqual(sim.get_num_events(), max_events)
+            self.assertGreater(sim.get_num_ancestors(), 0)
+        self.assertTrue(sim.run(max_events=10**9))
+        self.assertEqual(sim.get_num_events(), other.get_num_events())
+        self.assertEqual(sim.get_edges(), other.get_edges())
+
+    def test_max_events_reached_on_completion(self):
+        other, _ = get_example_simulator(num_samples=20)
+        other.run()
+        num_events = other.get_num_events()
+        sim, _ = get_example_simulator(num_samples=20)
+        self.assertTrue(sim.run(max_events=num_events))
+        self.assertEqual(sim.get_num_events(), num_events)
+
+    def test_max_events_end_time(self):
+        sim, _ = get_example_simulator(num_samples=20)
+        self.assertFalse(sim.run(1e-6, max_events=10**9))
+        self.assertEqual(sim.get_time(), 1e-6)
+
+    def test_max_memory(self):
+        sim, _ = get_example_simulator(num_samples=2000)
+        with self.assertRaises(_msprime.LimitExceededError) as context:
+            sim.run(max_memory=1)
+        self.assertEqual(context.exception.args[0], "max_memory")
+        self.assertGreater(sim.get_num_ancestors(), 0)
+        self.assertLessEqual(sim.get_num_events(), 1024)
+        sim, _ = get_example_simulator(num_samples=20)
+        self.assertTrue(sim.run(max_memory=2**62))
+
+    def test_max_wall_time(self):
+        sim, _ = get_example_simulator(num_samples=2000)
+        with self.assertRaises(_msprime.LimitExceededError) as context:
+            sim.run(max_wall_time=1e-9)
+        self.assertEqual(context.exception.args[0], "max_wall_time")
+        self.assertGreater(sim.get_num_ancestors(), 0)
+        sim, _ = get_example_simulator(num_samples=20)
+        self.assertTrue(sim.run(max_wall_time=1e6))
+
+    def test_zero_is_unlimited(self):
+        sim, _ = get_example_simulator(num_samples=20)
+        self.assertTrue(sim.run(max_wall_time=0, max_events=0, max_memory=0))
+
+    def test_bad_args(self):
+        sim, _ = get_example_simulator()
+        for name in ["max_wall_time", "max_events", "max_memory"]:
+            self.assertRaises(TypeError, sim.run, **{name: "1"})
+            self.assertRaises(TypeError, sim.run, **{name: None})
+            self.assertRaises(ValueError, sim.run, **{name: -1})
+        self.assertRaises(TypeError, sim.run, max_events=0.5)
+        self.assertRaises(TypeError, sim.run, max_memory=0.5)
+
+
+class TestSimulatorUpdate(LowLevelTestCase):
+    """
+    Tests for updating the parameters of a simulator between replicates.
+    """
+    def test_set_reference_size(self):
+        sim, _ = get_example_simulator(num_populations=2, Ne=0.25)
+        sim.set_migration_matrix([0, 2, 0.5, 0])
+        sim.reset()
+        before = sim.get_population_configuration()
+        sim.set_reference_size(10)
+        sim.reset()
+        self.assertEqual(sim.get_model()["reference_size"], 10)
+        self.assertEqual(sim.get_population_configuration(), before)
+        self.assertEqual(sim.get_migration_matrix(), [0, 2, 0.5, 0])
+        self.assertAlmostEqual(sim.get_recombination_rate(), 1.0 / 9)
+        sim.run()
+        self.assertGreater(sim.get_time(), 0)
+
+    def test_bad_reference_size(self):
+        sim, _ = get_example_simulator()
+        for bad_type in [None, "1", []]:
+            self.assertRaises(TypeError, sim.set_reference_size, bad_type)
+        for bad_value in [0, -1]:
+            self.assertRaises(_msprime.InputError, sim.set_reference_size, bad_value)
+
+    def test_set_recombination_map(self):
+        sim, _ = get_example_simulator()
+        recomb_map = uniform_recombination_map(10, 1.0)
+        sim.set_recombination_map(recomb_map)
+        # The simulator keeps its own reference to the map.
+        del recomb_map
+        sim.reset()
+        self.assertAlmostEqual(sim.get_recombination_rate(), 10.0 / 9)
+        sim.run()
+        self.assertGreater(sim.get_num_recombination_events(), 0)
+
+    def test_bad_recombination_map(self):
+        sim, _ = get_example_simulator()
+        self.assertRaises(TypeError, sim.set_recombination_map, None)
+        for bad_map in [
+                uniform_recombination_map(11, 1.0), uniform_recombination_map(10, 1, 5)]:
+            self.assertRaises(_msprime.InputError, sim.set_recombination_map, bad_map)
+
+    def test_set_population_configuration(self):
+        sim, _ = get_example_simulator(num_populations=2)
+        config = [
+            get_population_configuration(initial_size=2, growth_rate=0.5),
+            get_population_configuration(initial_size=0.5)]
+        sim.set_population_configuration(config)
+        sim.reset()
+        self.assertEqual(sim.get_population_configuration(), config)
+
+    def test_bad_population_configuration(self):
+        sim, _ = get_example_simulator(num_populations=2)
+        self.assertRaises(TypeError, sim.set_population_configuration, None)
+        self.assertRaises(TypeError, sim.set_population_configuration, [None, None])
+        for num_populations in [1, 3]:
+            config = [get_population_configuration() for _ in range(num_populations)]
+            self.assertRaises(ValueError, sim.set_population_configuration, config)
+
+    def test_set_migration_matrix(self):
+        sim, _ = get_example_simulator(num_populations=3)
+        matrix = get_migration_matrix(3, 4.0)
+        sim.set_migration_matrix(matrix)
+        sim.reset()
+        self.assertEqual(sim.get_migration_matrix(), matrix)
+        self.assertRaises(TypeError, sim.set_migration_matrix, None)
+        self.assertRaises(ValueError, sim.set_migration_matrix, [0, 1, 1, 0])
+
+    def test_set_demographic_events(self):
+        sim, _ = get_example_simulator(num_populations=2)
+        # Without migration, the populations can only coalesce via the
+        # mass migration event.
+        sim.set_migration_matrix(get_migration_matrix(2, 0))
+        events = [get_mass_migration_event(time=0.1, source=1, dest=0)]
+        sim.set_demographic_events(events)
+        sim.reset()
+        sim.run()
+        self.assertEqual(sim.get_num_ancestors(), 0)
+        self.assertGreater(sim.get_time(), 0.1)
+        self.assertEqual(sim.get_num_migration_events(), [0, 0, 0, 0])
+        sim.reset()
+        sim.set_migration_matrix(get_migration_matrix(2, 1))
+        sim.set_demographic_events([])
+        sim.reset()
+        sim.run()
+        self.assertEqual(sim.get_num_ancestors(), 0)
+        self.assertRaises(TypeError, sim.set_demographic_events, None)
+        self.assertRaises(
+            _msprime.InputError, sim.set_demographic_events,
+            [get_size_change_event(time=1), get_size_change_event(time=0.5)])
+
+    def test_update_while_running(self):
+        sim, _ = get_example_simulator(num_populations=2)
+        sim.run(0.01)
+        self.assertRaises(_msprime.InputError, sim.set_reference_size, 1)
+        self.assertRaises(
+            _msprime.InputError, sim.set_recombination_map,
+            uniform_recombination_map(10, 1.0))
+        self.assertRaises(
+            _msprime.InputError, sim.set_population_configuration,
+            [get_population_configuration(), get_population_configuration()])
+        self.assertRaises(
+            _msprime.InputError, sim.set_migration_matrix, get_migration_matrix(2))
+        self.assertRaises(_msprime.InputError, sim.set_demographic_events, [])
+
+
 class TestRecombinationMap(LowLevelTestCase):
     """
     Tests for the low-level Recombination Map.
@@ -1856,6 +2373,100 @@ class TestRandomGenerator(unittest.TestCase):
             rng = _msprime.RandomGenerator(s)
             self.assertEqual(rng.get_seed(), s)
 
+    def test_algorithm(self):
+        self.assertEqual(_msprime.RandomGenerator(1).get_algorithm(), "mt19937")
+        for algorithm in ["mt19937", "xoshiro256**"]:
+            rng = _msprime.RandomGenerator(1, algorithm=algorithm)
+            self.assertEqual(rng.get_algorithm(), algorithm)
+            self.assertEqual(rng.get_seed(), 1)
+        for bad_type in [1, None, []]:
+            self.assertRaises(
+                TypeError, _msprime.RandomGenerator, 1, algorithm=bad_type)
+        for bad_value in ["", "xoshiro", "MT19937"]:
+            self.assertRaises(
+                ValueError, _msprime.RandomGenerator, 1, algorithm=bad_value)
+
+    def get_simulation_times(self, rng, num_replicates=5):
+        sim = _msprime.Simulator(
+            get_samples(10), uniform_recombination_map(10, 1), rng,
+            _msprime.LightweightTableCollection())
+        times = []
+        for _ in range(num_replicates):
+            sim.run()
+            times.append(sim.get_time())
+            sim.reset()
+        return times
+
+    def test_xoshiro_simulation(self):
+        times = self.get_simulation_times(
+            _msprime.RandomGenerator(5, algorithm="xoshiro256**"))
+        self.assertEqual(len(set(times)), len(times))
+        other = self.get_simulation_times(
+            _msprime.RandomGenerator(5, algorithm="xoshiro256**"))
+        self.assertEqual(times, other)
+        self.assertNotEqual(times, self.get_simulation_times(
+            _msprime.RandomGenerator(5, algorithm="mt19937")))
+
+    def test_jump(self):
+        rng1 = _msprime.RandomGenerator(5, algorithm="xoshiro256**")
+        rng1.jump()
+        rng1.jump()
+        rng2 = _msprime.RandomGenerator(5, algorithm="xoshiro256**")
+        rng2.jump(num_jumps=2)
+        rng2.jump(0)
+        times = self.get_simulation_times(rng1)
+        self.assertEqual(times, self.get_simulation_times(rng2))
+        rng3 = _msprime.RandomGenerator(5, algorithm="xoshiro256**")
+        rng3.jump(1)
+        self.assertNotEqual(times, self.get_simulation_times(rng3))
+        self.assertEqual(rng3.get_seed(), 5)
+
+    def test_set_seed(self):
+        for algorithm in ["mt19937", "xoshiro256**"]:
+            rng = _msprime.RandomGenerator(1, algorithm=algorithm)
+            rng.set_seed(5)
+            self.assertEqual(rng.get_seed(), 5)
+            self.assertEqual(rng.get_algorithm(), algorithm)
+            times = self.get_simulation_times(rng)
+            self.assertEqual(times, self.get_simulation_times(
+                _msprime.RandomGenerator(5, algorithm=algorithm)))
+
+    def test_bad_set_seed(self):
+        rng = _msprime.RandomGenerator(1)
+        for bad_type in ["1", 1.0, None]:
+            self.assertRaises(TypeError, rng.set_seed, bad_type)
+        for bad_value in [0, 2**32]:
+            self.assertRaises(ValueError, rng.set_seed, bad_value)
+        self.assertEqual(rng.get_seed(), 1)
+
+    def test_reset_reproducible(self):
+        # A simulator that is reset and reseeded gives the same result as a
+        # new simulator.
+        rng = _msprime.RandomGenerator(1)
+        sim = _msprime.Simulator(
+            get_samples(50), uniform_recombination_map(100, 1), rng,
+            _msprime.LightweightTableCollection(), segment_block_size=5)
+        sim.run()
+        self.assertGreater(sim.get_num_segment_blocks(), 1)
+        sim.reset()
+        rng.set_seed(5)
+        sim.run()
+        other = _msprime.Simulator(
+            get_samples(50), uniform_recombination_map(100, 1),
+            _msprime.RandomGenerator(5), _msprime.LightweightTableCollection(),
+            segment_block_size=5)
+        other.run()
+        self.assertEqual(sim.get_edges(), other.get_edges())
+        self.assertEqual(sim.get_nodes(), other.get_nodes())
+
+    def test_bad_jump(self):
+        rng = _msprime.RandomGenerator(5, algorithm="xoshiro256**")
+        for bad_type in ["1", 1.0, None]:
+            self.assertRaises(TypeError, rng.jump, bad_type)
+        self.assertRaises(ValueError, rng.jump, -1)
+        rng = _msprime.RandomGenerator(5)
+        self.assertRaises(_msprime.InputError, rng.jump)
+
 
 class TestMutationGenerator(unittest.TestCase):
     """
@@ -1908,6 +2519,25 @@ class TestMutationGenerator(unittest.TestCase):
                 random_generator=rng, mutation_rate=0, alphabet=alphabet)
             self.assertEqual(alphabet, mg.get_alphabet())
 
+    def test_generate_reuse_exposure(self):
+        tables = _msprime.LightweightTableCollection()
+        sim = _msprime.Simulator(
+            get_samples(5), uniform_recombination_map(num_loci=20, rate=2),
+            _msprime.RandomGenerator(1), tables)
+        sim.run()
+        results = []
+        for reuse_exposure in [False, True]:
+            mutgen = _msprime.MutationGenerator(_msprime.RandomGenerator(2), 2)
+            for _ in range(3):
+                mutgen.generate(tables, reuse_exposure=reuse_exposure)
+            t = tskit.TableCollection.fromdict(tables.asdict())
+            self.assertGreater(len(t.mutations), 0)
+            results.append(t)
+        self.assertEqual(results[0], results[1])
+        for bad_type in ["x", {}, None]:
+            with self.assertRaises(TypeError):
+                mutgen.generate(tables, reuse_exposure=bad_type)
+
 
 class TestDemographyDebugger(unittest.TestCase):
     """
@@ -1988,3 +2618,133 @@ class TestLikelihood(unittest.TestCase):
         lw_tables = _msprime.LightweightTableCollection()
         with self.assertRaises(_msprime.LibraryError):
             _msprime.log_likelihood_arg(lw_tables, 1, 1)
+
+
+class TestSummaryStats(unittest.TestCase):
+    """
+    Tests for the low-level summary statistics interface.
+    """
+    def get_tables(self, n=5):
+        rng = _msprime.RandomGenerator(1)
+        tables = _msprime.LightweightTableCollection()
+        sim = _msprime.Simulator(
+            get_samples(n), uniform_recombination_map(num_loci=20, rate=2),
+            rng, tables)
+        sim.run()
+        sim.finalise_tables()
+        mutgen = _msprime.MutationGenerator(rng, 2)
+        mutgen.generate(tables)
+        return tables
+
+    def test_simple_example(self):
+        n = 5
+        tables = self.get_tables(n)
+        ts = tskit.TableCollection.fromdict(tables.asdict()).tree_sequence()
+        stats = [
+            _msprime.STAT_NUM_TREES, _msprime.STAT_SEGREGATING_SITES,
+            _msprime.STAT_PI, _msprime.STAT_SFS]
+        output = np.zeros(3 + n - 1)
+        _msprime.summary_stats(tables, stats, output)
+        self.assertEqual(output[0], ts.num_trees)
+        self.assertEqual(output[1], ts.num_sites)
+        self.assertAlmostEqual(output[2], ts.pairwise_diversity())
+        sfs = np.zeros(n + 1)
+        for variant in ts.variants():
+            sfs[np.sum(variant.genotypes)] += 1
+        self.assertTrue(np.array_equal(output[3:], sfs[1:n]))
+
+    def test_interface(self):
+        tables = self.get_tables()
+        output = np.zeros(1)
+        self.assertRaises(TypeError, _msprime.summary_stats)
+        self.assertRaises(TypeError, _msprime.summary_stats, tables)
+        self.assertRaises(TypeError, _msprime.summary_stats, tables, [0])
+        for bad_tables in [None, {}, "SDf"]:
+            with self.assertRaises(TypeError):
+                _msprime.summary_stats(bad_tables, [0], output)
+        for bad_output in [None, [0.0], np.zeros(1, dtype=np.int32),
+                           np.zeros((1, 1)), np.zeros(4)[::2]]:
+            with self.assertRaises(TypeError):
+                _msprime.summary_stats(tables, [0], bad_output)
+        for bad_stats in [None, "SDF", [[0]]]:
+            with self.assertRaises(ValueError):
+                _msprime.summary_stats(tables, bad_stats, output)
+        for bad_stat in [-1, 100]:
+            with self.assertRaises(_msprime.LibraryError):
+                _msprime.summary_stats(tables, [bad_stat], output)
+        for bad_size in [0, 2]:
+            with self.assertRaises(ValueError):
+                _msprime.summary_stats(tables, [0], np.zeros(bad_size))
+
+    def test_bad_tables(self):
+        lw_tables = _msprime.LightweightTableCollection()
+        with self.assertRaises(_msprime.LibraryError):
+            _msprime.summary_stats(lw_tables, [0], np.zeros(1))
+
+
+class TestFormatMsSites(unittest.TestCase):
+    """
+    Tests for the low-level ms format output function.
+    """
+    def get_tables(self, n=5, mutation_rate=2):
+        rng = _msprime.RandomGenerator(1)
+        tables = _msprime.LightweightTableCollection()
+        sim = _msprime.Simulator(
+            get_samples(n), uniform_recombination_map(num_loci=20, rate=2),
+            rng, tables)
+        sim.run()
+        sim.finalise_tables()
+        mutgen = _msprime.MutationGenerator(rng, mutation_rate)
+        mutgen.generate(tables)
+        return tables
+
+    def test_simple_example(self):
+        n = 5
+        tables = self.get_tables(n)
+        ts = tskit.TableCollection.fromdict(tables.asdict()).tree_sequence()
+        self.assertGreater(ts.num_sites, 0)
+        lines = _msprime.format_ms_sites(tables, 4).splitlines()
+        self.assertEqual(len(lines), n + 2)
+        self.assertEqual(lines[0], "segsites: {}".format(ts.num_sites))
+        positions = lines[1].split()
+        self.assertEqual(positions[0], "positions:")
+        self.assertEqual(positions[1:], [
+            "{:.4f}".format(site.position / ts.sequence_length)
+            for site in ts.sites()])
+        self.assertEqual(lines[2:], list(ts.haplotypes()))
+
+    def test_no_sites(self):
+        tables = self.get_tables(mutation_rate=0)
+        self.assertEqual(_msprime.format_ms_sites(tables, 3), "segsites: 0\n\n")
+
+    def test_interface(self):
+        tables = self.get_tables()
+        self.assertRaises(TypeError, _msprime.format_ms_sites)
+        self.assertRaises(TypeError, _msprime.format_ms_sites, tables)
+        for bad_tables in [None, {}, "SDf"]:
+            with self.assertRaises(TypeError):
+                _msprime.format_ms_sites(bad_tables, 3)
+        for bad_type in [None, "3", 1.5]:
+            with self.assertRaises(TypeError):
+                _msprime.format_ms_sites(tables, bad_type)
+        with self.assertRaises(ValueError):
+            _msprime.format_ms_sites(tables, -1)
+
+    def test_multiple_mutations(self):
+        tables = self.get_tables()
+        ts_tables = tskit.TableCollection.fromdict(tables.asdict())
+        # Add a second mutation at the first site.
+        ts_tables.mutations.add_row(
+            site=0, node=ts_tables.mutations.node[0], derived_state="0")
+        ts_tables.sort()
+        ts_tables.build_index()
+        ts_tables.compute_mutation_parents()
+        tables = _msprime.LightweightTableCollection()
+        tables.fromdict(ts_tables.asdict())
+        with self.assertRaises(_msprime.LibraryError):
+            _msprime.format_ms_sites(tables, 3)
+
+    def test_bad_tables(self):
+        lw_tables = _msprime.LightweightTableCollection()
+        with self.assertRaises(_msprime.LibraryError):
+            _msprime.format_ms_sites(lw_tables, 3)
@@ -328,6 +328,99 @@ class TestInterval(unittest.TestCase):
             self.verify(ts)
 
 
+class TestMutateReplicates(unittest.TestCase):
+    """
+    Tests for the mutate_replicates function.
+    """
+    def test_errors(self):
+        ts = msprime.simulate(10, random_seed=2)
+        with self.assertRaises(ValueError):
+            msprime.mutate_replicates(None, rate=1, num_replicates=2)
+        with self.assertRaises(ValueError):
+            msprime.mutate_replicates(ts, rate=1, num_replicates=-1)
+        with self.assertRaises(ValueError):
+            msprime.mutate_replicates(ts, rate=1, start_time=1, end_time=0)
+        with self.assertRaises(TypeError):
+            msprime.mutate_replicates(ts, rate=1, model="bad model")
+
+    def test_zero_replicates(self):
+        ts = msprime.simulate(10, random_seed=2)
+        self.assertEqual(list(msprime.mutate_replicates(ts, 1, 0)), [])
+
+    def test_first_replicate_equals_mutate(self):
+        ts = msprime.simulate(10, recombination_rate=1, mutation_rate=2, random_seed=2)
+        mutated = msprime.mutate(ts, rate=2, random_seed=5)
+        self.assertGreater(mutated.num_sites, 0)
+        replicates = msprime.mutate_replicates(
+            ts, rate=2, num_replicates=5, random_seed=5)
+        first = next(replicates)
+        self.assertEqual(first.tables.sites, mutated.tables.sites)
+        self.assertEqual(first.tables.mutations, mutated.tables.mutations)
+        self.assertEqual(first.tables.nodes, ts.tables.nodes)
+        self.assertEqual(first.tables.edges, ts.tables.edges)
+        self.assertEqual(len(list(replicates)), 4)
+
+    def test_replicates_differ(self):
+        ts = msprime.simulate(10, recombination_rate=1, random_seed=2)
+        positions = [
+            tuple(t.tables.sites.position)
+            for t in msprime.mutate_replicates(ts, 2, 10, random_seed=3)]
+        self.assertEqual(len(positions), 10)
+        self.assertEqual(len(set(positions)), 10)
+
+    def test_same_seed(self):
+        ts = msprime.simulate(10, recombination_rate=1, random_seed=2)
+        model = msprime.InfiniteSites(msprime.NUCLEOTIDES)
+        reps1 = msprime.mutate_replicates(ts, 2, 5, random_seed=3, model=model)
+        reps2 = msprime.mutate_replicates(ts, 2, 5, random_seed=3, model=model)
+        for ts1, ts2 in zip(reps1, reps2):
+            self.assertEqual(ts1.tables.sites, ts2.tables.sites)
+            self.assertEqual(ts1.tables.mutations, ts2.tables.mutations)
+
+    def test_as_arrays(self):
+        ts = msprime.simulate(10, recombination_rate=1, random_seed=2)
+        reps = msprime.mutate_replicates(ts, 2, 5, random_seed=3)
+        arrays = list(msprime.mutate_replicates(
+            ts, 2, 5, random_seed=3, as_arrays=True))
+        self.assertEqual(len(arrays), 5)
+        for mutated, (sites, mutations) in zip(reps, arrays):
+            tables = ts.dump_tables()
+            tables.sites.set_columns(**sites)
+            tables.mutations.set_columns(**mutations)
+            self.assertGreater(len(tables.sites), 0)
+            self.assertEqual(tables.sites, mutated.tables.sites)
+            self.assertEqual(tables.mutations, mutated.tables.mutations)
+
+    def test_interval(self):
+        ts = msprime.simulate(10, random_seed=2)
+        time = ts.tables.nodes.time
+        start = np.max(time) / 2
+        reps = msprime.mutate_replicates(ts, 10, 5, random_seed=3, start_time=start)
+        for mutated in reps:
+            self.assertGreater(mutated.num_sites, 0)
+            for tree in mutated.trees():
+                for site in tree.sites():
+                    for mutation in site.mutations:
+                        self.assertGreater(time[tree.parent(mutation.node)], start)
+
+    def test_existing_mutations_discarded(self):
+        ts = msprime.simulate(10, mutation_rate=2, random_seed=2)
+        self.assertGreater(ts.num_sites, 0)
+        for mutated in msprime.mutate_replicates(ts, 0, 3):
+            self.assertEqual(mutated.num_sites, 0)
+            self.assertEqual(mutated.num_mutations, 0)
+
+    def test_provenance(self):
+        ts = msprime.simulate(10, random_seed=1)
+        for mutated in msprime.mutate_replicates(ts, 1, 3, random_seed=4):
+            self.assertEqual(mutated.num_provenances, ts.num_provenances + 1)
+            record = json.loads(mutated.provenance(mutated.num_provenances - 1).record)
+            self.assertEqual(record["parameters"]["command"], "mutate_replicates")
+            self.assertEqual(record["parameters"]["rate"], 1)
+            self.assertEqual(record["parameters"]["num_replicates"], 3)
+            self.assertEqual(record["parameters"]["random_seed"], 4)
+
+
 class TestKeep(unittest.TestCase):
     """
     Tests for the "keep" functionality in which we append new mutations
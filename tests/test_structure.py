@@ -0,0 +1,239 @@
+#
+# Copyright (C) 2019 University of Oxford
+#
+# This file is part of msprime.
+#
+# msprime is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# msprime is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with msprime.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for sparse migration matrices and the models of population structure.
+"""
+import unittest
+
+import numpy as np
+
+import msprime
+
+
+def dense_stepping_stone(shape, periodic):
+    """
+    Returns the dense migration matrix of a stepping stone model with unit
+    migration rates, built by iterating over the grid.
+    """
+    if len(shape) == 1:
+        shape = (1, shape[0])
+    rows, cols = shape
+    N = rows * cols
+    M = np.zeros((N, N))
+    for j in range(rows):
+        for k in range(cols):
+            for dj, dk in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+                nj = j + dj
+                nk = k + dk
+                if periodic:
+                    nj %= rows
+                    nk %= cols
+                if 0 <= nj < rows and 0 <= nk < cols and (nj, nk) != (j, k):
+                    M[j * cols + k, nj * cols + nk] = 1
+    return M
+
+
+class TestSparseMigrationMatrix(unittest.TestCase):
+    """
+    Tests for the SparseMigrationMatrix class.
+    """
+    def test_sorted(self):
+        M = msprime.SparseMigrationMatrix(3, [2, 0, 1, 0], [0, 2, 0, 1], [1, 2, 3, 4])
+        self.assertEqual(M.num_populations, 3)
+        self.assertEqual(M.num_entries, 4)
+        self.assertEqual(M.shape, (3, 3))
+        self.assertEqual(list(M.source), [0, 0, 1, 2])
+        self.assertEqual(list(M.dest), [1, 2, 0, 0])
+        self.assertEqual(list(M.rate), [4, 2, 3, 1])
+        self.assertTrue(np.array_equal(
+            M.toarray(), [[0, 4, 2], [3, 0, 0], [1, 0, 0]]))
+
+    def test_single_rate(self):
+        M = msprime.SparseMigrationMatrix(2, [0, 1], [1, 0], 0.5)
+        self.assertEqual(list(M.rate), [0.5, 0.5])
+
+    def test_empty(self):
+        M = msprime.SparseMigrationMatrix(2, [], [], [])
+        self.assertEqual(M.num_entries, 0)
+        self.assertTrue(np.array_equal(M.toarray(), np.zeros((2, 2))))
+
+    def test_errors(self):
+        for bad_args in [
+                (0, [], [], []),
+                (2, [0], [0], [1]),
+                (2, [0], [2], [1]),
+                (2, [-1], [0], [1]),
+                (2, [2], [0], [1]),
+                (2, [0], [1], [-1]),
+                (2, [0], [1], [np.nan]),
+                (2, [0, 0], [1, 1], [1, 2]),
+                (2, [0, 1], [1], [1]),
+                (2, [0, 1], [1, 0], [1, 2, 3])]:
+            self.assertRaises(ValueError, msprime.SparseMigrationMatrix, *bad_args)
+
+    def test_simulate_matches_dense(self):
+        M = msprime.SparseMigrationMatrix(3, [0, 1, 2], [1, 2, 0], [0.5, 1, 2])
+        population_configurations = [
+            msprime.PopulationConfiguration(2) for _ in range(3)]
+        ts1 = msprime.simulate(
+            population_configurations=population_configurations,
+            migration_matrix=M, random_seed=5, record_migrations=True)
+        ts2 = msprime.simulate(
+            population_configurations=population_configurations,
+            migration_matrix=M.toarray().tolist(), random_seed=5,
+            record_migrations=True)
+        t1 = ts1.dump_tables()
+        t2 = ts2.dump_tables()
+        t1.provenances.clear()
+        t2.provenances.clear()
+        self.assertEqual(t1, t2)
+
+    def test_simulator(self):
+        M = msprime.SparseMigrationMatrix(2, [0], [1], [1])
+        sim = msprime.simulator_factory(
+            population_configurations=[
+                msprime.PopulationConfiguration(2),
+                msprime.PopulationConfiguration(2)],
+            migration_matrix=M)
+        self.assertIs(sim.migration_matrix, M)
+        sim.run()
+        self.assertEqual(sim.ll_sim.get_migration_matrix(), [0, 1, 0, 0])
+        self.assertEqual(
+            sim.total_num_migration_events, sim.num_migration_events[0][1])
+
+    def test_wrong_num_populations(self):
+        M = msprime.SparseMigrationMatrix(3, [0], [1], [1])
+        self.assertRaises(
+            ValueError, msprime.simulate,
+            population_configurations=[
+                msprime.PopulationConfiguration(2),
+                msprime.PopulationConfiguration(2)],
+            migration_matrix=M)
+
+
+class TestStructureModels(unittest.TestCase):
+    """
+    Tests for the island, stepping stone and torus models.
+    """
+    def test_island_model(self):
+        for N in [1, 2, 5]:
+            model = msprime.island_model(N, 0.25)
+            self.assertEqual(model.num_populations, N)
+            M = np.full((N, N), 0.25)
+            np.fill_diagonal(M, 0)
+            self.assertTrue(np.array_equal(model.migration_matrix.toarray(), M))
+
+    def test_stepping_stone_model(self):
+        for shape in [(1,), (2,), (3,), (10,), (1, 5), (2, 2), (3, 4), (5, 5)]:
+            for periodic in [False, True]:
+                model = msprime.stepping_stone_model(shape, 1, periodic=periodic)
+                self.assertEqual(model.num_populations, np.prod(shape))
+                self.assertTrue(np.array_equal(
+                    model.migration_matrix.toarray(),
+                    dense_stepping_stone(shape, periodic)))
+
+    def test_integer_shape(self):
+        model1 = msprime.stepping_stone_model(6, 1)
+        model2 = msprime.stepping_stone_model((6,), 1)
+        self.assertTrue(np.array_equal(
+            model1.migration_matrix.toarray(), model2.migration_matrix.toarray()))
+
+    def test_torus_model(self):
+        model1 = msprime.torus_model((4, 3), 0.5)
+        model2 = msprime.stepping_stone_model((4, 3), 0.5, periodic=True)
+        self.assertTrue(np.array_equal(
+            model1.migration_matrix.toarray(), model2.migration_matrix.toarray()))
+        self.assertRaises(ValueError, msprime.torus_model, 4, 1)
+        self.assertRaises(ValueError, msprime.torus_model, (2, 2, 2), 1)
+
+    def test_bad_shape(self):
+        for shape in [(), (0,), (2, 0), (-1, 2), (2, 2, 2)]:
+            self.assertRaises(ValueError, msprime.stepping_stone_model, shape, 1)
+
+    def test_per_edge_rates(self):
+        model = msprime.stepping_stone_model((3, 3), 1)
+        M = model.migration_matrix
+        # Migration rates decreasing away from the first column.
+        rate = 1 / (1 + M.source % 3)
+        model = msprime.stepping_stone_model((3, 3), rate)
+        dense = model.migration_matrix.toarray()
+        self.assertTrue(np.array_equal(dense[M.source, M.dest], rate))
+        self.assertEqual(np.count_nonzero(dense), M.num_entries)
+        self.assertRaises(
+            ValueError, msprime.stepping_stone_model, (3, 3), rate[:-1])
+        self.assertRaises(
+            ValueError, msprime.stepping_stone_model, (3, 3), -rate)
+
+    def test_population_configurations(self):
+        model = msprime.stepping_stone_model(
+            3, 1, sample_size=[1, 0, 2], initial_size=[10, 20, 30], growth_rate=0.5)
+        population_configurations = model.population_configurations
+        self.assertEqual(len(population_configurations), 3)
+        for conf, sample_size, initial_size in zip(
+                population_configurations, [1, 0, 2], [10, 20, 30]):
+            self.assertEqual(conf.sample_size, sample_size)
+            self.assertEqual(conf.initial_size, initial_size)
+            self.assertEqual(conf.growth_rate, 0.5)
+
+    def test_default_population_configurations(self):
+        for conf in msprime.island_model(3, 1).population_configurations:
+            self.assertIsNone(conf.sample_size)
+            self.assertIsNone(conf.initial_size)
+            self.assertEqual(conf.growth_rate, 0)
+
+    def test_bad_population_values(self):
+        for name in ["sample_size", "initial_size", "growth_rate"]:
+            self.assertRaises(
+                ValueError, msprime.island_model, 3, 1, **{name: [1, 1]})
+
+    def test_simulate(self):
+        model = msprime.torus_model((4, 4), 0.5, sample_size=1)
+        ts = msprime.simulate(
+            population_configurations=model.population_configurations,
+            migration_matrix=model.migration_matrix, random_seed=2)
+        self.assertEqual(ts.num_samples, 16)
+        self.assertEqual(ts.num_populations, 16)
+        self.assertEqual(
+            [ts.node(u).population for u in ts.samples()], list(range(16)))
+        self.assertEqual(ts.first().num_roots, 1)
+
+    def test_demography_debugger(self):
+        model = msprime.island_model(3, 0.5, initial_size=[1, 2, 3])
+        dd = msprime.DemographyDebugger(
+            population_configurations=model.population_configurations,
+            migration_matrix=model.migration_matrix)
+        self.assertTrue(np.array_equal(
+            dd.epochs[0].migration_matrix, model.migration_matrix.toarray()))
+        self.assertEqual(
+            [pop.start_size for pop in dd.epochs[0].populations], [1, 2, 3])
+
+    def test_large_grid(self):
+        model = msprime.stepping_stone_model((50, 50), 0.1, sample_size=0)
+        self.assertEqual(model.num_populations, 2500)
+        # Each population has 4 neighbours, except those at the edges.
+        self.assertEqual(model.migration_matrix.num_entries, 4 * 50 * 49)
+        population_configurations = model.population_configurations
+        population_configurations[0].sample_size = 2
+        population_configurations[-1].sample_size = 2
+        sim = msprime.simulator_factory(
+            population_configurations=population_configurations,
+            migration_matrix=model.migration_matrix,
+            random_generator=msprime.RandomGenerator(1))
+        sim.run(end_time=10)
+        self.assertGreater(sim.total_num_migration_events, 0)